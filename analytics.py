@@ -0,0 +1,337 @@
+"""
+本地結構化統計（不呼叫 Gemini）
+
+以映射檔建立 pandas 欄位式索引（日期、來源單位、類別、文號、裁罰金額），
+並以查詢路由判斷「件數」「金額最高的 N 個案例」「金額超過 X 的案件」「年度趨勢比較」等
+統計型問題，直接以精確數字回答。側邊欄的資料庫統計也由此計算。
+
+裁罰案件目前只有 Gemini ID 映射（fsc_pen_YYYYMMDD_NNNN），日期由文件 ID 推得；
+來源單位與金額只有在映射檔提供時才可使用，無法精確回答的問題仍交給 Gemini。
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from dataclasses import dataclass
+
+from metadata_filter import SOURCE_UNITS, doc_date_value, iter_known_docs, parse_filters
+from startup import lazy_module
+
+pd = lazy_module('pandas')  # 第一次建立索引時才匯入（可在背景預熱）
+
+# 來源單位：metadata 值 → 顯示名稱
+SOURCE_LABELS = {code: label for label, code in SOURCE_UNITS.items()}
+SOURCE_LABELS['unknown'] = '未標示'
+
+# 資料類型顯示名稱
+TYPE_LABELS = {
+    'penalty': '裁罰案件',
+    'law_interpretation': '法令函釋',
+    'announcement': '重要公告',
+}
+
+# 映射檔中可能記錄裁罰金額的欄位
+AMOUNT_KEYS = ('penalty_amount', 'amount', 'fine_amount')
+
+COLUMNS = ['doc_id', 'type', 'date', 'year', 'source', 'category', 'document_number',
+           'law_name', 'title', 'amount', 'url']
+
+
+def parse_amount(value) -> float:
+    """金額轉為數值（元），支援「600萬」「1.2億元」「新臺幣 3,000,000 元」"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).replace(',', '').replace('，', '')
+    match = re.search(r'(\d+(?:\.\d+)?)\s*(億|萬)?', text)
+    if not match:
+        return None
+    amount = float(match.group(1))
+    unit = match.group(2)
+    if unit == '億':
+        amount *= 100_000_000
+    elif unit == '萬':
+        amount *= 10_000
+    return amount
+
+
+def format_amount(amount: float) -> str:
+    """金額顯示（以萬元為單位）"""
+    if amount is None or pd.isna(amount):
+        return '—'
+    if amount >= 10_000:
+        return f"{amount / 10_000:,.0f} 萬元"
+    return f"{amount:,.0f} 元"
+
+
+def build_frame(snapshot) -> pd.DataFrame:
+    """由映射快照建立欄位式索引"""
+    rows = []
+    for doc_id, info in iter_known_docs(snapshot):
+        data_type = info.get('_type') or ('penalty' if doc_id.startswith('fsc_pen_') else 'unknown')
+        doc_date = doc_date_value(doc_id, info)
+        amount = None
+        for key in AMOUNT_KEYS:
+            amount = parse_amount(info.get(key))
+            if amount is not None:
+                break
+        rows.append((
+            doc_id,
+            data_type,
+            doc_date,
+            info.get('source') or 'unknown',
+            info.get('category') or '',
+            info.get('document_number') or info.get('announcement_number') or '',
+            info.get('law_name') or '',
+            info.get('display_name') or doc_id,
+            amount,
+            info.get('original_url') or ''
+        ))
+
+    frame = pd.DataFrame.from_records(
+        rows, columns=['doc_id', 'type', 'date', 'source', 'category', 'document_number',
+                       'law_name', 'title', 'amount', 'url']
+    )
+    frame['date'] = pd.to_datetime(frame['date'].astype('Int64').astype('string'), format='%Y%m%d', errors='coerce')
+    frame['year'] = frame['date'].dt.year.astype('Int64')
+    frame['amount'] = frame['amount'].astype('float64')
+    for column in ('type', 'source', 'category'):
+        frame[column] = frame[column].astype('category')
+    return frame[COLUMNS]
+
+
+@dataclass
+class AnalyticsIntent:
+    """統計型問題的解析結果"""
+    kind: str                       # count / top_amount / amount_over / trend
+    data_type: str = 'penalty'
+    years: tuple = ()
+    sources: tuple = ()
+    limit: int = 5
+    threshold: float = None
+
+
+# 查詢路由用的關鍵字
+_YEAR_RE = re.compile(r'((?:19|20)\d{2})\s*年?')
+_ROC_YEAR_RE = re.compile(r'民國\s*(\d{2,3})\s*年')
+_TOP_RE = re.compile(r'(?:金額|罰鍰)?最高的?\s*(?:前)?\s*(\d+|[一二三四五六七八九十])\s*(?:個|件|筆|名)?|前\s*(\d+|[一二三四五六七八九十])\s*(?:大|高|名)')
+_OVER_RE = re.compile(r'(?:金額|罰鍰)?(?:超過|高於|大於|以上|至少)\s*(?:新臺幣|新台幣)?\s*(\d+(?:\.\d+)?\s*(?:億|萬)?)\s*(?:元)?')
+_OVER_SUFFIX_RE = re.compile(r'(\d+(?:\.\d+)?\s*(?:億|萬)?)\s*元?\s*以上')
+_COUNT_RE = re.compile(r'多少(?:件|筆|個|次)?|幾(?:件|筆|個|次)|件數|筆數|總數|數量|統計')
+_TREND_RE = re.compile(r'趨勢|比較|對比|\bvs\.?\b|消長|變化', re.IGNORECASE)
+_SOURCE_ALIASES = {
+    '銀行局': 'bank_bureau',
+    '保險局': 'insurance_bureau',
+    '證券期貨局': 'securities_bureau',
+    '證期局': 'securities_bureau',
+    '檢查局': 'inspection_bureau',
+}
+_TYPE_ALIASES = {
+    '函釋': 'law_interpretation',
+    '法令': 'law_interpretation',
+    '公告': 'announcement',
+}
+_CHINESE_NUMBERS = {c: i for i, c in enumerate('一二三四五六七八九十', 1)}
+
+# 統計型問題中常見、不影響統計範圍的字詞；移除後仍有剩餘內容時代表問題帶有主題條件
+_FILLER_WORDS = (
+    '請問 請 查詢 列出 告訴我 顯示 想知道 金管會 金融監督管理委員會 發布 公布 發佈 '
+    '裁罰 處分 罰鍰 案件 案例 件 筆 個 次 年度 年 各 每 共 總共 一共 總 全部 所有 '
+    '金額 最高 最多 超過 高於 大於 以上 至少 新臺幣 新台幣 元 萬 億 前 大 名 '
+    '多少 幾 件數 筆數 總數 數量 統計 趨勢 比較 對比 vs 消長 變化 分布 分佈 依 按 '
+    '來源 單位 的 是 有 和 與 及 跟 到 至 間 之 在 了 嗎 呢 哪些 什麼 如何 民國'
+).split()
+_FILLER_RE = re.compile(
+    '|'.join(re.escape(word) for word in sorted(_FILLER_WORDS, key=len, reverse=True))
+    + r'|\d+|[一二三四五六七八九十]|[\s，,。？?！!、：:\.\-~〜]',
+    re.IGNORECASE
+)
+
+
+def _parse_number(text: str) -> int:
+    return _CHINESE_NUMBERS.get(text) or int(text)
+
+
+def route_query(query: str):
+    """判斷是否為可在本地精確回答的統計型問題
+
+    Returns:
+        AnalyticsIntent，不是統計型問題（或帶有本地無法判斷的主題條件）時返回 None
+    """
+    text = query or ''
+
+    years = [int(y) for y in _YEAR_RE.findall(text)]
+    years += [int(y) + 1911 for y in _ROC_YEAR_RE.findall(text)]
+    years = tuple(sorted(set(years)))
+
+    sources = []
+    residual = text
+    for alias, code in _SOURCE_ALIASES.items():
+        if alias in residual:
+            sources.append(code)
+            residual = residual.replace(alias, ' ')
+    data_type = 'penalty'
+    for alias, type_code in _TYPE_ALIASES.items():
+        if alias in residual:
+            data_type = type_code
+            residual = residual.replace(alias, ' ')
+
+    # 帶有主題條件（例如「洗錢防制」）的問題需要檢索內容，交給 Gemini
+    if _FILLER_RE.sub('', residual).strip():
+        return None
+
+    intent_args = {'data_type': data_type, 'years': years, 'sources': tuple(sorted(set(sources)))}
+
+    top_match = _TOP_RE.search(text)
+    if top_match and ('金額' in text or '罰鍰' in text):
+        limit = _parse_number(top_match.group(1) or top_match.group(2))
+        return AnalyticsIntent(kind='top_amount', limit=max(1, min(limit, 50)), **intent_args)
+
+    over_match = _OVER_RE.search(text) or _OVER_SUFFIX_RE.search(text)
+    if over_match and ('金額' in text or '罰鍰' in text or '萬' in over_match.group(1) or '億' in over_match.group(1)):
+        return AnalyticsIntent(kind='amount_over', threshold=parse_amount(over_match.group(1)), **intent_args)
+
+    if _TREND_RE.search(text) and (len(years) >= 2 or '趨勢' in text):
+        return AnalyticsIntent(kind='trend', **intent_args)
+
+    if _COUNT_RE.search(text):
+        return AnalyticsIntent(kind='count', **intent_args)
+
+    return None
+
+
+class CorpusAnalytics:
+    """以 pandas 欄位式索引回答統計型問題"""
+
+    def __init__(self, frame: pd.DataFrame, version: str = ''):
+        self.frame = frame
+        self.version = version
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> 'CorpusAnalytics':
+        return cls(build_frame(snapshot), version=snapshot.version)
+
+    def select(self, data_type: str = 'penalty', years=(), sources=(), filters: dict = None) -> pd.DataFrame:
+        """依資料類型、年度、來源單位與介面篩選條件選取文件"""
+        frame = self.frame
+        mask = frame['type'] == data_type
+        if years:
+            mask &= frame['year'].isin(list(years))
+        if sources:
+            mask &= frame['source'].isin(list(sources))
+
+        metadata_filter = parse_filters(filters)
+        if metadata_filter.start_date:
+            mask &= frame['date'] >= pd.Timestamp(str(metadata_filter.start_date))
+        if metadata_filter.end_date:
+            mask &= frame['date'] <= pd.Timestamp(str(metadata_filter.end_date))
+        if metadata_filter.sources:
+            mask &= frame['source'].isin(list(metadata_filter.sources))
+        return frame[mask.fillna(False)]
+
+    def summary(self, data_type: str = 'penalty') -> dict:
+        """資料庫統計（側邊欄用）"""
+        selected = self.select(data_type)
+        by_source = selected['source'].value_counts()
+        return {
+            'count': len(selected),
+            'min_date': selected['date'].min().date() if len(selected) else None,
+            'max_date': selected['date'].max().date() if len(selected) else None,
+            'by_source': {
+                SOURCE_LABELS.get(source, source): int(count)
+                for source, count in by_source.items() if count
+            },
+            'has_amounts': bool(selected['amount'].notna().any())
+        }
+
+    def answer(self, intent: AnalyticsIntent, filters: dict = None):
+        """以本地索引回答統計型問題
+
+        Returns:
+            與 query_penalties 相同格式的結果字典（local=True），無法精確回答時返回 None
+        """
+        start = time.perf_counter()
+        selected = self.select(intent.data_type, intent.years, intent.sources, filters)
+
+        # 指定來源單位，但範圍內有未標示來源的文件：無法精確回答，交給 Gemini
+        if intent.sources or parse_filters(filters).sources:
+            unscoped = self.select(intent.data_type, intent.years, (), dict(filters or {}, source_units=()))
+            if (unscoped['source'] == 'unknown').any():
+                return None
+
+        type_label = TYPE_LABELS.get(intent.data_type, intent.data_type)
+        scope = self._describe_scope(intent, filters)
+
+        if intent.kind in ('top_amount', 'amount_over'):
+            with_amount = selected[selected['amount'].notna()]
+            if with_amount.empty:
+                return None  # 沒有金額資料：交給 Gemini
+            if intent.kind == 'top_amount':
+                rows = with_amount.nlargest(intent.limit, 'amount')
+                heading = f"{scope}裁罰金額最高的 {len(rows)} 件{type_label}："
+            else:
+                rows = with_amount[with_amount['amount'] > intent.threshold].sort_values('amount', ascending=False)
+                heading = f"{scope}裁罰金額超過 {format_amount(intent.threshold)} 的{type_label}共 {len(rows)} 件："
+            lines = [heading, ""]
+            for i, row in enumerate(rows.itertuples(), 1):
+                title = f"[{row.title}]({row.url})" if row.url else row.title
+                lines.append(f"{i}. {row.date:%Y-%m-%d}｜{title}｜{format_amount(row.amount)}")
+            text = "\n".join(lines)
+
+        elif intent.kind == 'trend':
+            years = list(intent.years) or sorted(selected['year'].dropna().unique().tolist())
+            pivot = (
+                selected[selected['year'].isin(years)]
+                .groupby(['year', 'source'], observed=True).size()
+                .unstack(fill_value=0)
+                .reindex(years, fill_value=0)
+            )
+            source_columns = [s for s in pivot.columns if pivot[s].sum() > 0]
+            if source_columns == ['unknown']:
+                source_columns = []  # 沒有來源單位資料時只顯示合計
+            labels = ['年度'] + [SOURCE_LABELS.get(s, s) for s in source_columns] + ['合計']
+            lines = [f"{scope}{type_label}年度件數：", "",
+                     "| " + " | ".join(labels) + " |",
+                     "|" + "---|" * len(labels)]
+            for year, row in pivot.iterrows():
+                cells = [str(year)] + [str(int(row[s])) for s in source_columns] + [str(int(row.sum()))]
+                lines.append("| " + " | ".join(cells) + " |")
+            if len(years) >= 2:
+                first, last = int(pivot.loc[years[0]].sum()), int(pivot.loc[years[-1]].sum())
+                change = f"{(last - first) / first:+.0%}" if first else "—"
+                lines += ["", f"{years[-1]} 年相較 {years[0]} 年：{first} → {last} 件（{change}）"]
+            text = "\n".join(lines)
+
+        else:  # count
+            lines = [f"{scope}共有 **{len(selected)}** 件{type_label}。"]
+            by_source = selected['source'].value_counts()
+            if len(by_source[by_source > 0]) > 1:
+                lines.append("")
+                for source, count in by_source.items():
+                    if count:
+                        lines.append(f"- {SOURCE_LABELS.get(source, source)}：{count} 件（{count / len(selected):.1%}）")
+            text = "\n".join(lines)
+
+        elapsed = time.perf_counter() - start
+        return {
+            'success': True,
+            'local': True,
+            'text': text,
+            'sources': [],
+            'debug_info': {'analytics': intent.kind, 'analytics_seconds': elapsed, 'matched_docs': len(selected)}
+        }
+
+    @staticmethod
+    def _describe_scope(intent: AnalyticsIntent, filters: dict = None) -> str:
+        parts = []
+        if intent.years:
+            parts.append('、'.join(f"{y} 年" for y in intent.years))
+        metadata_filter = parse_filters(filters)
+        if metadata_filter.start_date or metadata_filter.end_date:
+            parts.append(f"{metadata_filter.start_date or ''}～{metadata_filter.end_date or ''}")
+        sources = set(intent.sources) | set(metadata_filter.sources)
+        if sources:
+            parts.append('、'.join(SOURCE_LABELS.get(s, s) for s in sorted(sources)))
+        return ('（' + '，'.join(parts) + '）') if parts else ''
@@ -0,0 +1,271 @@
+"""
+查詢結果快取
+
+在 query_penalties 前加上兩層快取：
+  - 記憶體 LRU（程序內所有 session 共用）
+  - 磁碟 SQLite（重啟後仍可使用）
+
+快取鍵涵蓋正規化後的查詢、篩選條件、Store ID、模型與 system instruction 雜湊。
+每筆快取同時記錄引用文件的內容雜湊，映射檔更新時只會使依賴已變動文件的答案失效。
+"""
+
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+
+# 快取資料結構版本（結構變更時遞增，舊快取自動失效）
+CACHE_FORMAT_VERSION = 1
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_query(query: str) -> str:
+    """正規化查詢文字（全形/半形統一、去除多餘空白）"""
+    text = unicodedata.normalize('NFKC', query or '')
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def hash_text(text: str) -> str:
+    """文字的短雜湊（用於 system instruction 等長字串）"""
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def make_scope_key(store_id: str, model: str, instruction_hash: str, filters: dict = None) -> str:
+    """查詢範圍（除查詢文字以外的快取鍵成分），相似查詢只在相同範圍內比對"""
+    return make_cache_key('', store_id, model, instruction_hash, filters)
+
+
+def make_cache_key(query: str, store_id: str, model: str, instruction_hash: str, filters: dict = None) -> str:
+    """建立快取鍵
+
+    Args:
+        query: 查詢文字
+        store_id: Gemini Store ID
+        model: 模型名稱
+        instruction_hash: system instruction（含法條連結表）的雜湊
+        filters: 篩選條件
+
+    Returns:
+        快取鍵
+    """
+    payload = json.dumps(
+        [CACHE_FORMAT_VERSION, normalize_query(query), filters or {}, store_id, model, instruction_hash],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class AnswerCache:
+    """記憶體 LRU + 磁碟 SQLite 的兩層查詢結果快取（執行緒安全）"""
+
+    def __init__(self, path=None, max_entries: int = 256, ttl: float = 7 * 86400,
+                 disk_max_entries: int = 5000):
+        """
+        Args:
+            path: 磁碟快取檔案路徑，None 表示只使用記憶體
+            max_entries: 記憶體快取最多筆數
+            ttl: 快取有效時間（秒）
+            disk_max_entries: 磁碟快取最多筆數
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key → (created_at, deps, result)
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'expired': 0,
+            'invalidated': 0
+        }
+
+        self._conn = None
+        if path:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(str(path), check_same_thread=False)
+            self._conn.executescript("""
+                PRAGMA journal_mode = WAL;
+                CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    created_at REAL,
+                    accessed_at REAL,
+                    query TEXT,
+                    deps TEXT,
+                    result TEXT,
+                    scope TEXT
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS answers_accessed ON answers (accessed_at);
+            """)
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+            if 'scope' not in columns:
+                self._conn.execute("ALTER TABLE answers ADD COLUMN scope TEXT")
+
+    def _is_expired(self, created_at: float) -> bool:
+        """快取是否超過有效時間"""
+        return time.time() - created_at > self.ttl
+
+    def _remember(self, key: str, entry: tuple):
+        """放入記憶體 LRU（呼叫前需持有鎖）"""
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+
+    def _lookup(self, key: str):
+        """查詢記憶體與磁碟快取（呼叫前需持有鎖），返回 (來源, (created_at, deps, result))，沒有時返回 (None, None)"""
+        entry = self._memory.get(key)
+        if entry is not None:
+            return 'memory', entry
+        if self._conn is not None:
+            row = self._conn.execute(
+                "SELECT created_at, deps, result FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                return 'disk', (row[0], json.loads(row[1]), json.loads(row[2]))
+        return None, None
+
+    def _is_current(self, key: str, origin: str, entry: tuple) -> bool:
+        """檢查期間快取是否未被取代或移除（呼叫前需持有鎖）"""
+        if origin == 'memory':
+            return self._memory.get(key) is entry
+        current = self._memory.get(key)
+        if current is not None:
+            return current[0] == entry[0]
+        row = self._conn.execute("SELECT created_at FROM answers WHERE key = ?", (key,)).fetchone()
+        return row is not None and row[0] == entry[0]
+
+    def get(self, key: str, validator=None):
+        """取得快取結果
+
+        validator 可能需要重新載入映射檔，因此在鎖外執行：先取出快取，檢查後再重新取得鎖更新 LRU 順序或移除失效項目
+        （檢查期間快取已被新結果取代時不移除新結果）。
+
+        Args:
+            key: 快取鍵
+            validator: 檢查依賴文件是否仍一致的函式 validator(deps) -> bool
+
+        Returns:
+            查詢結果字典，沒有有效快取時返回 None
+        """
+        with self._lock:
+            origin, entry = self._lookup(key)
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            if self._is_expired(entry[0]):
+                self._discard(key)
+                self._stats['expired'] += 1
+                self._stats['misses'] += 1
+                return None
+
+        valid = validator is None or validator(entry[1])
+
+        with self._lock:
+            current = self._is_current(key, origin, entry)
+            if not valid:
+                if current:
+                    self._discard(key)
+                self._stats['invalidated'] += 1
+                self._stats['misses'] += 1
+                return None
+
+            if origin == 'memory':
+                if current:
+                    self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+            else:
+                if current:
+                    self._conn.execute(
+                        "UPDATE answers SET accessed_at = ? WHERE key = ?", (time.time(), key)
+                    )
+                    self._conn.commit()
+                    self._remember(key, entry)
+                self._stats['disk_hits'] += 1
+            return entry[2]
+
+    def put(self, key: str, result: dict, deps: dict = None, query: str = '', scope: str = ''):
+        """寫入快取
+
+        Args:
+            key: 快取鍵
+            result: query_penalties 的查詢結果
+            deps: 引用文件的內容雜湊 {doc_id: digest}
+            query: 原始查詢文字（供相似查詢索引使用）
+            scope: 查詢範圍（見 make_scope_key）
+        """
+        deps = deps or {}
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, (now, deps, result))
+            self._stats['stores'] += 1
+
+            if self._conn is not None:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO answers (key, created_at, accessed_at, query, deps, result, scope) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, now, now, query, json.dumps(deps), json.dumps(result, ensure_ascii=False), scope)
+                )
+                overflow = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.disk_max_entries
+                if overflow > 0:
+                    self._conn.execute(
+                        "DELETE FROM answers WHERE key IN "
+                        "(SELECT key FROM answers ORDER BY accessed_at LIMIT ?)", (overflow,)
+                    )
+                    self._stats['evictions'] += overflow
+                self._conn.commit()
+
+    def entries(self) -> list:
+        """磁碟快取中仍在有效期內的 (key, query, scope)，用於重建相似查詢索引"""
+        if self._conn is None:
+            return []
+        with self._lock:
+            return self._conn.execute(
+                "SELECT key, query, scope FROM answers WHERE created_at >= ? ORDER BY accessed_at",
+                (time.time() - self.ttl,)
+            ).fetchall()
+
+    def _discard(self, key: str):
+        """移除單筆快取（呼叫前需持有鎖）"""
+        self._memory.pop(key, None)
+        if self._conn is not None:
+            self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def invalidate(self, key: str):
+        """移除單筆快取"""
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """清除所有快取"""
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM answers")
+                self._conn.commit()
+
+    def stats(self) -> dict:
+        """命中/未命中/淘汰等統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = (
+                self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+                if self._conn is not None else 0
+            )
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else 0.0
+        return stats
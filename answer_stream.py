@@ -0,0 +1,66 @@
+"""
+串流回答的累積與案件標題連結
+
+串流模式下回答是一段一段到達的。feed 只累積文字並切出已完成的行，不做任何後處理；
+串流結束、取得 grounding 來源後，finalize 才在完整文字上找出「### N.」案件標題並加入案件連結。
+
+標題以與 grounding.heading_citations 相同的規則式在完整文字上比對（不逐行比對）：
+「### 1.」後面換行、標題文字在下一行時也算一個標題（與原本整段文字替換的結果一致），
+否則兩邊的標題數不同，之後每個標題都會對應到錯誤的連結。
+
+非串流模式的 insert_case_links_by_order 也使用同一套處理，兩者結果一致。
+"""
+
+import re
+
+# 案件標題：### 1. [標題內容]（\s 可跨行，標題文字可在下一行）
+CASE_HEADING_RE = re.compile(r'(###\s*\d+\.\s+)([^\n]+)')
+
+
+class IncrementalAnswer:
+    """逐段累積回答文字（串流顯示用），結束時才為案件標題加入連結"""
+
+    def __init__(self):
+        self._completed = ''  # 已完成的行（隨新行到達累加，render 不必重新 join 全部文字）
+        self._pending = ''    # 尚未換行的最後一段
+
+    def feed(self, delta: str):
+        """加入新到達的文字（只切出已完成的行）"""
+        if not delta:
+            return
+        text = self._pending + delta
+        newline = text.rfind('\n')
+        if newline < 0:
+            self._pending = text
+            return
+        self._completed += text[:newline + 1]
+        self._pending = text[newline + 1:]
+
+    def render(self) -> str:
+        """目前為止的回答文字"""
+        return self._completed + self._pending
+
+    def finalize(self, case_urls: list) -> str:
+        """串流結束後，依序為案件標題加入連結
+
+        Args:
+            case_urls: 案件連結列表（依標題順序，無法決定連結的標題為 None）
+
+        Returns:
+            插入連結後的完整文字
+        """
+        text = self.render()
+        pieces = []
+        last = 0
+        for idx, match in enumerate(CASE_HEADING_RE.finditer(text)):
+            if idx >= len(case_urls):
+                break
+            title = match.group(2).strip()
+            # 沒有連結，或已經是連結（避免重複替換）
+            if not case_urls[idx] or (title.startswith('[') and '](' in title):
+                continue
+            pieces.append(text[last:match.start()])
+            pieces.append(f"{match.group(1)}[{title}]({case_urls[idx]})")
+            last = match.end()
+        pieces.append(text[last:])
+        return ''.join(pieces)
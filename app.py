@@ -16,152 +16,81 @@ Previous: 1.2.0 (2025-11-19)
   - Plain Text Store: 490 筆資料，100% pcode 映射覆蓋率
 """
 
+from __future__ import annotations
+
+import time
+
+_IMPORT_START = time.perf_counter()  # 冷啟動計時（第一次頁面顯示的耗時由此起算）
+
+import itertools
+import json
 import os
+import sqlite3
+import uuid
 import streamlit as st
 from datetime import datetime, date
+from pathlib import Path
 from dotenv import load_dotenv
-from google import genai
-from google.genai import types
+
+from analytics import CorpusAnalytics, route_query
+from answer_cache import AnswerCache, hash_text, make_cache_key, make_scope_key
+from answer_stream import IncrementalAnswer
+from cost_accounting import (CostBudget, CostLedger, classify_query, estimate_tokens, load_pricing,
+                             section_report, split_prompt_sections)
+from grounding import extract_grounding, heading_citations
+from gemini_transport import (DEFAULT_RECORDINGS_DIR, DEFAULT_SERVER_URL, TRANSPORTS, Recorder,
+                              RecordingClient, ReplayClient, ReplayOptions)
+from hedged_query import HedgedExecutor
+from identifier_index import IdentifierIndex
+from law_index import LAW_LINK_MODES, LawIndex
+from law_linker import get_law_linker
+from metadata_filter import SOURCE_UNITS, doc_date_value, has_matching_docs, parse_filters, pushable_keys
+from metadata_registry import MetadataRegistry
+from metrics import STAGE_LABELS, MetricsRegistry, Trace, start_http_exporter
+from prompt_cache import CachedPromptManager
+from query_similarity import SimilarQueryIndex, same_subject
+from result_history import ResultHistory
+from scheduler import RequestScheduler, SchedulerOverloaded, SchedulerTimeout, is_retryable
+from singleflight import SingleFlight
+from snippet_normalizer import SnippetNormalizer
+from startup import STARTUP, Warmup, lazy_module
+from store_fanout import (SharedRetrieval, StoreFanOut, cited_sources, context_block, format_store_ids, merge_sources,
+                          parse_store_ids, strip_citations)
+
+# google.genai 匯入約需 0.5 秒，建立 client 時才匯入（通常已由背景預熱完成）
+genai = lazy_module('google.genai')
+types = lazy_module('google.genai.types')
+
+# Streamlit 每次重新執行都會執行本腳本，只記錄程序第一次的匯入耗時
+STARTUP.record('app 模組匯入', time.perf_counter() - _IMPORT_START, 'import', once=True)
 
 # 載入環境變數
 load_dotenv()
 
-# 載入映射檔
-def load_file_mapping():
-    """載入所有資料類型的檔案映射檔"""
-    from pathlib import Path
-    import json
+# 映射檔共用登錄（所有 session 共用，檔案變動時才重新載入）
+@st.cache_resource
+def get_metadata_registry() -> MetadataRegistry:
+    """取得程序共用的映射檔登錄（若有編譯好的 SQLite 索引則優先使用）"""
+    return MetadataRegistry(
+        Path(__file__).parent / 'data',
+        index_path=os.getenv('FSC_METADATA_INDEX') or None
+    )
 
-    base_path = Path(__file__).parent / 'data'
-    combined_mapping = {}
+def load_metadata_snapshot():
+    """取得目前的映射內容，並提示載入失敗的映射檔"""
+    snapshot = get_metadata_registry().snapshot()
+    for label, error in snapshot.errors:
+        st.warning(f"⚠️ 載入{label}失敗: {error}")
+    return snapshot
 
-    # 載入裁罰案件映射
-    penalties_file = base_path / 'penalties/file_mapping.json'
-    if penalties_file.exists():
-        try:
-            with open(penalties_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for file_id, info in data.items():
-                    info['_type'] = 'penalty'
-                    combined_mapping[file_id] = info
-        except Exception as e:
-            st.warning(f"⚠️ 載入裁罰映射檔失敗: {e}")
-
-    # 載入法令函釋映射（優先使用 gemini_id_mapping_new.json，它包含所有上傳的檔案）
-    law_gemini_file = base_path / 'law_interpretations/gemini_id_mapping_new.json'
-    law_mapping_file = base_path / 'law_interpretations/law_interpretations_mapping.json'
-
-    # 先載入 gemini_id_mapping_new（包含基本資訊）
-    if law_gemini_file.exists():
-        try:
-            with open(law_gemini_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for file_id, info in data.items():
-                    combined_mapping[file_id] = {
-                        'display_name': info.get('display_name', file_id),
-                        'date': info.get('date', ''),
-                        'source': info.get('source', ''),
-                        'category': info.get('category', ''),
-                        '_type': 'law_interpretation'
-                    }
-        except Exception as e:
-            st.warning(f"⚠️ 載入法令函釋 Gemini 映射檔失敗: {e}")
-
-    # 再載入 law_interpretations_mapping（補充 original_url 等資訊）
-    if law_mapping_file.exists():
-        try:
-            with open(law_mapping_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for file_id, info in data.items():
-                    if file_id in combined_mapping:
-                        combined_mapping[file_id]['original_url'] = info.get('original_url', '')
-                    else:
-                        info['_type'] = 'law_interpretation'
-                        combined_mapping[file_id] = info
-        except Exception as e:
-            pass
-
-    # 載入重要公告映射（優先使用 gemini_id_mapping_new.json）
-    ann_gemini_file = base_path / 'announcements/gemini_id_mapping_new.json'
-    ann_mapping_file = base_path / 'announcements/announcements_mapping.json'
-
-    # 先載入 gemini_id_mapping_new
-    if ann_gemini_file.exists():
-        try:
-            with open(ann_gemini_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for file_id, info in data.items():
-                    combined_mapping[file_id] = {
-                        'display_name': info.get('display_name', file_id),
-                        'date': info.get('date', ''),
-                        'source': info.get('source', ''),
-                        'category': info.get('category', ''),
-                        '_type': 'announcement'
-                    }
-        except Exception as e:
-            st.warning(f"⚠️ 載入公告 Gemini 映射檔失敗: {e}")
-
-    # 再載入 announcements_mapping（補充 original_url）
-    if ann_mapping_file.exists():
-        try:
-            with open(ann_mapping_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for file_id, info in data.items():
-                    if file_id in combined_mapping:
-                        combined_mapping[file_id]['original_url'] = info.get('original_url', '')
-                    else:
-                        info['_type'] = 'announcement'
-                        combined_mapping[file_id] = info
-        except Exception as e:
-            pass
-
-    return combined_mapping
+# 載入映射檔
+def load_file_mapping():
+    """載入所有資料類型的檔案映射檔（共用內容，請勿修改）"""
+    return load_metadata_snapshot().file_mapping
 
 def load_gemini_id_mapping():
     """載入所有資料類型的 Gemini ID 反向映射（gemini_file_id → document_id）"""
-    from pathlib import Path
-    import json
-
-    base_path = Path(__file__).parent / 'data'
-    reverse_mapping = {}
-
-    # 載入裁罰案件 Gemini ID 映射（舊格式：直接是 gemini_id → doc_id）
-    penalties_file = base_path / 'penalties/gemini_id_mapping.json'
-    if penalties_file.exists():
-        try:
-            with open(penalties_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                reverse_mapping.update(data)
-        except Exception:
-            pass
-
-    # 載入法令函釋 Gemini ID 映射（新格式：doc_id → {gemini_file_id: ...}）
-    law_file = base_path / 'law_interpretations/gemini_id_mapping_new.json'
-    if law_file.exists():
-        try:
-            with open(law_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for doc_id, info in data.items():
-                    gemini_id = info.get('gemini_file_id', '')
-                    if gemini_id:
-                        reverse_mapping[gemini_id] = doc_id
-        except Exception:
-            pass
-
-    # 載入重要公告 Gemini ID 映射（新格式）
-    ann_file = base_path / 'announcements/gemini_id_mapping_new.json'
-    if ann_file.exists():
-        try:
-            with open(ann_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                for doc_id, info in data.items():
-                    gemini_id = info.get('gemini_file_id', '')
-                    if gemini_id:
-                        reverse_mapping[gemini_id] = doc_id
-        except Exception:
-            pass
-
-    return reverse_mapping
+    return get_metadata_registry().get_gemini_id_mapping()
 
 def extract_file_id(filename: str, gemini_id_mapping: dict = None) -> str:
     """從檔名中提取 file_id
@@ -214,124 +143,11 @@ def add_law_links_to_text(text: str, law_links_dict: dict) -> str:
     Returns:
         加入連結後的文字
     """
-    import re
-
     if not law_links_dict:
         return text
 
-    # 按法條名稱長度排序（長的優先，避免短的先被替換導致長的無法匹配）
-    sorted_laws = sorted(law_links_dict.keys(), key=len, reverse=True)
-
-    result = text
-    replaced_positions = set()  # 記錄已替換的位置，避免重複替換
-
-    # === 第一階段：處理完整法條名稱 ===
-    for law in sorted_laws:
-        # 跳過簡寫形式（留待第二階段處理）
-        if law.startswith('第'):
-            continue
-
-        link = law_links_dict[law]
-
-        # 提取法律名稱和條號
-        law_match = re.match(r'^(.+?)(第\d+條(?:之\d+)?)', law)
-        if not law_match:
-            continue
-
-        law_name = law_match.group(1)  # 例如：「金融控股公司法」
-        article = law_match.group(2)   # 例如：「第45條」
-
-        # 建立彈性匹配模式：支援書名號、項/款/目、前置連接詞
-        law_name_escaped = re.escape(law_name)
-        article_escaped = re.escape(article)
-
-        # 匹配模式：可選的前置連接詞 + 法律名稱 + 條號 + 項/款/目
-        pattern = (
-            r'(?<!\[)(?<!\()'  # 不在連結中
-            r'(?:[、，及與和以]\s*)?'  # 可選的前置連接詞
-            r'(?:《)?' + law_name_escaped + r'(?:》)?'  # 法律名稱（可選書名號）
-            r'\s*' + article_escaped +  # 條號
-            r'(?:第\d+項)?(?:第\d+款)?(?:第\d+目)?'  # 可選的項/款/目
-            r'(?!\])(?!\))'  # 不在連結中
-        )
-
-        # 找到所有匹配並收集
-        matches = []
-        for match in re.finditer(pattern, result):
-            start, end = match.span()
-
-            # 檢查這個位置是否已被替換
-            is_overlapping = False
-            for pos, pos_end in replaced_positions:
-                if (start < pos_end and end > pos):
-                    is_overlapping = True
-                    break
-
-            if not is_overlapping:
-                matched_text = match.group(0)
-                matches.append((start, end, matched_text))
-
-        # 從後往前替換（避免位置偏移）
-        for start, end, matched_text in reversed(matches):
-            # 檢查是否有前置連接詞
-            connector_match = re.match(r'^([、，及與和以]\s*)?(.+)$', matched_text)
-            if connector_match:
-                connector = connector_match.group(1) or ''
-                law_part = connector_match.group(2)
-                replacement = f'{connector}[{law_part}]({link})'
-            else:
-                replacement = f'[{matched_text}]({link})'
-
-            result = result[:start] + replacement + result[end:]
-            new_end = start + len(replacement)
-            replaced_positions.add((start, new_end))
-
-    # === 第二階段：處理簡寫形式（如「、第51條」「及第60條」） ===
-    for law in sorted_laws:
-        # 只處理簡寫形式
-        if not law.startswith('第'):
-            continue
-
-        link = law_links_dict[law]
-
-        # 匹配簡寫形式：前面有「、」「及」「與」「和」等連接詞
-        article_escaped = re.escape(law)
-        pattern = (
-            r'(?<!\[)(?<!\()'  # 不在連結中
-            r'(?:[、，及與和])\s*' + article_escaped +  # 連接詞 + 條號
-            r'(?:第\d+項)?(?:第\d+款)?(?:第\d+目)?'  # 可選的項/款/目
-            r'(?!\])(?!\))'  # 不在連結中
-        )
-
-        matches = []
-        for match in re.finditer(pattern, result):
-            start, end = match.span()
-
-            # 檢查這個位置是否已被替換
-            is_overlapping = False
-            for pos, pos_end in replaced_positions:
-                if (start < pos_end and end > pos):
-                    is_overlapping = True
-                    break
-
-            if not is_overlapping:
-                matched_text = match.group(0)
-                # 保留前面的連接詞
-                matches.append((start, end, matched_text))
-
-        # 從後往前替換
-        for start, end, matched_text in reversed(matches):
-            # 提取連接詞和條號部分
-            connector_match = re.match(r'([、，及與和]\s*)(.+)', matched_text)
-            if connector_match:
-                connector = connector_match.group(1)
-                article_part = connector_match.group(2)
-                replacement = f'{connector}[{article_part}]({link})'
-                result = result[:start] + replacement + result[end:]
-                new_end = start + len(replacement)
-                replaced_positions.add((start, new_end))
-
-    return result
+    # 法條連結表編譯為 Aho-Corasick 自動機後單次掃描（同一連結表只編譯一次）
+    return get_law_linker(law_links_dict).link(text)
 
 def insert_case_links_by_order(text: str, case_urls: list) -> str:
     """
@@ -339,46 +155,50 @@ def insert_case_links_by_order(text: str, case_urls: list) -> str:
 
     Args:
         text: Gemini 回答文字
-        case_urls: 案件連結列表（按順序，從 grounding_metadata 提取）
+        case_urls: 案件連結列表（依標題順序，見 case_urls_for_headings；無法決定連結的標題為 None）
 
     Returns:
         插入連結後的文字
     """
-    import re
-
     if not case_urls:
         return text
 
-    # 找出所有標題：### 1. [標題內容]
-    pattern = r'(###\s*\d+\.\s+)([^\n]+)'
-    matches = list(re.finditer(pattern, text))
+    # 與串流模式共用逐行處理
+    answer = IncrementalAnswer()
+    answer.feed(text)
+    return answer.finalize(case_urls)
 
-    if not matches:
-        return text
-
-    # 從後往前替換（避免位置偏移）
-    result = text
-    for i, match in enumerate(reversed(matches)):
-        # 反向索引
-        idx = len(matches) - 1 - i
+def case_urls_for_headings(text: str, sources: list, file_mapping: dict, gemini_id_mapping: dict,
+                           ordered_urls: list) -> list:
+    """每個案件標題（### N.）的連結
 
-        # 檢查是否有對應的 URL
-        if idx >= len(case_urls):
-            continue
+    優先使用標題所在段落實際引用的文件（grounding 引用區間）；
+    段落沒有引用區間時（例如快取中的舊結果），依序補上 ordered_urls 中尚未使用的連結。
 
-        prefix = match.group(1)      # "### 1. "
-        title = match.group(2).strip()  # "三商美邦人壽保險股份..."
-        url = case_urls[idx]
-
-        # 檢查是否已經是連結（避免重複替換）
-        if title.startswith('[') and '](' in title:
-            continue
+    Args:
+        text: Gemini 回答文字（與引用區間使用同一份文字）
+        sources: 查詢結果的來源（含 spans）
+        ordered_urls: 依日期排序的案件連結（沒有引用區間時使用）
 
-        # 替換為連結
-        new_text = f"{prefix}[{title}]({url})"
-        result = result[:match.start()] + new_text + result[match.end():]
+    Returns:
+        依標題順序的連結列表（無法決定的標題為 None）
+    """
+    cited_urls = []
+    for source_idx in heading_citations(text, sources):
+        url = None
+        if source_idx is not None:
+            file_id = extract_file_id(sources[source_idx].get('filename', ''), gemini_id_mapping)
+            url = file_mapping.get(file_id, {}).get('original_url') or None
+        cited_urls.append(url)
+
+    used = set(cited_urls)
+    remaining = iter([url for url in ordered_urls if url not in used])
+    return [url or next(remaining, None) for url in cited_urls]
 
-    return result
+@st.cache_resource
+def get_snippet_normalizer() -> SnippetNormalizer:
+    """取得程序共用的片段正規化器（同一片段跨查詢、跨 session 只清理一次）"""
+    return SnippetNormalizer(max_entries=int(os.getenv('FSC_SNIPPET_MEMO_SIZE', '20000')))
 
 def remove_social_media_noise(text: str) -> str:
     """
@@ -390,69 +210,14 @@ def remove_social_media_noise(text: str) -> str:
     Returns:
         清理後的文字
     """
-    import re
-
-    # 社群媒體相關關鍵字
-    noise_patterns = [
-        r'facebook',
-        r'Facebook',
-        r'twitter',
-        r'Twitter',
-        r'line',
-        r'LINE',
-        r'分享',
-        r'列印',
-        r'轉寄',
-        r'友善列印',
-        r'回上一頁',
-        r':::',
-        r'回首頁',
-        r'網站導覽',
-        r'English',
-        r'兒童版',
-        r'行動版',
-        r'RSS',
-        r'字級大小',
-        r'小 中 大',
-    ]
-
-    # 移除包含這些關鍵字的行
-    lines = text.split('\n')
-    cleaned_lines = []
-
-    for line in lines:
-        line = line.strip()
-        # 跳過空行
-        if not line:
-            continue
-
-        # 檢查是否包含雜訊關鍵字
-        is_noise = False
-        for pattern in noise_patterns:
-            if re.search(pattern, line, re.IGNORECASE):
-                is_noise = True
-                break
-
-        if not is_noise:
-            cleaned_lines.append(line)
+    return get_snippet_normalizer().normalize(text)
 
-    return '\n'.join(cleaned_lines)
+def collect_source_documents(sources: list, file_mapping: dict, gemini_id_mapping: dict) -> list:
+    """將引用來源去重並對應到文件（按日期排序，最新→最舊）
 
-def display_sources_simple(sources: list, file_mapping: dict, gemini_id_mapping: dict):
-    """
-    簡化版參考來源顯示
-
-    顯示 Gemini 回覆的最接近 chunk 內容和原始連結
-
-    Args:
-        sources: 從 query_penalties 返回的 sources 列表（包含 snippet）
-        file_mapping: file_mapping.json 的內容
-        gemini_id_mapping: Gemini ID 映射
+    Returns:
+        [{'file_id', 'snippet'}, ...]，映射失敗或不存在於 file_mapping 的來源略過
     """
-    if not sources:
-        st.warning("⚠️ 未找到參考來源")
-        return
-
     # 去重並提取有效的 file_ids，同時保存對應的 snippet
     unique_sources = []
     seen = set()
@@ -473,67 +238,116 @@ def display_sources_simple(sources: list, file_mapping: dict, gemini_id_mapping:
             })
             seen.add(file_id)
 
-    if not unique_sources:
-        st.warning("⚠️ 未找到有效的參考來源")
-        return
-
     # 按日期排序（最新→最舊）
     unique_sources.sort(
         key=lambda item: file_mapping.get(item['file_id'], {}).get('date', ''),
         reverse=True  # 降序：最新的在前面
     )
+    return unique_sources
+
+# 參考來源的資料類型圖示與名稱
+SOURCE_TYPE_ICONS = {
+    'penalty': '⚖️',
+    'law_interpretation': '📜',
+    'announcement': '📢'
+}
+SOURCE_TYPE_LABELS = {
+    'penalty': '裁罰案件',
+    'law_interpretation': '法令函釋',
+    'announcement': '重要公告'
+}
+
+def resolve_source_documents(sources: list, file_mapping: dict, gemini_id_mapping: dict) -> list:
+    """將引用來源對應到文件並整理為顯示用的資料（保存在查詢結果紀錄中，重新顯示時不必再查映射檔）
 
-    # 顯示參考來源
-    st.subheader(f"📚 參考來源 ({len(unique_sources)} 筆)")
+    Returns:
+        [{'file_id', 'snippet', 'display_name', 'url', 'type'}, ...]（按日期排序，最新→最舊）
+    """
+    documents = []
+    for source_item in collect_source_documents(sources, file_mapping, gemini_id_mapping):
+        file_info = file_mapping.get(source_item['file_id'], {})
+        documents.append({
+            'file_id': source_item['file_id'],
+            'snippet': source_item['snippet'],
+            'display_name': file_info.get('display_name', source_item['file_id']),
+            'url': file_info.get('original_url', ''),
+            'type': file_info.get('_type', 'unknown')
+        })
+    return documents
+
+def render_source_documents(documents: list, expanded: bool = False):
+    """
+    簡化版參考來源顯示
 
-    for i, source_item in enumerate(unique_sources, 1):
-        file_id = source_item['file_id']
-        snippet = source_item['snippet']
-        file_info = file_mapping.get(file_id, {})
-        display_name = file_info.get('display_name', file_id)
-        detail_url = file_info.get('original_url', '')
-        data_type = file_info.get('_type', 'unknown')
+    顯示 Gemini 回覆的最接近 chunk 內容和原始連結
+
+    Args:
+        documents: resolve_source_documents 的結果
+        expanded: 是否展開所有來源
+    """
+    if not documents:
+        st.warning("⚠️ 未找到有效的參考來源")
+        return
 
+    # 顯示參考來源
+    st.subheader(f"📚 參考來源 ({len(documents)} 筆)")
+
+    for document in documents:
         # 根據資料類型選擇圖示
-        type_icons = {
-            'penalty': '⚖️',
-            'law_interpretation': '📜',
-            'announcement': '📢'
-        }
-        type_labels = {
-            'penalty': '裁罰案件',
-            'law_interpretation': '法令函釋',
-            'announcement': '重要公告'
-        }
-        icon = type_icons.get(data_type, '📄')
-        type_label = type_labels.get(data_type, '未知')
+        icon = SOURCE_TYPE_ICONS.get(document['type'], '📄')
+        type_label = SOURCE_TYPE_LABELS.get(document['type'], '未知')
 
         # 使用 expander 顯示
-        with st.expander(f"{icon} {type_label}_{display_name}", expanded=False):
+        with st.expander(f"{icon} {type_label}_{document['display_name']}", expanded=expanded):
             # 顯示 Gemini 檢索到的最接近 chunk 內容
-            if snippet:
+            if document['snippet']:
                 st.markdown("**📄 相關內容：**")
-                st.markdown(f"> {snippet}")
+                st.markdown(f"> {document['snippet']}")
             else:
                 st.info("無可用的內容片段")
 
             # 原始公告連結
-            if detail_url:
+            if document['url']:
                 st.markdown("---")
-                st.markdown(f"🔗 [查看金管會原始頁面]({detail_url})")
-
-# 設定頁面
-st.set_page_config(
-    page_title="金管會裁罰案件查詢系統",
-    page_icon="⚖️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+                st.markdown(f"🔗 [查看金管會原始頁面]({document['url']})")
 
 # 初始化 Gemini
 @st.cache_resource
 def init_gemini():
-    """初始化 Gemini API"""
+    """初始化 Gemini API（FSC_GEMINI_TRANSPORT 可切換為錄製 / 重播 / 本地替身伺服器）
+
+    設定 GEMINI_STORE_IDS（多個 Store）時，store_id 為所有 Store 的設定字串，查詢時並行檢索各 Store。
+    """
+    store_id = os.getenv('GEMINI_STORE_ID', 'fileSearchStores/fscpenaltiesplaintext-4f87t5uexgui')
+    if os.getenv('GEMINI_STORE_IDS'):
+        store_id = format_store_ids(parse_store_ids(os.getenv('GEMINI_STORE_IDS'))) or store_id
+    transport = os.getenv('FSC_GEMINI_TRANSPORT', 'live')
+    recordings_dir = os.getenv('FSC_GEMINI_RECORDINGS') or Path(__file__).parent / DEFAULT_RECORDINGS_DIR
+
+    if transport not in TRANSPORTS:
+        st.error(f"❌ 未知的 FSC_GEMINI_TRANSPORT：{transport}（可用：{', '.join(TRANSPORTS)}）")
+        st.stop()
+
+    # 離線模式：使用假 client（不需要 API Key）
+    if os.getenv('FSC_GEMINI_FAKE') == '1':
+        from fake_genai import FakeClient, build_corpus
+        return FakeClient(corpus=build_corpus(get_metadata_registry().snapshot())), store_id
+
+    # 重播模式：從錄製檔回應（不需要 API Key，不消耗配額）
+    if transport == 'replay':
+        from fake_genai import build_corpus
+        corpus = build_corpus(get_metadata_registry().snapshot())
+        return ReplayClient(recordings_dir, ReplayOptions.from_env(), corpus=corpus), store_id
+
+    # 本地替身伺服器：以 HTTP 連到 gemini_transport.py serve
+    if transport == 'server':
+        base_url = os.getenv('FSC_GEMINI_BASE_URL', DEFAULT_SERVER_URL)
+        client = genai.Client(
+            api_key=os.getenv('GEMINI_API_KEY') or 'stand-in',
+            http_options=types.HttpOptions(base_url=base_url)
+        )
+        return client, store_id
+
     api_key = os.getenv('GEMINI_API_KEY')
     if not api_key:
         st.error("❌ 找不到 GEMINI_API_KEY，請設定環境變數")
@@ -542,57 +356,30 @@ def init_gemini():
     # 建立 GenAI Client
     client = genai.Client(api_key=api_key)
 
-    store_id = os.getenv('GEMINI_STORE_ID', 'fileSearchStores/fscpenaltiesplaintext-4f87t5uexgui')
+    # 錄製模式：照常呼叫 Gemini，並將回應寫入錄製檔
+    if transport == 'record':
+        client = RecordingClient(client, Recorder(recordings_dir))
 
     return client, store_id
 
-def generate_law_links_instruction() -> str:
-    """
-    生成法條連結的 system instruction
-
-    從 file_mapping.json 收集所有唯一的完整法條連結，
-    生成包含連結表格和格式規則的指令文字
-    """
-    import json
-    from pathlib import Path
-
-    # 讀取 file_mapping.json
-    mapping_file = Path(__file__).parent / 'data/penalties/file_mapping.json'
-
-    if not mapping_file.exists():
-        return ""
-
-    try:
-        with open(mapping_file, 'r', encoding='utf-8') as f:
-            mapping = json.load(f)
-
-        # 收集所有唯一的完整法條連結（不包含簡寫形式）
-        all_law_links = {}
-        for file_id, info in mapping.items():
-            law_links = info.get('law_links', {})
-            for law_text, url in law_links.items():
-                # 只保留完整法條名稱（不以「第」開頭）
-                if not law_text.startswith('第'):
-                    if law_text not in all_law_links:
-                        all_law_links[law_text] = url
-
-        if not all_law_links:
-            return ""
-
-        # 生成 system instruction
-        instruction = f"""
-
----
-
-## 法條連結生成規則
+# 法條連結索引（依語料版本建立，所有 session 共用）
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _law_index_for_version(corpus_version: str) -> LawIndex:
+    """依語料版本建立的法條連結索引（映射檔變動時版本改變，自動重建）"""
+    return LawIndex.from_snapshot(get_metadata_registry().snapshot())
 
-當你在回答中提到法條時，請使用 Markdown 連結格式。以下是可用的法條連結：
+def get_law_index() -> LawIndex:
+    """取得目前語料版本的法條連結索引"""
+    return _law_index_for_version(get_metadata_registry().snapshot().version)
 
-```json
-{json.dumps(all_law_links, ensure_ascii=False, indent=2)}
-```
+def configured_law_link_mode() -> str:
+    """FSC_LAW_LINK_MODE：full（完整連結表放在 system instruction）/ query（只附上與查詢相關的法條）/
+    local（提示中不附連結表，只在本地插入）"""
+    mode = os.getenv('FSC_LAW_LINK_MODE', 'query')
+    return mode if mode in LAW_LINK_MODES else 'query'
 
-### 格式規則：
+# 法條連結格式規則（full / query 模式共用）
+LAW_LINK_RULES = """### 格式規則：
 
 1. **完整法條**（包含法律名稱）：
    - 使用對應的完整連結
@@ -613,7 +400,7 @@ def generate_law_links_instruction() -> str:
    - 範例：[第45條第1項第2款](url) ← URL 指向第45條
 
 5. **未列出的法條**：
-   - 如果法條不在上述列表中，**不要加連結**，直接顯示文字
+   - 如果法條不在可用的法條連結中，**不要加連結**，直接顯示文字
 
 ### 輸出範例：
 
@@ -629,30 +416,46 @@ def generate_law_links_instruction() -> str:
 該公司違反[《金融控股公司法》第45條第1項及第51條](url)規定  ← 連結包含了兩個法條（錯誤）
 ```
 
-請嚴格遵守以上格式要求。
-"""
+請嚴格遵守以上格式要求。"""
 
-        return instruction
-
-    except Exception as e:
-        return ""
-
-# 查詢函數
-def query_penalties(client: genai.Client, query: str, store_id: str, model: str = 'gemini-2.5-flash', filters: dict = None) -> dict:
+def generate_law_links_instruction(mode: str = 'full') -> str:
     """
-    使用 Gemini File Search Store 查詢裁罰案件
-
-    Args:
-        query: 查詢文字
-        store_id: Gemini Store ID
-        filters: 篩選條件（日期範圍、來源單位等）
+    生成法條連結的 system instruction
 
-    Returns:
-        查詢結果字典
+    full 模式附上法條連結索引中所有唯一的完整法條連結（由裁罰案件映射 file_mapping.json 收集）；
+    query 模式只說明格式規則，相關的法條連結由 build_full_query 附在查詢內容中
     """
     try:
-        # 建立系統指令（針對裁罰案件的時效性優化）
-        system_instruction = """你是金融監督管理委員會的裁罰案件查詢助手。
+        law_index = get_law_index()
+        if mode not in ('full', 'query') or not law_index.links:
+            return ""
+
+        if mode == 'full':
+            table = f"""以下是可用的法條連結：
+
+```json
+{json.dumps(law_index.links, ensure_ascii=False, indent=2)}
+```"""
+        else:
+            table = "可用的法條連結會附在查詢內容最後的「相關法條連結」（JSON）中。"
+
+        # 生成 system instruction
+        return f"""
+
+---
+
+## 法條連結生成規則
+
+當你在回答中提到法條時，請使用 Markdown 連結格式。{table}
+
+{LAW_LINK_RULES}
+"""
+
+    except Exception as e:
+        return ""
+
+# 系統指令（針對裁罰案件的時效性優化）
+BASE_SYSTEM_INSTRUCTION = """你是金融監督管理委員會的裁罰案件查詢助手。
 
 【最重要】資料來源規則：
 - **必須使用提供的 File Search 工具**檢索裁罰案件資料庫
@@ -748,179 +551,1454 @@ def query_penalties(client: genai.Client, query: str, store_id: str, model: str
 （注意：不要在每個案件後面加上「資料來源」或檔名，系統會自動在最下方顯示參考文件）
 """
 
-        # 附加法條連結指令（讓 Gemini 直接生成帶連結的答案）
-        law_links_instruction = generate_law_links_instruction()
-        if law_links_instruction:
-            system_instruction += law_links_instruction
+# 多個 Store 時，最終回答不附 File Search 工具，而是根據附在查詢後面的檢索片段撰寫：
+# 基本規則中要求使用 File Search 工具的部分改為以下內容（其餘格式規則相同）
+SYNTHESIS_INSTRUCTION_REPLACEMENTS = (
+    ("""- **必須使用提供的 File Search 工具**檢索裁罰案件資料庫
+""", """- **只能根據查詢後面附上的檢索片段（[來源 N]）回答**，不會另外提供檢索工具
+- 引用片段內容時，在該行結尾標示 [來源 N]（多個來源寫成 [來源 1、2]）
+"""),
+    ("**但必須列出至少 1-3 個從 File Search 檢索到的具體案例**", "**但必須列出至少 1-3 個檢索片段中的具體案例**"),
+    ("如果 File Search 檢索到相關案件", "如果檢索片段中有相關案件"),
+    ("在回答前，確認你是否真的使用了 File Search 工具", "在回答前，確認每個案例都已標示 [來源 N]"),
+    ("除非它們出現在 File Search 結果中", "除非它們出現在檢索片段中"),
+)
 
-        # 建立完整查詢（篩選條件）
-        full_query = query
+def synthesis_instruction(instruction: str) -> str:
+    """將基本規則改寫為根據檢索片段撰寫最終回答的版本"""
+    for old, new in SYNTHESIS_INSTRUCTION_REPLACEMENTS:
+        instruction = instruction.replace(old, new)
+    return instruction
 
-        if filters:
-            filter_parts = []
+def build_system_instruction(synthesis: bool = False) -> str:
+    """組合完整的 system instruction（基本規則 + 法條連結規則），每個語料版本只組合一次
 
-            if filters.get('start_date') and filters.get('end_date'):
-                filter_parts.append(
-                    f"日期範圍：{filters['start_date']} 到 {filters['end_date']}"
-                )
+    Args:
+        synthesis: 多個 Store 檢索後撰寫最終回答（不使用 File Search 工具）
+    """
+    version = get_metadata_registry().snapshot().version
+    return _system_instruction_for_version(version, law_link_mode(version), synthesis)
 
-            if filters.get('source_units'):
-                units_str = "、".join(filters['source_units'])
-                filter_parts.append(f"來源單位：{units_str}")
-
-            if filters.get('min_penalty'):
-                filter_parts.append(f"裁罰金額至少：{filters['min_penalty']:,} 元")
-
-            if filter_parts:
-                full_query += "\n\n篩選條件：\n" + "\n".join(f"- {p}" for p in filter_parts)
-
-        # 根據模型類型設定 token 限制
-        # Pro 模型通常提供更詳細的回答，需要更多 tokens
-        max_tokens = 8192 if 'pro' in model.lower() else 4096
-
-        # 使用 File Search Store 進行查詢（使用正確的型別物件）
-        response = client.models.generate_content(
-            model=model,  # 使用用戶選擇的模型
-            contents=full_query,
-            config=types.GenerateContentConfig(
-                tools=[
-                    types.Tool(
-                        file_search=types.FileSearch(
-                            file_search_store_names=[store_id]
-                        )
-                    )
-                ],
-                temperature=0.1,
-                max_output_tokens=max_tokens,
-                system_instruction=system_instruction
+@st.cache_data(max_entries=4, show_spinner=False)
+def _system_instruction_for_version(corpus_version: str, mode: str = 'full', synthesis: bool = False) -> str:
+    """依語料版本與法條連結方式快取的 system instruction（映射檔變動時版本改變，自動重新組合）"""
+    system_instruction = synthesis_instruction(BASE_SYSTEM_INSTRUCTION) if synthesis else BASE_SYSTEM_INSTRUCTION
+
+    # 附加法條連結指令（讓 Gemini 直接生成帶連結的答案）
+    law_links_instruction = generate_law_links_instruction(mode)
+    if law_links_instruction:
+        system_instruction += law_links_instruction
+
+    return system_instruction
+
+@st.cache_data(max_entries=8, show_spinner=False)
+def _static_prompt_tokens(corpus_version: str, mode: str) -> int:
+    """system instruction 的估計 token 數"""
+    return estimate_tokens(_system_instruction_for_version(corpus_version, mode))
+
+def static_prompt_status() -> dict:
+    """固定提示（依 FSC_LAW_LINK_MODE 組合的 system instruction）的估計大小與預算
+
+    Returns:
+        {'tokens', 'budget', 'over_budget', 'mode', 'law_link_mode'}
+    """
+    budget = get_cost_budget()
+    tokens = _static_prompt_tokens(get_metadata_registry().snapshot().version, configured_law_link_mode())
+    return {
+        'tokens': tokens,
+        'budget': budget.prompt_tokens or None,
+        'over_budget': bool(budget.prompt_tokens) and tokens > budget.prompt_tokens,
+        'mode': budget.prompt_mode,
+        'law_link_mode': law_link_mode()
+    }
+
+def law_link_mode(corpus_version: str = None) -> str:
+    """實際使用的法條連結方式
+
+    固定提示超過預算且 FSC_PROMPT_BUDGET_MODE=degrade 時改為 local，
+    此時答案的法條連結只由 add_law_links_to_text 在本地插入
+    """
+    mode = configured_law_link_mode()
+    budget = get_cost_budget()
+    if mode == 'local' or not budget.prompt_tokens or budget.prompt_mode != 'degrade':
+        return mode
+    version = corpus_version or get_metadata_registry().snapshot().version
+    return mode if _static_prompt_tokens(version, mode) <= budget.prompt_tokens else 'local'
+
+def relevant_law_links(query: str) -> dict:
+    """query 模式附在查詢內容中的法條連結（其他模式返回空字典）"""
+    if law_link_mode() != 'query':
+        return {}
+    return get_law_index().select_for_query(query, limit=int(os.getenv('FSC_LAW_LINK_LIMIT', '40')))
+
+def system_instruction_sections() -> list:
+    """system instruction 依段落切分（用於固定提示大小報告）"""
+    sections = [(f"基本規則／{title}", text) for title, text in split_prompt_sections(BASE_SYSTEM_INSTRUCTION)]
+    law_links_instruction = generate_law_links_instruction(configured_law_link_mode())
+    if law_links_instruction:
+        sections += [(f"法條連結／{title}", text) for title, text in split_prompt_sections(law_links_instruction)]
+    return sections
+
+def build_full_query(query: str, filters: dict = None, pushdown=frozenset(), law_links: dict = None) -> str:
+    """將篩選條件與相關法條連結附加到查詢文字
+
+    Args:
+        pushdown: 已下推為 metadata filter 的欄位（date / source），不再附加於文字
+        law_links: 與查詢相關的法條連結（query 模式，見 relevant_law_links）
+    """
+    # 建立完整查詢（篩選條件）
+    full_query = query
+
+    if filters:
+        filter_parts = []
+
+        if 'date' in pushdown:
+            pass  # 日期範圍由 File Search 篩選
+        elif filters.get('start_date') and filters.get('end_date'):
+            filter_parts.append(
+                f"日期範圍：{filters['start_date']} 到 {filters['end_date']}"
             )
+
+        if filters.get('source_units') and 'source' not in pushdown:
+            units_str = "、".join(filters['source_units'])
+            filter_parts.append(f"來源單位：{units_str}")
+
+        if filters.get('min_penalty'):
+            filter_parts.append(f"裁罰金額至少：{filters['min_penalty']:,} 元")
+
+        if filter_parts:
+            full_query += "\n\n篩選條件：\n" + "\n".join(f"- {p}" for p in filter_parts)
+
+    if law_links:
+        full_query += f"\n\n相關法條連結：\n```json\n{json.dumps(law_links, ensure_ascii=False, indent=2)}\n```"
+
+    return full_query
+
+def build_generate_config(store_id: str, model: str, system_instruction: str,
+                          cached_content: str = None, metadata_filter: str = None,
+                          max_output_tokens: int = None) -> types.GenerateContentConfig:
+    """建立 File Search 查詢設定
+
+    Args:
+        store_id: File Search Store（None 表示不使用 File Search，例如多個 Store 檢索後撰寫最終回答）
+        cached_content: 已上傳的 system instruction 快取名稱；提供時 system instruction
+            與 File Search 工具都已包含在快取中，不再內嵌於請求
+        metadata_filter: File Search metadata 篩選表達式（與 cached_content 不可同時使用）
+        max_output_tokens: 輸出 token 上限（預算降級時使用，None 表示依模型決定）
+    """
+    # 根據模型類型設定 token 限制
+    # Pro 模型通常提供更詳細的回答，需要更多 tokens
+    max_tokens = 8192 if 'pro' in model.lower() else 4096
+    if max_output_tokens:
+        max_tokens = min(max_tokens, max_output_tokens)
+
+    if cached_content:
+        return types.GenerateContentConfig(
+            cached_content=cached_content,
+            temperature=0.1,
+            max_output_tokens=max_tokens
         )
 
-        # 提取來源文件
-        sources = []
-        seen_files = {}  # 用於去重
-
-        # 診斷資訊（用於排查 sources 提取失敗）
-        debug_info = {
-            'has_candidates': False,
-            'has_grounding_metadata': False,
-            'has_grounding_supports': False,
-            'has_grounding_chunks': False,
-            'grounding_supports_count': 0,
-            'grounding_chunks_count': 0
-        }
+    return types.GenerateContentConfig(
+        tools=[
+            types.Tool(
+                file_search=types.FileSearch(
+                    file_search_store_names=[store_id],
+                    metadata_filter=metadata_filter
+                )
+            )
+        ] if store_id else None,
+        temperature=0.1,
+        max_output_tokens=max_tokens,
+        system_instruction=system_instruction
+    )
+
+def extract_grounding_sources(response, text: str = None) -> tuple:
+    """從回應的 grounding_metadata 提取來源文件（單次走訪，見 grounding.extract_grounding）
+
+    Args:
+        text: 完整回答文字（串流模式的 grounding 在最後一個 chunk，需另外提供）
+
+    Returns:
+        (sources, debug_info)：sources 為 [{'filename', 'snippet', 'spans'}]，spans 為引用此文件的回答區間
+    """
+    sources, debug_info = extract_grounding(response, text, normalize=remove_social_media_noise)
+    return [source.to_dict() for source in sources], debug_info
+
+def extract_usage(response) -> dict:
+    """從回應的 usage_metadata 提取 token 用量，沒有用量資訊時返回空字典"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return {}
+    return {
+        'prompt_tokens': usage.prompt_token_count or 0,
+        'cached_tokens': usage.cached_content_token_count or 0,
+        'output_tokens': usage.candidates_token_count or 0,
+        'thoughts_tokens': usage.thoughts_token_count or 0,
+        'tool_prompt_tokens': usage.tool_use_prompt_token_count or 0,
+        'total_tokens': usage.total_token_count or 0
+    }
+
+# System instruction 的 Gemini 內容快取（所有 session 共用）
+@st.cache_resource
+def get_prompt_cache_manager(_client) -> CachedPromptManager:
+    """取得程序共用的 system instruction 快取管理器"""
+    return CachedPromptManager(
+        _client,
+        ttl_seconds=int(os.getenv('FSC_CONTEXT_CACHE_TTL', '3600'))
+    )
+
+def get_cached_prompt_name(client, model: str, store_id: str, system_instruction: str):
+    """取得 system instruction 的 cached content 名稱，停用或無法使用時返回 None"""
+    if os.getenv('FSC_CONTEXT_CACHE', '1') == '0':
+        return None
+    return get_prompt_cache_manager(client).get(model, store_id, system_instruction)
+
+# 可下推的篩選欄位（依語料版本計算，所有 session 共用）
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _pushable_keys_for_version(corpus_version: str) -> frozenset:
+    """每份已知文件都有 metadata 的篩選欄位（映射檔變動時版本改變，自動重新計算）"""
+    return pushable_keys(get_metadata_registry().snapshot())
+
+def resolve_metadata_filter(filters: dict = None) -> tuple:
+    """將篩選條件轉換為 File Search metadata filter
+
+    只有 Store 文件已以 corpus_sync.py 上傳 custom metadata 時才能下推（FSC_METADATA_FILTER=1）；
+    原本的 Store 文件沒有 metadata，下推後會查無結果，因此預設只以本地映射檔檢查是否有符合的文件。
+    下推時也只包含每份文件都有的欄位（裁罰案件沒有來源單位，來源單位仍以文字附加於查詢）。
+
+    Returns:
+        (篩選表達式或 None, 已下推的欄位, 本地映射檔中是否可能有符合的文件)
+    """
+    if not filters:
+        return None, frozenset(), True
+
+    metadata_filter = parse_filters(filters)
+    if not metadata_filter:
+        return None, frozenset(), True
+
+    snapshot = get_metadata_registry().snapshot()
+    has_matches = has_matching_docs(snapshot, metadata_filter)
+    if os.getenv('FSC_METADATA_FILTER', '0') == '0':
+        return None, frozenset(), has_matches
+    pushed = metadata_filter.restrict(_pushable_keys_for_version(snapshot.version))
+    return pushed.expression() or None, pushed.keys(), has_matches
+
+def no_matching_result(expression: str) -> dict:
+    """篩選條件沒有任何符合文件時的查詢結果（不呼叫 Gemini）"""
+    return {
+        'success': True,
+        'no_match': True,
+        'text': "查無符合篩選條件的案件，請放寬日期範圍或來源單位後再試。",
+        'sources': [],
+        'debug_info': {'metadata_filter': expression}
+    }
+
+# 查詢流程的分段計時與指標（所有 session 共用）
+@st.cache_resource
+def get_metrics() -> MetricsRegistry:
+    """取得程序共用的指標（設定 FSC_METRICS_PORT 時另啟動 Prometheus 端點）"""
+    metrics = MetricsRegistry(log_path=os.getenv('FSC_METRICS_LOG') or None)
+    port = os.getenv('FSC_METRICS_PORT')
+    if port:
+        try:
+            start_http_exporter(metrics, int(port))
+        except OSError:
+            pass  # 連接埠已被使用（例如同一台機器上的其他程序）：只在程序內記錄
+    return metrics
 
-        if hasattr(response, 'candidates') and len(response.candidates) > 0:
-            debug_info['has_candidates'] = True
-            candidate = response.candidates[0]
-
-            if hasattr(candidate, 'grounding_metadata') and candidate.grounding_metadata:
-                debug_info['has_grounding_metadata'] = True
-                metadata = candidate.grounding_metadata
-
-                # 記錄 grounding_supports 和 grounding_chunks 的狀態
-                if hasattr(metadata, 'grounding_supports'):
-                    debug_info['has_grounding_supports'] = bool(metadata.grounding_supports)
-                    debug_info['grounding_supports_count'] = len(metadata.grounding_supports) if metadata.grounding_supports else 0
-
-                if hasattr(metadata, 'grounding_chunks'):
-                    debug_info['has_grounding_chunks'] = bool(metadata.grounding_chunks)
-                    debug_info['grounding_chunks_count'] = len(metadata.grounding_chunks) if metadata.grounding_chunks else 0
-
-                # 優先從 grounding_supports 提取（包含引用資訊）
-                if hasattr(metadata, 'grounding_supports') and metadata.grounding_supports:
-                    for support in metadata.grounding_supports:
-                        if hasattr(support, 'grounding_chunk_indices'):
-                            for chunk_idx in support.grounding_chunk_indices:
-                                if chunk_idx < len(metadata.grounding_chunks):
-                                    chunk = metadata.grounding_chunks[chunk_idx]
-
-                                    if hasattr(chunk, 'retrieved_context'):
-                                        context = chunk.retrieved_context
-
-                                        # 提取文件 ID/名稱
-                                        filename = "未知文件"
-                                        if hasattr(context, 'title') and context.title:
-                                            filename = context.title
-                                        elif hasattr(context, 'uri') and context.uri:
-                                            filename = context.uri.split('/')[-1]
-
-                                        # 提取內容片段
-                                        snippet = ""
-                                        if hasattr(context, 'text') and context.text:
-                                            snippet = context.text
-
-                                        # 使用 snippet 的部分內容作為唯一標識避免重複
-                                        snippet_id = snippet[:100] if snippet else str(len(sources))
-
-                                        if snippet_id not in seen_files:
-                                            sources.append({
-                                                'filename': filename,
-                                                'snippet': snippet
-                                            })
-                                            seen_files[snippet_id] = True
-
-                # 如果沒有 grounding_supports，回退到 grounding_chunks
-                if not sources and hasattr(metadata, 'grounding_chunks') and metadata.grounding_chunks:
-                    for chunk in metadata.grounding_chunks:
-                        if hasattr(chunk, 'retrieved_context'):
-                            context = chunk.retrieved_context
-
-                            # 提取文件 ID/名稱
-                            filename = "未知文件"
-                            if hasattr(context, 'title') and context.title:
-                                filename = context.title
-                            elif hasattr(context, 'uri') and context.uri:
-                                filename = context.uri.split('/')[-1]
-
-                            # 提取內容片段
-                            snippet = ""
-                            if hasattr(context, 'text') and context.text:
-                                snippet = context.text
-
-                            # 使用 snippet 的部分內容作為唯一標識避免重複
-                            snippet_id = snippet[:100] if snippet else str(len(sources))
-
-                            if snippet_id not in seen_files:
-                                sources.append({
-                                    'filename': filename,
-                                    'snippet': snippet
-                                })
-                                seen_files[snippet_id] = True
-
-        return {
+# Token 用量與成本帳本（所有 session 共用，寫入磁碟，重啟後仍可累計當日花費）
+@st.cache_resource
+def get_cost_ledger() -> CostLedger:
+    """取得程序共用的成本帳本（無法寫入磁碟時改為只保存在記憶體）"""
+    pricing = load_pricing(os.getenv('FSC_PRICING'))
+    cache_dir = Path(os.getenv('FSC_CACHE_DIR') or Path(__file__).parent / '.cache')
+    try:
+        return CostLedger(cache_dir / 'costs.sqlite', pricing=pricing)
+    except (OSError, sqlite3.Error):
+        return CostLedger(pricing=pricing)
+
+def get_cost_budget() -> CostBudget:
+    """目前的成本預算設定（FSC_DAILY_BUDGET_USD、FSC_PROMPT_TOKEN_BUDGET 等）"""
+    return CostBudget.from_env()
+
+def cost_budget_status() -> dict:
+    """今日花費與每日上限的比較（state 為 ok / warn / exceeded）"""
+    return get_cost_ledger().budget_status(get_cost_budget())
+
+def budget_output_limit(status: dict) -> int:
+    """今日花費達警告比例時的輸出 token 上限（未達時返回 None）"""
+    return get_cost_budget().degraded_max_output_tokens if status['state'] == 'warn' else None
+
+def budget_exceeded_result(status: dict) -> dict:
+    """今日花費已達上限時的查詢結果（不呼叫 Gemini）"""
+    return {
+        'success': False,
+        'budget_exceeded': True,
+        'error': f"今日 Gemini 查詢預算已用完（US${status['spent_usd']:.2f} / US${status['cap_usd']:.2f}），請明天再試。"
+    }
+
+def record_request_cost(model: str, usage: dict, trace: Trace) -> dict:
+    """將一次 Gemini 請求的用量寫入成本帳本（session 與查詢類型取自 trace），返回成本明細"""
+    if not usage:
+        return {}
+    cost = get_cost_ledger().record(
+        model, usage,
+        session=trace.attributes.get('session'),
+        query_class=trace.attributes.get('query_class')
+    )
+    get_metrics().inc('cost_usd_total', cost['total_usd'], model=model)
+    return cost
+
+# Gemini 請求排程器（所有 session 共用：依 RPM/TPM 放行、優先順序、429 退避）
+@st.cache_resource
+def get_request_scheduler():
+    """取得程序共用的請求排程器（FSC_SCHEDULER=0 時返回 None，直接呼叫 Gemini）"""
+    if os.getenv('FSC_SCHEDULER', '1') == '0':
+        return None
+    return RequestScheduler(
+        requests_per_minute=max(1.0, float(os.getenv('FSC_GEMINI_RPM', '300'))),
+        tokens_per_minute=max(1.0, float(os.getenv('FSC_GEMINI_TPM', '1000000'))),
+        max_queue=int(os.getenv('FSC_SCHEDULER_MAX_QUEUE', '64')),
+        max_wait={'interactive': float(os.getenv('FSC_SCHEDULER_MAX_WAIT', '60'))}
+    )
+
+def estimate_request_tokens(full_query: str, max_output_tokens: int = None) -> int:
+    """一次請求預估使用的 token 數（固定提示 + 查詢內容 + 輸出上限），用於 TPM 限制"""
+    version = get_metadata_registry().snapshot().version
+    output_tokens = max_output_tokens or int(os.getenv('FSC_EXPECTED_OUTPUT_TOKENS', '2000'))
+    return _static_prompt_tokens(version, law_link_mode(version)) + estimate_tokens(full_query) + output_tokens
+
+def call_gemini(fn, priority: str = 'interactive', tokens: int = 0, on_wait=None, trace: Trace = None):
+    """經由排程器呼叫 Gemini（排隊時間記為 scheduler_wait）
+
+    Args:
+        fn: 不帶參數、實際呼叫 Gemini 的函式
+        priority: 排程優先順序（interactive / hedge / batch / prewarm）
+        tokens: 預估 token 數
+        on_wait: 排隊時呼叫 on_wait(排在前面的請求數, 預估等待秒數)
+
+    Returns:
+        (fn 的結果, 排隊秒數)
+    """
+    scheduler = get_request_scheduler()
+    if scheduler is None:
+        return fn(), 0.0
+
+    call_seconds = 0.0
+
+    def timed():
+        nonlocal call_seconds
+        start = time.perf_counter()
+        try:
+            return fn()
+        finally:
+            call_seconds += time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        result = scheduler.call(timed, priority, tokens, on_wait)
+    finally:
+        waited = time.perf_counter() - start - call_seconds
+        if trace is not None:
+            trace.add('scheduler_wait', waited)
+    return result, waited
+
+def settle_request_tokens(estimated: int, usage: dict):
+    """以實際用量修正排程器的 TPM 扣除量"""
+    scheduler = get_request_scheduler()
+    if scheduler is not None and usage:
+        scheduler.settle(estimated, usage.get('total_tokens') or 0)
+
+def gemini_error_result(error: Exception) -> dict:
+    """Gemini 呼叫失敗時的查詢結果（排隊逾時、負載過高與配額不足改為友善訊息）"""
+    if isinstance(error, SchedulerTimeout):
+        message = "目前查詢人數較多，排隊等候時間過長，請稍後再試。"
+    elif isinstance(error, SchedulerOverloaded):
+        message = f"目前查詢人數較多（{error}），請稍後再試。"
+    elif is_retryable(error):
+        message = "Gemini 查詢配額暫時不足，請稍等片刻再試。"
+    else:
+        return {'success': False, 'error': str(error)}
+    return {'success': False, 'overloaded': True, 'error': message}
+
+def queue_notice(position: int, eta: float) -> str:
+    """排隊位置提示文字"""
+    ahead = f"前面還有 {position} 個請求" if position else "即將開始查詢（等待 Gemini 配額）"
+    return f"⏳ 排隊中：{ahead}，預計約 {max(1, round(eta))} 秒"
+
+# 多個 File Search Store 的並行檢索（所有 session 共用執行緒池與統計）
+@st.cache_resource
+def get_store_fanout() -> StoreFanOut:
+    """取得程序共用的多 Store 檢索器（FSC_STORE_DEADLINES 可個別設定期限，例如 announcement=8）"""
+    deadlines = {}
+    for item in os.getenv('FSC_STORE_DEADLINES', '').split(','):
+        key, _, seconds = item.partition('=')
+        if key.strip() and seconds.strip():
+            deadlines[key.strip()] = float(seconds)
+    return StoreFanOut(
+        deadline=float(os.getenv('FSC_STORE_DEADLINE', '20')),
+        deadlines=deadlines,
+        max_workers=int(os.getenv('FSC_FANOUT_WORKERS', '16'))
+    )
+
+# 各 Store 檢索時使用的指令（只需要引用來源，回答本身不顯示）
+RETRIEVAL_INSTRUCTION = (
+    "你是檢索助理。只根據 File Search 檢索到的文件，逐點摘錄與問題最相關的內容（案件、日期、處分、法條），"
+    "不要推論或補充文件以外的內容。"
+)
+
+def combine_counts(*items: dict) -> dict:
+    """加總多次請求的用量或成本（數值欄位逐項相加）"""
+    combined = {}
+    for item in items:
+        for key, value in (item or {}).items():
+            if isinstance(value, (int, float)):
+                combined[key] = combined.get(key, 0) + value
+    return combined
+
+def retrieve_from_store(client, target, contents: str, model: str, metadata_filter: str, trace: Trace,
+                        priority: str) -> dict:
+    """在單一 Store 檢索（簡短回答，只取引用來源）
+
+    Returns:
+        {'sources': [{'filename', 'snippet', 'spans'}], 'usage', 'cost'}
+    """
+    max_tokens = int(os.getenv('FSC_FANOUT_RETRIEVAL_TOKENS', '512'))
+    config = build_generate_config(target.name, model, RETRIEVAL_INSTRUCTION, metadata_filter=metadata_filter,
+                                   max_output_tokens=max_tokens)
+    estimated_tokens = estimate_tokens(RETRIEVAL_INSTRUCTION + contents) + max_tokens
+    response, _ = call_gemini(
+        lambda: client.models.generate_content(model=model, contents=contents, config=config),
+        priority, estimated_tokens
+    )
+    sources, _ = extract_grounding_sources(response)
+    usage = extract_usage(response)
+    settle_request_tokens(estimated_tokens, usage)
+    get_metrics().record_usage(usage)
+    return {'sources': sources, 'usage': usage, 'cost': record_request_cost(model, usage, trace)}
+
+def fan_out_retrieval(client, query: str, store_id: str, model: str, filters: dict, metadata_filter: str,
+                      pushdown: frozenset, trace: Trace, priority: str = 'interactive',
+                      shared: SharedRetrieval = None):
+    """設定多個 Store 時並行檢索，依相關度與日期合併來源
+
+    Args:
+        shared: 同一次查詢各嘗試共用的檢索結果（對沖請求與重試只重新撰寫回答，不重複檢索各 Store）
+
+    Returns:
+        單一 Store 時為 None；否則為 {'sources': 合併後的來源, 'stores': 各 Store 狀態,
+        'skipped': 逾時或失敗的 Store 名稱, 'failed': 是否全部失敗, 'timed_out': 是否全部逾時, 'usage', 'cost'}
+    """
+    targets = parse_store_ids(store_id)
+    if len(targets) < 2:
+        return None
+    if shared is not None:
+        return shared.get(lambda: fan_out_retrieval(client, query, store_id, model, filters, metadata_filter,
+                                                    pushdown, trace, priority))
+
+    metrics = get_metrics()
+    contents = build_full_query(query, filters, pushdown=pushdown)
+    snapshot = get_metadata_registry().snapshot()
+
+    def source_date(filename: str) -> int:
+        doc_id = extract_file_id(filename, snapshot.gemini_id_mapping)
+        return doc_date_value(doc_id, snapshot.file_mapping.get(doc_id)) if doc_id else 0
+
+    with trace.span('store_fanout'):
+        results = get_store_fanout().run(
+            targets, lambda target: retrieve_from_store(client, target, contents, model, metadata_filter, trace, priority)
+        )
+    for result in results:
+        metrics.inc('store_fanout_total', store=result.target.family or result.target.name, status=result.status)
+    succeeded = [result for result in results if result.status == 'ok']
+    with trace.span('source_merge'):
+        sources = merge_sources(
+            [(result.target.family or result.target.name, result.value['sources']) for result in succeeded],
+            int(os.getenv('FSC_FANOUT_TOP_K', '8')), source_date
+        )
+
+    return {
+        'sources': sources,
+        'stores': [
+            {'store': result.target.label, 'status': result.status, 'seconds': round(result.seconds, 2),
+             'sources': len(result.value['sources']) if result.status == 'ok' else 0, 'error': result.error}
+            for result in results
+        ],
+        'skipped': [result.target.label for result in results if result.status != 'ok'],
+        'failed': not succeeded,
+        'timed_out': all(result.status == 'timeout' for result in results),
+        'usage': combine_counts(*(result.value['usage'] for result in succeeded)),
+        'cost': combine_counts(*(result.value['cost'] for result in succeeded))
+    }
+
+def fanout_failed_result(fanout: dict) -> dict:
+    """所有 Store 都逾時或失敗時的查詢結果"""
+    if fanout['timed_out']:
+        return {'success': False, 'overloaded': True, 'error': "各資料庫都沒有在期限內回應，請稍後再試。",
+                'debug_info': {'fanout': fanout['stores']}}
+    errors = [store['error'] for store in fanout['stores'] if store['error']]
+    return {'success': False, 'error': errors[0] if errors else "各資料庫檢索失敗",
+            'debug_info': {'fanout': fanout['stores']}}
+
+def new_shared_retrieval() -> SharedRetrieval:
+    """一次查詢的共用檢索結果：對沖請求與沒有引用來源時的重試只重新撰寫回答（所有 Store 都失敗或沒有來源時重新檢索）"""
+    return SharedRetrieval(reuse=lambda fanout: fanout is not None and not fanout['failed'] and fanout['sources'])
+
+def add_fanout_totals(result: dict, fanout: dict):
+    """將各 Store 檢索請求的用量與成本加入查詢結果，並標示逾時或失敗而略過的 Store"""
+    result['usage'] = combine_counts(result['usage'], fanout['usage'])
+    result['cost'] = combine_counts(result['cost'], fanout['cost'])
+    if fanout['skipped']:
+        result['partial_stores'] = fanout['skipped']
+
+def fanout_sources(text: str, fanout: dict) -> tuple:
+    """最終回答的來源（依 [來源 N] 標記換算引用區間）與診斷資訊
+
+    Returns:
+        (移除 [來源 N] 標記後的回答文字, 來源（引用區間對應移除後的文字）, 診斷資訊)
+    """
+    sources = cited_sources(text, fanout['sources'])
+    text, sources = strip_citations(text, sources)
+    debug_info = {
+        'fanout': fanout['stores'],
+        'merged_sources': len(fanout['sources']),
+        'cited_sources': len(sources)
+    }
+    return text, sources, debug_info
+
+# 查詢函數
+def query_penalties(client: genai.Client, query: str, store_id: str, model: str = 'gemini-2.5-flash', filters: dict = None,
+                    trace: Trace = None, priority: str = 'interactive', on_wait=None,
+                    retrieval: SharedRetrieval = None) -> dict:
+    """
+    使用 Gemini File Search Store 查詢裁罰案件
+
+    Args:
+        query: 查詢文字
+        store_id: Gemini Store ID
+        filters: 篩選條件（日期範圍、來源單位等）
+        trace: 分段計時（None 表示只記錄到共用指標）
+        priority: 排程優先順序（interactive / hedge / batch / prewarm）
+        on_wait: 排隊時呼叫 on_wait(排在前面的請求數, 預估等待秒數)
+        retrieval: 多個 Store 時，同一次查詢各嘗試共用的檢索結果（見 new_shared_retrieval）
+
+    Returns:
+        查詢結果字典
+    """
+    metrics = get_metrics()
+    trace = trace or metrics.trace()
+    try:
+        # 篩選條件下推：本地確定沒有符合的文件時不必呼叫 Gemini
+        metadata_filter, pushdown, has_matches = resolve_metadata_filter(filters)
+        if not has_matches:
+            return no_matching_result(metadata_filter)
+
+        # 今日花費已達上限時不再呼叫 Gemini，達警告比例時縮短輸出上限
+        budget_status = cost_budget_status()
+        if budget_status['state'] == 'exceeded':
+            return budget_exceeded_result(budget_status)
+        max_output_tokens = budget_output_limit(budget_status)
+
+        with trace.span('system_instruction'):
+            system_instruction = build_system_instruction()
+
+            # 建立完整查詢（篩選條件）
+            full_query = build_full_query(query, filters, pushdown=pushdown,
+                                          law_links=relevant_law_links(query))
+
+        # 多個 Store：先並行檢索各 Store，再以合併後的片段撰寫回答（不使用 File Search 工具）
+        fanout = fan_out_retrieval(client, query, store_id, model, filters, metadata_filter, pushdown, trace,
+                                   priority, shared=retrieval)
+        if fanout is not None:
+            if fanout['failed']:
+                return fanout_failed_result(fanout)
+            system_instruction = build_system_instruction(synthesis=True)
+            full_query += "\n\n" + context_block(fanout['sources'])
+        search_store = store_id if fanout is None else None
+
+        # 使用 File Search Store 進行查詢（優先使用已快取的 system instruction；
+        # 快取中的 File Search 工具沒有篩選條件，有篩選條件時改用內嵌指令）
+        cached_content = None
+        if not metadata_filter and fanout is None:
+            with trace.span('prompt_cache'):
+                cached_content = get_cached_prompt_name(client, model, store_id, system_instruction)
+
+        def generate():
+            try:
+                return client.models.generate_content(
+                    model=model,  # 使用用戶選擇的模型
+                    contents=full_query,
+                    config=build_generate_config(search_store, model, system_instruction, cached_content,
+                                                 metadata_filter, max_output_tokens)
+                )
+            except Exception as e:
+                # 配額不足交給排程器退避後重新排隊（不是快取的問題）
+                if not cached_content or is_retryable(e):
+                    raise
+                # 快取無法使用：捨棄快取並改用內嵌指令
+                get_prompt_cache_manager(client).invalidate(model, store_id, cached_content)
+                return client.models.generate_content(
+                    model=model,
+                    contents=full_query,
+                    config=build_generate_config(search_store, model, system_instruction,
+                                                 metadata_filter=metadata_filter, max_output_tokens=max_output_tokens)
+                )
+
+        # 經由排程器呼叫（排隊時間另記為 scheduler_wait，不計入 Gemini 呼叫）
+        estimated_tokens = estimate_request_tokens(full_query, max_output_tokens)
+        gemini_start = time.perf_counter()
+        response, waited = call_gemini(generate, priority, estimated_tokens, on_wait, trace)
+        trace.add('gemini_call', time.perf_counter() - gemini_start - waited)
+
+        # 提取來源文件
+        with trace.span('grounding_extraction'):
+            text = response.text
+            if fanout is None:
+                sources, debug_info = extract_grounding_sources(response)
+            else:
+                text, sources, debug_info = fanout_sources(text, fanout)
+        if metadata_filter:
+            debug_info['metadata_filter'] = metadata_filter
+        if max_output_tokens:
+            debug_info['max_output_tokens'] = max_output_tokens  # 預算降級：輸出較短
+
+        usage = extract_usage(response)
+        settle_request_tokens(estimated_tokens, usage)
+        metrics.record_usage(usage)
+        cost = record_request_cost(model, usage, trace)
+
+        result = {
             'success': True,
-            'text': response.text,
+            'text': text,
             'sources': sources,
+            'usage': usage,  # token 用量
+            'cost': cost,  # 估計成本（美元）
             'debug_info': debug_info  # 診斷資訊
         }
+        if fanout is not None:
+            add_fanout_totals(result, fanout)
+        return result
 
     except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
+        metrics.inc('errors_total', stage='gemini_call', error=type(e).__name__)
+        return gemini_error_result(e)
+
+def query_penalties_stream(client: genai.Client, query: str, store_id: str, model: str = 'gemini-2.5-flash', filters: dict = None,
+                           trace: Trace = None, priority: str = 'interactive', on_wait=None,
+                           retrieval: SharedRetrieval = None):
+    """
+    串流版的 query_penalties：逐段產生回答文字，最後產生完整的查詢結果
+
+    Gemini 呼叫的耗時不包含呼叫端處理每段文字的時間（另記為 stream_render）與排隊時間（scheduler_wait）。
+    排程器只管到收到第一個 chunk 為止（配額錯誤在建立串流或第一個 chunk 時發生）。
+
+    Yields:
+        {'type': 'text', 'text': 新增的文字}，最後為 {'type': 'result', 'result': 查詢結果字典}
+    """
+    metrics = get_metrics()
+    trace = trace or metrics.trace()
+    try:
+        metadata_filter, pushdown, has_matches = resolve_metadata_filter(filters)
+        if not has_matches:
+            result = no_matching_result(metadata_filter)
+            yield {'type': 'text', 'text': result['text']}
+            yield {'type': 'result', 'result': result}
+            return
+
+        budget_status = cost_budget_status()
+        if budget_status['state'] == 'exceeded':
+            yield {'type': 'result', 'result': budget_exceeded_result(budget_status)}
+            return
+        max_output_tokens = budget_output_limit(budget_status)
+
+        with trace.span('system_instruction'):
+            system_instruction = build_system_instruction()
+            full_query = build_full_query(query, filters, pushdown=pushdown,
+                                          law_links=relevant_law_links(query))
+
+        # 多個 Store：先並行檢索（不串流），再串流撰寫回答
+        fanout = None
+        if len(parse_store_ids(store_id)) > 1:
+            yield {'type': 'status', 'text': "🔎 正在檢索各資料庫..."}
+            fanout = fan_out_retrieval(client, query, store_id, model, filters, metadata_filter, pushdown,
+                                       trace, priority, shared=retrieval)
+            if fanout['failed']:
+                yield {'type': 'result', 'result': fanout_failed_result(fanout)}
+                return
+            system_instruction = build_system_instruction(synthesis=True)
+            full_query += "\n\n" + context_block(fanout['sources'])
+        search_store = store_id if fanout is None else None
+
+        text_parts = []
+        grounded_chunk = None  # grounding_metadata 只在最後的 chunk 中完整出現
+        usage = {}             # usage_metadata 同樣只在最後的 chunk 中出現
+
+        cached_content = None
+        if not metadata_filter and fanout is None:
+            with trace.span('prompt_cache'):
+                cached_content = get_cached_prompt_name(client, model, store_id, system_instruction)
+
+        def open_stream():
+            """建立串流並取得第一個 chunk，返回 (stream, first_chunk)"""
+            stream = client.models.generate_content_stream(
+                model=model,
+                contents=full_query,
+                config=build_generate_config(search_store, model, system_instruction, cached_content, metadata_filter,
+                                             max_output_tokens)
+            )
+            try:
+                return stream, next(stream, None)
+            except Exception as e:
+                if not cached_content or is_retryable(e):
+                    raise
+                # 快取無法使用：捨棄快取並改用內嵌指令
+                get_prompt_cache_manager(client).invalidate(model, store_id, cached_content)
+                stream = client.models.generate_content_stream(
+                    model=model,
+                    contents=full_query,
+                    config=build_generate_config(search_store, model, system_instruction,
+                                                 metadata_filter=metadata_filter, max_output_tokens=max_output_tokens)
+                )
+                return stream, next(stream, None)
+
+        estimated_tokens = estimate_request_tokens(full_query, max_output_tokens)
+        render_seconds = 0.0  # 呼叫端處理文字的時間（不計入 Gemini 呼叫）
+        request_start = time.perf_counter()
+        (stream, first_chunk), waited = call_gemini(open_stream, priority, estimated_tokens, on_wait, trace)
+        gemini_start = request_start + waited
+        trace.add('gemini_first_chunk', time.perf_counter() - gemini_start)
+
+        for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], stream):
+            text = chunk.text if chunk.candidates else None
+            if text:
+                text_parts.append(text)
+                render_start = time.perf_counter()
+                yield {'type': 'text', 'text': text}
+                render_seconds += time.perf_counter() - render_start
+
+            if chunk.candidates and chunk.candidates[0].grounding_metadata:
+                grounded_chunk = chunk
+            usage = extract_usage(chunk) or usage
+        trace.add('gemini_call', time.perf_counter() - gemini_start - render_seconds)
+        trace.add('stream_render', render_seconds)
+
+        with trace.span('grounding_extraction'):
+            text = ''.join(text_parts)
+            if fanout is None:
+                sources, debug_info = extract_grounding_sources(grounded_chunk, text)
+            else:
+                text, sources, debug_info = fanout_sources(text, fanout)
+        if metadata_filter:
+            debug_info['metadata_filter'] = metadata_filter
+        if max_output_tokens:
+            debug_info['max_output_tokens'] = max_output_tokens  # 預算降級：輸出較短
+        settle_request_tokens(estimated_tokens, usage)
+        metrics.record_usage(usage)
+        cost = record_request_cost(model, usage, trace)
+
+        result = {
+            'success': True,
+            'text': text,
+            'sources': sources,
+            'usage': usage,
+            'cost': cost,
+            'debug_info': debug_info
         }
+        if fanout is not None:
+            add_fanout_totals(result, fanout)
+        yield {'type': 'result', 'result': result}
+
+    except Exception as e:
+        metrics.inc('errors_total', stage='gemini_call', error=type(e).__name__)
+        yield {'type': 'result', 'result': gemini_error_result(e)}
+
+def stream_query_to_placeholder(client: genai.Client, query: str, store_id: str, model: str, placeholder,
+                                filters: dict = None, trace: Trace = None, hedge: bool = False,
+                                retrieval: SharedRetrieval = None):
+    """以串流模式查詢，邊接收邊將已生成的回答顯示在 placeholder（排隊時先顯示排隊位置）
+
+    hedge=True 時以非串流請求對沖（見 HedgedExecutor.run_stream）：第一段文字太慢時同時送出非串流請求，
+    串流沒有引用來源時立即改用（或送出）非串流請求，不必等串流結束後才重新查詢。
+    多個 Store 時兩個請求共用 retrieval 的檢索結果，對沖請求只多一次撰寫回答的呼叫。
+
+    Returns:
+        (查詢結果字典, IncrementalAnswer（結果不是串流的回答時為 None）, 對沖資訊（hedge=False 時為 None）)
+    """
+    answer = IncrementalAnswer()
+
+    def show(event):
+        if event['type'] == 'text':
+            answer.feed(event['text'])
+            placeholder.markdown(answer.render() + " ▌")
+        elif event['type'] == 'status':
+            placeholder.info(event['text'])
+        elif event['type'] == 'queue':
+            placeholder.info(queue_notice(event['position'], event['eta']))
+
+    def run_stream(emit):
+        result = None
+        on_wait = lambda position, eta: emit({'type': 'queue', 'position': position, 'eta': eta})
+        for event in query_penalties_stream(client, query, store_id, model, filters, trace, on_wait=on_wait,
+                                            retrieval=retrieval):
+            if event['type'] == 'result':
+                result = event['result']
+            else:
+                emit(event)
+        return result
+
+    if not hedge:
+        return run_stream(show), answer, None
+
+    result, hedge_info = get_hedged_executor().run_stream(
+        run_stream,
+        lambda: query_penalties(client, query, store_id, model, filters, trace, priority='hedge',
+                                retrieval=retrieval),
+        is_grounded=is_grounded_result,
+        on_event=show,
+        on_retry=lambda: placeholder.info("🔄 正在重新查詢...")
+    )
+    return result, answer if hedge_info['streamed'] else None, hedge_info
+
+# 本地結構化統計（依語料版本建立，所有 session 共用）
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _analytics_for_version(corpus_version: str) -> CorpusAnalytics:
+    """依語料版本建立的欄位式索引（映射檔變動時版本改變，自動重建）"""
+    return CorpusAnalytics.from_snapshot(get_metadata_registry().snapshot())
+
+def get_corpus_analytics() -> CorpusAnalytics:
+    """取得目前語料版本的本地統計索引"""
+    return _analytics_for_version(get_metadata_registry().snapshot().version)
+
+def answer_locally(query: str, filters: dict = None):
+    """統計型問題（件數、金額排名、年度趨勢）直接以本地索引回答，無法精確回答時返回 None"""
+    if os.getenv('FSC_LOCAL_ANALYTICS', '1') == '0':
+        return None
+    intent = route_query(query)
+    if intent is None:
+        return None
+    return get_corpus_analytics().answer(intent, filters)
+
+# 發文字號、法規名稱、文件名稱的倒排索引（依語料版本建立，所有 session 共用）
+@st.cache_resource(max_entries=2, show_spinner=False)
+def _identifier_index_for_version(corpus_version: str) -> IdentifierIndex:
+    """依語料版本建立的識別碼索引（映射檔變動時版本改變，自動重建）"""
+    return IdentifierIndex.from_snapshot(get_metadata_registry().snapshot())
+
+def get_identifier_index() -> IdentifierIndex:
+    """取得目前語料版本的識別碼索引"""
+    return _identifier_index_for_version(get_metadata_registry().snapshot().version)
+
+def lookup_identifiers(query: str, filters: dict = None) -> tuple:
+    """查詢中的發文字號、法規名稱、文件名稱直接對應到文件（FSC_IDENTIFIER_LOOKUP=0 停用）
+
+    Returns:
+        (列出文件的查詢結果, 查詢是否只有識別碼)；沒有比對到符合篩選條件的文件時為 (None, False)
+    """
+    if os.getenv('FSC_IDENTIFIER_LOOKUP', '1') == '0':
+        return None, False
+    index = get_identifier_index()
+    lookup = index.lookup(query)
+    if not lookup:
+        return None, False
+    result = index.answer(lookup, filters, limit=int(os.getenv('FSC_IDENTIFIER_MAX_DOCS', '20')))
+    if result is None:
+        return None, False
+    return result, lookup.coverage >= float(os.getenv('FSC_IDENTIFIER_COVERAGE', '0.8'))
+
+# 對沖查詢執行器（所有 session 共用延遲統計與執行緒池）
+@st.cache_resource
+def get_hedged_executor() -> HedgedExecutor:
+    """取得程序共用的對沖查詢執行器"""
+    return HedgedExecutor(
+        max_attempts=int(os.getenv('FSC_HEDGE_MAX_ATTEMPTS', '2')),
+        hedge_percentile=float(os.getenv('FSC_HEDGE_PERCENTILE', '0.9')),
+        default_delay=float(os.getenv('FSC_HEDGE_DELAY', '8'))
+    )
+
+def is_grounded_result(result: dict) -> bool:
+    """查詢成功且有引用來源（或已確定沒有符合篩選條件的文件）"""
+    return bool(result and result.get('success') and (result.get('sources') or result.get('no_match')))
+
+# 相同查詢的單一請求合併（所有 session 共用）
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    """取得程序共用的 single-flight 合併器"""
+    return SingleFlight(wait_timeout=float(os.getenv('FSC_SINGLE_FLIGHT_WAIT', '120')) or None)
+
+# 查詢結果快取（所有 session 共用）
+@st.cache_resource
+def get_answer_cache() -> AnswerCache:
+    """取得程序共用的答案快取（磁碟快取無法建立時只使用記憶體）"""
+    cache_dir = Path(os.getenv('FSC_CACHE_DIR') or Path(__file__).parent / '.cache')
+    max_entries = int(os.getenv('FSC_ANSWER_CACHE_SIZE', '256'))
+    ttl = float(os.getenv('FSC_ANSWER_CACHE_TTL', str(7 * 86400)))
+
+    try:
+        return AnswerCache(path=cache_dir / 'answers.sqlite', max_entries=max_entries, ttl=ttl)
+    except (OSError, sqlite3.Error):
+        return AnswerCache(path=None, max_entries=max_entries, ttl=ttl)
+
+def prompt_fingerprint() -> str:
+    """system instruction 與法條連結表的雜湊（query 模式的連結表附在查詢內容中，另外加入索引雜湊）"""
+    fingerprint = build_system_instruction()
+    if law_link_mode() == 'query':
+        fingerprint += get_law_index().fingerprint
+    return hash_text(fingerprint)
+
+def answer_cache_key(query: str, store_id: str, model: str, filters: dict = None) -> str:
+    """查詢結果的快取鍵（包含 system instruction 與法條連結表的雜湊）"""
+    return make_cache_key(query, store_id, model, prompt_fingerprint(), filters)
+
+def answer_cache_scope(store_id: str, model: str, filters: dict = None) -> str:
+    """查詢範圍鍵（相似查詢只在相同範圍內比對）"""
+    return make_scope_key(store_id, model, prompt_fingerprint(), filters)
+
+# 相似查詢索引（所有 session 共用，啟動時由磁碟快取重建）
+@st.cache_resource
+def get_similar_query_index() -> SimilarQueryIndex:
+    """取得程序共用的相似查詢索引"""
+    index = SimilarQueryIndex(max_entries=int(os.getenv('FSC_SIMILAR_INDEX_SIZE', '5000')))
+    for key, cached_query, scope in get_answer_cache().entries():
+        if cached_query:
+            index.add(key, cached_query, scope or '')
+    return index
+
+def find_similar_answer(query: str, scope: str, min_score: float):
+    """找出相似度最高且快取仍有效的既有答案
+
+    Returns:
+        (SimilarMatch, 查詢結果)，找不到時返回 (None, None)
+    """
+    index = get_similar_query_index()
+    for match in index.search(query, scope, min_score=min_score):
+        result = get_answer_cache().get(match.key, validator=answer_is_current)
+        if result is not None:
+            return match, result
+        index.remove(match.key)
+    return None, None
+
+def cited_doc_digests(result: dict) -> dict:
+    """查詢結果引用的文件及其內容雜湊 {doc_id: digest}"""
+    snapshot = get_metadata_registry().snapshot()
+    deps = {}
+    for source in result.get('sources', []):
+        doc_id = extract_file_id(source.get('filename', ''), snapshot.gemini_id_mapping)
+        if doc_id:
+            deps[doc_id] = snapshot.doc_digest(doc_id)
+    return deps
+
+def answer_is_current(deps: dict) -> bool:
+    """快取答案引用的文件是否都未變動"""
+    snapshot = get_metadata_registry().snapshot()
+    return all(snapshot.doc_digest(doc_id) == digest for doc_id, digest in deps.items())
+
+# 冷啟動預熱（每個程序執行一次）
+def warmup_tasks() -> list:
+    """背景預熱工作，依第一次顯示頁面與第一次查詢需要的順序排列
+
+    Returns:
+        [(名稱, 不帶參數的函式), ...]
+    """
+    return [
+        ('metadata_registry', lambda: get_metadata_registry().snapshot()),
+        ('corpus_analytics', get_corpus_analytics),  # 側邊欄的資料庫資訊
+        ('law_index', get_law_index),
+        ('identifier_index', get_identifier_index),
+        ('system_instruction', build_system_instruction),
+        ('snippet_normalizer', get_snippet_normalizer),
+        ('answer_cache', get_similar_query_index),  # 同時開啟磁碟快取並重建相似查詢索引
+        ('query_routing', lambda: (route_query("2024年銀行裁罰件數"), classify_query("2024年銀行裁罰件數"))),
+        ('gemini_client', init_gemini),
+        ('genai_types', lambda: types.GenerateContentConfig),
+    ]
+
+@st.cache_resource(show_spinner=False)
+def start_warmup():
+    """啟動背景預熱（FSC_WARMUP=0 停用；所有 session 共用同一次預熱）"""
+    if os.getenv('FSC_WARMUP', '1') == '0':
+        return None
+    return Warmup(warmup_tasks()).start()
+
+def record_first_render():
+    """記錄程序啟動到第一次頁面顯示完成的耗時（每個程序只報告一次）"""
+    if STARTUP.reported('first_render'):
+        return
+    STARTUP.record('first_render', time.perf_counter() - _IMPORT_START)
+    STARTUP.report_once('first_render', "第一次頁面顯示完成", kinds=('startup', 'import'))
+
+# 指標頁面（?view=metrics，需設定 FSC_METRICS_PAGE=1）
+def render_metrics_page():
+    """顯示各階段延遲的即時百分位數、計數器與匯出內容"""
+    import pandas as pd
+
+    st.title("📈 查詢效能指標")
+    metrics = get_metrics()
+    snapshot = metrics.snapshot()
+    if st.button("🔄 重新整理"):
+        st.rerun()
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    latency_rows = []
+    for item in snapshot['histograms']:
+        if item['name'] not in ('stage_seconds', 'query_seconds'):
+            continue
+        labels = item['labels']
+        name = STAGE_LABELS.get(labels.get('stage'), labels.get('stage')) if item['name'] == 'stage_seconds' \
+            else f"端到端（{labels.get('path')} / {labels.get('outcome')}）"
+        latency_rows.append({
+            '項目': name, '次數': item['count'], 'p50 (ms)': ms(item['p50']), 'p95 (ms)': ms(item['p95']),
+            'p99 (ms)': ms(item['p99']), '平均 (ms)': ms(item['mean']), '最大 (ms)': ms(item['max'])
+        })
+
+    st.subheader("⏱️ 延遲（最近樣本）")
+    if latency_rows:
+        st.dataframe(pd.DataFrame(latency_rows), hide_index=True, use_container_width=True)
+    else:
+        st.caption("尚無查詢紀錄")
+
+    st.subheader("🔢 計數器")
+    counter_rows = [
+        {'指標': item['name'], '標籤': '、'.join(f"{k}={v}" for k, v in item['labels'].items()), '數值': item['value']}
+        for item in snapshot['counters']
+    ]
+    if counter_rows:
+        st.dataframe(pd.DataFrame(counter_rows), hide_index=True, use_container_width=True)
+
+    prometheus_text = metrics.to_prometheus()
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("⬇️ Prometheus 文字格式", prometheus_text, file_name="metrics.prom", mime="text/plain")
+    with col2:
+        st.download_button("⬇️ JSON lines", metrics.to_json_lines(), file_name="metrics.jsonl",
+                           mime="application/x-ndjson")
+    with st.expander("Prometheus 文字格式"):
+        st.code(prometheus_text, language="text")
+
+    scheduler = get_request_scheduler()
+    if scheduler is not None:
+        st.subheader("🚦 請求排程")
+        scheduler_stats = scheduler.stats()
+        st.caption(
+            f"目前速率 {scheduler_stats['requests_per_minute']:.0f} RPM / {scheduler_stats['tokens_per_minute']:,.0f} TPM"
+            f"（設定值的 {scheduler_stats['rate_ratio']:.0%}），排隊中 {scheduler_stats['queue_length']} 個請求"
+            + (f"，退避中（剩 {scheduler_stats['backoff_seconds']:.1f} 秒）" if scheduler_stats['backoff_seconds'] else '')
+        )
+        st.dataframe(pd.DataFrame([{
+            '放行': scheduler_stats['admitted'], '平均等待 (秒)': round(scheduler_stats['mean_wait_seconds'], 2),
+            '限流 (429/503)': scheduler_stats['throttled'], '重新排隊': scheduler_stats['requeued'],
+            '拒絕': scheduler_stats['rejected'], '淘汰': scheduler_stats['shed'], '逾時': scheduler_stats['timeouts']
+        }]), hide_index=True, use_container_width=True)
+
+    st.subheader("🚀 啟動耗時")
+    warmup = start_warmup()
+    warmup_status = warmup.status() if warmup is not None else None
+    if warmup_status is None:
+        st.caption("背景預熱已停用（FSC_WARMUP=0）")
+    elif warmup_status['done']:
+        st.caption(f"背景預熱已完成（{warmup_status['elapsed']:.2f} 秒）")
+    else:
+        pending = [name for name, state in warmup_status['tasks'].items() if state in ('pending', 'running')]
+        st.caption(f"背景預熱進行中：{'、'.join(pending)}")
+    startup_rows = [
+        {'項目': event['phase'], '類型': event['kind'], '耗時 (ms)': round(event['seconds'] * 1000, 1),
+         '錯誤': event['error'] or ''}
+        for event in STARTUP.events()
+    ]
+    if startup_rows:
+        st.dataframe(pd.DataFrame(startup_rows), hide_index=True, use_container_width=True)
+
+    st.subheader("💰 成本")
+    ledger = get_cost_ledger()
+    budget_status = cost_budget_status()
+    cap_text = f" / 上限 US${budget_status['cap_usd']:.2f}（{budget_status['ratio']:.0%}）" if budget_status['cap_usd'] else ''
+    st.caption(f"今日估計花費 US${budget_status['spent_usd']:.4f}{cap_text}")
+    rollup_labels = {'day': '日期', 'query_class': '查詢類型', 'session': 'Session', 'model': '模型'}
+    by = st.radio("彙總方式（最近 7 天）", list(rollup_labels), format_func=rollup_labels.get, horizontal=True)
+    cost_rows = ledger.rollup(by, days=7)
+    if cost_rows:
+        st.dataframe(pd.DataFrame(cost_rows), hide_index=True, use_container_width=True)
+    else:
+        st.caption("尚無 Gemini 請求紀錄")
+
+    prompt_status = static_prompt_status()
+    budget_text = f"（預算 {prompt_status['budget']:,} tokens）" if prompt_status['budget'] else ''
+    st.markdown(f"**固定提示大小：約 {prompt_status['tokens']:,} tokens**{budget_text}")
+    law_stats = get_law_index().stats()
+    st.caption(
+        f"⚖️ 法條連結方式：{prompt_status['law_link_mode']}（法條連結索引 {law_stats['laws']} 部法律、"
+        f"{law_stats['articles']} 條，{law_stats['documents']} 份文件有引用）"
+    )
+    if prompt_status['over_budget']:
+        action = '法條連結表已改由本地插入' if prompt_status['mode'] == 'degrade' else '設定 FSC_PROMPT_BUDGET_MODE=degrade 可改由本地插入法條連結'
+        st.warning(f"⚠️ 固定提示超過預算：{action}")
+    section_rows = [
+        {'段落': row['section'], '字數': row['chars'], '估計 tokens': row['tokens'], '佔比': f"{row['share']:.1%}"}
+        for row in section_report(system_instruction_sections())
+    ]
+    st.dataframe(pd.DataFrame(section_rows), hide_index=True, use_container_width=True)
 
 # 主應用
+def set_current_query(query: str):
+    """快速查詢與清除按鈕的 callback"""
+    st.session_state.current_query = query
+
+def get_result_history() -> ResultHistory:
+    """目前 session 的查詢結果紀錄（FSC_RESULT_HISTORY 筆）"""
+    if 'result_history' not in st.session_state:
+        st.session_state.result_history = ResultHistory(max_entries=int(os.getenv('FSC_RESULT_HISTORY', '5')))
+    return st.session_state.result_history
+
+def build_result_entry(query: str, filters: dict, result: dict, path: str, retry_attempted: bool,
+                       stream_answer, trace: Trace) -> dict:
+    """將查詢結果處理為可直接顯示的紀錄（加入連結後的答案、已對應到文件的參考來源、除錯資訊）
+
+    Args:
+        result: 查詢結果字典
+        path: 答案來源（local / cache / similar / stream / hedged / direct / coalesced）
+        retry_attempted: 是否已重新查詢過
+        stream_answer: 串流模式的逐行處理結果（其他模式為 None）
+
+    Returns:
+        紀錄字典；kind 為 answer / local / no_match / ungrounded / budget_exceeded / overloaded / error
+    """
+    sources_count = len(result.get('sources') or [])
+    entry = {
+        'query': query,
+        'filters': filters or {},
+        'created_at': datetime.now().strftime('%H:%M:%S'),
+        'kind': 'error',
+        'message': result.get('error'),
+        'markdown': None,
+        'caption': None,
+        'sources': None,          # 顯示用的參考來源（resolve_source_documents；None 表示沒有引用來源）
+        'sources_count': sources_count,
+        'usage': result.get('usage') or {},
+        'cost': result.get('cost') or {},
+        'replayed': path in ('cache', 'similar'),  # 由快取提供：cost 為原始查詢的成本，本次未呼叫 Gemini
+        'timing': None,
+        'stores': (result.get('debug_info') or {}).get('fanout'),  # 多個 Store 時各 Store 的檢索狀態
+        'identifier_docs': None,  # 查詢提到的識別碼對應到的文件（Markdown；查詢另有其他內容時與答案一併顯示）
+        'summary_query': None,    # 只有識別碼的查詢：請 Gemini 摘要這些文件時使用的查詢
+        'render_seconds': {}      # 第一次顯示的耗時（記入分段計時）
+    }
+
+    if result['success'] and result.get('no_match'):
+        entry.update(kind='no_match', message=result['text'])
+    elif result['success'] and result.get('local') and 'identifier_seconds' in result['debug_info']:
+        entry.update(
+            kind='local',
+            markdown=result['text'],
+            caption=f"🔖 依發文字號／法規名稱直接比對（未呼叫 Gemini，"
+                    f"{result['debug_info']['identifier_seconds'] * 1_000_000:,.0f} 微秒）",
+            summary_query=f"請摘要以下文件的重點內容：{'、'.join(result['debug_info']['identifier'])}"
+        )
+    elif result['success'] and result.get('local'):
+        entry.update(
+            kind='local',
+            markdown=result['text'],
+            caption=f"📊 由本地統計索引直接計算（未呼叫 Gemini，"
+                    f"{result['debug_info']['analytics_seconds'] * 1000:.1f} 毫秒）"
+        )
+    elif result['success'] and retry_attempted and sources_count == 0:
+        # 兩次查詢都沒有使用 File Search：不顯示查詢回答（避免顯示可能被捏造的內容）
+        entry.update(kind='ungrounded',
+                     message="你查詢的問題在目前的文件庫中沒有合適的結果，請更具體的描述問題，或更換其他詢問方式。")
+    elif result['success']:
+        # 載入映射檔（用於法條連結）
+        with trace.span('mapping_load'):
+            mapping = load_file_mapping()
+            gemini_id_mapping = load_gemini_id_mapping()
+
+        # 收集所有參考文件中的法條連結和案例連結（用於在答案中加入連結）
+        all_law_links = {}
+        case_urls = []  # 案例連結列表（按時間排序）
+
+        id_resolution_start = time.perf_counter()
+        if sources_count:
+            # 先收集所有 file_id 及其資訊
+            file_ids_with_info = []
+            for source in result['sources']:
+                filename = source.get('filename', '')
+                file_id = extract_file_id(filename, gemini_id_mapping)
+                file_info = mapping.get(file_id, {})
+
+                if file_info:
+                    file_ids_with_info.append({
+                        'file_id': file_id,
+                        'date': file_info.get('date', ''),
+                        'original_url': file_info.get('original_url', '')
+                    })
+
+            # 按日期排序（最新→最舊）
+            file_ids_with_info.sort(key=lambda x: x['date'], reverse=True)
+
+            # 收集法條連結（法條連結索引保留各文件引用的法條，已過濾無效法條）
+            all_law_links = get_law_index().select_for_docs(info['file_id'] for info in file_ids_with_info)
+
+            # 收集案例連結（按時間排序）
+            case_urls = [info['original_url'] for info in file_ids_with_info if info['original_url']]
+
+            # 參考來源（去重、對應到文件）
+            entry['sources'] = resolve_source_documents(result['sources'], mapping, gemini_id_mapping)
+        trace.add('id_resolution', time.perf_counter() - id_resolution_start)
+
+        response_text = result['text']
+
+        # 法條連結由 Gemini 在生成答案時加入（full 模式為完整連結表，query 模式只有相關法條）；
+        # query / local 模式再以參考文件的法條連結在本地補上（已有連結的法條會略過）
+
+        # 加入案例連結（依標題段落實際引用的文件，沒有引用區間時按時間順序；
+        # 串流模式直接使用已記錄的標題行）
+        with trace.span('link_insertion'):
+            case_urls = case_urls_for_headings(response_text, result.get('sources') or [],
+                                               mapping, gemini_id_mapping, case_urls)
+            # 串流結束後回答文字有改寫時（例如移除 [來源 N] 標記）不使用串流的處理結果
+            if stream_answer is not None and stream_answer.render() == response_text:
+                response_with_all_links = stream_answer.finalize(case_urls)
+            else:
+                response_with_all_links = insert_case_links_by_order(response_text, case_urls)
+            if law_link_mode() != 'full':
+                response_with_all_links = add_law_links_to_text(response_with_all_links, all_law_links)
+
+        if result.get('partial_stores'):
+            entry['caption'] = f"⚠️ {'、'.join(result['partial_stores'])}資料庫未在期限內回應，以下結果只包含其他資料庫的文件"
+        entry.update(kind='answer', markdown=response_with_all_links,
+                     timing=f"（答案來源：{path}，至此 {trace.elapsed():.2f} 秒）：{trace.summary()}")
+    elif result.get('budget_exceeded'):
+        entry['kind'] = 'budget_exceeded'
+    elif result.get('overloaded'):
+        entry['kind'] = 'overloaded'
+    return entry
+
+@st.fragment
+def render_answer_panel(entry_id: str):
+    """答案區塊"""
+    entry = get_result_history().get(entry_id)
+    if entry is None:
+        return
+    start = time.perf_counter()
+    kind = entry['kind']
+
+    if kind == 'no_match':
+        st.info(f"🔎 {entry['message']}")
+    elif kind in ('local', 'answer'):
+        st.success("✅ 查詢完成")
+        st.markdown("---")
+        if entry.get('identifier_docs'):
+            with st.expander("🔖 查詢提到的文件", expanded=False):
+                st.markdown(entry['identifier_docs'])
+        st.subheader("📝 答案")
+        st.markdown(entry['markdown'])
+        if entry['caption']:
+            st.caption(entry['caption'])
+        st.download_button("⬇️ 下載答案（Markdown）", entry['markdown'], file_name="answer.md",
+                           mime="text/markdown", key=f"download_{entry_id}", on_click='ignore')
+        if entry.get('summary_query') and st.button("🤖 請 Gemini 摘要這些文件", key=f"summarize_{entry_id}"):
+            # 以摘要查詢重新執行整個頁面並直接查詢（不再走識別碼快速查詢）
+            st.session_state.current_query = entry['summary_query']
+            st.session_state.auto_search = True
+            st.rerun()
+    elif kind == 'ungrounded':
+        st.warning(entry['message'])
+    elif kind == 'budget_exceeded':
+        st.warning(f"💰 {entry['message']}")
+    elif kind == 'overloaded':
+        st.warning(f"⏳ {entry['message']}")
+    else:
+        st.error(f"❌ 查詢失敗：{entry['message']}")
+
+    entry['render_seconds'].setdefault('answer_rendering', time.perf_counter() - start)
+
+@st.fragment
+def render_sources_panel(entry_id: str):
+    """參考來源區塊（展開/收合全部時只重新執行此區塊）"""
+    entry = get_result_history().get(entry_id)
+    if entry is None or entry['kind'] != 'answer' or entry['sources'] is None:
+        return
+    start = time.perf_counter()
+    st.markdown("---")
+    expanded = len(entry['sources']) > 1 and st.toggle("展開全部參考來源", key=f"expand_sources_{entry_id}")
+    render_source_documents(entry['sources'], expanded)
+    entry['render_seconds'].setdefault('source_rendering', time.perf_counter() - start)
+
+def render_debug_panel(entry: dict):
+    """除錯資訊（折疊）"""
+    st.markdown("---")
+    with st.expander("⚠️ 本系統僅供參考，實際裁罰資訊請以金管會官網公告為準", expanded=False):
+        st.info(f"📊 此查詢有使用參考文件")
+        if entry['sources_count'] == 0:
+            st.warning("⚠️ 此次查詢未使用參考文件（可能是 Gemini 自行回答）")
+
+        st.caption(f"⏱️ 各階段耗時{entry['timing']}")
+        usage = entry['usage']
+        if usage:
+            st.caption(
+                f"🔢 {'原始查詢 ' if entry['replayed'] else ''}Token：輸入 {usage.get('prompt_tokens', 0):,}（快取 {usage.get('cached_tokens', 0):,}、"
+                f"檢索 {usage.get('tool_prompt_tokens', 0):,}）、輸出 {usage.get('output_tokens', 0):,}、"
+                f"思考 {usage.get('thoughts_tokens', 0):,}"
+            )
+        cost = entry['cost']
+        if cost and entry['replayed']:
+            st.caption(
+                f"💰 本次由快取提供，未呼叫 Gemini（成本 US$0；原始查詢估計成本 US${cost['total_usd']:.5f}），"
+                f"今日累計 US${get_cost_ledger().spent():.4f}"
+            )
+        elif cost:
+            st.caption(
+                f"💰 本次請求估計成本 US${cost['total_usd']:.5f}（輸入 {cost['input_usd']:.5f}、"
+                f"快取 {cost['cached_usd']:.5f}、檢索 {cost['tool_usd']:.5f}、輸出 {cost['output_usd']:.5f}），"
+                f"今日累計 US${get_cost_ledger().spent():.4f}"
+            )
+
+        registry_stats = get_metadata_registry().stats()
+        st.caption(
+            f"🗂️ 映射檔 v{registry_stats['version']}（{registry_stats['backend']}）："
+            f"{registry_stats['counts'].get('file_mapping', 0)} 筆文件、"
+            f"{registry_stats['counts'].get('gemini_id_mapping', 0)} 筆 Gemini ID，"
+            f"載入 {registry_stats['loads']} 次（{registry_stats['load_seconds'] or 0:.2f} 秒），"
+            f"命中 {registry_stats['hits']} 次"
+        )
+
+        cache_stats = get_answer_cache().stats()
+        st.caption(
+            f"💾 答案快取：記憶體命中 {cache_stats['memory_hits']}、"
+            f"磁碟命中 {cache_stats['disk_hits']}、未命中 {cache_stats['misses']}、"
+            f"淘汰 {cache_stats['evictions']}、過期 {cache_stats['expired']}、"
+            f"失效 {cache_stats['invalidated']}"
+            f"（命中率 {cache_stats['hit_rate']:.0%}）"
+        )
+
+        hedge_stats = get_hedged_executor().stats()
+        st.caption(
+            f"⚡ 對沖查詢：共 {hedge_stats['runs']} 次，對沖請求 {hedge_stats['hedges_launched']}、"
+            f"重試 {hedge_stats['retries_launched']}，首個請求勝出 {hedge_stats['primary_wins']}、"
+            f"對沖/重試勝出 {hedge_stats['hedge_wins']}、皆無來源 {hedge_stats['ungrounded']}"
+            f"（目前等待 {hedge_stats['hedge_delay']:.1f} 秒）"
+        )
+
+        flight_stats = get_single_flight().stats()
+        st.caption(
+            f"🤝 相同查詢合併：實際呼叫 {flight_stats['executions']}、共用結果 {flight_stats['coalesced']}、"
+            f"改由等待者重新執行 {flight_stats['takeovers']}、等待逾時自行查詢 {flight_stats['timeouts']}、"
+            f"進行中 {flight_stats['in_flight']}"
+        )
+
+        if entry.get('stores'):
+            status_labels = {'timeout': '逾時', 'error': '失敗'}
+            fanout_stats = get_store_fanout().stats()
+            st.caption(
+                "🗄️ 多資料庫檢索：" + "、".join(
+                    f"{store['store']} {store['seconds']:.1f} 秒（{store['sources']} 筆）" if store['status'] == 'ok'
+                    else f"{store['store']} {status_labels[store['status']]}"
+                    for store in entry['stores']
+                ) + f"；累計 {fanout_stats['runs']} 次，部分結果 {fanout_stats['partial']}、全部失敗 {fanout_stats['failed']}"
+            )
+
+        scheduler = get_request_scheduler()
+        if scheduler is not None:
+            scheduler_stats = scheduler.stats()
+            st.caption(
+                f"🚦 請求排程：放行 {scheduler_stats['admitted']}、排隊中 {scheduler_stats['queue_length']}、"
+                f"平均等待 {scheduler_stats['mean_wait_seconds']:.2f} 秒，遇到限流 {scheduler_stats['throttled']}、"
+                f"重新排隊 {scheduler_stats['requeued']}、拒絕 {scheduler_stats['rejected']}、"
+                f"淘汰 {scheduler_stats['shed']}、逾時 {scheduler_stats['timeouts']}"
+                f"（目前速率 {scheduler_stats['rate_ratio']:.0%}）"
+            )
+
+        prompt_cache_stats = get_prompt_cache_manager(init_gemini()[0]).stats()
+        st.caption(
+            f"🧠 指令快取：命中 {prompt_cache_stats['hits']}、建立 {prompt_cache_stats['created']}、"
+            f"延長 {prompt_cache_stats['refreshed']}、改用內嵌指令 {prompt_cache_stats['fallbacks']}"
+        )
+        if prompt_cache_stats['last_error']:
+            st.caption(f"（指令快取最近錯誤：{prompt_cache_stats['last_error'][:200]}）")
+
+@st.fragment
+def render_result_area():
+    """顯示目前選擇的查詢結果（切換查詢紀錄時只重新執行此區塊）"""
+    history = get_result_history()
+    entry_ids = history.ids()
+    if not entry_ids:
+        return
+    if st.session_state.get('active_result') not in entry_ids:
+        st.session_state.active_result = entry_ids[0]
+    if len(entry_ids) > 1:
+        st.selectbox(
+            "📜 本次查詢紀錄", entry_ids, key='active_result',
+            format_func=lambda entry_id: f"{history.get(entry_id)['created_at']}　{history.get(entry_id)['query'][:40]}"
+        )
+
+    entry_id = st.session_state.active_result
+    render_answer_panel(entry_id)
+    render_sources_panel(entry_id)
+    if history.get(entry_id)['kind'] == 'answer':
+        render_debug_panel(history.get(entry_id))
+
 def main():
     """主應用程式"""
 
+    # 設定頁面（放在 main 中，批次查詢等匯入本模組時不會觸發頁面設定）
+    st.set_page_config(
+        page_title="金管會裁罰案件查詢系統",
+        page_icon="⚖️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+
+    # 背景預熱（Gemini client、映射檔、索引），頁面顯示的同時進行
+    start_warmup()
+
+    # 管理用指標頁面
+    if st.query_params.get('view') == 'metrics' and os.getenv('FSC_METRICS_PAGE') == '1':
+        render_metrics_page()
+        return
+
     # 標題
     st.title("⚖️ 金管會裁罰案件查詢系統")
     st.info("💡 本系統為展示用，如遇畫面無反應，請重新整理頁面")
 
-    # 初始化 Gemini
-    client, store_id = init_gemini()
-
     # 側邊欄：資料庫資訊
     with st.sidebar:
         # 固定使用 Flash 模型（Pro 模型在 File Search 上有 hallucination 問題）
         model = "gemini-2.5-flash"
 
-        # 顯示資料庫資訊
+        # 顯示資料庫資訊（由本地統計索引計算）
         st.header("📊 資料庫資訊")
-        st.caption(f"總案件數：490 筆")
-        st.caption(f"日期範圍：2012-01-12 至 2025-09-25")
+        corpus_summary = get_corpus_analytics().summary('penalty')
+        st.caption(f"總案件數：{corpus_summary['count']} 筆")
+        if corpus_summary['min_date']:
+            st.caption(f"日期範圍：{corpus_summary['min_date']} 至 {corpus_summary['max_date']}")
+        if set(corpus_summary['by_source']) - {'未標示'}:
+            st.caption("來源分布：" + "、".join(
+                f"{label} {count} 筆" for label, count in corpus_summary['by_source'].items()
+            ))
+
+        # 篩選條件（下推為 File Search metadata filter）
+        st.header("🔎 篩選條件")
+        filters = {}
+        if st.checkbox("限定日期範圍"):
+            date_range = st.date_input(
+                "日期範圍",
+                value=(date(2012, 1, 1), date.today()),
+                min_value=date(2012, 1, 1),
+                max_value=date.today()
+            )
+            if isinstance(date_range, (tuple, list)) and len(date_range) == 2:
+                filters['start_date'] = date_range[0].isoformat()
+                filters['end_date'] = date_range[1].isoformat()
+        source_units = st.multiselect("來源單位", list(SOURCE_UNITS))
+        if source_units:
+            filters['source_units'] = source_units
+
+        # 今日 Gemini 花費（設定每日上限時顯示）
+        budget_status = cost_budget_status()
+        if budget_status['state'] == 'exceeded':
+            st.error("💰 今日查詢預算已用完，僅能顯示已快取的答案")
+        elif budget_status['state'] == 'warn':
+            st.warning(f"💰 今日查詢預算已使用 {budget_status['ratio']:.0%}，回答長度已縮短")
 
         # 版本號（放在側邊欄最下方）
         st.markdown("---")
@@ -929,6 +2007,8 @@ def main():
     # 初始化 session state（使用不同的變數名）
     if 'current_query' not in st.session_state:
         st.session_state.current_query = ""
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:12]  # 成本彙總用
 
     # 查詢輸入
     query = st.text_area(
@@ -954,9 +2034,9 @@ def main():
     for idx, quick_query in enumerate(quick_queries):
         col_idx = idx % 2
         with cols[col_idx]:
-            if st.button(f"📌 {quick_query}", key=f"quick_{idx}", use_container_width=True):
-                st.session_state.current_query = quick_query
-                st.rerun()
+            # 以 callback 設定查詢內容（按鈕本身就會重新執行腳本，不必再 st.rerun）
+            st.button(f"📌 {quick_query}", key=f"quick_{idx}", use_container_width=True,
+                      on_click=set_current_query, args=(quick_query,))
 
     st.markdown("")  # 空行分隔
 
@@ -965,118 +2045,197 @@ def main():
     with col1:
         search_button = st.button("🔍 查詢", type="primary", use_container_width=True)
     with col2:
-        clear_button = st.button("🗑️ 清除", use_container_width=True)
-
-    if clear_button:
-        st.session_state.current_query = ""
-        st.rerun()
-
-    # 執行查詢
-    if search_button and query:
-        with st.spinner("🔍 查詢中..."):
-            # 第一次查詢
-            result = query_penalties(client, query, store_id, model)
+        st.button("🗑️ 清除", use_container_width=True, on_click=set_current_query, args=("",))
+
+    # 執行查詢（「請 Gemini 摘要」按鈕設定的查詢直接執行）
+    finished_query = None  # (trace, 紀錄, 答案來源, 結果)：結果顯示後才結束計時
+    auto_search = st.session_state.pop('auto_search', False)
+    if (search_button or auto_search) and query:
+        # 初始化 Gemini（通常已由背景預熱完成）
+        client, store_id = init_gemini()
+        metrics = get_metrics()
+        trace = metrics.trace()
+        trace.set(session=st.session_state.session_id, query_class=classify_query(query, filters))
+        path = 'local'  # 答案來源：local / cache / similar / stream / hedged / direct / coalesced
+
+        # 統計型問題直接以本地索引回答；其餘先查詢快取（相同查詢、相同語料時不必再呼叫 Gemini）
+        answer_cache = get_answer_cache()
+        cache_key = answer_cache_key(query, store_id, model, filters)
+        cache_scope = answer_cache_scope(store_id, model, filters)
+        with trace.span('local_analytics'):
+            result = answer_locally(query, filters)
+
+        # 發文字號、法規名稱等識別碼：查詢只有識別碼時直接列出文件，否則先列出文件再照常查詢
+        identifier_result = None
+        if result is None:
+            with trace.span('identifier_lookup'):
+                identifier_result, identifier_only = lookup_identifiers(query, filters)
+            if identifier_result is not None and identifier_only and not auto_search:
+                result = identifier_result
+            metrics.inc('identifier_lookups_total', result='none' if identifier_result is None
+                        else 'local' if result is not None else 'mention')
+        identifier_placeholder = st.empty()
+        if identifier_result is not None and result is None:
+            with identifier_placeholder.container():
+                st.info("🔖 查詢提到的文件（Gemini 回答中...）")
+                st.markdown(identifier_result['text'])
+
+        if result is None:
+            path = 'cache'
+            with trace.span('answer_cache_lookup'):
+                result = answer_cache.get(cache_key, validator=answer_is_current)
+            metrics.inc('cache_lookups_total', result='hit' if result is not None else 'miss')
+        retry_attempted = False
+
+        # 相似查詢：相似度夠高且機構類型、業務局與法律名稱相同時直接使用既有答案，否則在查詢期間先顯示預覽
+        preview_placeholder = st.empty()
+        if result is None:
+            serve_threshold = float(os.getenv('FSC_SIMILAR_SERVE_THRESHOLD', '0.85'))
+            preview_threshold = float(os.getenv('FSC_SIMILAR_PREVIEW_THRESHOLD', '0.45'))
+            with trace.span('similar_lookup'):
+                similar_match, similar_result = find_similar_answer(query, cache_scope, preview_threshold)
+
+            if (similar_match is not None and similar_match.score >= serve_threshold
+                    and same_subject(query, similar_match.query, get_law_index())):
+                result = similar_result
+                path = 'similar'
+                st.caption(f"♻️ 使用相似問題「{similar_match.query}」的答案（相似度 {similar_match.score:.0%}）")
+            elif similar_match is not None:
+                with preview_placeholder.container():
+                    st.info(f"⏳ 查詢進行中，先顯示相似問題「{similar_match.query}」的答案（相似度 {similar_match.score:.0%}）")
+                    st.markdown(similar_result['text'])
+
+        stream_answer = None  # 串流模式的逐行處理結果（用於最後加入案件連結）
+        queue_placeholder = st.empty()  # 非串流模式的排隊位置提示
+
+        def show_queue(position, eta):
+            queue_placeholder.info(queue_notice(position, eta))
+
+        def run_gemini_query():
+            """呼叫 Gemini（含沒有引用來源時的重試），返回 (查詢結果, 答案來源, 是否重試, 串流處理結果)"""
+            stream_answer = None
+            retry_attempted = False
+            retrieval = new_shared_retrieval()  # 多個 Store 時各次嘗試共用檢索結果
+            # 第一次查詢（串流模式下邊生成邊顯示）
+            if os.getenv('FSC_STREAMING', '1') != '0':
+                path = 'stream'
+                # 串流請求同樣以非串流請求對沖（第一段文字太慢或沒有引用來源時），對沖請求勝出時答案來源為 hedged
+                hedge = os.getenv('FSC_HEDGE_ENABLED', '1') != '0'
+                stream_area = st.empty()
+                with stream_area.container():
+                    st.subheader("📝 答案")
+                    result, stream_answer, hedge_info = stream_query_to_placeholder(
+                        client, query, store_id, model, st.empty(), filters, trace, hedge=hedge,
+                        retrieval=retrieval
+                    )
+                stream_area.empty()
+                if hedge_info is not None:
+                    retry_attempted = hedge_info['attempts'] > 1
+                    if not hedge_info['streamed']:
+                        path = 'hedged'
+                    metrics.inc('hedge_runs_total', hedged=hedge_info['hedged'], winner=hedge_info['winner'] or 'none')
+                    trace.set(hedge=hedge_info)
+            elif os.getenv('FSC_HEDGE_ENABLED', '1') != '0':
+                path = 'hedged'
+                # 對沖查詢：第一個請求太慢或沒有引用來源時，同時/立即送出下一個請求
+                # （之後的請求以 hedge 優先順序排程，負載高時先讓給其他使用者的查詢）
+                launched = itertools.count()
+                with st.spinner("🔍 查詢中..."):
+                    result, hedge_info = get_hedged_executor().run(
+                        lambda: query_penalties(client, query, store_id, model, filters, trace,
+                                                priority='interactive' if next(launched) == 0 else 'hedge',
+                                                retrieval=retrieval),
+                        is_grounded=is_grounded_result
+                    )
+                retry_attempted = hedge_info['attempts'] > 1
+                metrics.inc('hedge_runs_total', hedged=hedge_info['hedged'], winner=hedge_info['winner'] or 'none')
+                trace.set(hedge=hedge_info)
+            else:
+                path = 'direct'
+                with st.spinner("🔍 查詢中..."):
+                    result = query_penalties(client, query, store_id, model, filters, trace, on_wait=show_queue,
+                                             retrieval=retrieval)
 
             # 檢查是否需要重試（sources = 0 表示 Gemini 沒有使用 File Search）
-            retry_attempted = False
-            if result['success'] and len(result.get('sources', [])) == 0:
+            if (not retry_attempted and result['success'] and not result.get('no_match')
+                    and len(result.get('sources', [])) == 0):
                 retry_attempted = True
+                stream_answer = None
+                metrics.inc('retries_total', reason='ungrounded')
                 st.info("🔄 正在重新查詢...")
-                result = query_penalties(client, query, store_id, model)
-
-        # 顯示結果
-        if result['success']:
-                # 檢查是否兩次查詢都沒有 sources（防止 Hallucination）
-                sources_count = len(result.get('sources', []))
-                if retry_attempted and sources_count == 0:
-                    # 兩次查詢都沒有使用 File Search，顯示友善訊息並停止
-                    st.warning("你查詢的問題在目前的文件庫中沒有合適的結果，請更具體的描述問題，或更換其他詢問方式。")
-                    # 不顯示查詢回答（避免顯示可能被捏造的內容）
-                else:
-                    # 有 sources 或第一次查詢就成功，正常顯示結果
-                    st.success("✅ 查詢完成")
-
-                    # 保留 sources_count 變數供後續除錯資訊使用
-                    sources_count = len(result.get('sources', []))
-
-                    st.markdown("---")
-
-                    # 載入映射檔（用於法條連結）
-                    mapping = load_file_mapping()
-                    gemini_id_mapping = load_gemini_id_mapping()
-
-                    # 收集所有參考文件中的法條連結和案例連結（用於在答案中加入連結）
-                    all_law_links = {}
-                    case_urls = []  # 案例連結列表（按時間排序）
-
-                    if result.get('sources') and len(result['sources']) > 0:
-                        # 先收集所有 file_id 及其資訊
-                        file_ids_with_info = []
-                        for source in result['sources']:
-                            filename = source.get('filename', '')
-                            file_id = extract_file_id(filename, gemini_id_mapping)
-                            file_info = mapping.get(file_id, {})
-
-                            if file_info:
-                                file_ids_with_info.append({
-                                    'file_id': file_id,
-                                    'date': file_info.get('date', ''),
-                                    'original_url': file_info.get('original_url', ''),
-                                    'law_links': file_info.get('law_links', {})
-                                })
-
-                        # 按日期排序（最新→最舊）
-                        file_ids_with_info.sort(key=lambda x: x['date'], reverse=True)
-
-                        # 收集法條連結
-                        for info in file_ids_with_info:
-                            law_links = info['law_links']
-                            # 過濾掉無效法條
-                            filtered_law_links = {
-                                law: link for law, link in law_links.items()
-                                if not law.startswith(('與', '同', '及', '或', '和'))
-                            }
-                            all_law_links.update(filtered_law_links)
-
-                        # 收集案例連結（按時間排序）
-                        case_urls = [info['original_url'] for info in file_ids_with_info if info['original_url']]
-
-                    # 顯示答案（加入案例連結）
-                    st.subheader("📝 答案")
-                    response_text = result['text']
-
-                    # 法條連結已由 Gemini 在生成答案時自動加入（透過 system_instruction）
-                    # 不再需要後處理 add_law_links_to_text()
-
-                    # 加入案例連結（按時間順序）
-                    response_with_all_links = insert_case_links_by_order(response_text, case_urls)
-
-                    st.markdown(response_with_all_links)
-
-                    # 顯示參考來源（簡化版）
-                    if result.get('sources') and len(result['sources']) > 0:
-                        st.markdown("---")
-                        display_sources_simple(
-                            sources=result['sources'],
-                            file_mapping=mapping,
-                            gemini_id_mapping=gemini_id_mapping
-                        )
-
-                    # 除錯資訊（折疊）
-                    st.markdown("---")
-                    with st.expander("⚠️ 本系統僅供參考，實際裁罰資訊請以金管會官網公告為準", expanded=False):
-                        st.info(f"📊 此查詢有使用參考文件")
-                        if sources_count == 0:
-                            st.warning("⚠️ 此次查詢未使用參考文件（可能是 Gemini 自行回答）")
+                with st.spinner("🔍 查詢中..."):
+                    result = query_penalties(client, query, store_id, model, filters, trace, on_wait=show_queue,
+                                             retrieval=retrieval)
+
+            # 只快取有引用來源的成功結果（部分 Store 逾時或預算降級縮短輸出的結果不快取，下次查詢可取得完整結果）
+            if (result['success'] and result.get('sources') and not result.get('partial_stores')
+                    and not result.get('debug_info', {}).get('max_output_tokens')):
+                answer_cache.put(cache_key, result, deps=cited_doc_digests(result), query=query, scope=cache_scope)
+                get_similar_query_index().add(cache_key, query, cache_scope)
+            return result, path, retry_attempted, stream_answer
+
+        def show_coalesced():
+            queue_placeholder.info("⏳ 相同的查詢正在進行中，完成後直接顯示結果...")
+
+        if result is None:
+            # 其他 session 正在執行相同查詢時等待並共用其結果（包含重試與是否有引用來源），不另外呼叫 Gemini
+            if os.getenv('FSC_SINGLE_FLIGHT', '1') != '0':
+                flight_start = time.perf_counter()
+                (result, path, retry_attempted, stream_answer), shared = get_single_flight().do(
+                    cache_key, run_gemini_query, on_join=show_coalesced
+                )
+                if shared:
+                    path = 'coalesced'
+                    stream_answer = None  # 串流處理結果屬於執行查詢的 session
+                    trace.add('single_flight_wait', time.perf_counter() - flight_start)
+                metrics.inc('single_flight_total', role='follower' if shared else 'leader')
+            else:
+                result, path, retry_attempted, stream_answer = run_gemini_query()
+            queue_placeholder.empty()
+
+        preview_placeholder.empty()
+        identifier_placeholder.empty()
+
+        # 處理結果（加入連結、對應參考來源）並存入查詢紀錄，之後重新執行腳本時直接顯示
+        history = get_result_history()
+        entry = build_result_entry(query, filters, result, path, retry_attempted, stream_answer, trace)
+        if identifier_result is not None and result is not identifier_result:
+            entry['identifier_docs'] = identifier_result['text']
+        st.session_state.active_result = history.add(entry)
+
+        # 記錄端到端耗時（失敗、超過預算、查無結果、沒有引用來源分開統計）
+        if result.get('budget_exceeded'):
+            outcome = 'budget_exceeded'
+        elif result.get('overloaded'):
+            outcome = 'overloaded'
+        elif not result['success']:
+            outcome = 'error'
+        elif result.get('no_match'):
+            outcome = 'no_match'
+        elif result.get('local') or result.get('sources'):
+            outcome = 'grounded'
         else:
-            st.error(f"❌ 查詢失敗：{result['error']}")
+            outcome = 'ungrounded'
+        trace.set(retried=retry_attempted, sources=len(result.get('sources') or []), usage=result.get('usage') or {})
+        finished_query = (trace, entry, path, outcome)
 
     elif search_button and not query:
         st.warning("⚠️ 請輸入查詢內容")
 
+    # 顯示目前選擇的查詢結果（其他互動造成的重新執行也會顯示，不必重新查詢）
+    render_result_area()
+
+    if finished_query is not None:
+        trace, entry, path, outcome = finished_query
+        for stage in ('answer_rendering', 'source_rendering'):
+            if stage in entry['render_seconds']:
+                trace.add(stage, entry['render_seconds'][stage])
+        trace.finish(path, outcome)
+
     # 頁尾
     st.divider()
     st.caption("資料來源：金融監督管理委員會")
+    record_first_render()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,303 @@
+"""
+批次查詢（不需要瀏覽器）
+
+從檔案讀取查詢，以執行緒池（可設定並行數與每分鐘請求上限）呼叫 query_penalties，
+請求經由共用的排程器以 batch 優先順序送出（遇到 429 時自動退避並重新排隊），
+每完成一筆即寫入一行 JSONL：來源文件 ID、原始連結、延遲與 token 用量（沒有引用來源而重查時為所有嘗試的合計）。
+中斷後以相同參數重新執行，會略過輸出檔中已成功的查詢（失敗的查詢會重跑）。
+
+查詢檔格式：
+  - .txt：每行一個查詢（空行與 # 開頭的行略過）
+  - .jsonl：每行 {"id": "...", "query": "...", "filters": {...}}（id、filters 可省略）
+
+使用方式：
+    python batch_query.py queries.txt --output results.jsonl
+    python batch_query.py queries.jsonl --output results.jsonl --concurrency 8 --rpm 120
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+
+import app
+from answer_cache import hash_text
+
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+
+class RateLimiter:
+    """限制每分鐘送出的請求數（各執行緒共用，依序分配送出時間）"""
+
+    def __init__(self, requests_per_minute: float = 0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self.interval
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
+def load_queries(path) -> list:
+    """讀取查詢檔
+
+    Returns:
+        [{'id', 'query', 'filters'}, ...]（同一查詢檔重新執行時 id 不變）
+    """
+    path = Path(path)
+    queries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or (path.suffix != '.jsonl' and line.startswith('#')):
+                continue
+            if path.suffix == '.jsonl':
+                item = json.loads(line)
+                query = item['query']
+                filters = item.get('filters') or None
+                query_id = str(item.get('id') or hash_text(json.dumps([query, filters], ensure_ascii=False, sort_keys=True)))
+            else:
+                query, filters = line, None
+                query_id = hash_text(query)
+            queries.append({'id': query_id, 'query': query, 'filters': filters})
+    return queries
+
+
+def completed_ids(output_path) -> set:
+    """輸出檔中已成功完成的查詢 id（用於中斷後繼續）"""
+    done = set()
+    output_path = Path(output_path)
+    if not output_path.exists():
+        return done
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 中斷時寫到一半的行
+            if record.get('success'):
+                done.add(record.get('id'))
+            else:
+                done.discard(record.get('id'))
+    return done
+
+
+def resolve_sources(sources: list, file_mapping, gemini_id_mapping) -> list:
+    """將引用來源對應到文件 ID 與原始連結"""
+    resolved = []
+    for source in sources or []:
+        filename = source.get('filename', '')
+        doc_id = app.extract_file_id(filename, gemini_id_mapping)
+        info = file_mapping.get(doc_id, {}) if doc_id else {}
+        resolved.append({
+            'gemini_id': filename,
+            'doc_id': doc_id,
+            'display_name': info.get('display_name', doc_id or filename),
+            'type': info.get('_type'),
+            'url': info.get('original_url', '')
+        })
+    return resolved
+
+
+def run_one(client, store_id: str, model: str, item: dict, limiter: RateLimiter,
+            retry_ungrounded: bool = True) -> dict:
+    """執行單一查詢並組成輸出紀錄"""
+    started_at = datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    attempts = 0
+
+    # 成本帳本以 session='batch' 與查詢類型彙總
+    trace = app.get_metrics().trace()
+    trace.set(session='batch', query_class=app.classify_query(item['query'], item['filters']))
+    # 沒有引用來源而重查時，兩次請求都有計費：用量與成本都加總所有嘗試
+    # （成本帳本由 query_penalties 逐次記錄，輸出檔的加總與帳本一致）
+    usage = {}
+    cost_usd = 0.0
+
+    result = app.answer_locally(item['query'], item['filters'])
+    if result is None:
+        while True:
+            limiter.wait()
+            attempts += 1
+            # 以 batch 優先順序排程：與介面共用同一個程序時，互動查詢優先放行
+            result = app.query_penalties(client, item['query'], store_id, model, item['filters'], trace,
+                                         priority='batch')
+            usage = app.combine_counts(usage, result.get('usage'))
+            cost_usd += (result.get('cost') or {}).get('total_usd', 0.0)
+            # 與介面相同：成功但沒有引用來源時再查一次
+            if (retry_ungrounded and attempts == 1 and result.get('success')
+                    and not result.get('no_match') and not result.get('sources')):
+                continue
+            break
+
+    snapshot = app.get_metadata_registry().snapshot()
+    sources = resolve_sources(result.get('sources'), snapshot.file_mapping, snapshot.gemini_id_mapping)
+
+    return {
+        'id': item['id'],
+        'query': item['query'],
+        'filters': item['filters'],
+        'success': bool(result.get('success')),
+        'error': result.get('error'),
+        'text': result.get('text', ''),
+        'doc_ids': [s['doc_id'] for s in sources if s['doc_id']],
+        'urls': [s['url'] for s in sources if s['url']],
+        'sources': sources,
+        'latency_seconds': round(time.perf_counter() - start, 3),
+        'attempts': attempts,
+        'usage': usage,
+        'cost_usd': round(cost_usd, 6),
+        'local': bool(result.get('local')),
+        'no_match': bool(result.get('no_match')),
+        'model': model,
+        'store_id': store_id,
+        'started_at': started_at
+    }
+
+
+def run_batch(queries: list, output_path, client, store_id: str, model: str = DEFAULT_MODEL,
+              concurrency: int = 4, requests_per_minute: float = 0, retry_ungrounded: bool = True,
+              resume: bool = True, progress=None) -> dict:
+    """批次執行查詢，結果逐筆附加到 JSONL
+
+    Args:
+        queries: load_queries 的結果
+        output_path: 輸出 JSONL 路徑
+        client: genai.Client（或假 client）
+        concurrency: 同時執行的查詢數
+        requests_per_minute: 每分鐘最多送出的 Gemini 請求數（0 表示不限制）
+        retry_ungrounded: 沒有引用來源時是否再查一次
+        resume: 略過輸出檔中已成功的查詢
+        progress: 每完成一筆呼叫 progress(完成數, 總數, 紀錄)
+
+    Returns:
+        統計摘要
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+
+    done = completed_ids(output_path) if resume else set()
+    pending = [item for item in queries if item['id'] not in done]
+    limiter = RateLimiter(requests_per_minute)
+
+    summary = {
+        'total': len(queries),
+        'skipped': len(queries) - len(pending),
+        'succeeded': 0,
+        'failed': 0,
+        'cost_usd': 0.0,
+        'local': 0,
+        'total_tokens': 0,
+        'latencies': []
+    }
+    start = time.perf_counter()
+
+    # 中斷時最後一行可能只寫了一半：先補上換行，避免與新紀錄黏在同一行
+    needs_newline = False
+    if resume and output_path.exists() and output_path.stat().st_size:
+        with open(output_path, 'rb') as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b'\n'
+
+    mode = 'a' if resume else 'w'
+    with open(output_path, mode, encoding='utf-8') as out, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='batch-query') as pool:
+        if needs_newline:
+            out.write('\n')
+        futures = {
+            pool.submit(run_one, client, store_id, model, item, limiter, retry_ungrounded): item
+            for item in pending
+        }
+        try:
+            for finished, future in enumerate(as_completed(futures), 1):
+                try:
+                    record = future.result()
+                except Exception as e:
+                    item = futures[future]
+                    record = {'id': item['id'], 'query': item['query'], 'filters': item['filters'],
+                              'success': False, 'error': str(e)}
+
+                # 每完成一筆就寫入並 flush，中斷後可從輸出檔繼續
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+
+                summary['succeeded' if record['success'] else 'failed'] += 1
+                summary['local'] += int(record.get('local', False))
+                summary['total_tokens'] += (record.get('usage') or {}).get('total_tokens', 0)
+                summary['cost_usd'] += record.get('cost_usd', 0.0)
+                if 'latency_seconds' in record:
+                    summary['latencies'].append(record['latency_seconds'])
+                if progress:
+                    progress(finished, len(pending), record)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            summary['interrupted'] = True
+
+    latencies = sorted(summary.pop('latencies'))
+    elapsed = time.perf_counter() - start
+    summary['elapsed_seconds'] = round(elapsed, 2)
+    summary['queries_per_minute'] = round((summary['succeeded'] + summary['failed']) / elapsed * 60, 1) if elapsed else 0.0
+    if latencies:
+        summary['latency_p50'] = latencies[len(latencies) // 2]
+        summary['latency_p95'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批次執行裁罰案件查詢並輸出 JSONL')
+    parser.add_argument('queries', help='查詢檔（.txt 每行一個查詢，或 .jsonl）')
+    parser.add_argument('--output', default='batch_results.jsonl', help='輸出 JSONL 路徑')
+    parser.add_argument('--model', default=DEFAULT_MODEL, help='Gemini 模型')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時執行的查詢數')
+    parser.add_argument('--rpm', type=float, default=60, help='每分鐘最多送出的請求數（0 表示不限制）')
+    parser.add_argument('--no-retry', action='store_true', help='沒有引用來源時不再查一次')
+    parser.add_argument('--restart', action='store_true', help='忽略既有輸出，從頭執行')
+    args = parser.parse_args()
+
+    # 非 Streamlit 環境下使用快取函式會產生大量警告（streamlit 的各個 logger 各自設定層級）
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('streamlit'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    offline = os.getenv('FSC_GEMINI_FAKE') == '1' or os.getenv('FSC_GEMINI_TRANSPORT') in ('replay', 'server')
+    if not offline and not os.getenv('GEMINI_API_KEY'):
+        parser.error('找不到 GEMINI_API_KEY，請設定環境變數（或設定 FSC_GEMINI_FAKE=1 / FSC_GEMINI_TRANSPORT=replay 離線執行）')
+
+    client, store_id = app.init_gemini()
+    queries = load_queries(args.queries)
+
+    def progress(finished, total, record):
+        status = '✅' if record['success'] else '❌'
+        print(f"[{finished}/{total}] {status} {record['query'][:40]}（{record.get('latency_seconds', 0):.1f} 秒）")
+
+    summary = run_batch(
+        queries, args.output, client, store_id, args.model,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        retry_ungrounded=not args.no_retry,
+        resume=not args.restart,
+        progress=progress
+    )
+
+    print(f"📋 共 {summary['total']} 筆：成功 {summary['succeeded']}、失敗 {summary['failed']}、"
+          f"略過（已完成）{summary['skipped']}、本地統計 {summary['local']}")
+    print(f"   耗時 {summary['elapsed_seconds']} 秒（{summary['queries_per_minute']} 筆/分鐘），"
+          f"token 共 {summary['total_tokens']}，估計花費 US${summary['cost_usd']:.4f}")
+    if summary.get('interrupted'):
+        print("⚠️ 已中斷，重新執行相同指令即可從中斷處繼續")
+
+
+if __name__ == '__main__':
+    main()
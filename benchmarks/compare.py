@@ -0,0 +1,75 @@
+"""
+比較兩次效能測試結果
+
+依（項目名稱, 參數）對齊兩個 JSON 結果，列出 ops/sec 與記憶體峰值的變化；
+有項目變慢超過門檻時以非零狀態結束（可用於 CI）。
+
+使用方式：
+    python benchmarks/compare.py benchmarks/results/abc1234.json benchmarks/results/def5678.json
+    python benchmarks/compare.py base.json head.json --threshold 0.2
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def _key(result: dict) -> tuple:
+    return result['name'], json.dumps(result['params'], sort_keys=True, ensure_ascii=False)
+
+
+def compare(base: dict, head: dict, threshold: float = 0.25) -> tuple:
+    """比較兩次結果
+
+    Returns:
+        (rows, regressions)：rows 為 [(名稱, 參數, base ops, head ops, 速度變化, 峰值變化)]，
+        regressions 為變慢超過 threshold 的項目
+    """
+    base_results = {_key(r): r for r in base['results']}
+    rows = []
+    regressions = []
+    for result in head['results']:
+        key = _key(result)
+        previous = base_results.get(key)
+        if previous is None:
+            rows.append((key[0], key[1], None, result['ops_per_sec'], None, None))
+            continue
+        speed = result['ops_per_sec'] / previous['ops_per_sec'] - 1 if previous['ops_per_sec'] else None
+        peak = (result['peak_kb'] / previous['peak_kb'] - 1) if previous['peak_kb'] else None
+        rows.append((key[0], key[1], previous['ops_per_sec'], result['ops_per_sec'], speed, peak))
+        if speed is not None and speed < -threshold:
+            regressions.append(key)
+    return rows, regressions
+
+
+def _pct(value) -> str:
+    return '—' if value is None else f"{value:+.1%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='比較兩次效能測試結果')
+    parser.add_argument('base', help='基準結果 JSON')
+    parser.add_argument('head', help='新結果 JSON')
+    parser.add_argument('--threshold', type=float, default=0.25, help='視為變慢的比例（預設 0.25 = 25%%，低於此值多為量測雜訊）')
+    args = parser.parse_args()
+
+    base = json.loads(Path(args.base).read_text(encoding='utf-8'))
+    head = json.loads(Path(args.head).read_text(encoding='utf-8'))
+    rows, regressions = compare(base, head, args.threshold)
+
+    print(f"基準 {base['meta']['revision']}（{base['meta']['created_at']}）→ "
+          f"新 {head['meta']['revision']}（{head['meta']['created_at']}）")
+    print(f"{'項目':<42} {'參數':<48} {'基準 ops/s':>12} {'新 ops/s':>12} {'速度':>8} {'峰值':>8}")
+    for name, params, base_ops, head_ops, speed, peak in rows:
+        base_text = '—' if base_ops is None else f"{base_ops:,.1f}"
+        print(f"{name:<42} {params:<48} {base_text:>12} {head_ops:>12,.1f} {_pct(speed):>8} {_pct(peak):>8}")
+
+    if regressions:
+        print(f"⚠️ {len(regressions)} 個項目變慢超過 {args.threshold:.0%}")
+        sys.exit(1)
+    print("✅ 沒有項目變慢超過門檻")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+"""
+後處理熱點函式的效能測試
+
+以合成資料（見 synthetic.py）測量下列函式在不同語料規模下的表現：
+  - 映射檔載入（read_sources + merge_mappings）、SQLite 索引查詢
+  - extract_file_id、參考來源去重/排序（collect_source_documents）
+  - add_law_links_to_text、insert_case_links_by_order、remove_social_media_noise
+  - 法條連結索引的建立與挑選（LawIndex）
+  - grounding_metadata 解析與案件標題的引用對應
+
+每個項目輸出每秒執行次數（ops/sec）、單次執行的記憶體峰值與保留的記憶體區塊數（tracemalloc），
+結果存為 JSON，可用 compare.py 比較不同 commit 的差異。
+
+使用方式：
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 10000,200000 --filter law
+    python benchmarks/run_benchmarks.py --quick --output /tmp/base.json
+"""
+
+import argparse
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import timeit
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import synthetic  # noqa: E402
+
+DEFAULT_SIZES = (10_000, 50_000, 200_000)
+QUICK_SIZES = (10_000,)
+
+
+def _quiet_streamlit():
+    """在 Streamlit 以外使用快取函式時，關閉 streamlit 的警告訊息"""
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('streamlit'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+
+def measure(fn, repeat: int = 5, min_time: float = 0.2) -> dict:
+    """測量函式的執行速度與記憶體
+
+    Returns:
+        {'ops_per_sec', 'mean_seconds', 'stdev_seconds', 'peak_kb', 'retained_kb', 'retained_blocks'}
+    """
+    fn()  # 預熱（建立快取、載入模組）
+
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    if elapsed < min_time:
+        number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    per_call = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    del result
+
+    diffs = after.compare_to(before, 'filename')
+    median = statistics.median(per_call)
+    return {
+        'ops_per_sec': 1 / median if median else float('inf'),
+        'mean_seconds': statistics.mean(per_call),
+        'stdev_seconds': statistics.stdev(per_call) if len(per_call) > 1 else 0.0,
+        'peak_kb': round(peak / 1024, 1),
+        'retained_kb': round(sum(d.size_diff for d in diffs if d.size_diff > 0) / 1024, 1),
+        'retained_blocks': sum(d.count_diff for d in diffs if d.count_diff > 0)
+    }
+
+
+def mapping_cases(n_docs: int, workdir: Path):
+    """映射檔規模相關的測試項目"""
+    from build_metadata_index import write_index
+    from metadata_registry import INDEX_SCHEMA_VERSION, merge_mappings, open_index, read_sources
+
+    import app
+
+    raw = synthetic.make_raw_mappings(n_docs)
+    base_path = synthetic.write_raw_mappings(raw, workdir / f"data_{n_docs}")
+    file_mapping, gemini_id_mapping = merge_mappings(raw)
+
+    index_path = workdir / f"index_{n_docs}.sqlite"
+    write_index(index_path, file_mapping, gemini_id_mapping, {'schema_version': str(INDEX_SCHEMA_VERSION)})
+    indexed = open_index(index_path)
+    if indexed is None:
+        raise RuntimeError(f"無法開啟剛建立的索引 {index_path}（schema_version 與 INDEX_SCHEMA_VERSION 不符？）")
+    indexed_files, indexed_gemini = indexed[0], indexed[1]
+
+    gemini_ids = list(gemini_id_mapping)[:: max(1, len(gemini_id_mapping) // 1000)][:1000]
+    filenames = [gemini_id.replace('files/', '') for gemini_id in gemini_ids]
+    fallback_names = [f"{doc_id}.md" for doc_id in list(file_mapping)[:1000]]
+    sources = synthetic.make_sources(raw, 60)
+
+    params = {'docs': n_docs}
+    yield 'mapping.read_and_merge', params, lambda: merge_mappings(read_sources(base_path)[0])
+    yield 'mapping.merge', params, lambda: merge_mappings(raw)
+    yield 'mapping.index_lookup_1000', params, lambda: [indexed_files.get(indexed_gemini.get(g)) for g in gemini_ids]
+    yield 'extract_file_id.mapped_1000', params, lambda: [app.extract_file_id(f, gemini_id_mapping) for f in filenames]
+    yield 'extract_file_id.fallback_1000', params, lambda: [app.extract_file_id(f, gemini_id_mapping) for f in fallback_names]
+    yield 'collect_source_documents.60', params, lambda: app.collect_source_documents(sources, file_mapping, gemini_id_mapping)
+
+
+def text_cases(n_articles: int, n_cases: int):
+    """法條連結表與回答長度相關的測試項目"""
+    import app
+    from law_linker import LawLinker
+
+    law_table = synthetic.make_law_table(n_articles)
+    answer = synthetic.make_answer(n_cases, law_table)
+    case_urls = [f"https://www.fsc.gov.tw/case/{i}" for i in range(n_cases)]
+
+    params = {'articles': n_articles, 'cases': n_cases, 'answer_chars': len(answer)}
+    yield 'add_law_links_to_text', params, lambda: app.add_law_links_to_text(answer, law_table)
+    yield 'law_linker.compile', params, lambda: LawLinker(law_table)
+    yield 'insert_case_links_by_order', params, lambda: app.insert_case_links_by_order(answer, case_urls)
+
+
+def grounding_cases(n_cases: int, n_chunks: int = 40):
+    """grounding_metadata 解析的測試項目（回答每一行都是引用 3 個 chunk 的 support）"""
+    from grounding import extract_grounding, heading_citations
+
+    answer = synthetic.make_answer(n_cases, synthetic.make_law_table(100))
+    response = synthetic.make_grounded_response(answer, n_chunks)
+    sources = [source.to_dict() for source in extract_grounding(response)[0]]
+
+    params = {'cases': n_cases, 'chunks': n_chunks,
+              'supports': len(response.candidates[0].grounding_metadata.grounding_supports)}
+    yield 'extract_grounding', params, lambda: extract_grounding(response)
+    yield 'heading_citations', params, lambda: heading_citations(answer, sources)
+
+
+def law_index_cases(n_articles: int, citations_per_doc: int = 4):
+    """法條連結索引的測試項目（每份文件引用 citations_per_doc 條，文件數與法條數相同）"""
+    from law_index import LawIndex
+
+    law_table = synthetic.make_law_table(n_articles)
+    laws = list(law_table)
+    doc_law_links = {
+        f"doc_{i}": {law: law_table[law] for law in laws[i % len(laws):i % len(laws) + citations_per_doc]}
+        for i in range(n_articles)
+    }
+    index = LawIndex(doc_law_links)
+    query = f"違反{next(iter(index.articles), '')}第12條規定的裁罰案件"
+    doc_ids = list(doc_law_links)[:10]
+
+    params = {'articles': n_articles, 'docs': len(doc_law_links)}
+    yield 'law_index.build', params, lambda: LawIndex(doc_law_links)
+    yield 'law_index.select_for_query', params, lambda: index.select_for_query(query)
+    yield 'law_index.select_for_docs', params, lambda: index.select_for_docs(doc_ids)
+
+
+def snippet_cases(n_snippets: int = 1000):
+    """檢索片段清理的測試項目（重複片段比例固定為 70%）"""
+    from snippet_normalizer import SnippetNormalizer, clean_text
+
+    snippets = synthetic.make_snippets(n_snippets)
+    snippet_params = {'snippets': len(snippets), 'unique': len(set(snippets))}
+    yield 'remove_social_media_noise.uncached_1000', snippet_params, lambda: [clean_text(s) for s in snippets]
+    yield 'remove_social_media_noise.memo_1000', snippet_params, lambda: SnippetNormalizer().normalize_many(snippets)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def run(sizes, law_sizes, case_counts, name_filter: str = '', repeat: int = 5, progress=print) -> dict:
+    """執行所有測試項目
+
+    Returns:
+        {'meta': {...}, 'results': [{'name', 'params', 指標...}, ...]}
+    """
+    _quiet_streamlit()
+    results = []
+
+    def record(cases):
+        for name, params, fn in cases:
+            if name_filter and name_filter not in name:
+                continue
+            metrics = measure(fn, repeat=repeat)
+            results.append({'name': name, 'params': params, **metrics})
+            progress(f"{name:<42} {json.dumps(params, ensure_ascii=False):<48} "
+                     f"{metrics['ops_per_sec']:>12,.1f} ops/s  峰值 {metrics['peak_kb']:>10,.1f} KB")
+
+    with tempfile.TemporaryDirectory(prefix='fsc-bench-') as workdir:
+        for n_docs in sizes:
+            record(mapping_cases(n_docs, Path(workdir)))
+
+    for n_articles in law_sizes:
+        for n_cases in case_counts:
+            record(text_cases(n_articles, n_cases))
+        record(law_index_cases(n_articles))
+    for n_cases in case_counts:
+        record(grounding_cases(n_cases))
+    record(snippet_cases())
+
+    return {
+        'meta': {
+            'revision': git_revision(),
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': list(sizes),
+            'law_sizes': list(law_sizes),
+            'case_counts': list(case_counts)
+        },
+        'results': results
+    }
+
+
+def _int_list(value: str) -> list:
+    return [int(v) for v in value.split(',') if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='後處理熱點函式的效能測試')
+    parser.add_argument('--sizes', type=_int_list, help='映射檔文件數（逗號分隔，預設 10000,50000,200000）')
+    parser.add_argument('--law-sizes', type=_int_list, default=[1000, 5000], help='法條連結表條數')
+    parser.add_argument('--cases', type=_int_list, default=[20, 200], help='回答中的案件數')
+    parser.add_argument('--filter', default='', help='只執行名稱包含此字串的項目')
+    parser.add_argument('--repeat', type=int, default=5, help='每個項目重複測量的次數')
+    parser.add_argument('--quick', action='store_true', help='只測 10000 筆文件規模')
+    parser.add_argument('--output', help='結果 JSON 路徑（預設 benchmarks/results/<revision>.json）')
+    args = parser.parse_args()
+
+    sizes = args.sizes or (QUICK_SIZES if args.quick else DEFAULT_SIZES)
+    report = run(sizes, args.law_sizes, args.cases, args.filter, args.repeat)
+
+    output = Path(args.output) if args.output else (
+        Path(__file__).parent / 'results' / f"{report['meta']['revision']}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+    print(f"✅ 結果已輸出：{output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+效能測試用的合成資料
+
+產生與真實資料格式相同、但規模可調整的資料：
+  - 映射檔（裁罰案件 / 法令函釋 / 重要公告，10k–200k 筆文件）
+  - 法條連結表（數千條法條 + 「第N條」簡寫）
+  - 長回答（多個「### N.」案件標題、大量法條引用）與檢索片段（含網頁雜訊、重複片段）
+  - 含 grounding_metadata 的 Gemini 回應（每個案件標題與法條行各有引用）
+
+所有產生器都以 seed 固定，相同參數產生相同資料，結果可跨 commit 比較。
+"""
+
+import json
+import random
+import string
+import zlib
+from datetime import date, timedelta
+from pathlib import Path
+
+SOURCES = ('bank_bureau', 'securities_bureau', 'insurance_bureau', 'inspection_bureau')
+LAW_CATEGORIES = ('law_amendment', 'law_other', 'law_clarification', 'law_enactment')
+ANN_CATEGORIES = ('ann_amendment', 'ann_regulation', 'ann_enactment', 'ann_draft')
+
+LAW_NAME_PARTS = ('銀行', '保險', '證券', '期貨', '金融控股公司', '信託', '投資', '顧問', '洗錢防制', '票券', '電子支付', '信用合作社')
+LAW_NAME_SUFFIXES = ('法', '管理辦法', '施行細則', '管理規則', '處理準則')
+
+NOISE_LINES = ('分享至 Facebook', 'LINE 分享', '友善列印', '回上一頁', ':::', '字級大小 小 中 大', 'RSS 訂閱')
+BODY_LINES = (
+    '金融監督管理委員會依據相關法令核處罰鍰新臺幣{amount}萬元。',
+    '該公司辦理{topic}業務，未確實執行內部控制制度。',
+    '經查該公司未依規定辦理{topic}作業，核有違反規定。',
+    '爰依{law}規定，核處如主旨。',
+)
+TOPICS = ('洗錢防制', '共同行銷', '專業投資人資格審核', '利害關係人交易', '客戶資料保護', '資訊安全')
+
+
+def _gemini_id(rng: random.Random) -> str:
+    return 'files/' + ''.join(rng.choices(string.ascii_lowercase + string.digits, k=12))
+
+
+def _random_date(rng: random.Random, start: date = date(2000, 1, 1), days: int = 9500) -> date:
+    return start + timedelta(days=rng.randrange(days))
+
+
+def _unique_day(i: int, days: int = 9500) -> tuple:
+    """第 i 份文件的 (日期, 當日序號)；同一類型內文件 ID 不重複"""
+    offset = i * 7919 % days  # 7919 與 days 互質：日期分散且可重現
+    return date(2000, 1, 1) + timedelta(days=offset), i // days + 1
+
+
+def make_raw_mappings(n_docs: int, seed: int = 0) -> dict:
+    """產生映射檔原始內容（與 metadata_registry.read_sources 的回傳格式相同）
+
+    文件數依真實資料比例分配：裁罰案件約 12%、法令函釋約 55%、重要公告約 33%。
+    """
+    rng = random.Random(seed)
+    n_penalty = n_docs * 12 // 100
+    n_law = n_docs * 55 // 100
+    n_ann = n_docs - n_penalty - n_law
+
+    raw = {'penalty_files': {}, 'penalty_gemini': {}, 'law_gemini': {}, 'law_files': {},
+           'ann_gemini': {}, 'ann_files': {}}
+
+    for i in range(n_penalty):
+        day, serial = _unique_day(i)
+        doc_id = f"fsc_pen_{day:%Y%m%d}_{serial:04d}"
+        raw['penalty_gemini'][_gemini_id(rng)] = doc_id
+        raw['penalty_files'][doc_id] = {
+            'display_name': f"{day:%Y-%m-%d}_{rng.choice(SOURCES)}_{doc_id}",
+            'date': f"{day:%Y-%m-%d}",
+            'source': rng.choice(SOURCES),
+            'original_url': f"https://www.fsc.gov.tw/ch/home.jsp?id=131&dataserno={day:%Y%m%d}{serial:04d}",
+            'law_links': {
+                f"{rng.choice(LAW_NAME_PARTS)}法第{rng.randint(1, 200)}條": f"https://law.moj.gov.tw/{i}/{k}"
+                for k in range(rng.randint(0, 4))
+            }
+        }
+
+    for key_gemini, key_files, prefix, categories, count, number_key in (
+        ('law_gemini', 'law_files', 'fsc_law', LAW_CATEGORIES, n_law, 'document_number'),
+        ('ann_gemini', 'ann_files', 'fsc_unk', ANN_CATEGORIES, n_ann, 'announcement_number'),
+    ):
+        for i in range(count):
+            day, serial = _unique_day(i)
+            doc_id = f"{prefix}_{day:%Y%m%d}{serial:04d}" if prefix == 'fsc_law' else f"{prefix}_{day:%Y%m%d}_{serial:04d}"
+            source = rng.choice(SOURCES)
+            category = rng.choice(categories)
+            display_name = f"{day:%Y-%m-%d}_{source}_{category}_{doc_id}"
+            gemini_id = _gemini_id(rng)
+            raw[key_gemini][doc_id] = {
+                'display_name': display_name,
+                'gemini_file_id': gemini_id,
+                'date': f"{day:%Y-%m-%d}",
+                'source': source,
+                'category': category
+            }
+            raw[key_files][doc_id] = {
+                'display_name': display_name,
+                'gemini_file_id': gemini_id,
+                'original_url': f"https://www.fsc.gov.tw/ch/home.jsp?dataserno={day:%Y%m%d}{serial:04d}",
+                'date': f"{day:%Y-%m-%d}",
+                'source': source,
+                'category': category,
+                number_key: f"金管銀字第{rng.randint(10000000000, 99999999999)}號"
+            }
+    return raw
+
+
+def write_raw_mappings(raw: dict, base_path) -> Path:
+    """將映射檔原始內容寫入 data/ 目錄結構（供載入測試使用）"""
+    from metadata_registry import MAPPING_SOURCES
+
+    base_path = Path(base_path)
+    for source in MAPPING_SOURCES:
+        if source.key not in raw:
+            continue
+        path = base_path / source.relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(raw[source.key], f, ensure_ascii=False)
+    return base_path
+
+
+def make_law_names(n_names: int, seed: int = 0) -> list:
+    """產生不重複的法律名稱"""
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n_names:
+        parts = rng.sample(LAW_NAME_PARTS, rng.randint(1, 3))
+        names.add(''.join(parts) + rng.choice(LAW_NAME_SUFFIXES))
+    return sorted(names)
+
+
+def make_law_table(n_articles: int, n_short: int = 80, seed: int = 0) -> dict:
+    """產生法條連結表 {法條: URL}（含「第N條」簡寫）"""
+    rng = random.Random(seed)
+    names = make_law_names(max(1, n_articles // 12), seed)
+    table = {}
+    while len(table) < n_articles:
+        name = rng.choice(names)
+        article = f"第{rng.randint(1, 300)}條" + (f"之{rng.randint(1, 3)}" if rng.random() < 0.1 else '')
+        table[f"{name}{article}"] = f"https://law.moj.gov.tw/LawClass/LawSingle.aspx?pcode={zlib.crc32(name.encode('utf-8')) & 0xffff}&flno={article}"
+    for n in range(1, n_short + 1):
+        table[f"第{n}條"] = f"https://law.moj.gov.tw/short/{n}"
+    return table
+
+
+def make_answer(n_cases: int, law_table: dict, seed: int = 0, citations_per_case: int = 3) -> str:
+    """產生與 Gemini 回答格式相同的長回答（案件標題 + 法條引用）"""
+    rng = random.Random(seed)
+    laws = [law for law in law_table if not law.startswith('第')]
+    lines = ['## 問題詮釋', '您詢問的是相關裁罰案件。', '', '## 具體案例', '']
+    for i in range(1, n_cases + 1):
+        day = _random_date(rng)
+        lines.append(f"### {i}. {day:%Y-%m-%d} - 某某{rng.choice(LAW_NAME_PARTS)}股份有限公司")
+        lines.append(f"- **日期**：{day:%Y-%m-%d}")
+        cited = rng.sample(laws, min(citations_per_case, len(laws))) if laws else []
+        connector = rng.choice(('、', '及', '與'))
+        lines.append(f"- **違反法條**：違反{'、'.join(cited)}{connector}第{rng.randint(1, 80)}條規定")
+        lines.append(f"- **裁罰內容**：核處罰鍰新臺幣{rng.randint(10, 3000)}萬元")
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def make_snippet(rng: random.Random, n_lines: int = 12, noise_ratio: float = 0.2) -> str:
+    """產生一段檢索片段（部分行為網頁雜訊）"""
+    lines = []
+    for _ in range(n_lines):
+        if rng.random() < noise_ratio:
+            lines.append(rng.choice(NOISE_LINES))
+        else:
+            lines.append('  ' + rng.choice(BODY_LINES).format(
+                amount=rng.randint(10, 3000), topic=rng.choice(TOPICS), law=rng.choice(LAW_NAME_PARTS) + '法'
+            ))
+        if rng.random() < 0.1:
+            lines.append('')
+    return '\n'.join(lines)
+
+
+def make_snippets(n: int, unique_ratio: float = 0.3, seed: int = 0) -> list:
+    """產生 n 個片段，其中只有 unique_ratio 比例不重複（模擬跨查詢重複出現的片段）"""
+    rng = random.Random(seed)
+    pool = [make_snippet(rng) for _ in range(max(1, int(n * unique_ratio)))]
+    return [rng.choice(pool) for _ in range(n)]
+
+
+def make_sources(raw: dict, n_sources: int, seed: int = 0) -> list:
+    """從映射檔中挑選引用來源（與 extract_grounding_sources 的格式相同，含重複）"""
+    rng = random.Random(seed)
+    gemini_ids = list(raw['penalty_gemini'])
+    gemini_ids += [info['gemini_file_id'] for info in raw['law_gemini'].values()]
+    gemini_ids += [info['gemini_file_id'] for info in raw['ann_gemini'].values()]
+    picked = rng.sample(gemini_ids, min(len(gemini_ids), max(1, n_sources * 2 // 3)))
+    return [
+        {'filename': rng.choice(picked).replace('files/', ''), 'snippet': make_snippet(rng, 4)}
+        for _ in range(n_sources)
+    ]
+
+
+def make_grounded_response(answer: str, n_chunks: int, chunks_per_support: int = 3, seed: int = 0):
+    """產生含 grounding_metadata 的 Gemini 回應：回答的每一行非空白文字都是一個 support
+
+    chunk 每兩個屬於同一份文件（模擬同一文件被切成多個片段），support 的起訖為 UTF-8 位元組位置。
+    """
+    from google.genai import types
+
+    rng = random.Random(seed)
+    chunks = [
+        types.GroundingChunk(retrieved_context=types.GroundingChunkRetrievedContext(
+            title=f"doc{i // 2:05d}", text=make_snippet(rng, 4)
+        ))
+        for i in range(n_chunks)
+    ]
+    supports = []
+    offset = 0
+    for line in answer.split('\n'):
+        size = len(line.encode('utf-8'))
+        if line.strip():
+            supports.append(types.GroundingSupport(
+                grounding_chunk_indices=rng.sample(range(n_chunks), min(chunks_per_support, n_chunks)),
+                segment=types.Segment(start_index=offset, end_index=offset + size, text=line)
+            ))
+        offset += size + 1
+    return types.GenerateContentResponse(candidates=[types.Candidate(
+        content=types.Content(role='model', parts=[types.Part(text=answer)]),
+        grounding_metadata=types.GroundingMetadata(grounding_chunks=chunks, grounding_supports=supports)
+    )])
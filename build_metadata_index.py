@@ -0,0 +1,256 @@
+"""
+映射檔離線編譯工具
+
+將 data/ 下所有映射檔合併編譯為單一 SQLite 索引（data/metadata_index.sqlite），
+並輸出一致性報告（無法對應、重複、衝突的 ID）。
+
+使用方式：
+    python build_metadata_index.py
+    python build_metadata_index.py --output /tmp/index.sqlite --report /tmp/report.json
+
+應用程式啟動時若發現索引與映射檔內容一致，會直接開啟索引，
+不必在每個 worker 解析約 4 MB 的 JSON。
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+from metadata_registry import (
+    DEFAULT_INDEX_NAME,
+    INDEX_SCHEMA_VERSION,
+    MAPPING_SOURCES,
+    merge_mappings,
+    read_sources,
+    source_fingerprint,
+)
+
+# 一致性報告中每一類問題最多列出的範例數
+REPORT_SAMPLE_LIMIT = 50
+
+# 同一文件在 gemini_id_mapping_new 與 *_mapping 之間需要比對的欄位
+COMPARED_FIELDS = ('date', 'source', 'category', 'gemini_file_id')
+
+
+def build_report(raw: dict, file_mapping: dict, gemini_id_mapping: dict, missing: list) -> dict:
+    """比對各映射檔，整理無法對應、重複與衝突的 ID
+
+    Args:
+        raw: 各映射檔原始內容
+        file_mapping: 合併後的正向映射
+        gemini_id_mapping: 合併後的反向映射
+        missing: 不存在的映射檔
+
+    Returns:
+        一致性報告
+    """
+    issues = {
+        'missing_sources': missing,
+        'unresolved_gemini_ids': [],     # 反向映射指向不存在的文件
+        'docs_without_gemini_id': [],    # 文件沒有任何 Gemini ID 指向它
+        'duplicate_gemini_ids': [],      # 同一 Gemini ID 指向多個文件
+        'duplicate_doc_gemini_ids': [],  # 同一文件有多個 Gemini ID
+        'conflicting_fields': [],        # 兩份映射檔對同一文件的描述不一致
+        'unpaired_docs': []              # 只出現在其中一份映射檔的文件
+    }
+
+    # 反向映射指向不存在的文件（裁罰案件缺少 file_mapping.json 時會全部列出）
+    for gemini_id, doc_id in gemini_id_mapping.items():
+        if doc_id not in file_mapping:
+            issues['unresolved_gemini_ids'].append({'gemini_id': gemini_id, 'doc_id': doc_id})
+
+    referenced = {}
+    for gemini_id, doc_id in gemini_id_mapping.items():
+        referenced.setdefault(doc_id, []).append(gemini_id)
+
+    for doc_id in file_mapping:
+        if doc_id not in referenced:
+            issues['docs_without_gemini_id'].append(doc_id)
+
+    for doc_id, gemini_ids in referenced.items():
+        if len(gemini_ids) > 1:
+            issues['duplicate_doc_gemini_ids'].append({'doc_id': doc_id, 'gemini_ids': gemini_ids})
+
+    # 同一 Gemini ID 在不同映射檔中指向不同文件
+    owners = {}
+    for gemini_id, doc_id in (raw.get('penalty_gemini') or {}).items():
+        owners.setdefault(gemini_id, set()).add(doc_id)
+    for key in ('law_gemini', 'ann_gemini'):
+        for doc_id, info in (raw.get(key) or {}).items():
+            gemini_id = info.get('gemini_file_id', '')
+            if gemini_id:
+                owners.setdefault(gemini_id, set()).add(doc_id)
+    for gemini_id, doc_ids in owners.items():
+        if len(doc_ids) > 1:
+            issues['duplicate_gemini_ids'].append({'gemini_id': gemini_id, 'doc_ids': sorted(doc_ids)})
+
+    # 比對 gemini_id_mapping_new 與 *_mapping 的欄位
+    for gemini_key, files_key in (('law_gemini', 'law_files'), ('ann_gemini', 'ann_files')):
+        gemini_data = raw.get(gemini_key) or {}
+        files_data = raw.get(files_key) or {}
+
+        for doc_id in sorted(set(gemini_data) ^ set(files_data)):
+            issues['unpaired_docs'].append({
+                'doc_id': doc_id,
+                'only_in': gemini_key if doc_id in gemini_data else files_key
+            })
+
+        for doc_id in sorted(set(gemini_data) & set(files_data)):
+            for field_name in COMPARED_FIELDS:
+                left = gemini_data[doc_id].get(field_name, '')
+                right = files_data[doc_id].get(field_name, '')
+                if left and right and left != right:
+                    issues['conflicting_fields'].append({
+                        'doc_id': doc_id,
+                        'field': field_name,
+                        gemini_key: left,
+                        files_key: right
+                    })
+
+    counts = {name: len(items) for name, items in issues.items()}
+    samples = {name: items[:REPORT_SAMPLE_LIMIT] for name, items in issues.items()}
+
+    return {
+        'counts': counts,
+        'samples': samples
+    }
+
+
+def write_index(index_path: Path, file_mapping: dict, gemini_id_mapping: dict, meta: dict):
+    """寫入 SQLite 索引（先寫入暫存檔再原子替換）"""
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.metadata_index_', suffix='.sqlite', dir=index_path.parent)
+    os.close(fd)
+
+    try:
+        conn = sqlite3.connect(tmp_path)
+        conn.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA page_size = 4096;
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT) WITHOUT ROWID;
+            CREATE TABLE docs (
+                doc_id TEXT PRIMARY KEY,
+                type TEXT,
+                date TEXT,
+                source TEXT,
+                category TEXT,
+                info TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE gemini_ids (gemini_id TEXT PRIMARY KEY, doc_id TEXT) WITHOUT ROWID;
+        """)
+
+        conn.executemany(
+            "INSERT INTO docs VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    doc_id,
+                    info.get('_type', ''),
+                    info.get('date', ''),
+                    info.get('source', ''),
+                    info.get('category', ''),
+                    json.dumps(info, ensure_ascii=False, separators=(',', ':'))
+                )
+                for doc_id, info in sorted(file_mapping.items())
+            )
+        )
+        conn.executemany(
+            "INSERT INTO gemini_ids VALUES (?, ?)",
+            sorted(gemini_id_mapping.items())
+        )
+        conn.execute("CREATE INDEX docs_type_date ON docs (type, date)")
+        conn.execute("CREATE INDEX docs_source ON docs (source)")
+        conn.executemany("INSERT INTO meta VALUES (?, ?)", sorted(meta.items()))
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.close()
+
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, index_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def compile_index(base_path, index_path=None, report_path=None) -> dict:
+    """編譯映射檔為 SQLite 索引並輸出一致性報告
+
+    Args:
+        base_path: data/ 目錄
+        index_path: 索引輸出路徑（預設 data/metadata_index.sqlite）
+        report_path: 報告輸出路徑（預設與索引同名的 _report.json）
+
+    Returns:
+        一致性報告
+    """
+    base_path = Path(base_path)
+    index_path = Path(index_path) if index_path else base_path / DEFAULT_INDEX_NAME
+    report_path = Path(report_path) if report_path else index_path.with_name(index_path.stem + '_report.json')
+
+    raw, errors = read_sources(base_path)
+    if errors:
+        raise RuntimeError("; ".join(f"{label}: {error}" for label, error in errors))
+
+    file_mapping, gemini_id_mapping = merge_mappings(raw)
+    fingerprint = source_fingerprint(base_path)
+    missing = [relpath for relpath, size, _ in fingerprint if size is None]
+
+    content_hash = hashlib.sha1(
+        json.dumps([file_mapping, gemini_id_mapping], ensure_ascii=False, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+    meta = {
+        'schema_version': str(INDEX_SCHEMA_VERSION),
+        'built_at': datetime.now().isoformat(timespec='seconds'),
+        'source_fingerprint': json.dumps(fingerprint),
+        'content_hash': content_hash,
+        'doc_count': str(len(file_mapping)),
+        'gemini_id_count': str(len(gemini_id_mapping))
+    }
+    write_index(index_path, file_mapping, gemini_id_mapping, meta)
+
+    report = build_report(raw, file_mapping, gemini_id_mapping, missing)
+    report.update({
+        'index_path': str(index_path),
+        'schema_version': INDEX_SCHEMA_VERSION,
+        'built_at': meta['built_at'],
+        'content_hash': content_hash,
+        'sources': [
+            {'path': source.relpath, 'entries': len(raw.get(source.key) or {})}
+            for source in MAPPING_SOURCES
+        ],
+        'doc_count': len(file_mapping),
+        'gemini_id_count': len(gemini_id_mapping)
+    })
+
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='編譯映射檔為 SQLite 索引並輸出一致性報告')
+    parser.add_argument('--data', default=str(Path(__file__).parent / 'data'), help='data/ 目錄')
+    parser.add_argument('--output', help=f'索引輸出路徑（預設 data/{DEFAULT_INDEX_NAME}）')
+    parser.add_argument('--report', help='一致性報告輸出路徑')
+    args = parser.parse_args()
+
+    report = compile_index(args.data, args.output, args.report)
+
+    print(f"✅ 索引已輸出：{report['index_path']}")
+    print(f"   文件數：{report['doc_count']}，Gemini ID：{report['gemini_id_count']}")
+    for source in report['sources']:
+        print(f"   - {source['path']}：{source['entries']} 筆")
+    print("📋 一致性檢查：")
+    for name, count in report['counts'].items():
+        print(f"   - {name}：{count}")
+
+
+if __name__ == '__main__':
+    main()
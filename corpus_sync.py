@@ -0,0 +1,623 @@
+"""
+語料增量同步（本地文件 → File Search Store → 映射檔）
+
+映射檔記錄了每份文件的 gemini_file_id、upload_type、uploaded_at，但沒有工具讓 Store 與映射檔保持一致，
+新增公告時只能整批重建映射檔。這裡比對本地文件與 Store 中的文件，只上傳新增或內容變動的文件：
+
+  1. 在背景執行緒逐頁列出 Store 中的文件（文件 ID、內容雜湊取自上傳時的 custom metadata），
+     同時以執行緒池計算本地文件的內容雜湊（依檔案大小與 mtime 快取，未變動的檔案不重新讀取）
+  2. 依文件 ID 與內容雜湊比對：新增、變動（上傳新版本後刪除舊版本）、未變動
+  3. 以有上限的並行數上傳（Files API 上傳後匯入 Store，附上 doc_custom_metadata 與內容雜湊），
+     每完成一份即寫入檢查點；中斷後重新執行相同指令會略過已完成的文件
+  4. 全部完成後以原子方式（暫存檔 + os.replace）更新 gemini ID 映射檔，再刪除被取代的舊版本
+
+每日同步的上傳量、映射檔寫入與舊版本刪除只與變動的文件數有關；列出 Store 仍需逐頁讀取，但與本地雜湊計算同時進行。
+
+本地文件目錄：檔名（或路徑）包含文件 ID 的 .txt / .md / .pdf，例如 fsc_unk_20251114_0001.txt；
+同名的 .json（例如 fsc_unk_20251114_0001.json）可提供映射檔尚未記錄的新文件資訊（display_name、date、source、category、original_url 等）。
+
+使用方式：
+    python corpus_sync.py docs/ --store fileSearchStores/xxx --dry-run     # 只列出差異
+    python corpus_sync.py docs/ --store fileSearchStores/xxx --concurrency 4
+    FSC_GEMINI_FAKE=1 FSC_FAKE_STORE=.cache/fake_store.json python corpus_sync.py docs/ --store fileSearchStores/fake
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from metadata_filter import doc_custom_metadata
+from metadata_registry import MAPPING_SOURCES, MetadataRegistry, read_sources
+from scheduler import is_retryable
+from startup import lazy_module
+
+types = lazy_module('google.genai.types')
+
+# 文件 ID：裁罰案件 fsc_pen_YYYYMMDD_NNNN、法令函釋 fsc_law_YYYYMMDDNNNN、重要公告 fsc_unk_YYYYMMDD_NNNN
+DOC_ID_RE = re.compile(r'fsc_(?:pen_\d{8}_\d{4}|law_\d{12}|unk_\d{8}_\d{4})')
+
+DOC_TYPE_PREFIXES = {
+    'fsc_pen_': 'penalty',
+    'fsc_law_': 'law_interpretation',
+    'fsc_unk_': 'announcement',
+}
+
+# 副檔名 → (upload_type, mime_type)
+UPLOAD_TYPES = {
+    '.txt': ('plaintext', 'text/plain'),
+    '.md': ('plaintext', 'text/markdown'),
+    '.pdf': ('pdf', 'application/pdf'),
+}
+
+# 資料類型 → (gemini ID 映射檔, 文件資訊映射檔)（MappingSource.key）
+MAPPING_TARGETS = {
+    'penalty': ('penalty_gemini', 'penalty_files'),
+    'law_interpretation': ('law_gemini', 'law_files'),
+    'announcement': ('ann_gemini', 'ann_files'),
+}
+
+# gemini_id_mapping_new.json 每筆保留的欄位（與既有映射檔相同）
+GEMINI_MAPPING_FIELDS = ('display_name', 'date', 'source', 'category')
+
+# 上傳時附加的內容雜湊 metadata（下次同步時用來判斷文件是否變動）
+CONTENT_HASH_KEY = 'content_hash'
+
+DEFAULT_STATE_DIR = Path('.cache') / 'corpus_sync'
+
+
+def doc_type(doc_id: str) -> str:
+    """由文件 ID 判斷資料類型，無法判斷時返回 None"""
+    for prefix, data_type in DOC_TYPE_PREFIXES.items():
+        if doc_id.startswith(prefix):
+            return data_type
+    return None
+
+
+def file_digest(path) -> str:
+    """檔案內容的 sha256（前 16 碼）"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def write_json_atomic(path, data):
+    """以暫存檔 + os.replace 寫入 JSON（讀取端只會看到舊檔或完整的新檔）"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class HashCache:
+    """本地文件的內容雜湊快取（路徑 → [大小, mtime_ns, 雜湊]），檔案未變動時不重新讀取"""
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        if self.path is not None and self.path.exists():
+            try:
+                self._entries = json.loads(self.path.read_text(encoding='utf-8'))
+            except (OSError, json.JSONDecodeError):
+                self._entries = {}
+
+    def digest(self, path: Path) -> str:
+        stat = path.stat()
+        key = str(path.resolve())
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            with self._lock:
+                self.hits += 1
+            return cached[2]
+
+        value = file_digest(path)
+        with self._lock:
+            self._entries[key] = [stat.st_size, stat.st_mtime_ns, value]
+            self.misses += 1
+        return value
+
+    def save(self):
+        if self.path is not None:
+            with self._lock:
+                entries = dict(self._entries)
+            write_json_atomic(self.path, entries)
+
+
+@dataclass
+class LocalDoc:
+    """本地的一份文件"""
+    doc_id: str
+    path: Path
+    content_hash: str
+    data_type: str
+    info: dict              # 映射檔中的文件資訊（含 .json 補充的欄位）
+    upload_type: str
+    mime_type: str
+    overrides: dict = field(default_factory=dict)  # .json 提供的欄位（寫入映射檔時優先於既有內容）
+
+
+@dataclass
+class StoreDoc:
+    """Store 中的一份文件"""
+    name: str               # fileSearchStores/.../documents/...
+    doc_id: str
+    content_hash: str       # 上傳時的內容雜湊（此工具之前上傳的文件沒有）
+    display_name: str
+    create_time: str
+
+
+@dataclass
+class SyncPlan:
+    """同步計畫"""
+    uploads: list = field(default_factory=list)     # [(LocalDoc, 'new' / 'changed' / 'legacy')]
+    unchanged: int = 0
+    legacy: int = 0                                 # Store 中沒有內容雜湊、視為未變動的文件
+    stale: dict = field(default_factory=dict)       # 文件 ID → [被取代的 Store 文件名稱]
+    orphans: list = field(default_factory=list)     # 本地與映射檔都沒有的 Store 文件
+
+    def counts(self) -> dict:
+        reasons = [reason for _, reason in self.uploads]
+        return {
+            'new': reasons.count('new'),
+            'changed': reasons.count('changed') + reasons.count('legacy'),
+            'unchanged': self.unchanged,
+            'legacy': self.legacy,
+            'stale': sum(len(names) for names in self.stale.values()),
+            'orphans': len(self.orphans)
+        }
+
+
+def scan_local_docs(docs_dir, snapshot, hash_cache: HashCache, concurrency: int = 8) -> dict:
+    """找出本地文件並計算內容雜湊
+
+    Returns:
+        {文件 ID: LocalDoc}（同一文件 ID 有多個檔案時使用路徑排序最後的一個）
+    """
+    candidates = {}
+    for path in sorted(Path(docs_dir).rglob('*')):
+        if path.suffix.lower() not in UPLOAD_TYPES or not path.is_file():
+            continue
+        match = DOC_ID_RE.search(path.stem) or DOC_ID_RE.search(str(path))
+        if match and doc_type(match.group(0)):
+            candidates[match.group(0)] = path
+
+    def load(doc_id: str, path: Path) -> LocalDoc:
+        info = dict(snapshot.file_mapping.get(doc_id) or {})
+        info.pop('_type', None)
+        sidecar = path.with_suffix('.json')
+        overrides = json.loads(sidecar.read_text(encoding='utf-8')) if sidecar.exists() else {}
+        info.update(overrides)
+        info.setdefault('display_name', doc_id)
+        upload_type, mime_type = UPLOAD_TYPES[path.suffix.lower()]
+        return LocalDoc(doc_id, path, hash_cache.digest(path), doc_type(doc_id), info, upload_type, mime_type,
+                        overrides)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='sync-hash') as pool:
+        docs = pool.map(lambda item: load(*item), candidates.items())
+        return {doc.doc_id: doc for doc in docs}
+
+
+def store_doc_from(document) -> StoreDoc:
+    """由 Store 的 Document 建立 StoreDoc（文件 ID 優先使用 custom metadata，否則由顯示名稱取得）"""
+    metadata = {item.key: item.string_value for item in document.custom_metadata or () if item.string_value}
+    doc_id = metadata.get('doc_id')
+    if not doc_id:
+        match = DOC_ID_RE.search(document.display_name or '')
+        doc_id = match.group(0) if match else None
+    create_time = document.create_time.isoformat() if document.create_time else ''
+    return StoreDoc(document.name, doc_id, metadata.get(CONTENT_HASH_KEY), document.display_name or '', create_time)
+
+
+def list_store_docs(client, store_name: str, page_size: int = 20) -> list:
+    """逐頁列出 Store 中的所有文件"""
+    return [
+        store_doc_from(document)
+        for document in client.file_search_stores.documents.list(parent=store_name, config={'page_size': page_size})
+    ]
+
+
+def plan_sync(local_docs: dict, store_docs: list, known_doc_ids=(), replace_legacy: bool = False) -> SyncPlan:
+    """比對本地文件與 Store 文件
+
+    Args:
+        local_docs: scan_local_docs 的結果
+        store_docs: list_store_docs 的結果
+        known_doc_ids: 映射檔中的文件 ID（不在本地目錄、但仍屬於語料的文件不算孤兒）
+        replace_legacy: Store 中沒有內容雜湊的文件是否重新上傳（否則視為未變動）
+
+    Returns:
+        SyncPlan
+    """
+    by_doc_id = {}
+    plan = SyncPlan()
+    for store_doc in store_docs:
+        if store_doc.doc_id:
+            by_doc_id.setdefault(store_doc.doc_id, []).append(store_doc)
+        else:
+            plan.orphans.append(store_doc)
+
+    for doc_id, local_doc in local_docs.items():
+        existing = sorted(by_doc_id.get(doc_id, ()), key=lambda store_doc: store_doc.create_time, reverse=True)
+        current = [store_doc for store_doc in existing if store_doc.content_hash == local_doc.content_hash]
+        legacy = [store_doc for store_doc in existing if not store_doc.content_hash]
+
+        if current:
+            # 已是最新版本；其餘版本（舊內容或重複上傳）在同步後刪除
+            plan.unchanged += 1
+            keep = current[0]
+        elif legacy and not replace_legacy:
+            plan.legacy += 1
+            keep = legacy[0]
+        else:
+            plan.uploads.append((local_doc, 'legacy' if legacy else 'changed' if existing else 'new'))
+            keep = None
+        stale = [store_doc.name for store_doc in existing if store_doc is not keep]
+        if stale:
+            plan.stale[doc_id] = stale
+
+    known = set(known_doc_ids) | set(local_docs)
+    plan.orphans.extend(
+        store_doc for doc_id, docs in by_doc_id.items() if doc_id not in known for store_doc in docs
+    )
+    return plan
+
+
+class SyncCheckpoint:
+    """已上傳文件的檢查點（JSONL，每完成一份附加一行）"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def load(self) -> dict:
+        """{文件 ID: 紀錄}（同一文件多次上傳時取最後一筆）"""
+        records = {}
+        if not self.path.exists():
+            return records
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中斷時寫到一半的行
+                records[record['doc_id']] = record
+        return records
+
+    def append(self, record: dict):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+
+    def clear(self):
+        with self._lock:
+            self.path.unlink(missing_ok=True)
+
+
+def _with_retries(fn, max_retries: int):
+    """執行 fn()，429 / 503 時退避重試"""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn()
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            time.sleep(min(30.0, 2.0 ** attempt))
+
+
+def upload_document(client, store_name: str, doc: LocalDoc, poll_interval: float = 2.0,
+                    timeout: float = 600.0, max_retries: int = 3) -> dict:
+    """上傳一份文件並匯入 Store（429 / 503 時退避重試）
+
+    Returns:
+        檢查點紀錄 {'doc_id', 'content_hash', 'gemini_file_id', 'document_name', 'upload_type', 'uploaded_at'}
+    """
+    custom_metadata = doc_custom_metadata(doc.doc_id, dict(doc.info, _type=doc.data_type))
+    custom_metadata.append(types.CustomMetadata(key=CONTENT_HASH_KEY, string_value=doc.content_hash))
+
+    def import_uploaded(file_name: str):
+        operation = client.file_search_stores.import_file(
+            file_search_store_name=store_name,
+            file_name=file_name,
+            config=types.ImportFileConfig(custom_metadata=custom_metadata)
+        )
+        deadline = time.monotonic() + timeout
+        while not operation.done:
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"匯入 {doc.doc_id} 超過 {timeout:.0f} 秒")
+            time.sleep(poll_interval)
+            operation = client.operations.get(operation)
+        if operation.error:
+            raise RuntimeError(f"匯入 {doc.doc_id} 失敗：{operation.error}")
+        return operation
+
+    # 只上傳一次，匯入失敗時以同一個檔案重試（避免留下沒有匯入的上傳檔案）
+    uploaded = _with_retries(lambda: client.files.upload(
+        file=doc.path,
+        config=types.UploadFileConfig(display_name=doc.info['display_name'], mime_type=doc.mime_type)
+    ), max_retries)
+    try:
+        operation = _with_retries(lambda: import_uploaded(uploaded.name), max_retries)
+    except BaseException:
+        try:
+            client.files.delete(name=uploaded.name)
+        except Exception:
+            pass  # 上傳檔案 48 小時後也會自動刪除
+        raise
+
+    return {
+        'doc_id': doc.doc_id,
+        'content_hash': doc.content_hash,
+        'gemini_file_id': uploaded.name,
+        'document_name': operation.response.document_name if operation.response else None,
+        'upload_type': doc.upload_type,
+        'uploaded_at': datetime.now().isoformat()
+    }
+
+
+def apply_to_mappings(base_path, records: list, local_docs: dict, sources=MAPPING_SOURCES) -> list:
+    """將上傳結果寫入映射檔（只寫入有變動的檔案）
+
+    Args:
+        base_path: data/ 目錄
+        records: 檢查點紀錄
+        local_docs: {文件 ID: LocalDoc}（提供新文件的資訊）
+
+    Returns:
+        已寫入的映射檔路徑
+    """
+    paths = {source.key: Path(base_path) / source.relpath for source in sources}
+    raw, _ = read_sources(base_path, sources)
+    changed = set()
+
+    for record in records:
+        doc_id = record['doc_id']
+        local_doc = local_docs.get(doc_id)
+        data_type = local_doc.data_type if local_doc else doc_type(doc_id)
+        if data_type not in MAPPING_TARGETS:
+            continue
+        gemini_key, files_key = MAPPING_TARGETS[data_type]
+        info = local_doc.info if local_doc else {}
+        overrides = local_doc.overrides if local_doc else {}
+
+        # 文件資訊映射檔：保留既有欄位（.json 提供的欄位除外），補上缺少的欄位並更新上傳資訊
+        files_mapping = raw.setdefault(files_key, {})
+        entry = dict(files_mapping.get(doc_id) or {})
+        for key, value in info.items():
+            entry.setdefault(key, value)
+        entry.update(overrides)
+        entry.update({
+            'gemini_file_id': record['gemini_file_id'],
+            'upload_type': record['upload_type'],
+            'uploaded_at': record['uploaded_at'],
+            CONTENT_HASH_KEY: record['content_hash']
+        })
+        files_mapping[doc_id] = entry
+        changed.add(files_key)
+
+        # gemini ID 映射檔：裁罰案件為舊格式（gemini_id → doc_id），其餘為 doc_id → {gemini_file_id, ...}
+        gemini_mapping = raw.setdefault(gemini_key, {})
+        if data_type == 'penalty':
+            for gemini_id in [key for key, value in gemini_mapping.items() if value == doc_id]:
+                del gemini_mapping[gemini_id]
+            gemini_mapping[record['gemini_file_id']] = doc_id
+        else:
+            gemini_entry = dict(gemini_mapping.get(doc_id) or {})
+            gemini_entry['gemini_file_id'] = record['gemini_file_id']
+            for key in GEMINI_MAPPING_FIELDS:
+                gemini_entry.setdefault(key, info.get(key, ''))
+                if key in overrides:
+                    gemini_entry[key] = overrides[key]
+            gemini_mapping[doc_id] = gemini_entry
+        changed.add(gemini_key)
+
+    # 先寫文件資訊，再寫 gemini ID 映射（查詢時以 gemini ID 對應文件，對應得到時資訊已經存在）
+    written = []
+    for key in sorted(changed, key=lambda key: key in {target[0] for target in MAPPING_TARGETS.values()}):
+        write_json_atomic(paths[key], raw[key])
+        written.append(paths[key])
+    return written
+
+
+def sync_corpus(client, store_name: str, docs_dir, base_path, concurrency: int = 4, page_size: int = 20,
+                state_dir=DEFAULT_STATE_DIR, dry_run: bool = False, prune: bool = False,
+                replace_legacy: bool = False, poll_interval: float = 2.0, progress=None) -> dict:
+    """比對並同步本地文件到 File Search Store，更新映射檔
+
+    Args:
+        client: genai.Client（或 FakeClient）
+        store_name: File Search Store 名稱
+        docs_dir: 本地文件目錄
+        base_path: 映射檔所在的 data/ 目錄
+        concurrency: 同時上傳的文件數
+        page_size: 列出 Store 文件時每頁的筆數
+        state_dir: 檢查點與雜湊快取目錄
+        dry_run: 只比對，不上傳也不寫入
+        prune: 刪除本地與映射檔都沒有的 Store 文件
+        replace_legacy: 重新上傳 Store 中沒有內容雜湊的文件
+        progress: 每完成一份上傳呼叫 progress(完成數, 總數, LocalDoc, 錯誤或 None)
+
+    Returns:
+        統計摘要
+    """
+    start = time.perf_counter()
+    state_dir = Path(state_dir)
+    store_key = hashlib.sha1(store_name.encode('utf-8')).hexdigest()[:12]
+    checkpoint = SyncCheckpoint(state_dir / f"checkpoint_{store_key}.jsonl")
+    hash_cache = HashCache(state_dir / 'hash_cache.json')
+    snapshot = MetadataRegistry(base_path, index_path=None).snapshot()
+
+    # 列出 Store（逐頁請求）與計算本地雜湊同時進行
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync-list') as lister:
+        listing = lister.submit(list_store_docs, client, store_name, page_size)
+        local_docs = scan_local_docs(docs_dir, snapshot, hash_cache, concurrency=max(4, concurrency))
+        store_docs = listing.result()
+    if not dry_run:
+        hash_cache.save()
+
+    plan = plan_sync(local_docs, store_docs, known_doc_ids=snapshot.file_mapping.keys(),
+                     replace_legacy=replace_legacy)
+    summary = {
+        'local_docs': len(local_docs),
+        'store_docs': len(store_docs),
+        'hash_cache_hits': hash_cache.hits,
+        **plan.counts(),
+        'uploaded': 0,
+        'resumed': 0,
+        'failed': 0,
+        'deleted': 0,
+        'mappings_written': [],
+        'errors': []
+    }
+    if dry_run:
+        summary['plan'] = plan
+        summary['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+        return summary
+
+    # 中斷後繼續：檢查點中內容相同的文件不再上傳
+    completed = {
+        doc_id: record for doc_id, record in checkpoint.load().items()
+        if doc_id in local_docs and record['content_hash'] == local_docs[doc_id].content_hash
+    }
+    pending = [local_doc for local_doc, _ in plan.uploads if local_doc.doc_id not in completed]
+    summary['resumed'] = len(plan.uploads) - len(pending)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='sync-upload') as pool:
+        futures = {
+            pool.submit(upload_document, client, store_name, local_doc, poll_interval): local_doc
+            for local_doc in pending
+        }
+        try:
+            for finished, future in enumerate(as_completed(futures), 1):
+                local_doc = futures[future]
+                try:
+                    record = future.result()
+                except Exception as e:
+                    summary['failed'] += 1
+                    summary['errors'].append({'doc_id': local_doc.doc_id, 'error': f"{type(e).__name__}: {e}"})
+                    if progress:
+                        progress(finished, len(pending), local_doc, e)
+                    continue
+                checkpoint.append(record)
+                completed[local_doc.doc_id] = record
+                summary['uploaded'] += 1
+                if progress:
+                    progress(finished, len(pending), local_doc, None)
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            summary['interrupted'] = True
+            summary['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+            return summary
+
+    # 已上傳的文件寫入映射檔後，才刪除被取代的舊版本（查詢時引用的舊版本仍可對應）
+    summary['mappings_written'] = [
+        str(path) for path in apply_to_mappings(base_path, list(completed.values()), local_docs)
+    ]
+    upload_ids = {local_doc.doc_id for local_doc, _ in plan.uploads}
+    to_delete = [
+        name for doc_id, names in plan.stale.items()
+        if doc_id in completed or doc_id not in upload_ids  # 上傳失敗的文件保留舊版本
+        for name in names
+    ]
+    if prune:
+        to_delete.extend(store_doc.name for store_doc in plan.orphans)
+    for name in to_delete:
+        try:
+            client.file_search_stores.documents.delete(name=name, config={'force': True})
+            summary['deleted'] += 1
+        except Exception as e:
+            summary['errors'].append({'document': name, 'error': f"{type(e).__name__}: {e}"})
+
+    if not summary['failed']:
+        checkpoint.clear()
+    summary['elapsed_seconds'] = round(time.perf_counter() - start, 2)
+    return summary
+
+
+def create_client():
+    """建立 Gemini client（FSC_GEMINI_FAKE=1 時使用假 Store，FSC_FAKE_STORE 指定保存位置）"""
+    if os.getenv('FSC_GEMINI_FAKE') == '1':
+        from fake_genai import FakeClient
+        return FakeClient(store_path=os.getenv('FSC_FAKE_STORE') or None)
+
+    from google import genai
+    return genai.Client(api_key=os.environ['GEMINI_API_KEY'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='將本地文件增量同步到 File Search Store 並更新映射檔')
+    parser.add_argument('docs_dir', help='本地文件目錄（檔名包含文件 ID 的 .txt / .md / .pdf）')
+    parser.add_argument('--store', default=os.getenv('GEMINI_STORE_ID'), help='File Search Store 名稱（預設 GEMINI_STORE_ID）')
+    parser.add_argument('--data-dir', default=str(Path(__file__).parent / 'data'), help='映射檔所在目錄')
+    parser.add_argument('--concurrency', type=int, default=4, help='同時上傳的文件數')
+    parser.add_argument('--page-size', type=int, default=20, help='列出 Store 文件時每頁的筆數')
+    parser.add_argument('--state-dir', default=str(Path(os.getenv('FSC_CACHE_DIR') or '.cache') / 'corpus_sync'),
+                        help='檢查點與雜湊快取目錄')
+    parser.add_argument('--dry-run', action='store_true', help='只列出差異，不上傳也不寫入映射檔')
+    parser.add_argument('--prune', action='store_true', help='刪除本地與映射檔都沒有的 Store 文件')
+    parser.add_argument('--replace-legacy', action='store_true', help='重新上傳 Store 中沒有內容雜湊的文件')
+    args = parser.parse_args()
+
+    if not args.store:
+        parser.error('請以 --store 或 GEMINI_STORE_ID 指定 File Search Store')
+    if os.getenv('FSC_GEMINI_FAKE') != '1' and not os.getenv('GEMINI_API_KEY'):
+        parser.error('找不到 GEMINI_API_KEY，請設定環境變數（或設定 FSC_GEMINI_FAKE=1 使用假 Store）')
+
+    def progress(finished, total, local_doc, error):
+        status = f"❌ {error}" if error else '✅'
+        print(f"[{finished}/{total}] {status} {local_doc.doc_id}")
+
+    summary = sync_corpus(
+        create_client(), args.store, args.docs_dir, args.data_dir,
+        concurrency=args.concurrency,
+        page_size=args.page_size,
+        state_dir=args.state_dir,
+        dry_run=args.dry_run,
+        prune=args.prune,
+        replace_legacy=args.replace_legacy,
+        progress=progress
+    )
+
+    print(f"📋 本地 {summary['local_docs']} 份、Store {summary['store_docs']} 份：新增 {summary['new']}、"
+          f"變動 {summary['changed']}、未變動 {summary['unchanged']}（其中 {summary['legacy']} 份沒有內容雜湊）、"
+          f"舊版本 {summary['stale']}、孤兒 {summary['orphans']}")
+    if args.dry_run:
+        for local_doc, reason in summary['plan'].uploads:
+            print(f"   {reason:<8}{local_doc.doc_id}  {local_doc.path}")
+        return
+    print(f"   上傳 {summary['uploaded']}、略過（已完成）{summary['resumed']}、失敗 {summary['failed']}、"
+          f"刪除 {summary['deleted']}，耗時 {summary['elapsed_seconds']} 秒")
+    for path in summary['mappings_written']:
+        print(f"   📝 已更新 {path}")
+    for error in summary['errors']:
+        print(f"   ⚠️ {error}")
+    if summary.get('interrupted'):
+        print("⚠️ 已中斷，重新執行相同指令即可從中斷處繼續")
+
+
+if __name__ == '__main__':
+    main()
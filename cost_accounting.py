@@ -0,0 +1,278 @@
+"""
+Token 用量與成本統計
+
+依 usage_metadata 記錄每次 Gemini 請求的輸入、快取、檢索（File Search 工具）、輸出與思考 token，
+換算成本後寫入 SQLite 帳本（重啟後仍可累計，多個程序可共用），並提供：
+  - 依日期、session、查詢類型、模型彙總
+  - 每日花費上限：達警告比例時降級（縮短輸出上限），超過上限時不再呼叫 Gemini
+  - 固定提示（system instruction）的大小預算，以及各段落的 token 佔比報告
+
+價格為每百萬 token 的美元價格（預設值可能與最新公告不同，請以 FSC_PRICING 覆寫）。
+
+使用方式：
+    python cost_accounting.py --by day --days 7
+    python cost_accounting.py --by query_class
+    python cost_accounting.py --prompt
+"""
+
+import argparse
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date, timedelta
+from pathlib import Path
+
+# 每百萬 token 的美元價格（思考 token 以輸出價格計算，File Search 檢索內容以輸入價格計算）
+DEFAULT_PRICING = {
+    'gemini-2.5-flash': {'input': 0.30, 'cached': 0.075, 'output': 2.50},
+    'gemini-2.5-pro': {'input': 1.25, 'cached': 0.31, 'output': 10.00},
+}
+FALLBACK_MODEL = 'gemini-2.5-flash'
+
+ROLLUP_COLUMNS = ('day', 'session', 'query_class', 'model')
+
+# 查詢類型（依序比對，都不符合時依是否有篩選條件分為 filtered / case_search）
+QUERY_CLASS_RULES = (
+    ('amount', re.compile(r'金額|罰鍰多少|多少錢|最高|最低|萬元')),
+    ('concept', re.compile(r'什麼|如何|為何|是否|哪些業務|限制|構成|定義|時點|認定')),
+)
+
+_CJK_RE = re.compile(r'[　-〿㐀-䶿一-鿿＀-￯]')
+# 段落標題：## 標題、以冒號結尾的 ### 標題（答案範例中的 ### 案件標題不算）、【…】規則、範例
+_SECTION_RE = re.compile(r'^(?:## .+|### .+：|【.+?】.*|回答格式範例：|\*\*範例 \d.*\*\*)$', re.MULTILINE)
+_FENCE_RE = re.compile(r'```json\n.*?```', re.DOTALL)
+
+
+def load_pricing(overrides: str = None) -> dict:
+    """預設價格，可用 JSON 覆寫：{"gemini-2.5-flash": {"input": 0.3, "cached": 0.075, "output": 2.5}}"""
+    pricing = {model: dict(prices) for model, prices in DEFAULT_PRICING.items()}
+    for model, prices in json.loads(overrides or '{}').items():
+        pricing.setdefault(model, dict(DEFAULT_PRICING[FALLBACK_MODEL])).update(prices)
+    return pricing
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數（中文約每 1.5 字一個 token，英數與符號約每 4 字一個 token）"""
+    text = text or ''
+    cjk = len(_CJK_RE.findall(text))
+    return math.ceil(cjk / 1.5 + (len(text) - cjk) / 4)
+
+
+def request_cost(usage: dict, model: str, pricing: dict = None) -> dict:
+    """依 extract_usage 的結果計算一次請求的成本（美元）
+
+    prompt_tokens 已包含 cached_tokens：未快取部分以輸入價格、快取部分以快取價格計算。
+    """
+    pricing = pricing or DEFAULT_PRICING
+    prices = pricing.get(model) or pricing[FALLBACK_MODEL]
+    prompt = usage.get('prompt_tokens', 0)
+    cached = min(usage.get('cached_tokens', 0), prompt)
+    tool = usage.get('tool_prompt_tokens', 0)
+    output = usage.get('output_tokens', 0) + usage.get('thoughts_tokens', 0)
+
+    cost = {
+        'input_usd': (prompt - cached) * prices['input'] / 1e6,
+        'cached_usd': cached * prices['cached'] / 1e6,
+        'tool_usd': tool * prices['input'] / 1e6,
+        'output_usd': output * prices['output'] / 1e6,
+    }
+    cost['total_usd'] = sum(cost.values())
+    return cost
+
+
+def classify_query(query: str, filters: dict = None) -> str:
+    """查詢類型（用於成本彙總）"""
+    for name, pattern in QUERY_CLASS_RULES:
+        if pattern.search(query or ''):
+            return name
+    return 'filtered' if filters else 'case_search'
+
+
+@dataclass(frozen=True)
+class CostBudget:
+    """成本預算
+
+    daily_usd: 每日 Gemini 花費上限（0 表示不限制）
+    warn_ratio: 達上限的此比例時降級（輸出上限改為 degraded_max_output_tokens）
+    prompt_tokens: 固定提示的 token 預算（0 表示不限制）
+    prompt_mode: 固定提示超過預算時 'warn'（只提示）或 'degrade'（法條連結表改為本地處理）
+    """
+    daily_usd: float = 0.0
+    warn_ratio: float = 0.8
+    degraded_max_output_tokens: int = 2048
+    prompt_tokens: int = 0
+    prompt_mode: str = 'warn'
+
+    @classmethod
+    def from_env(cls) -> 'CostBudget':
+        return cls(
+            daily_usd=float(os.getenv('FSC_DAILY_BUDGET_USD', '0')),
+            warn_ratio=float(os.getenv('FSC_BUDGET_WARN_RATIO', '0.8')),
+            degraded_max_output_tokens=int(os.getenv('FSC_DEGRADED_MAX_OUTPUT_TOKENS', '2048')),
+            prompt_tokens=int(os.getenv('FSC_PROMPT_TOKEN_BUDGET', '0')),
+            prompt_mode=os.getenv('FSC_PROMPT_BUDGET_MODE', 'warn')
+        )
+
+
+class CostLedger:
+    """每次 Gemini 請求的 token 用量與成本帳本（SQLite，執行緒安全）"""
+
+    def __init__(self, path=None, pricing: dict = None):
+        """
+        Args:
+            path: SQLite 檔案路徑，None 表示只保存在記憶體
+            pricing: 價格表（預設 DEFAULT_PRICING）
+        """
+        self.pricing = pricing or DEFAULT_PRICING
+        self._lock = threading.Lock()
+        if path:
+            path = Path(path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path) if path else ':memory:', check_same_thread=False)
+        self._conn.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS requests (
+                created_at REAL,
+                day TEXT,
+                session TEXT,
+                query_class TEXT,
+                model TEXT,
+                prompt_tokens INTEGER,
+                cached_tokens INTEGER,
+                tool_tokens INTEGER,
+                output_tokens INTEGER,
+                thoughts_tokens INTEGER,
+                cost_usd REAL
+            );
+            CREATE INDEX IF NOT EXISTS requests_day ON requests (day);
+        """)
+
+    def record(self, model: str, usage: dict, session: str = None, query_class: str = None,
+               day: date = None) -> dict:
+        """記錄一次請求，返回成本明細"""
+        cost = request_cost(usage, model, self.pricing)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), (day or date.today()).isoformat(), session or 'unknown', query_class or 'unknown', model,
+                 usage.get('prompt_tokens', 0), usage.get('cached_tokens', 0), usage.get('tool_prompt_tokens', 0),
+                 usage.get('output_tokens', 0), usage.get('thoughts_tokens', 0), cost['total_usd'])
+            )
+            self._conn.commit()
+        return cost
+
+    def spent(self, day: date = None) -> float:
+        """某日（預設今天）的總花費（美元）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(cost_usd), 0) FROM requests WHERE day = ?",
+                ((day or date.today()).isoformat(),)
+            ).fetchone()
+        return row[0]
+
+    def rollup(self, by: str = 'day', days: int = 7, limit: int = 50) -> list:
+        """最近 days 天依 by（day / session / query_class / model）彙總，依花費由高到低排序"""
+        if by not in ROLLUP_COLUMNS:
+            raise ValueError(f"不支援的彙總欄位：{by}（可用：{', '.join(ROLLUP_COLUMNS)}）")
+        since = (date.today() - timedelta(days=days - 1)).isoformat()
+        order = 'day DESC' if by == 'day' else 'cost_usd DESC'
+        with self._lock:
+            rows = self._conn.execute(f"""
+                SELECT {by}, COUNT(*), SUM(prompt_tokens), SUM(cached_tokens), SUM(tool_tokens),
+                       SUM(output_tokens), SUM(thoughts_tokens), SUM(cost_usd) AS cost_usd
+                FROM requests WHERE day >= ? GROUP BY {by} ORDER BY {order} LIMIT ?
+            """, (since, limit)).fetchall()
+        keys = (by, 'requests', 'prompt_tokens', 'cached_tokens', 'tool_tokens',
+                'output_tokens', 'thoughts_tokens', 'cost_usd')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def budget_status(self, budget: CostBudget) -> dict:
+        """今日花費與上限的比較
+
+        Returns:
+            {'spent_usd', 'cap_usd', 'ratio', 'state'}；state 為 ok / warn（降級）/ exceeded（停止呼叫）
+        """
+        spent = self.spent()
+        if not budget.daily_usd:
+            return {'spent_usd': spent, 'cap_usd': None, 'ratio': None, 'state': 'ok'}
+        ratio = spent / budget.daily_usd
+        state = 'exceeded' if ratio >= 1 else 'warn' if ratio >= budget.warn_ratio else 'ok'
+        return {'spent_usd': spent, 'cap_usd': budget.daily_usd, 'ratio': ratio, 'state': state}
+
+
+def split_prompt_sections(text: str) -> list:
+    """依標題（## / ### …： / 【…】 / 範例）切分提示文字，JSON 表格另列為一段
+
+    Returns:
+        [(段落標題, 段落文字), ...]（第一個標題之前的文字標題為「開頭」）
+    """
+    sections = []
+    starts = [match.start() for match in _SECTION_RE.finditer(text)]
+    bounds = [0] + [start for start in starts if start > 0] + [len(text)]
+    for begin, end in zip(bounds, bounds[1:]):
+        chunk = text[begin:end]
+        if not chunk.strip():
+            continue
+        first_line = chunk.strip().split('\n', 1)[0]
+        title = first_line.strip('#* ') if begin in starts else '開頭'
+        for fence in _FENCE_RE.findall(chunk):
+            sections.append((f"{title}（JSON 表格）", fence))
+            chunk = chunk.replace(fence, '')
+        sections.append((title, chunk))
+    return sections
+
+
+def section_report(sections: list) -> list:
+    """各段落的字數、估計 token 數與佔比（依 token 數由大到小）"""
+    rows = [{'section': name, 'chars': len(text), 'tokens': estimate_tokens(text)} for name, text in sections]
+    total = sum(row['tokens'] for row in rows) or 1
+    for row in rows:
+        row['share'] = row['tokens'] / total
+    return sorted(rows, key=lambda row: row['tokens'], reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gemini token 用量與成本報告')
+    parser.add_argument('--ledger', help='帳本路徑（預設 $FSC_CACHE_DIR/costs.sqlite 或 .cache/costs.sqlite）')
+    parser.add_argument('--by', choices=ROLLUP_COLUMNS, default='day', help='彙總欄位')
+    parser.add_argument('--days', type=int, default=7, help='最近幾天')
+    parser.add_argument('--prompt', action='store_true', help='改為顯示固定提示各段落的 token 佔比')
+    args = parser.parse_args()
+
+    if args.prompt:
+        import logging
+
+        # 非 Streamlit 環境下使用快取函式會產生大量警告（streamlit 的各個 logger 各自設定層級）
+        for name in list(logging.root.manager.loggerDict):
+            if name.startswith('streamlit'):
+                logging.getLogger(name).setLevel(logging.ERROR)
+        import app
+
+        rows = section_report(app.system_instruction_sections())
+        print(f"固定提示約 {sum(row['tokens'] for row in rows):,} tokens")
+        for row in rows:
+            print(f"{row['tokens']:>8,} tokens {row['share']:>6.1%}  {row['chars']:>8,} 字  {row['section']}")
+        return
+
+    ledger_path = Path(args.ledger) if args.ledger else (
+        Path(os.getenv('FSC_CACHE_DIR') or Path(__file__).parent / '.cache') / 'costs.sqlite'
+    )
+    if not ledger_path.exists():
+        parser.error(f"找不到帳本：{ledger_path}")
+
+    ledger = CostLedger(ledger_path)
+    rows = ledger.rollup(args.by, args.days)
+    print(f"{args.by:<20} {'請求':>6} {'輸入':>12} {'快取':>12} {'檢索':>10} {'輸出':>10} {'思考':>10} {'US$':>10}")
+    for row in rows:
+        print(f"{str(row[args.by]):<20} {row['requests']:>6} {row['prompt_tokens']:>12,} {row['cached_tokens']:>12,} "
+              f"{row['tool_tokens']:>10,} {row['output_tokens']:>10,} {row['thoughts_tokens']:>10,} {row['cost_usd']:>10.4f}")
+    print(f"今日花費 US${ledger.spent():.4f}")
+
+
+if __name__ == '__main__':
+    main()
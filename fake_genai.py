@@ -0,0 +1,374 @@
+"""
+離線用的假 Gemini client
+
+提供與 genai.Client 相同的 models / caches 介面，不需要 API Key 也不會產生費用，
+用於本地開發與離線驗證查詢流程（包含 cached content 路徑）。
+另提供 files / file_search_stores / operations 介面（假的 File Search Store），
+供語料同步（corpus_sync.py）在不連線的情況下執行；設定 FSC_FAKE_STORE 時 Store 內容存成 JSON 檔，跨次執行保留。
+
+啟用方式：設定環境變數 FSC_GEMINI_FAKE=1
+"""
+
+from __future__ import annotations
+
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from startup import lazy_module
+
+# google.genai.types 匯入較慢（約 0.4 秒），第一次使用時才匯入
+types = lazy_module('google.genai.types')
+
+# 粗估 token 數（中文約每 1.5 字一個 token）
+CHARS_PER_TOKEN = 1.5
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text or '') / CHARS_PER_TOKEN)
+
+
+class FakeCaches:
+    """假的 caches API（create / get / update / delete）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._items = {}  # name → {'cached_content', 'system_instruction'}
+
+    def create(self, model: str, config=None):
+        ttl = int(str(getattr(config, 'ttl', None) or '3600s').rstrip('s'))
+        name = f"cachedContents/fake-{next(self._counter)}"
+        cached_content = types.CachedContent(
+            name=name,
+            model=model,
+            display_name=getattr(config, 'display_name', None),
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        )
+        instruction = getattr(config, 'system_instruction', None) or ''
+        with self._lock:
+            self._items[name] = {'cached_content': cached_content, 'system_instruction': str(instruction)}
+        return cached_content
+
+    def get(self, name: str, config=None):
+        with self._lock:
+            item = self._items.get(name)
+        if item is None or item['cached_content'].expire_time < datetime.now(timezone.utc):
+            raise ValueError(f"cached content not found: {name}")
+        return item['cached_content']
+
+    def update(self, name: str, config=None):
+        ttl = int(str(getattr(config, 'ttl', None) or '3600s').rstrip('s'))
+        cached_content = self.get(name)
+        cached_content.expire_time = datetime.now(timezone.utc) + timedelta(seconds=ttl)
+        return cached_content
+
+    def delete(self, name: str, config=None):
+        with self._lock:
+            self._items.pop(name, None)
+
+    def system_instruction(self, name: str) -> str:
+        self.get(name)
+        return self._items[name]['system_instruction']
+
+
+class FakeModels:
+    """假的 models API：依查詢內容固定地挑選語料中的文件作為引用來源"""
+
+    def __init__(self, caches: FakeCaches, corpus: list, latency: float = 0.0, sources_per_answer: int = 3):
+        """
+        Args:
+            caches: FakeCaches（用於驗證 cached_content）
+            corpus: [(gemini_file_id, display_name), ...]
+            latency: 每次呼叫的模擬延遲（秒）
+            sources_per_answer: 每個回答引用的文件數
+        """
+        self.caches = caches
+        self.corpus = list(corpus)
+        self.latency = latency
+        self.sources_per_answer = sources_per_answer
+        self.calls = 0
+
+    def _pick(self, contents: str) -> list:
+        if not self.corpus:
+            return []
+        seed = int(hashlib.sha1(contents.encode('utf-8')).hexdigest(), 16)
+        return [self.corpus[(seed + i * 7919) % len(self.corpus)] for i in range(self.sources_per_answer)]
+
+    def _response(self, model: str, contents: str, config) -> types.GenerateContentResponse:
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        cached_tokens = 0
+        instruction = getattr(config, 'system_instruction', None) or ''
+        cached_name = getattr(config, 'cached_content', None)
+        if cached_name:
+            cached_tokens = estimate_tokens(self.caches.system_instruction(cached_name))
+
+        picked = self._pick(str(contents))
+        lines = [f"根據資料庫所查詢到的案件，共找到 {len(picked)} 筆與「{contents}」相關的文件。", ""]
+        for i, (_, display_name) in enumerate(picked, 1):
+            lines += [f"### {i}. {display_name}", f"- **日期**：{display_name[:10]}", ""]
+        text = "\n".join(lines)
+
+        chunks = [
+            types.GroundingChunk(retrieved_context=types.GroundingChunkRetrievedContext(
+                title=gemini_id.replace('files/', ''),
+                text=f"{display_name}\n（離線模擬內容）"
+            ))
+            for gemini_id, display_name in picked
+        ]
+        supports = []
+        offset = len(lines[0].encode('utf-8')) + 2
+        for i, (_, display_name) in enumerate(picked):
+            heading = f"### {i + 1}. {display_name}"
+            supports.append(types.GroundingSupport(
+                grounding_chunk_indices=[i],
+                segment=types.Segment(start_index=offset, end_index=offset + len(heading.encode('utf-8')), text=heading)
+            ))
+            offset += len(heading.encode('utf-8')) + len(f"\n- **日期**：{display_name[:10]}\n\n".encode('utf-8'))
+
+        prompt_tokens = estimate_tokens(str(contents)) + estimate_tokens(str(instruction)) + cached_tokens
+        return types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role='model', parts=[types.Part(text=text)]),
+                grounding_metadata=types.GroundingMetadata(grounding_chunks=chunks, grounding_supports=supports),
+                finish_reason=types.FinishReason.STOP
+            )],
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=prompt_tokens,
+                cached_content_token_count=cached_tokens or None,
+                candidates_token_count=estimate_tokens(text),
+                total_token_count=prompt_tokens + estimate_tokens(text)
+            ),
+            model_version=model
+        )
+
+    def generate_content(self, model: str, contents, config=None):
+        return self._response(model, contents, config)
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        response = self._response(model, contents, config)
+        text = response.text
+        step = 40
+        for start in range(0, len(text), step):
+            last = start + step >= len(text)
+            yield types.GenerateContentResponse(
+                candidates=[types.Candidate(
+                    content=types.Content(role='model', parts=[types.Part(text=text[start:start + step])]),
+                    grounding_metadata=response.candidates[0].grounding_metadata if last else None
+                )],
+                usage_metadata=response.usage_metadata if last else None
+            )
+
+
+def _config_value(config, key: str, default=None):
+    """config 可以是 dict 或 types 物件（與 SDK 相同）"""
+    if config is None:
+        return default
+    if isinstance(config, dict):
+        return config.get(key, default)
+    value = getattr(config, key, None)
+    return default if value is None else value
+
+
+class FakeFiles:
+    """假的 files API（upload / get / delete）：只記錄檔案資訊，不保存內容"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        self._items = {}  # name → types.File
+
+    def upload(self, file, config=None):
+        path = Path(file)
+        data = path.read_bytes()
+        name = f"files/fake{hashlib.sha1(data).hexdigest()[:6]}{next(self._counter):06d}"
+        uploaded = types.File(
+            name=name,
+            display_name=_config_value(config, 'display_name', path.name),
+            mime_type=_config_value(config, 'mime_type', 'text/plain'),
+            size_bytes=len(data),
+            sha256_hash=hashlib.sha256(data).hexdigest()
+        )
+        with self._lock:
+            self._items[name] = uploaded
+        return uploaded
+
+    def get(self, name: str, config=None):
+        with self._lock:
+            uploaded = self._items.get(name)
+        if uploaded is None:
+            raise ValueError(f"file not found: {name}")
+        return uploaded
+
+    def delete(self, name: str, config=None):
+        with self._lock:
+            self._items.pop(name, None)
+
+
+class FakeDocuments:
+    """假的 file_search_stores.documents API（list 分頁、get、delete）"""
+
+    def __init__(self, stores: FakeFileSearchStores):
+        self._stores = stores
+
+    def list(self, parent: str, config=None):
+        """依序產生 Store 中的文件（每頁模擬一次請求延遲，與 SDK 的 Pager 一樣可直接迭代）"""
+        page_size = int(_config_value(config, 'page_size', 20))
+        documents = self._stores.documents_of(parent)
+        for start in range(0, len(documents), page_size):
+            if self._stores.page_latency:
+                time.sleep(self._stores.page_latency)
+            self._stores.page_requests += 1
+            yield from documents[start:start + page_size]
+
+    def get(self, name: str, config=None):
+        document = self._stores.document(name)
+        if document is None:
+            raise ValueError(f"document not found: {name}")
+        return document
+
+    def delete(self, name: str, config=None):
+        self._stores.remove(name)
+
+
+class FakeFileSearchStores:
+    """假的 file_search_stores API（import_file 與 documents）"""
+
+    def __init__(self, files: FakeFiles, operations: FakeOperations, path=None, page_latency: float = 0.0):
+        """
+        Args:
+            files: FakeFiles（import_file 時確認檔案存在）
+            operations: FakeOperations（import_file 返回長時間作業）
+            path: Store 內容的 JSON 檔（None 表示只存在記憶體）
+            page_latency: 列出文件時每頁的模擬延遲（秒）
+        """
+        self._lock = threading.Lock()
+        self._files = files
+        self._operations = operations
+        self.path = Path(path) if path else None
+        self.page_latency = page_latency
+        self.page_requests = 0
+        self._stores = {}  # store 名稱 → {文件名稱: 文件資訊}
+        if self.path is not None and self.path.exists():
+            self._stores = json.loads(self.path.read_text(encoding='utf-8'))
+        self.documents = FakeDocuments(self)
+
+    def _save(self):
+        if self.path is None:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self._stores, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _document(name: str, item: dict):
+        return types.Document(
+            name=name,
+            display_name=item['display_name'],
+            state='STATE_ACTIVE',
+            size_bytes=item.get('size_bytes'),
+            mime_type=item.get('mime_type'),
+            create_time=datetime.fromisoformat(item['create_time']),
+            custom_metadata=[types.CustomMetadata(**metadata) for metadata in item.get('custom_metadata', [])]
+        )
+
+    def documents_of(self, store_name: str) -> list:
+        with self._lock:
+            items = list((self._stores.get(store_name) or {}).items())
+        return [self._document(name, item) for name, item in items]
+
+    def document(self, name: str):
+        store_name = name.split('/documents/')[0]
+        with self._lock:
+            item = (self._stores.get(store_name) or {}).get(name)
+        return self._document(name, item) if item is not None else None
+
+    def remove(self, name: str):
+        store_name = name.split('/documents/')[0]
+        with self._lock:
+            if (self._stores.get(store_name) or {}).pop(name, None) is None:
+                raise ValueError(f"document not found: {name}")
+            self._save()
+
+    def import_file(self, file_search_store_name: str, file_name: str, config=None):
+        uploaded = self._files.get(file_name)
+        custom_metadata = []
+        for metadata in _config_value(config, 'custom_metadata', None) or []:
+            if not isinstance(metadata, dict):
+                metadata = metadata.model_dump(exclude_none=True)
+            custom_metadata.append(metadata)
+
+        document_name = f"{file_search_store_name}/documents/{file_name.split('/')[-1]}"
+        with self._lock:
+            self._stores.setdefault(file_search_store_name, {})[document_name] = {
+                'display_name': uploaded.display_name,
+                'size_bytes': uploaded.size_bytes,
+                'mime_type': uploaded.mime_type,
+                'create_time': datetime.now(timezone.utc).isoformat(),
+                'custom_metadata': custom_metadata
+            }
+            self._save()
+        return self._operations.start(types.ImportFileOperation(
+            name=f"{file_search_store_name}/operations/{file_name.split('/')[-1]}",
+            done=False,
+            response=types.ImportFileResponse(parent=file_search_store_name, document_name=document_name)
+        ))
+
+
+class FakeOperations:
+    """假的 operations API：長時間作業在查詢 polls_until_done 次後完成"""
+
+    def __init__(self, polls_until_done: int = 0):
+        self.polls_until_done = polls_until_done
+        self._lock = threading.Lock()
+        self._polls = {}  # 作業名稱 → 剩餘查詢次數
+
+    def start(self, operation):
+        with self._lock:
+            self._polls[operation.name] = self.polls_until_done
+        if not self.polls_until_done:
+            operation.done = True
+        return operation
+
+    def get(self, operation, config=None):
+        with self._lock:
+            remaining = self._polls.get(operation.name, 0) - 1
+            self._polls[operation.name] = remaining
+        if remaining <= 0:
+            operation = operation.model_copy(update={'done': True})
+        return operation
+
+
+class FakeClient:
+    """假的 genai.Client"""
+
+    def __init__(self, corpus: list = (), latency: float = 0.0, store_path=None):
+        """
+        Args:
+            corpus: 回答引用的語料 [(gemini_file_id, display_name), ...]
+            latency: 每次呼叫的模擬延遲（秒）
+            store_path: 假 File Search Store 的 JSON 檔（None 表示只存在記憶體）
+        """
+        self.caches = FakeCaches()
+        self.models = FakeModels(self.caches, corpus, latency=latency)
+        self.files = FakeFiles()
+        self.operations = FakeOperations()
+        self.file_search_stores = FakeFileSearchStores(self.files, self.operations, path=store_path)
+
+
+def build_corpus(snapshot) -> list:
+    """從映射檔快照建立假 client 使用的語料 [(gemini_file_id, display_name), ...]"""
+    return [
+        (gemini_id, snapshot.file_mapping[doc_id].get('display_name', doc_id))
+        for gemini_id, doc_id in snapshot.gemini_id_mapping.items()
+        if doc_id in snapshot.file_mapping
+    ]
@@ -0,0 +1,594 @@
+"""
+Gemini 傳輸層：錄製 / 重播 / 本地替身伺服器
+
+壓力測試不應消耗 API 配額。init_gemini() 依環境變數 FSC_GEMINI_TRANSPORT 選擇 client：
+  - live（預設）：直接呼叫 Gemini
+  - record：呼叫 Gemini，並將 generate_content 的完整回應（含 grounding_chunks /
+    grounding_supports 與 usage_metadata）與延遲寫入錄製檔
+  - replay：從錄製檔重播，可設定模擬延遲與錯誤注入（429、逾時、沒有引用來源）
+  - server：透過 HTTP 連到本地替身伺服器（python gemini_transport.py serve），
+    多個 app 程序可共用同一份錄製檔與錯誤注入設定
+
+錄製檔為 JSONL（每次呼叫一行），以「模型 + 查詢文字 + metadata filter」作為比對鍵；
+同一查詢錄製多次時輪流重播。找不到錄製的查詢時，依比對鍵固定挑選其他錄製回應
+（strict 模式則回報錯誤），沒有任何錄製時改用離線假回應（fake_genai）。
+
+使用方式：
+    python gemini_transport.py serve --recordings recordings/ --port 8765 --faults 429=0.05
+    python gemini_transport.py inspect recordings/
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import weakref
+from dataclasses import dataclass, field
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from answer_cache import hash_text
+from fake_genai import FakeCaches, FakeModels
+from startup import lazy_module
+
+# google.genai 與 httpx 在建立 client 或重播時才匯入
+errors = lazy_module('google.genai.errors')
+httpx = lazy_module('httpx')
+types = lazy_module('google.genai.types')
+
+TRANSPORTS = ('live', 'record', 'replay', 'server')
+RECORDINGS_FILE = 'recordings.jsonl'
+DEFAULT_RECORDINGS_DIR = 'recordings'
+DEFAULT_SERVER_URL = 'http://127.0.0.1:8765'
+FAULT_KINDS = ('429', 'timeout', 'empty')
+STREAM_CHUNK_CHARS = 40
+
+# 程序內所有重播中的 models（供壓力測試彙整統計）
+_replays = weakref.WeakSet()
+
+
+def request_key(model: str, contents, metadata_filter: str = None) -> str:
+    """錄製/重播的比對鍵"""
+    model = str(model).removeprefix('models/')
+    return hash_text(json.dumps([model, str(contents), metadata_filter or None], ensure_ascii=False))
+
+
+def config_metadata_filter(config):
+    """從 GenerateContentConfig 取出 File Search 的 metadata filter"""
+    for tool in getattr(config, 'tools', None) or []:
+        file_search = getattr(tool, 'file_search', None)
+        if file_search is not None and file_search.metadata_filter:
+            return file_search.metadata_filter
+    return None
+
+
+def dump_response(response) -> dict:
+    """回應轉為 JSON（與 REST API 相同的 camelCase 欄位）"""
+    return response.model_dump(mode='json', by_alias=True, exclude_none=True, exclude={'sdk_http_response'})
+
+
+def load_response(data: dict) -> types.GenerateContentResponse:
+    return types.GenerateContentResponse.model_validate(data)
+
+
+def merge_chunks(chunks: list) -> types.GenerateContentResponse:
+    """將串流的各個 chunk 合併為一個完整回應（grounding 與用量取最後出現的）"""
+    text_parts = []
+    grounding_metadata = None
+    usage_metadata = None
+    finish_reason = None
+    for chunk in chunks:
+        for candidate in chunk.candidates or []:
+            for part in (candidate.content.parts if candidate.content else None) or []:
+                if part.text:
+                    text_parts.append(part.text)
+            grounding_metadata = candidate.grounding_metadata or grounding_metadata
+            finish_reason = candidate.finish_reason or finish_reason
+        usage_metadata = chunk.usage_metadata or usage_metadata
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role='model', parts=[types.Part(text=''.join(text_parts))]),
+            grounding_metadata=grounding_metadata,
+            finish_reason=finish_reason
+        )],
+        usage_metadata=usage_metadata,
+        model_version=chunks[-1].model_version if chunks else None
+    )
+
+
+def split_response(response, step: int = STREAM_CHUNK_CHARS) -> list:
+    """將完整回應切成串流 chunk（grounding 與用量只放在最後一個 chunk，與 Gemini 相同）"""
+    text = response.text or ''
+    candidate = response.candidates[0] if response.candidates else None
+    chunks = []
+    for start in range(0, max(1, len(text)), step):
+        last = start + step >= len(text)
+        chunks.append(types.GenerateContentResponse(
+            candidates=[types.Candidate(
+                content=types.Content(role='model', parts=[types.Part(text=text[start:start + step])]),
+                grounding_metadata=candidate.grounding_metadata if last and candidate else None,
+                finish_reason=candidate.finish_reason if last and candidate else None
+            )],
+            usage_metadata=response.usage_metadata if last else None,
+            model_version=response.model_version
+        ))
+    return chunks
+
+
+def strip_grounding(response) -> types.GenerateContentResponse:
+    """移除引用來源（模擬 File Search 沒有檢索到文件的回應）"""
+    response = response.model_copy(deep=True)
+    for candidate in response.candidates or []:
+        candidate.grounding_metadata = None
+    return response
+
+
+# ========== 錄製 ==========
+
+class Recorder:
+    """將呼叫紀錄附加到錄製檔（執行緒安全）"""
+
+    def __init__(self, directory):
+        self.path = Path(directory) / RECORDINGS_FILE
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, ensure_ascii=False)
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(line + '\n')
+
+
+def load_recordings(directory) -> dict:
+    """讀取錄製檔
+
+    Returns:
+        {比對鍵: [紀錄, ...]}（同一查詢的多次錄製依錄製順序排列）
+    """
+    recordings = {}
+    path = Path(directory) / RECORDINGS_FILE
+    if not path.exists():
+        return recordings
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 錄製中斷時寫到一半的行
+            if record.get('responses'):
+                recordings.setdefault(record['key'], []).append(record)
+    return recordings
+
+
+class RecordingModels:
+    """包裝 genai.Client.models：照常呼叫 Gemini，並錄製每次的完整回應與延遲"""
+
+    def __init__(self, models, recorder: Recorder):
+        self._models = models
+        self._recorder = recorder
+
+    def _record(self, model, contents, config, responses: list, latency: float, first_chunk: float, stream: bool):
+        metadata_filter = config_metadata_filter(config)
+        self._recorder.write({
+            'key': request_key(model, contents, metadata_filter),
+            'model': str(model).removeprefix('models/'),
+            'contents': str(contents),
+            'metadata_filter': metadata_filter,
+            'stream': stream,
+            'latency_seconds': round(latency, 3),
+            'first_chunk_seconds': round(first_chunk, 3),
+            'responses': [dump_response(response) for response in responses],
+            'recorded_at': datetime.now().isoformat(timespec='seconds')
+        })
+
+    def generate_content(self, model: str, contents, config=None):
+        start = time.perf_counter()
+        response = self._models.generate_content(model=model, contents=contents, config=config)
+        latency = time.perf_counter() - start
+        self._record(model, contents, config, [response], latency, latency, stream=False)
+        return response
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        start = time.perf_counter()
+        first_chunk = None
+        chunks = []
+        for chunk in self._models.generate_content_stream(model=model, contents=contents, config=config):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            chunks.append(chunk)
+            yield chunk
+        # 只錄製完整讀完的串流
+        if chunks:
+            self._record(model, contents, config, chunks, time.perf_counter() - start, first_chunk, stream=True)
+
+    def __getattr__(self, name):
+        return getattr(self._models, name)
+
+
+class RecordingClient:
+    """包裝 genai.Client，只錄製 models 的呼叫（caches 等其他 API 直接轉送）"""
+
+    def __init__(self, client, recorder: Recorder):
+        self._client = client
+        self.models = RecordingModels(client.models, recorder)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+# ========== 重播 ==========
+
+def parse_faults(spec: str) -> dict:
+    """解析錯誤注入設定，例如 '429=0.05,timeout=0.02,empty=0.1'"""
+    faults = {}
+    for item in (spec or '').split(','):
+        if not item.strip():
+            continue
+        kind, _, rate = item.partition('=')
+        kind = kind.strip()
+        if kind not in FAULT_KINDS:
+            raise ValueError(f"未知的錯誤類型：{kind}（可用：{', '.join(FAULT_KINDS)}）")
+        faults[kind] = float(rate)
+    if sum(faults.values()) > 1:
+        raise ValueError(f"錯誤注入比例總和超過 1：{spec}")
+    return faults
+
+
+@dataclass
+class ReplayOptions:
+    """重播設定
+
+    latency: 'recorded'（使用錄製時的延遲）、固定秒數（'0.8'）或範圍（'0.5-2.0'）
+    latency_scale: 延遲倍率（例如 0.1 以十分之一的延遲快速重播）
+    faults: 錯誤注入比例 {'429': 0.05, 'timeout': 0.02, 'empty': 0.1}
+    timeout_seconds: 注入逾時前等待的秒數
+    strict: 找不到錄製的查詢時回報錯誤，而不是改用其他錄製回應
+    seed: 延遲與錯誤注入的亂數種子（None 表示不固定）
+    """
+    latency: str = 'recorded'
+    latency_scale: float = 1.0
+    faults: dict = field(default_factory=dict)
+    timeout_seconds: float = 30.0
+    strict: bool = False
+    seed: int = None
+
+    @classmethod
+    def from_env(cls) -> 'ReplayOptions':
+        seed = os.getenv('FSC_REPLAY_SEED')
+        return cls(
+            latency=os.getenv('FSC_REPLAY_LATENCY', 'recorded'),
+            latency_scale=float(os.getenv('FSC_REPLAY_LATENCY_SCALE', '1')),
+            faults=parse_faults(os.getenv('FSC_REPLAY_FAULTS', '')),
+            timeout_seconds=float(os.getenv('FSC_REPLAY_TIMEOUT', '30')),
+            strict=os.getenv('FSC_REPLAY_STRICT') == '1',
+            seed=int(seed) if seed else None
+        )
+
+
+class ReplayModels:
+    """以錄製檔取代 genai.Client.models（含模擬延遲與錯誤注入）"""
+
+    def __init__(self, recordings: dict, options: ReplayOptions = None, fallback: FakeModels = None):
+        """
+        Args:
+            recordings: load_recordings 的結果
+            options: 重播設定
+            fallback: 沒有任何錄製時使用的假 models
+        """
+        self.recordings = recordings
+        self.options = options or ReplayOptions()
+        self.fallback = fallback
+        self._keys = sorted(recordings)
+        self._rng = random.Random(self.options.seed)
+        self._lock = threading.Lock()
+        self._takes = {}  # 比對鍵 → 下次重播第幾次錄製
+        self._stats = {'calls': 0, 'hits': 0, 'misses': 0, 'synthetic': 0,
+                       'fault_429': 0, 'fault_timeout': 0, 'fault_empty': 0}
+        _replays.add(self)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def _lookup(self, key: str):
+        """取得要重播的錄製紀錄，沒有任何錄製時返回 None"""
+        if key in self.recordings:
+            self._count('hits')
+        elif self.options.strict:
+            raise LookupError(f"沒有錄製的回應（比對鍵 {key}）")
+        elif self._keys:
+            self._count('misses')
+            key = self._keys[int(key, 16) % len(self._keys)]
+        else:
+            self._count('synthetic')
+            return None
+
+        takes = self.recordings[key]
+        with self._lock:
+            take = self._takes.get(key, 0)
+            self._takes[key] = take + 1
+        return takes[take % len(takes)]
+
+    def _pick_fault(self):
+        if not self.options.faults:
+            return None
+        draw = self._random()
+        for kind in FAULT_KINDS:
+            rate = self.options.faults.get(kind, 0)
+            if draw < rate:
+                self._count(f'fault_{kind}')
+                return kind
+            draw -= rate
+        return None
+
+    def _raise_fault(self, kind: str):
+        if kind == '429':
+            raise errors.ClientError(429, {'error': {
+                'code': 429,
+                'message': 'Resource has been exhausted (e.g. check quota).',
+                'status': 'RESOURCE_EXHAUSTED'
+            }})
+        if kind == 'timeout':
+            time.sleep(self.options.timeout_seconds)
+            raise httpx.ReadTimeout('The read operation timed out (replay)')
+
+    def _latency(self, record) -> tuple:
+        """(總延遲, 第一個 chunk 前的延遲)，單位為秒"""
+        recorded = record['latency_seconds'] if record else 0.0
+        first_ratio = (record['first_chunk_seconds'] / recorded) if record and recorded else 0.25
+
+        latency = self.options.latency
+        if latency == 'recorded':
+            total = recorded
+        elif '-' in latency:
+            low, high = (float(v) for v in latency.split('-', 1))
+            with self._lock:
+                total = self._rng.uniform(low, high)
+        else:
+            total = float(latency)
+
+        total *= self.options.latency_scale
+        return total, total * first_ratio
+
+    def _responses(self, model: str, contents, config) -> tuple:
+        """(回應列表, 錄製紀錄或 None)"""
+        self._count('calls')
+        fault = self._pick_fault()
+        if fault in ('429', 'timeout'):
+            self._raise_fault(fault)
+
+        record = self._lookup(request_key(model, contents, config_metadata_filter(config)))
+        if record is None:
+            if self.fallback is None:
+                raise LookupError("沒有任何錄製的回應")
+            responses = [self.fallback.generate_content(model=model, contents=contents, config=config)]
+        else:
+            responses = [load_response(data) for data in record['responses']]
+
+        if fault == 'empty':
+            responses = [strip_grounding(response) for response in responses]
+        return responses, record
+
+    def generate_content(self, model: str, contents, config=None):
+        responses, record = self._responses(model, contents, config)
+        total, _ = self._latency(record)
+        if total:
+            time.sleep(total)
+        return responses[0] if len(responses) == 1 else merge_chunks(responses)
+
+    def generate_content_stream(self, model: str, contents, config=None):
+        responses, record = self._responses(model, contents, config)
+        chunks = responses if len(responses) > 1 else split_response(responses[0])
+        total, first = self._latency(record)
+        interval = (total - first) / max(1, len(chunks) - 1)
+
+        for i, chunk in enumerate(chunks):
+            delay = first if i == 0 else interval
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, 'recorded_queries': len(self._keys)}
+
+
+def replay_stats() -> dict:
+    """程序內所有重播 models 的統計合計（沒有使用重播時返回空字典）"""
+    total = {}
+    for models in list(_replays):
+        for name, value in models.stats().items():
+            total[name] = total.get(name, 0) + value
+    return total
+
+
+class ReplayClient:
+    """以錄製檔取代 genai.Client（caches 使用離線的假實作）"""
+
+    def __init__(self, recordings_dir, options: ReplayOptions = None, corpus: list = ()):
+        self.caches = FakeCaches()
+        self.models = ReplayModels(
+            load_recordings(recordings_dir),
+            options,
+            fallback=FakeModels(self.caches, corpus)
+        )
+
+
+# ========== 本地替身伺服器 ==========
+
+_MODEL_PATH_RE = re.compile(r'/[^/]+/models/([^:/]+):(generateContent|streamGenerateContent)')
+
+
+def request_text(body: dict) -> str:
+    """REST 請求中的查詢文字（對應 contents 為單一字串的呼叫）"""
+    return ''.join(
+        part.get('text', '')
+        for content in body.get('contents') or []
+        for part in content.get('parts') or []
+    )
+
+
+def request_config(body: dict):
+    """由 REST 請求還原比對與假回應需要的設定（metadata filter、system instruction）"""
+    metadata_filter = None
+    for tool in body.get('tools') or []:
+        metadata_filter = (tool.get('fileSearch') or {}).get('metadataFilter') or metadata_filter
+    system_instruction = request_text({'contents': [body['systemInstruction']]}) if body.get('systemInstruction') else None
+    return types.GenerateContentConfig(
+        system_instruction=system_instruction,
+        tools=[types.Tool(file_search=types.FileSearch(metadata_filter=metadata_filter))] if metadata_filter else None
+    )
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    server_version = 'FscGeminiStandIn/1.0'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int, message: str, status_text: str):
+        self._send_json(status, {'error': {'code': status, 'message': message, 'status': status_text}})
+
+    def do_GET(self):
+        self._send_error(404, f"不支援的路徑：{self.path}", 'NOT_FOUND')
+
+    def do_POST(self):
+        match = _MODEL_PATH_RE.fullmatch(self.path.partition('?')[0])
+        if not match:
+            # 僅支援 generateContent；cachedContents 等請求回 404，app 會改用內嵌指令
+            self._send_error(404, f"不支援的路徑：{self.path}", 'NOT_FOUND')
+            return
+
+        model, method = match.groups()
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        contents = request_text(body)
+        config = request_config(body)
+        models = self.server.models
+
+        try:
+            if method == 'generateContent':
+                response = models.generate_content(model=model, contents=contents, config=config)
+                self._send_json(200, dump_response(response))
+                return
+
+            stream = models.generate_content_stream(model=model, contents=contents, config=config)
+            first_chunk = next(stream, None)  # 錯誤在送出標頭前發生，才能回應錯誤狀態碼
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.end_headers()
+            for chunk in itertools.chain([first_chunk] if first_chunk is not None else [], stream):
+                self.wfile.write(f"data: {json.dumps(dump_response(chunk), ensure_ascii=False)}\r\n\r\n".encode('utf-8'))
+                self.wfile.flush()
+        except errors.APIError as e:
+            self._send_json(e.code, e.details)
+        except httpx.TimeoutException:
+            self._send_error(504, 'Deadline exceeded (replay)', 'DEADLINE_EXCEEDED')
+        except LookupError as e:
+            self._send_error(404, str(e), 'NOT_FOUND')
+
+
+def make_server(recordings_dir, host: str = '127.0.0.1', port: int = 8765,
+                options: ReplayOptions = None, corpus: list = ()) -> ThreadingHTTPServer:
+    """建立本地替身伺服器（以 genai.Client 的 http_options.base_url 指向此伺服器）"""
+    server = ThreadingHTTPServer((host, port), _StandInHandler)
+    server.daemon_threads = True
+    server.models = ReplayModels(
+        load_recordings(recordings_dir),
+        options,
+        fallback=FakeModels(FakeCaches(), corpus)
+    )
+    return server
+
+
+def inspect_recordings(directory) -> dict:
+    """錄製檔摘要"""
+    recordings = load_recordings(directory)
+    records = [record for takes in recordings.values() for record in takes]
+    latencies = sorted(record['latency_seconds'] for record in records)
+    grounded = sum(
+        1 for record in records
+        if any(candidate.get('groundingMetadata', {}).get('groundingChunks')
+               for response in record['responses'] for candidate in response.get('candidates', []))
+    )
+    summary = {
+        'records': len(records),
+        'queries': len(recordings),
+        'stream': sum(1 for record in records if record.get('stream')),
+        'grounded': grounded,
+        'models': sorted({record.get('model') for record in records})
+    }
+    if latencies:
+        summary['latency_p50'] = latencies[len(latencies) // 2]
+        summary['latency_p95'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gemini 錄製檔重播伺服器')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serve = subparsers.add_parser('serve', help='以錄製檔啟動本地替身伺服器')
+    serve.add_argument('--recordings', default=DEFAULT_RECORDINGS_DIR, help='錄製檔目錄')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('--latency', default='recorded', help="'recorded'、固定秒數或範圍（例如 0.5-2.0）")
+    serve.add_argument('--latency-scale', type=float, default=1.0, help='延遲倍率')
+    serve.add_argument('--faults', default='', help='錯誤注入比例，例如 429=0.05,timeout=0.02,empty=0.1')
+    serve.add_argument('--timeout', type=float, default=30.0, help='注入逾時前等待的秒數')
+    serve.add_argument('--strict', action='store_true', help='找不到錄製的查詢時回報錯誤')
+    serve.add_argument('--seed', type=int, help='亂數種子')
+
+    inspect = subparsers.add_parser('inspect', help='顯示錄製檔摘要')
+    inspect.add_argument('recordings', nargs='?', default=DEFAULT_RECORDINGS_DIR)
+
+    args = parser.parse_args()
+
+    if args.command == 'inspect':
+        print(json.dumps(inspect_recordings(args.recordings), ensure_ascii=False, indent=2))
+        return
+
+    from fake_genai import build_corpus
+    from metadata_registry import MetadataRegistry
+
+    options = ReplayOptions(
+        latency=args.latency,
+        latency_scale=args.latency_scale,
+        faults=parse_faults(args.faults),
+        timeout_seconds=args.timeout,
+        strict=args.strict,
+        seed=args.seed
+    )
+    snapshot = MetadataRegistry(Path(__file__).parent / 'data').snapshot()
+    server = make_server(args.recordings, args.host, args.port, options, build_corpus(snapshot))
+    print(f"🎬 替身伺服器：http://{args.host}:{args.port}（錄製查詢 {server.models.stats()['recorded_queries']} 筆）")
+    print(f"   app 端設定 FSC_GEMINI_TRANSPORT=server FSC_GEMINI_BASE_URL=http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📋 {json.dumps(server.models.stats(), ensure_ascii=False)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""
+grounding_metadata 單次解析與引用區間
+
+Gemini 回應的 grounding_metadata 包含：
+  - grounding_chunks：檢索到的文件片段（title 為 Gemini 檔案 ID，text 為片段內容）
+  - grounding_supports：回答中的一段文字（segment，以 UTF-8 位元組計算的起訖位置）與其引用的 chunk 索引
+
+這裡一次走訪 supports，每個 chunk 只解析一次，依文件（檔名）合併為 SourceRef，
+並保留每段引用在回答文字中的字元區間。案件標題（### N.）可依所在段落實際引用的文件加入連結，
+不必依日期順序猜測。
+"""
+
+from bisect import bisect_left
+
+from answer_stream import CASE_HEADING_RE
+
+
+class SourceRef:
+    """一份被引用的文件（同一文件的多個 chunk 合併）"""
+
+    __slots__ = ('filename', 'snippet', 'chunk_indices', 'spans')
+
+    def __init__(self, filename: str, snippet: str):
+        self.filename = filename
+        self.snippet = snippet      # 第一個 chunk 的內容片段
+        self.chunk_indices = []     # 引用到的 chunk 索引
+        self.spans = []             # 引用此文件的回答區間 [(起, 訖), ...]（字元位置，依起點排序）
+
+    def to_dict(self) -> dict:
+        """查詢結果中的來源格式（可序列化，供答案快取與批次輸出使用）"""
+        return {
+            'filename': self.filename,
+            'snippet': self.snippet,
+            'spans': [list(span) for span in self.spans]
+        }
+
+
+class _OffsetMap:
+    """UTF-8 位元組位置 → 字元位置
+
+    supports 大致依位置排序，因此從上一次的位置往後解碼即可（往前時從頭開始），
+    不必為整段回答建立逐字對照表。
+    """
+
+    __slots__ = ('_encoded', '_byte_cursor', '_char_cursor')
+
+    def __init__(self, text: str):
+        self._encoded = text.encode('utf-8')
+        self._byte_cursor = 0
+        self._char_cursor = 0
+
+    def char_offset(self, byte_offset: int) -> int:
+        byte_offset = max(0, min(byte_offset, len(self._encoded)))
+        if byte_offset < self._byte_cursor:
+            self._byte_cursor = self._char_cursor = 0
+        chars = self._char_cursor + len(self._encoded[self._byte_cursor:byte_offset].decode('utf-8', 'ignore'))
+        # 只在字元邊界上移動游標（位置落在多位元組字元中間時，該字元不計入）
+        if byte_offset == len(self._encoded) or (self._encoded[byte_offset] & 0xC0) != 0x80:
+            self._byte_cursor, self._char_cursor = byte_offset, chars
+        return chars
+
+
+def _chunk_source(chunk, normalize):
+    """由 grounding chunk 建立 SourceRef，沒有 retrieved_context 時返回 None"""
+    context = getattr(chunk, 'retrieved_context', None)
+    if context is None:
+        return None
+
+    # 提取文件 ID/名稱
+    filename = "未知文件"
+    if getattr(context, 'title', None):
+        filename = context.title
+    elif getattr(context, 'uri', None):
+        filename = context.uri.split('/')[-1]
+
+    # 提取內容片段
+    text = getattr(context, 'text', None)
+    return SourceRef(filename, normalize(text) if text else "")
+
+
+def _segment_span(segment, text: str, offsets: _OffsetMap):
+    """support 的 segment 在回答文字中的字元區間，無法對應時返回 None
+
+    segment 的起訖以位元組計算；換算後內容與 segment.text 不一致時（例如回答經過重組），
+    改以 segment.text 在回答中搜尋。
+    """
+    if segment is None or text is None:
+        return None
+    segment_text = getattr(segment, 'text', None)
+    end_index = getattr(segment, 'end_index', None)
+    if end_index is not None:
+        start = offsets.char_offset(getattr(segment, 'start_index', None) or 0)
+        end = offsets.char_offset(end_index)
+        if start < end and (not segment_text or text[start:end] == segment_text):
+            return start, end
+    if segment_text:
+        start = text.find(segment_text)
+        if start >= 0:
+            return start, start + len(segment_text)
+    return None
+
+
+def extract_grounding(response, text: str = None, normalize=lambda snippet: snippet) -> tuple:
+    """從回應的 grounding_metadata 提取引用文件
+
+    Args:
+        response: Gemini 回應（串流模式為含 grounding_metadata 的最後一個 chunk）
+        text: 完整回答文字（用於換算引用區間；None 表示使用 response.text）
+        normalize: 片段內容的清理函式（每個 chunk 只呼叫一次）
+
+    Returns:
+        (sources, debug_info)：sources 為 [SourceRef]，依第一次被引用的順序；
+        沒有 grounding_supports 時改用所有 grounding_chunks（沒有引用區間）
+    """
+    # 診斷資訊（用於排查 sources 提取失敗）
+    debug_info = {
+        'has_candidates': False,
+        'has_grounding_metadata': False,
+        'has_grounding_supports': False,
+        'has_grounding_chunks': False,
+        'grounding_supports_count': 0,
+        'grounding_chunks_count': 0
+    }
+
+    candidates = getattr(response, 'candidates', None)
+    if not candidates:
+        return [], debug_info
+    debug_info['has_candidates'] = True
+
+    metadata = getattr(candidates[0], 'grounding_metadata', None)
+    if not metadata:
+        return [], debug_info
+    debug_info['has_grounding_metadata'] = True
+
+    chunks = getattr(metadata, 'grounding_chunks', None) or []
+    supports = getattr(metadata, 'grounding_supports', None) or []
+    debug_info.update({
+        'has_grounding_supports': bool(supports),
+        'has_grounding_chunks': bool(chunks),
+        'grounding_supports_count': len(supports),
+        'grounding_chunks_count': len(chunks)
+    })
+
+    by_chunk = {}     # chunk 索引 → SourceRef（None 表示該 chunk 沒有檔案內容）
+    by_filename = {}  # 檔名 → SourceRef
+    sources = []
+
+    def resolve(chunk_idx: int):
+        if chunk_idx in by_chunk:
+            return by_chunk[chunk_idx]
+        source = _chunk_source(chunks[chunk_idx], normalize) if 0 <= chunk_idx < len(chunks) else None
+        if source is not None:
+            existing = by_filename.get(source.filename)
+            if existing is None:
+                by_filename[source.filename] = source
+                sources.append(source)
+            else:
+                source = existing
+            source.chunk_indices.append(chunk_idx)
+        by_chunk[chunk_idx] = source
+        return source
+
+    if text is None and supports:
+        text = getattr(response, 'text', None)
+    offsets = _OffsetMap(text) if text and supports else None
+
+    # 優先從 grounding_supports 提取（包含引用區間）
+    for support in supports:
+        span = _segment_span(getattr(support, 'segment', None), text, offsets) if offsets else None
+        for chunk_idx in getattr(support, 'grounding_chunk_indices', None) or []:
+            source = resolve(chunk_idx)
+            # 同一 support 引用同一文件的多個 chunk 時只記錄一次
+            if source is not None and span is not None and (not source.spans or source.spans[-1] != span):
+                source.spans.append(span)
+
+    # 如果沒有 grounding_supports，回退到 grounding_chunks
+    if not sources:
+        for chunk_idx in range(len(chunks)):
+            resolve(chunk_idx)
+
+    for source in sources:
+        source.spans.sort()
+    return sources, debug_info
+
+
+def heading_citations(text: str, sources: list) -> list:
+    """每個案件標題（### N.）所在段落第一個引用的來源
+
+    段落為標題到下一個標題之前的文字；取起點落在段落內、位置最前面的引用區間
+    （同一區間引用多個來源時取排在前面的來源）。
+
+    Args:
+        text: 回答文字（與引用區間使用同一份文字）
+        sources: 查詢結果的來源（dict，含 spans）
+
+    Returns:
+        依標題順序的來源索引列表，段落中沒有引用區間的標題為 None
+    """
+    text = text or ''
+    spans = sorted(
+        (span[0], idx)
+        for idx, source in enumerate(sources)
+        for span in source.get('spans') or ()
+    )
+    span_starts = [start for start, _ in spans]
+
+    headings = [match.start() for match in CASE_HEADING_RE.finditer(text)]
+    bounds = headings + [len(text)]
+    cited = []
+    for start, end in zip(bounds, bounds[1:]):
+        position = bisect_left(span_starts, start)
+        cited.append(spans[position][1] if position < len(spans) and span_starts[position] < end else None)
+    return cited
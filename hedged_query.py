@@ -0,0 +1,296 @@
+"""
+對沖（hedged）查詢
+
+原本第一次查詢沒有引用來源時，才「再查一次」，最差延遲是兩倍。
+這裡改為：第一個請求超過近期延遲的某個百分位數仍未完成時，就同時送出第二個請求；
+先取得有引用來源（grounded）結果的請求勝出，其餘請求的結果直接忽略。
+
+第一個請求若已完成但沒有引用來源，會立即送出下一個請求（等同原本的重試）。
+
+串流模式（run_stream）：串流請求在背景執行緒執行，文字傳回呼叫端的執行緒顯示；
+超過對沖等待時間（依近期「第一段文字」的延遲）仍沒有文字時，同時送出非串流的備援請求，
+串流結束但沒有引用來源時也立即送出（或等待已送出的）備援請求，不再等串流結束後才重試。
+串流已開始顯示文字後，備援請求只作為串流沒有引用來源時的結果，不會中途取代已顯示的回答。
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class LatencyTracker:
+    """最近 N 次請求的延遲，用於計算對沖等待時間"""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, p: float) -> float:
+        """第 p 百分位數（p 介於 0 到 1），沒有樣本時返回 None"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, max(0, int(round(p * (len(samples) - 1)))))
+        return samples[index]
+
+
+class _StreamAbandoned(Exception):
+    """備援請求勝出後，停止轉送串流的文字"""
+
+
+class HedgedExecutor:
+    """以對沖方式執行查詢，並統計對沖勝出的次數"""
+
+    def __init__(self, max_attempts: int = 2, hedge_percentile: float = 0.9,
+                 default_delay: float = 8.0, min_delay: float = 2.0, max_delay: float = 20.0,
+                 min_samples: int = 20, max_workers: int = 16):
+        """
+        Args:
+            max_attempts: 每個查詢最多同時/先後送出的請求數
+            hedge_percentile: 以近期延遲的哪個百分位數作為對沖等待時間
+            default_delay: 樣本不足時的對沖等待時間（秒）
+            min_delay: 對沖等待時間下限（秒）
+            max_delay: 對沖等待時間上限（秒）
+            min_samples: 開始使用百分位數前需要的樣本數
+            max_workers: 執行緒池大小（所有 session 共用）
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.hedge_percentile = hedge_percentile
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+
+        self.latency = LatencyTracker()
+        self.first_text_latency = LatencyTracker()  # 串流請求收到第一段文字的延遲
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedged-query')
+        self._lock = threading.Lock()
+        self._stats = {
+            'runs': 0,
+            'attempts': 0,
+            'hedges_launched': 0,   # 因逾時而提前送出的請求
+            'retries_launched': 0,  # 因前一個請求沒有引用來源而送出的請求
+            'primary_wins': 0,
+            'hedge_wins': 0,
+            'ungrounded': 0         # 所有請求都沒有引用來源
+        }
+
+    def hedge_delay(self) -> float:
+        """目前的對沖等待時間（秒）"""
+        if len(self.latency) < self.min_samples:
+            return self.default_delay
+        delay = self.latency.percentile(self.hedge_percentile)
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def stream_delay(self) -> float:
+        """串流請求的對沖等待時間（秒，依第一段文字的延遲）"""
+        if len(self.first_text_latency) < self.min_samples:
+            return self.default_delay
+        delay = self.first_text_latency.percentile(self.hedge_percentile)
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def _timed(self, fn):
+        start = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - start
+
+    def _record_latency(self, future):
+        if not future.cancelled() and future.exception() is None:
+            self.latency.record(future.result()[1])
+
+    def run(self, fn, is_grounded) -> tuple:
+        """執行查詢
+
+        Args:
+            fn: 不帶參數的查詢函式（例如 lambda: query_penalties(...)）
+            is_grounded: 判斷結果是否可直接採用的函式
+
+        Returns:
+            (結果, 執行資訊)；執行資訊包含 attempts、hedged、winner（勝出請求的序號，從 1 起算）
+        """
+        self._count('runs')
+        delay = self.hedge_delay()
+        pending = {}
+        fallback = None
+        attempts = 0
+        hedged = False
+
+        def launch():
+            nonlocal attempts
+            attempts += 1
+            self._count('attempts')
+            future = self._pool.submit(self._timed, fn)
+            future.add_done_callback(self._record_latency)  # 被忽略的請求也計入延遲統計
+            pending[future] = attempts
+
+        launch()
+        next_hedge = time.monotonic() + delay
+
+        while pending:
+            timeout = None
+            if attempts < self.max_attempts:
+                timeout = max(0.0, next_hedge - time.monotonic())
+
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # 逾時仍未完成：送出對沖請求
+                hedged = True
+                self._count('hedges_launched')
+                launch()
+                next_hedge = time.monotonic() + delay
+                continue
+
+            for future in done:
+                attempt = pending.pop(future)
+                result, _ = future.result()
+
+                if is_grounded(result):
+                    for other in pending:
+                        other.cancel()  # 尚未開始的請求直接取消，已開始的結果忽略
+                    self._count('primary_wins' if attempt == 1 else 'hedge_wins')
+                    return result, {'attempts': attempts, 'hedged': hedged, 'winner': attempt}
+
+                # 沒有引用來源：保留作為備用結果（優先保留成功的結果）
+                if fallback is None or (not fallback.get('success') and result.get('success')):
+                    fallback = result
+
+            if not pending and attempts < self.max_attempts:
+                self._count('retries_launched')
+                launch()
+                next_hedge = time.monotonic() + delay
+
+        self._count('ungrounded')
+        return fallback, {'attempts': attempts, 'hedged': hedged, 'winner': None}
+
+    def run_stream(self, stream_fn, backup_fn, is_grounded, on_event, on_retry=None) -> tuple:
+        """以串流請求為主、非串流請求為備援執行查詢
+
+        Args:
+            stream_fn: stream_fn(emit) 在背景執行緒執行串流請求，每個事件以 emit(事件) 傳回，返回最後的結果
+            backup_fn: 不帶參數的非串流查詢函式
+            is_grounded: 判斷結果是否可直接採用的函式
+            on_event: 在呼叫端的執行緒處理串流事件（例如顯示文字），事件為 dict，文字事件的 type 為 text
+            on_retry: 串流沒有引用來源、送出備援請求時呼叫（例如顯示「正在重新查詢」）
+
+        Returns:
+            (結果, 執行資訊)；執行資訊包含 attempts、hedged、winner（1 為串流、2 為備援，都沒有引用來源時為 None）
+            與 streamed（返回的結果是否為串流請求的結果）
+        """
+        self._count('runs')
+        delay = self.stream_delay()
+        start = time.monotonic()
+        events = queue.Queue()
+        abandoned = threading.Event()
+
+        def emit(event):
+            if abandoned.is_set():
+                raise _StreamAbandoned()
+            events.put(('event', event))
+
+        def outcome(future, timed: bool):
+            if future.cancelled():
+                return None
+            error = future.exception()
+            if error is not None:
+                return {'success': False, 'error': f"{type(error).__name__}: {error}"}
+            result = future.result()[0] if timed else future.result()
+            return result if result is not None else {'success': False, 'error': "查詢沒有產生結果"}
+
+        self._count('attempts')
+        attempts = 1
+        stream = self._pool.submit(stream_fn, emit)
+        stream.add_done_callback(lambda future: events.put(('stream_done', future)))
+
+        backup = None
+        hedged = False
+        first_text = False
+        stream_result = backup_result = None
+
+        def launch_backup():
+            nonlocal backup, attempts
+            attempts += 1
+            self._count('attempts')
+            backup = self._pool.submit(self._timed, backup_fn)
+            backup.add_done_callback(self._record_latency)
+            backup.add_done_callback(lambda future: events.put(('backup_done', future)))
+
+        def info(winner, result):
+            return {'attempts': attempts, 'hedged': hedged, 'winner': winner, 'streamed': result is stream_result}
+
+        try:
+            while True:
+                timeout = None
+                if backup is None and not first_text and self.max_attempts > 1:
+                    timeout = max(0.0, start + delay - time.monotonic())
+                try:
+                    kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # 超過對沖等待時間仍沒有文字：送出備援請求
+                    hedged = True
+                    self._count('hedges_launched')
+                    launch_backup()
+                    continue
+
+                if kind == 'event':
+                    if payload.get('type') == 'text' and not first_text:
+                        first_text = True
+                        self.first_text_latency.record(time.monotonic() - start)
+                    on_event(payload)
+                elif kind == 'stream_done':
+                    stream_result = outcome(payload, timed=False)
+                    if is_grounded(stream_result):
+                        if backup is not None:
+                            backup.cancel()
+                        self._count('primary_wins')
+                        return stream_result, info(1, stream_result)
+                    if backup is None and self.max_attempts > 1:
+                        self._count('retries_launched')
+                        if on_retry is not None:
+                            on_retry()
+                        launch_backup()
+                else:  # backup_done
+                    backup_result = outcome(payload, timed=True)
+                    if is_grounded(backup_result) and not first_text:
+                        self._count('hedge_wins')
+                        return backup_result, info(2, backup_result)
+
+                # 串流已結束（沒有引用來源）：等待備援請求完成
+                if stream_result is not None and (backup is None or backup_result is not None):
+                    if backup_result is not None and is_grounded(backup_result):
+                        self._count('hedge_wins')
+                        return backup_result, info(2, backup_result)
+                    break
+        finally:
+            abandoned.set()  # 備援勝出或呼叫端中斷時，串流不再轉送文字
+
+        # 都沒有引用來源：優先使用成功的結果（串流的回答已經顯示，相同時以串流為準）
+        self._count('ungrounded')
+        result = stream_result
+        if not stream_result.get('success') and backup_result is not None and backup_result.get('success'):
+            result = backup_result
+        return result, info(None, result)
+
+    def stats(self) -> dict:
+        """對沖統計"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['hedge_delay'] = self.hedge_delay()
+        stats['stream_delay'] = self.stream_delay()
+        stats['latency_p50'] = self.latency.percentile(0.5)
+        stats['latency_p95'] = self.latency.percentile(0.95)
+        return stats
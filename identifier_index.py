@@ -0,0 +1,243 @@
+"""
+識別碼快速查詢（發文字號、法規名稱、文件名稱的本地倒排索引）
+
+使用者常直接貼上發文字號（「金管保壽字第11404942301號」）或法規名稱（「保險業設立遷移或裁撤分支機構管理辦法」），
+這類查詢不需要 Gemini 理解，只需要找到對應的文件。這裡以映射檔的 document_number、announcement_number、
+law_name、display_name 與文件 ID 建立字元 n-gram 倒排索引（中文沒有空白分詞，以相鄰三字為詞；
+發文字號的數字部分若以兩字為詞只有 100 種組合，幾乎每個字號都會成為候選）：
+  - 查詢包含識別碼：每個識別碼只登記在它最少見的 n-gram 下（錨點），依查詢的 n-gram 取出候選後確認是否為子字串，
+    候選很少，查詢耗時在微秒等級
+  - 查詢是識別碼的一部分（例如只貼上字號的數字）：依文件數由少到多交集各 n-gram 的倒排清單，再確認子字串
+  - 重疊的比對結果只保留最長者（「保險法施行細則」不會另外比對到「保險法」）
+
+查詢幾乎只有識別碼時直接列出文件（不呼叫 Gemini）；查詢另有其他內容時先列出文件，再照常由 Gemini 回答。
+"""
+
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+
+from analytics import TYPE_LABELS
+from metadata_filter import doc_date_value, doc_metadata, iter_known_docs, parse_filters
+
+# 建立索引的欄位（依顯示優先順序）
+IDENTIFIER_FIELDS = ('document_number', 'announcement_number', 'law_name', 'display_name', 'doc_id')
+
+# 欄位的中文名稱
+FIELD_LABELS = {
+    'document_number': '發文字號',
+    'announcement_number': '發文字號',
+    'law_name': '法規名稱',
+    'display_name': '文件名稱',
+    'doc_id': '文件 ID',
+}
+
+# n-gram 長度
+NGRAM = 3
+
+# 正規化後少於此長度的識別碼不建立索引（最短的法規名稱如「銀行法」為 3 字）
+MIN_IDENTIFIER_LENGTH = NGRAM
+
+# 查詢是識別碼的一部分時，查詢至少需要的長度（太短的片段會比對到大量文件）
+MIN_PARTIAL_LENGTH = 8
+
+# 正規化時移除的空白與標點（使用者貼上的字號常帶有引號、書名號或全形括號）
+_STRIP_RE = re.compile(r'[\s「」『』《》〈〉“”"\'‘’()（）【】\[\]、，,。：:；;？?！!]')
+
+
+def normalize(text: str) -> str:
+    """比對用的正規化：全形轉半形、英文小寫、「台」統一為「臺」、移除空白與標點"""
+    text = unicodedata.normalize('NFKC', text or '').lower().replace('台', '臺')
+    return _STRIP_RE.sub('', text)
+
+
+def ngrams(text: str, n: int = NGRAM) -> set:
+    """相鄰 n 字的集合（正規化後的文字）"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+@dataclass(frozen=True)
+class IdentifierMatch:
+    """查詢中比對到的一個識別碼"""
+    label: str          # 映射檔中的原始文字
+    field: str          # 欄位名稱（IDENTIFIER_FIELDS）
+    doc_ids: tuple
+    start: int          # 在正規化查詢中的位置
+    end: int
+    partial: bool = False  # 查詢只是識別碼的一部分
+
+
+@dataclass(frozen=True)
+class IdentifierLookup:
+    """一次查詢的比對結果"""
+    matches: tuple
+    query_length: int   # 正規化後的查詢長度
+    seconds: float
+
+    def __bool__(self):
+        return bool(self.matches)
+
+    @property
+    def coverage(self) -> float:
+        """識別碼佔查詢的比例（1 表示查詢只有識別碼）"""
+        if not self.query_length:
+            return 0.0
+        return sum(match.end - match.start for match in self.matches) / self.query_length
+
+    def doc_ids(self) -> list:
+        """比對到的文件（依比對結果順序，不重複）"""
+        return list(dict.fromkeys(doc_id for match in self.matches for doc_id in match.doc_ids))
+
+
+class IdentifierIndex:
+    """識別碼倒排索引（依語料版本建立，建立後不再變動，可跨執行緒共用）"""
+
+    def __init__(self, docs: dict):
+        """
+        Args:
+            docs: {doc_id: 文件資訊}（映射檔中的所有文件）
+        """
+        self._values = []   # 識別碼 ID → 正規化後的文字
+        self._labels = []   # 識別碼 ID → 原始文字（第一次出現的）
+        self._fields = []   # 識別碼 ID → 欄位名稱
+        self._docs = []     # 識別碼 ID → [doc_id, ...]
+        self._records = {}  # doc_id → 顯示與篩選用的資訊
+        value_ids = {}
+
+        for doc_id, info in docs.items():
+            self._records[doc_id] = self._record(doc_id, info)
+            for field in IDENTIFIER_FIELDS:
+                label = doc_id if field == 'doc_id' else info.get(field)
+                value = normalize(label)
+                if len(value) < MIN_IDENTIFIER_LENGTH:
+                    continue
+                value_id = value_ids.get(value)
+                if value_id is None:
+                    value_id = value_ids[value] = len(self._values)
+                    self._values.append(value)
+                    self._labels.append(label)
+                    self._fields.append(field)
+                    self._docs.append([])
+                if doc_id not in self._docs[value_id][-1:]:
+                    self._docs[value_id].append(doc_id)
+
+        # 完整倒排清單：n-gram → 含有該 n-gram 的識別碼（查詢是識別碼的一部分時交集使用）
+        value_grams = [ngrams(value) for value in self._values]
+        postings = {}
+        for value_id, grams in enumerate(value_grams):
+            for gram in grams:
+                postings.setdefault(gram, []).append(value_id)
+        self._postings = {gram: frozenset(value_ids) for gram, value_ids in postings.items()}
+
+        # 錨點：每個識別碼只登記在它最少見的 n-gram 下（查詢包含識別碼時的候選）
+        sizes = {gram: len(value_ids) for gram, value_ids in postings.items()}
+        anchors = {}
+        for value_id, grams in enumerate(value_grams):
+            anchors.setdefault(min(grams, key=sizes.__getitem__), []).append(value_id)
+        self._anchors = {gram: tuple(value_ids) for gram, value_ids in anchors.items()}
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> 'IdentifierIndex':
+        return cls(dict(iter_known_docs(snapshot)))
+
+    @staticmethod
+    def _record(doc_id: str, info: dict) -> dict:
+        data_type = info.get('_type') or ('penalty' if doc_id.startswith('fsc_pen_') else 'unknown')
+        doc_date = doc_date_value(doc_id, info)
+        return {
+            'date': f"{doc_date // 10000}-{doc_date // 100 % 100:02d}-{doc_date % 100:02d}" if doc_date else '',
+            'type': data_type,
+            'title': info.get('law_name') or info.get('display_name') or doc_id,
+            'number': info.get('document_number') or info.get('announcement_number') or '',
+            'url': info.get('original_url') or '',
+            'metadata': doc_metadata(doc_id, info)
+        }
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def lookup(self, query: str) -> IdentifierLookup:
+        """找出查詢中的識別碼（或查詢所屬的識別碼）"""
+        start_time = time.perf_counter()
+        text = normalize(query)
+        found = []  # (起, 訖, 識別碼 ID, 是否為部分比對)
+        if len(text) >= MIN_IDENTIFIER_LENGTH:
+            grams = ngrams(text)
+            for gram in grams:
+                for value_id in self._anchors.get(gram, ()):
+                    value = self._values[value_id]
+                    position = text.find(value)
+                    while position >= 0:
+                        found.append((position, position + len(value), value_id, False))
+                        position = text.find(value, position + 1)
+
+            if not found and len(text) >= MIN_PARTIAL_LENGTH:
+                candidates = None
+                for posting in sorted((self._postings.get(gram, frozenset()) for gram in grams), key=len):
+                    candidates = set(posting) if candidates is None else candidates & posting
+                    if not candidates:
+                        break
+                found = [(0, len(text), value_id, True) for value_id in candidates or ()
+                         if text in self._values[value_id]]
+
+        # 重疊的比對結果只保留最長者（長度相同時取較前面的）
+        selected = []
+        for start, end, value_id, partial in sorted(found, key=lambda item: (item[0] - item[1], item[0], item[2])):
+            if all(end <= kept[0] or start >= kept[1] for kept in selected):
+                selected.append((start, end, value_id, partial))
+        selected.sort()
+
+        matches = tuple(
+            IdentifierMatch(self._labels[value_id], self._fields[value_id], tuple(self._docs[value_id]),
+                            start, end, partial)
+            for start, end, value_id, partial in selected
+        )
+        return IdentifierLookup(matches, len(text), time.perf_counter() - start_time)
+
+    def answer(self, lookup: IdentifierLookup, filters: dict = None, limit: int = 20):
+        """列出比對到的文件
+
+        Returns:
+            與 query_penalties 相同格式的結果字典（local=True），沒有符合篩選條件的文件時返回 None
+        """
+        metadata_filter = parse_filters(filters)
+        doc_ids = [
+            doc_id for doc_id in lookup.doc_ids()
+            if not metadata_filter or metadata_filter.may_match(self._records[doc_id]['metadata'])
+        ]
+        if not doc_ids:
+            return None
+
+        records = sorted((self._records[doc_id] for doc_id in doc_ids), key=lambda record: record['date'], reverse=True)
+        described = '、'.join(
+            f"{FIELD_LABELS[match.field]}「{match.label}」" + ('（部分相符）' if match.partial else '')
+            for match in lookup.matches
+        )
+        lines = [f"比對到{described}，共 {len(records)} 份文件" + (f"（列出最新的 {limit} 份）：" if len(records) > limit else "："), ""]
+        for i, record in enumerate(records[:limit], 1):
+            title = f"[{record['title']}]({record['url']})" if record['url'] else record['title']
+            parts = [record['date'] or '日期不明', TYPE_LABELS.get(record['type'], record['type']), title]
+            if record['number'] and record['number'] not in record['title']:
+                parts.append(record['number'])
+            lines.append(f"{i}. " + '｜'.join(parts))
+
+        return {
+            'success': True,
+            'local': True,
+            'text': "\n".join(lines),
+            'sources': [],
+            'debug_info': {
+                'identifier': [match.label for match in lookup.matches],
+                'identifier_seconds': lookup.seconds,
+                'identifier_coverage': round(lookup.coverage, 3),
+                'matched_docs': len(records)
+            }
+        }
+
+    def stats(self) -> dict:
+        return {
+            'identifiers': len(self._values),
+            'documents': len(self._records),
+            'ngrams': len(self._postings)
+        }
@@ -0,0 +1,154 @@
+"""
+法條連結索引（依查詢與檢索文件挑選相關法條）
+
+system instruction 原本附上整個語料庫的完整法條連結表，法條數從一百多條成長到數千條時，
+每個請求的輸入 token 也隨之成長。這裡將映射檔中的 law_links 依「法律名稱 → 條號」建立索引，
+並保留每份文件引用的法條，只挑出與查詢或檢索文件相關的項目：
+  - select_for_query：查詢提到的法律（全名、常用簡稱或去掉「法」「條例」的名稱）與條號，
+    附在查詢內容中，讓 Gemini 生成答案時加入連結（數量有上限，提示長度大致固定）
+  - select_for_docs：檢索到的文件引用的法條（含「第N條」簡寫），供本地後處理插入連結
+"""
+
+import hashlib
+import json
+from collections import Counter
+
+from law_linker import ARTICLE_RE, LAW_KEY_RE
+
+# 法條連結方式：full（完整連結表放在 system instruction）/ query（只附上與查詢相關的法條）/ local（只在本地插入）
+LAW_LINK_MODES = ('full', 'query', 'local')
+
+# 常用簡稱 → 法律全名（查詢中常以簡稱提及）
+LAW_ALIASES = {
+    '金控法': '金融控股公司法',
+    '證交法': '證券交易法',
+    '投信投顧法': '證券投資信託及顧問法',
+    '票券法': '票券金融管理法',
+    '電支條例': '電子支付機構管理條例',
+    '洗錢法': '洗錢防制法',
+    '期交法': '期貨交易法',
+    '信合社法': '信用合作社法',
+}
+
+# 法律名稱去掉這些結尾後仍可作為查詢關鍵字（「洗錢防制法」→「洗錢防制」）
+NAME_SUFFIXES = ('管理條例', '條例', '法')
+
+# 檢索文件的法條中，以連接詞開頭的多半是斷句錯誤（「與第5條」），不使用
+INVALID_PREFIXES = ('與', '同', '及', '或', '和')
+
+
+class LawIndex:
+    """法條連結索引（依語料版本建立，建立後不再變動，可跨執行緒共用）"""
+
+    def __init__(self, doc_law_links: dict):
+        """
+        Args:
+            doc_law_links: {doc_id: {法條文字: URL}}（映射檔中各文件的 law_links，依文件順序）
+        """
+        self.links = {}          # 完整法條文字 → URL（同一法條以最先出現的連結為準）
+        self.articles = {}       # 法律名稱 → {條號: [完整法條文字, ...]}
+        self.citations = Counter()  # 完整法條文字 → 引用的文件數
+        self.doc_citations = {}  # doc_id → {法條文字: URL}（含簡寫，已略過無效法條）
+
+        for doc_id, law_links in doc_law_links.items():
+            cited = {law: url for law, url in law_links.items() if not law.startswith(INVALID_PREFIXES)}
+            if cited:
+                self.doc_citations[doc_id] = cited
+            for law_text, url in cited.items():
+                # 完整法條名稱（不以「第」開頭）才放入共用連結表
+                if law_text.startswith('第'):
+                    continue
+                self.citations[law_text] += 1
+                if law_text in self.links:
+                    continue
+                self.links[law_text] = url
+                match = LAW_KEY_RE.match(law_text)
+                if match:
+                    name = match.group(1).strip('《》')
+                    self.articles.setdefault(name, {}).setdefault(match.group(2), []).append(law_text)
+
+        self._keywords = self._build_keywords()
+        self.fingerprint = hashlib.sha256(
+            json.dumps(sorted(self.links.items()), ensure_ascii=False).encode('utf-8')
+        ).hexdigest()[:16]
+
+    @classmethod
+    def from_snapshot(cls, snapshot, data_type: str = 'penalty') -> 'LawIndex':
+        return cls({
+            doc_id: info.get('law_links') or {}
+            for doc_id, info in snapshot.docs_of_type(data_type)
+        })
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+    def _build_keywords(self) -> list:
+        """[(關鍵字, 法律名稱, 分數)]：全名與簡稱 2 分，去掉結尾的名稱 1 分（長的關鍵字優先比對）"""
+        keywords = {}
+        for name in self.articles:
+            keywords[name] = (name, 2)
+            for suffix in NAME_SUFFIXES:
+                core = name.removesuffix(suffix)
+                if core != name and len(core) >= 2:
+                    keywords.setdefault(core, (name, 1))
+                    break
+        for alias, name in LAW_ALIASES.items():
+            if name in self.articles:
+                keywords[alias] = (name, 2)
+        return sorted(((keyword, name, score) for keyword, (name, score) in keywords.items()),
+                      key=lambda item: len(item[0]), reverse=True)
+
+    def mentioned_laws(self, query: str) -> list:
+        """查詢提到的法律名稱（依分數、被引用次數排序）"""
+        scores = {}
+        for keyword, name, score in self._keywords:
+            if keyword in query and score > scores.get(name, 0):
+                scores[name] = score
+        return sorted(scores, key=lambda name: (-scores[name], -self._law_citations(name), name))
+
+    def _law_citations(self, name: str) -> int:
+        return sum(self.citations[law] for entries in self.articles[name].values() for law in entries)
+
+    def select_for_query(self, query: str, limit: int = 40, fallback: int = 10) -> dict:
+        """與查詢相關的完整法條連結
+
+        查詢提到的法律依序輪流挑選條文（查詢提到的條號優先，其餘依被引用次數）；
+        沒有提到任何法律時，改用被最多文件引用的 fallback 條。
+
+        Returns:
+            {法條文字: URL}，最多 limit 條
+        """
+        laws = self.mentioned_laws(query or '')
+        if not laws:
+            return {law: self.links[law] for law, _ in self.citations.most_common(min(fallback, limit))}
+
+        mentioned_articles = set(ARTICLE_RE.findall(query))
+        queues = []
+        for name in laws:
+            entries = [law for article, laws_of_article in self.articles[name].items() for law in laws_of_article]
+            entries.sort(key=lambda law: (LAW_KEY_RE.match(law).group(2) not in mentioned_articles,
+                                          -self.citations[law], law))
+            queues.append(entries)
+
+        selected = {}
+        depth = 0
+        while len(selected) < limit and any(depth < len(entries) for entries in queues):
+            for entries in queues:
+                if depth < len(entries) and len(selected) < limit:
+                    selected[entries[depth]] = self.links[entries[depth]]
+            depth += 1
+        return selected
+
+    def select_for_docs(self, doc_ids) -> dict:
+        """檢索文件引用的法條連結（含「第N條」簡寫；後面的文件覆蓋相同法條）"""
+        selected = {}
+        for doc_id in doc_ids:
+            selected.update(self.doc_citations.get(doc_id, {}))
+        return selected
+
+    def stats(self) -> dict:
+        return {
+            'laws': len(self.articles),
+            'articles': len(self.links),
+            'documents': len(self.doc_citations)
+        }
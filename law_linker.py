@@ -0,0 +1,275 @@
+"""
+法條連結器（Aho-Corasick 單次掃描）
+
+將法條連結表編譯為 Aho-Corasick 自動機，一次由左到右掃描文字找出所有候選法條，
+再依原本的優先順序（法條名稱長的優先、完整名稱先於「第N條」簡寫）以區間結構挑選不重疊的連結，
+最後一次 join 組出結果。
+
+比對規則與 add_law_links_to_text 原本的兩階段正則相同：
+  - 完整法條：可選前置連接詞（、，及與和以）+ 可選書名號 + 法律名稱 + 條號 + 可選項/款/目
+  - 簡寫法條：必要前置連接詞（、，及與和）+「第N條」+ 可選項/款/目
+  - 連接詞放在連結外面；前一字為「[」「(」或後一字為「]」「)」時不加連結
+另外會略過文字中已存在的 Markdown 連結，避免產生巢狀連結。
+原本逐條替換時記錄的已替換區間不會隨文字變長而位移，偶爾會漏掉後面法條的連結；
+這裡在原始文字上比對，沒有這個問題（與原本結果的比較見 tests/test_law_linker.py）。
+"""
+
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque
+
+# 法條名稱與條號：「金融控股公司法第45條」→（金融控股公司法, 第45條）
+LAW_KEY_RE = re.compile(r'^(.+?)(第\d+條(?:之\d+)?)')
+
+# 條號（含「之N」）
+ARTICLE_RE = re.compile(r'第\d+條(?:之\d+)?')
+
+# 項/款/目（依序、皆可省略）
+SUFFIX_RES = (re.compile(r'第\d+項'), re.compile(r'第\d+款'), re.compile(r'第\d+目'))
+
+# 已存在的 Markdown 連結
+MARKDOWN_LINK_RE = re.compile(r'\[[^\[\]\n]*\]\([^()\s]*\)')
+
+FULL_CONNECTORS = '、，及與和以'
+SHORT_CONNECTORS = '、，及與和'
+LINK_OPENERS = '[('
+LINK_CLOSERS = '])'
+
+
+class AhoCorasick:
+    """多字串比對自動機"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]  # 節點 → [(pattern_id, 長度)]
+
+        for pattern_id, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                next_node = self._goto[node].get(ch)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][ch] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((pattern_id, len(pattern)))
+
+        # 以 BFS 建立失敗連結，並合併輸出
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def finditer(self, text: str):
+        """產生所有（可重疊的）比對結果 (start, end, pattern_id)"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern_id, length in output[node]:
+                yield i + 1 - length, i + 1, pattern_id
+
+
+class IntervalSet:
+    """已使用的不重疊區間（以排序的起點/終點查詢是否重疊）"""
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+
+    def overlaps(self, start: int, end: int) -> bool:
+        i = bisect_left(self._starts, end)
+        # 只需檢查起點小於 end 的最後一個區間
+        return i > 0 and self._ends[i - 1] > start
+
+    def add(self, start: int, end: int):
+        i = bisect_left(self._starts, start)
+        self._starts.insert(i, start)
+        self._ends.insert(i, end)
+
+
+def _suffix_end(text: str, pos: int) -> list:
+    """條號之後可接的項/款/目，返回所有可能的結束位置（由長到短）"""
+    ends = [pos]
+    for suffix_re in SUFFIX_RES:
+        match = suffix_re.match(text, pos)
+        if match:
+            pos = match.end()
+            ends.append(pos)
+    return ends[::-1]
+
+
+def _valid_end(text: str, ends: list):
+    """第一個後面不是「]」「)」的結束位置"""
+    for end in ends:
+        if end >= len(text) or text[end] not in LINK_CLOSERS:
+            return end
+    return None
+
+
+class LawLinker:
+    """編譯一次、可重複使用的法條連結器"""
+
+    def __init__(self, law_links_dict: dict):
+        # 與原本相同：依法條名稱長度排序（長的優先）
+        sorted_laws = sorted(law_links_dict.keys(), key=len, reverse=True)
+
+        self._full = {}   # (法律名稱, 條號) → (優先順序, URL)
+        self._short = {}  # 簡寫條號 → (優先順序, URL)
+        names = []
+
+        for rank, law in enumerate(sorted_laws):
+            link = law_links_dict[law]
+            if law.startswith('第'):
+                self._short.setdefault(law, (rank, link))
+                continue
+
+            law_match = LAW_KEY_RE.match(law)
+            if not law_match:
+                continue
+            key = (law_match.group(1), law_match.group(2))
+            if key not in self._full:
+                self._full[key] = (rank, link)
+                names.append(law_match.group(1))
+
+        self._patterns = list(dict.fromkeys(names)) + list(self._short)
+        self._name_count = len(dict.fromkeys(names))
+        self._automaton = AhoCorasick(self._patterns)
+
+    def _full_candidates(self, text: str, start: int, end: int, name: str):
+        """法律名稱出現於 [start, end) 時，可能的完整法條候選"""
+        pos = end
+        if pos < len(text) and text[pos] == '》':
+            pos += 1
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+
+        article_match = ARTICLE_RE.match(text, pos)
+        if not article_match:
+            return
+
+        # 可選的書名號與前置連接詞（連接詞留在連結外）
+        link_start = start - 1 if start > 0 and text[start - 1] == '《' else start
+        match_start = link_start
+        ws = link_start
+        while ws > 0 and text[ws - 1].isspace():
+            ws -= 1
+        if ws > 0 and text[ws - 1] in FULL_CONNECTORS:
+            match_start = ws - 1
+
+        # 正則會由最左邊的起點開始嘗試；前一字是「[」「(」時改從下一個可能的起點開始
+        starts = [s for s in dict.fromkeys((match_start, link_start, start))
+                  if s == 0 or text[s - 1] not in LINK_OPENERS]
+        if not starts:
+            return
+        match_start = starts[0]
+        link_start = max(match_start, link_start)
+
+        # 條號可能為「第45條之1」，也可能只比對到前綴「第45條」
+        articles = [article_match.group(0)]
+        if '之' in articles[0]:
+            articles.append(articles[0].split('之')[0])
+
+        for article in articles:
+            entry = self._full.get((name, article))
+            if entry is None:
+                continue
+            end_pos = _valid_end(text, _suffix_end(text, pos + len(article)))
+            if end_pos is None:
+                continue
+            rank, link = entry
+            yield rank, match_start, end_pos, link_start, link
+
+    def _short_candidates(self, text: str, start: int, end: int, article: str):
+        """簡寫條號出現於 [start, end) 時的候選（必須有前置連接詞）"""
+        ws = start
+        while ws > 0 and text[ws - 1].isspace():
+            ws -= 1
+        if ws == 0 or text[ws - 1] not in SHORT_CONNECTORS:
+            return
+        match_start = ws - 1
+        if match_start > 0 and text[match_start - 1] in LINK_OPENERS:
+            return
+
+        end_pos = _valid_end(text, _suffix_end(text, end))
+        if end_pos is None:
+            return
+        rank, link = self._short[article]
+        yield rank, match_start, end_pos, start, link
+
+    def link(self, text: str) -> str:
+        """為文字中的法條加入連結"""
+        if not text or not self._patterns:
+            return text
+
+        full = []
+        short = []
+        for start, end, pattern_id in self._automaton.finditer(text):
+            pattern = self._patterns[pattern_id]
+            if pattern_id < self._name_count:
+                full.extend(self._full_candidates(text, start, end, pattern))
+            else:
+                short.extend(self._short_candidates(text, start, end, pattern))
+
+        used = IntervalSet()
+        for match in MARKDOWN_LINK_RE.finditer(text):
+            used.add(match.start(), match.end())
+
+        # 先處理完整法條，再處理簡寫；同一階段內依優先順序、再依位置
+        accepted = []
+        for candidates in (full, short):
+            candidates.sort(key=lambda c: (c[0], c[1]))
+            for rank, match_start, match_end, link_start, link in candidates:
+                if used.overlaps(match_start, match_end):
+                    continue
+                used.add(match_start, match_end)
+                accepted.append((link_start, match_end, link))
+
+        if not accepted:
+            return text
+
+        accepted.sort()
+        pieces = []
+        pos = 0
+        for link_start, link_end, link in accepted:
+            pieces.append(text[pos:link_start])
+            pieces.append(f"[{text[link_start:link_end]}]({link})")
+            pos = link_end
+        pieces.append(text[pos:])
+        return ''.join(pieces)
+
+
+_LINKER_CACHE = OrderedDict()
+_LINKER_CACHE_SIZE = 32
+_LINKER_LOCK = threading.Lock()
+
+
+def get_law_linker(law_links_dict: dict) -> LawLinker:
+    """取得（必要時編譯）法條連結表對應的連結器"""
+    key = frozenset(law_links_dict.items())
+    with _LINKER_LOCK:
+        linker = _LINKER_CACHE.get(key)
+        if linker is not None:
+            _LINKER_CACHE.move_to_end(key)
+            return linker
+
+    linker = LawLinker(law_links_dict)
+    with _LINKER_LOCK:
+        _LINKER_CACHE[key] = linker
+        while len(_LINKER_CACHE) > _LINKER_CACHE_SIZE:
+            _LINKER_CACHE.popitem(last=False)
+    return linker
@@ -0,0 +1,281 @@
+"""
+並行 session 壓力測試
+
+以 streamlit.testing 的 AppTest 同時模擬 N 個使用者 session：每個 session 開啟頁面後
+依序送出查詢（輸入查詢 → 按下查詢按鈕 → 等待結果顯示完成），量測端到端延遲，
+報告 p50 / p95 / p99 延遲與吞吐量。所有 session 在同一程序內執行，
+與實際部署相同地共用 st.cache_resource（映射檔、答案快取、Gemini client）。
+
+預設使用重播傳輸（FSC_GEMINI_TRANSPORT=replay，見 gemini_transport.py），不消耗 API 配額；
+延遲與錯誤注入以 FSC_REPLAY_* 環境變數設定。
+
+使用方式：
+    python loadtest.py --sessions 20 --queries-per-session 5
+    python loadtest.py --sessions 50 --queries queries.txt --distinct --output report.json
+    FSC_REPLAY_FAULTS=429=0.05 python loadtest.py --sessions 20 --ramp 10
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+APP_PATH = Path(__file__).parent / 'app.py'
+
+DEFAULT_QUERIES = (
+    '最近有哪些銀行因為違反洗錢防制法被裁罰？',
+    '證券商違反內部控制的案例',
+    '保險公司招攬不當的裁罰案件',
+    '金控公司利害關係人交易的相關處分',
+    '投信業者違反法令的案件',
+    '電子支付機構的裁罰案例',
+)
+
+
+def percentile(values: list, p: float) -> float:
+    """第 p 百分位數（p 介於 0 到 1，最近排名法），沒有樣本時返回 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(p * (len(values) - 1)))))
+    return values[index]
+
+
+@contextlib.contextmanager
+def concurrent_apptest():
+    """讓多個 AppTest 可在同一程序內並行執行（僅在壓力測試期間生效）
+
+    - AppTest 每次執行腳本時會設定全域的 Runtime 單例（mock），結束時清除；
+      session 重疊執行時，先結束的 session 會清掉其他 session 仍在使用的單例，
+      這裡讓單例被清除後仍可取得最近一次設定的 mock。
+    - AppTest 每次執行都會重新編譯腳本，而 ast.parse 不能在多個執行緒同時呼叫；
+      這裡與實際伺服器相同，所有 session 共用編譯好的 bytecode。
+    """
+    from streamlit.runtime.runtime import Runtime
+    from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+
+    original_instance = Runtime.__dict__['instance']
+    original_exists = Runtime.__dict__['exists']
+    original_get_bytecode = ScriptCache.get_bytecode
+    last = {'runtime': None}
+    bytecode = {}
+    compile_lock = threading.Lock()
+
+    def instance(cls):
+        if cls._instance is not None:
+            last['runtime'] = cls._instance
+        if last['runtime'] is None:
+            raise RuntimeError("Runtime hasn't been created!")
+        return last['runtime']
+
+    def exists(cls):
+        return cls._instance is not None or last['runtime'] is not None
+
+    def get_bytecode(self, script_path):
+        with compile_lock:
+            if script_path not in bytecode:
+                bytecode[script_path] = original_get_bytecode(self, script_path)
+            return bytecode[script_path]
+
+    Runtime.instance = classmethod(instance)
+    Runtime.exists = classmethod(exists)
+    ScriptCache.get_bytecode = get_bytecode
+    try:
+        yield
+    finally:
+        Runtime.instance = original_instance
+        Runtime.exists = original_exists
+        ScriptCache.get_bytecode = original_get_bytecode
+
+
+def _query_button(at):
+    return next(b for b in at.button if '查詢' in b.label and '📌' not in b.label)
+
+
+def run_session(session_id: int, queries: list, timeout: float, distinct: bool, results: list, lock):
+    """執行一個 session：開啟頁面後依序送出查詢，將每次查詢的結果附加到 results"""
+    from streamlit.testing.v1 import AppTest
+
+    def record(kind: str, query: str, seconds: float, ok: bool, error: str = None):
+        with lock:
+            results.append({'session': session_id, 'kind': kind, 'query': query,
+                            'seconds': seconds, 'ok': ok, 'error': error})
+
+    start = time.perf_counter()
+    try:
+        at = AppTest.from_file(str(APP_PATH), default_timeout=timeout)
+        at.run()
+    except Exception as e:
+        record('startup', '', time.perf_counter() - start, False, str(e))
+        return
+    record('startup', '', time.perf_counter() - start, not at.exception,
+           at.exception[0].value if at.exception else None)
+
+    for i, query in enumerate(queries):
+        text = f"{query}（session {session_id}-{i}）" if distinct else query
+        start = time.perf_counter()
+        try:
+            at.text_area[0].set_value(text)
+            _query_button(at).click().run()
+        except Exception as e:
+            record('query', text, time.perf_counter() - start, False, str(e))
+            continue
+        seconds = time.perf_counter() - start
+
+        error = None
+        if at.exception:
+            error = at.exception[0].value
+        elif at.error:
+            error = at.error[0].value
+        elif not at.text_area:
+            error = '頁面未完整顯示（腳本執行中斷）'
+        record('query', text, seconds, error is None, error)
+
+
+def summarize(results: list, elapsed: float) -> dict:
+    """彙整延遲百分位數與吞吐量"""
+    queries = [r for r in results if r['kind'] == 'query']
+    succeeded = [r['seconds'] for r in queries if r['ok']]
+    startup = [r['seconds'] for r in results if r['kind'] == 'startup' and r['ok']]
+    errors = {}
+    for r in results:
+        if not r['ok']:
+            key = (r['error'] or '').split('\n')[0][:120]
+            errors[key] = errors.get(key, 0) + 1
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 1)
+
+    return {
+        'queries': len(queries),
+        'succeeded': len(succeeded),
+        'failed': len(queries) - len(succeeded),
+        'elapsed_seconds': round(elapsed, 2),
+        'throughput_qps': round(len(succeeded) / elapsed, 3) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': ms(percentile(succeeded, 0.5)),
+            'p95': ms(percentile(succeeded, 0.95)),
+            'p99': ms(percentile(succeeded, 0.99)),
+            'max': ms(max(succeeded) if succeeded else None),
+            'mean': ms(sum(succeeded) / len(succeeded) if succeeded else None)
+        },
+        'startup_ms': {
+            'p50': ms(percentile(startup, 0.5)),
+            'p95': ms(percentile(startup, 0.95))
+        },
+        'errors': errors
+    }
+
+
+def run_load(sessions: int, queries: list, queries_per_session: int, ramp: float = 0.0,
+             timeout: float = 120.0, distinct: bool = False, progress=None) -> dict:
+    """同時執行多個 session 並彙整結果
+
+    Args:
+        sessions: 同時執行的 session 數
+        queries: 查詢文字（各 session 從不同位置開始輪流使用）
+        queries_per_session: 每個 session 送出的查詢數
+        ramp: 在幾秒內逐步啟動所有 session（0 表示同時啟動）
+        timeout: 單次腳本執行的逾時秒數
+        distinct: 每個查詢加上 session 編號，避免命中答案快取
+        progress: 每個 session 結束時呼叫 progress(已結束數, 總數)
+    """
+    results = []
+    lock = threading.Lock()
+    threads = []
+    finished = 0
+
+    def worker(session_id: int):
+        nonlocal finished
+        picked = [queries[(session_id + i) % len(queries)] for i in range(queries_per_session)]
+        run_session(session_id, picked, timeout, distinct, results, lock)
+        with lock:
+            finished += 1
+            done = finished
+        if progress:
+            progress(done, sessions)
+
+    start = time.perf_counter()
+    with concurrent_apptest():
+        for session_id in range(sessions):
+            thread = threading.Thread(target=worker, args=(session_id,), name=f'loadtest-{session_id}', daemon=True)
+            thread.start()
+            threads.append(thread)
+            if ramp and sessions > 1:
+                time.sleep(ramp / (sessions - 1))
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    summary = summarize(results, elapsed)
+    summary['sessions'] = sessions
+    summary['queries_per_session'] = queries_per_session
+    return {'summary': summary, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='並行 Streamlit session 壓力測試')
+    parser.add_argument('--sessions', type=int, default=10, help='同時執行的 session 數')
+    parser.add_argument('--queries-per-session', type=int, default=3, help='每個 session 送出的查詢數')
+    parser.add_argument('--queries', help='查詢檔（格式同 batch_query.py），預設使用內建查詢')
+    parser.add_argument('--ramp', type=float, default=0.0, help='在幾秒內逐步啟動所有 session')
+    parser.add_argument('--timeout', type=float, default=120.0, help='單次腳本執行的逾時秒數')
+    parser.add_argument('--distinct', action='store_true', help='每個查詢加上 session 編號，避免命中答案快取')
+    parser.add_argument('--transport', default='replay', help='FSC_GEMINI_TRANSPORT（預設 replay）')
+    parser.add_argument('--warm-cache', action='store_true', help='使用既有的磁碟答案快取（預設使用空的暫存目錄）')
+    parser.add_argument('--output', help='完整報告 JSON 路徑')
+    args = parser.parse_args()
+
+    os.environ.setdefault('FSC_GEMINI_TRANSPORT', args.transport)
+    if not args.warm_cache:
+        os.environ['FSC_CACHE_DIR'] = tempfile.mkdtemp(prefix='fsc-loadtest-')
+    if os.environ['FSC_GEMINI_TRANSPORT'] in ('live', 'record') and os.getenv('FSC_GEMINI_FAKE') != '1':
+        print("⚠️ 使用 live/record 傳輸會實際呼叫 Gemini 並消耗 API 配額")
+
+    # 非 Streamlit 環境下使用快取函式會產生大量警告（streamlit 的各個 logger 各自設定層級）
+    for name in list(logging.root.manager.loggerDict):
+        if name.startswith('streamlit'):
+            logging.getLogger(name).setLevel(logging.ERROR)
+
+    from gemini_transport import replay_stats
+
+    if args.queries:
+        from batch_query import load_queries
+        queries = [item['query'] for item in load_queries(args.queries)]
+    else:
+        queries = list(DEFAULT_QUERIES)
+    if not queries:
+        parser.error('查詢檔中沒有查詢')
+
+    def progress(done, total):
+        print(f"[{done}/{total}] session 完成")
+
+    report = run_load(
+        args.sessions, queries, args.queries_per_session,
+        ramp=args.ramp, timeout=args.timeout, distinct=args.distinct, progress=progress
+    )
+    summary = report['summary']
+    summary['transport'] = os.environ['FSC_GEMINI_TRANSPORT']
+    summary['transport_stats'] = replay_stats()
+
+    latency = summary['latency_ms']
+    print(f"📋 {summary['sessions']} 個 session、{summary['queries']} 次查詢：成功 {summary['succeeded']}、失敗 {summary['failed']}")
+    print(f"   延遲 p50 {latency['p50']} ms、p95 {latency['p95']} ms、p99 {latency['p99']} ms、最大 {latency['max']} ms")
+    print(f"   吞吐量 {summary['throughput_qps']} 查詢/秒（耗時 {summary['elapsed_seconds']} 秒）")
+    if summary['transport_stats']:
+        print(f"   傳輸統計 {json.dumps(summary['transport_stats'], ensure_ascii=False)}")
+    for error, count in summary['errors'].items():
+        print(f"   ❌ {count} 次：{error}")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"✅ 完整報告已輸出：{args.output}")
+
+
+if __name__ == '__main__':
+    main()
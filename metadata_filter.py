@@ -0,0 +1,196 @@
+"""
+篩選條件下推（File Search metadata filter）
+
+原本篩選條件（日期範圍、來源單位）只以文字附加在查詢後面，檢索仍會掃描整個 Store，
+再由模型自行丟棄不符合的片段。這裡改為：
+  - 文件的日期/來源單位/類別/資料類型上傳為 Store 的自訂 metadata（doc_custom_metadata）
+  - 篩選條件轉換為 File Search 的 metadata_filter 表達式（MetadataFilter.expression）
+  - 查詢前先以本地映射檔檢查是否有任何文件可能符合；確定沒有時不必呼叫 Gemini
+
+裁罰金額不在映射檔中，無法下推，仍以文字附加在查詢後面。
+只有每份已知文件都有的欄位才下推（pushable_keys）：例如裁罰案件沒有來源單位 metadata，
+下推來源單位會讓 File Search 排除所有裁罰案件，因此該條件改以文字附加在查詢後面。
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from startup import lazy_module
+
+types = lazy_module('google.genai.types')  # 只有建立上傳用 custom metadata 時才需要
+
+# 來源單位：介面顯示名稱 → metadata 值
+SOURCE_UNITS = {
+    '銀行局': 'bank_bureau',
+    '證券期貨局': 'securities_bureau',
+    '保險局': 'insurance_bureau',
+    '檢查局': 'inspection_bureau',
+}
+
+# 可下推的篩選欄位
+FILTER_KEYS = ('date', 'source', 'category')
+
+# 文件 ID 中的日期：fsc_pen_20250925_0001、fsc_law_202511140001
+DOC_ID_DATE_RE = re.compile(r'^fsc_[a-z]+_(\d{8})_?\d{4}$')
+
+
+def date_value(value) -> int:
+    """日期轉為 metadata 使用的數值（YYYYMMDD），無法解析時返回 None"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (date, datetime)):
+        return value.year * 10000 + value.month * 100 + value.day
+    digits = re.sub(r'\D', '', str(value))[:8]
+    return int(digits) if len(digits) == 8 else None
+
+
+def doc_date_value(doc_id: str, info: dict = None) -> int:
+    """文件日期（優先使用映射檔的 date，否則由文件 ID 推得）"""
+    value = date_value((info or {}).get('date'))
+    if value is None:
+        match = DOC_ID_DATE_RE.match(doc_id or '')
+        if match:
+            value = int(match.group(1))
+    return value
+
+
+def doc_metadata(doc_id: str, info: dict = None) -> dict:
+    """文件的結構化 metadata（未知的欄位省略）"""
+    info = info or {}
+    metadata = {}
+    doc_date = doc_date_value(doc_id, info)
+    if doc_date is not None:
+        metadata['date'] = doc_date
+    for key in ('source', 'category'):
+        value = info.get(key)
+        if value and value != 'unknown':
+            metadata[key] = value
+    data_type = info.get('_type') or ('penalty' if (doc_id or '').startswith('fsc_pen_') else None)
+    if data_type:
+        metadata['type'] = data_type
+    metadata['doc_id'] = doc_id
+    return metadata
+
+
+def doc_custom_metadata(doc_id: str, info: dict = None) -> list:
+    """上傳文件到 File Search Store 時使用的 custom_metadata"""
+    custom_metadata = []
+    for key, value in doc_metadata(doc_id, info).items():
+        if isinstance(value, int):
+            custom_metadata.append(types.CustomMetadata(key=key, numeric_value=value))
+        else:
+            custom_metadata.append(types.CustomMetadata(key=key, string_value=value))
+    return custom_metadata
+
+
+def _quote(value: str) -> str:
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+@dataclass(frozen=True)
+class MetadataFilter:
+    """可下推到 File Search 的篩選條件"""
+    start_date: int = None
+    end_date: int = None
+    sources: tuple = ()
+    categories: tuple = ()
+
+    def __bool__(self):
+        return bool(self.start_date or self.end_date or self.sources or self.categories)
+
+    def expression(self) -> str:
+        """File Search metadata_filter 表達式，例如
+        date >= 20240101 AND date <= 20241231 AND (source = "bank_bureau")
+        """
+        clauses = []
+        if self.start_date:
+            clauses.append(f"date >= {self.start_date}")
+        if self.end_date:
+            clauses.append(f"date <= {self.end_date}")
+        for key, values in (('source', self.sources), ('category', self.categories)):
+            if values:
+                clauses.append('(' + ' OR '.join(f"{key} = {_quote(v)}" for v in values) + ')')
+        return ' AND '.join(clauses)
+
+    def restrict(self, keys) -> MetadataFilter:
+        """只保留指定欄位（FILTER_KEYS 的子集）的篩選條件"""
+        keys = set(keys)
+        return MetadataFilter(
+            start_date=self.start_date if 'date' in keys else None,
+            end_date=self.end_date if 'date' in keys else None,
+            sources=self.sources if 'source' in keys else (),
+            categories=self.categories if 'category' in keys else ()
+        )
+
+    def keys(self) -> frozenset:
+        """有設定條件的欄位"""
+        return frozenset(key for key, active in (
+            ('date', self.start_date or self.end_date),
+            ('source', self.sources),
+            ('category', self.categories)
+        ) if active)
+
+    def may_match(self, metadata: dict) -> bool:
+        """本地檢查文件是否可能符合（欄位未知時視為可能符合）"""
+        doc_date = metadata.get('date')
+        if doc_date is not None:
+            if self.start_date and doc_date < self.start_date:
+                return False
+            if self.end_date and doc_date > self.end_date:
+                return False
+        for key, values in (('source', self.sources), ('category', self.categories)):
+            value = metadata.get(key)
+            if values and value is not None and value not in values:
+                return False
+        return True
+
+
+def parse_filters(filters: dict) -> MetadataFilter:
+    """將介面的篩選條件轉換為 MetadataFilter（min_penalty 無法下推，忽略）"""
+    filters = filters or {}
+    sources = tuple(sorted({
+        SOURCE_UNITS.get(unit, unit) for unit in (filters.get('source_units') or ())
+    }))
+    categories = tuple(sorted(set(filters.get('categories') or ())))
+    return MetadataFilter(
+        start_date=date_value(filters.get('start_date')),
+        end_date=date_value(filters.get('end_date')),
+        sources=sources,
+        categories=categories
+    )
+
+
+def iter_known_docs(snapshot):
+    """映射檔中所有已知文件的 (doc_id, info)（裁罰案件只有 Gemini ID 映射，info 為空）"""
+    seen = set()
+    for doc_id, info in snapshot.file_mapping.items():
+        seen.add(doc_id)
+        yield doc_id, info
+    for doc_id in snapshot.gemini_id_mapping.values():
+        if doc_id not in seen:
+            seen.add(doc_id)
+            yield doc_id, {}
+
+
+def has_matching_docs(snapshot, metadata_filter: MetadataFilter) -> bool:
+    """本地映射檔中是否有任何文件可能符合篩選條件（找到第一筆即返回）"""
+    if not metadata_filter:
+        return True
+    return any(
+        metadata_filter.may_match(doc_metadata(doc_id, info))
+        for doc_id, info in iter_known_docs(snapshot)
+    )
+
+
+def pushable_keys(snapshot) -> frozenset:
+    """每份已知文件都有的篩選欄位（缺少某欄位的文件在下推後一定不符合，因此該欄位不能下推）"""
+    missing = set()
+    for doc_id, info in iter_known_docs(snapshot):
+        metadata = doc_metadata(doc_id, info)
+        missing.update(key for key in FILTER_KEYS if key not in metadata)
+        if len(missing) == len(FILTER_KEYS):
+            break
+    return frozenset(FILTER_KEYS) - missing
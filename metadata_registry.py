@@ -0,0 +1,463 @@
+"""
+映射檔共用登錄（Metadata Registry）
+
+將裁罰案件、法令函釋、重要公告的映射檔合併為：
+  - 正向映射：document_id → 文件資訊
+  - 反向映射：gemini_file_id → document_id
+
+整個程序只建立一次，所有 Streamlit session 共用；
+只有在映射檔的 mtime / 大小改變時才重新載入。
+
+若存在由 build_metadata_index.py 編譯的 SQLite 索引，且與映射檔內容一致，
+則直接以唯讀方式開啟索引，按需查詢，不必在啟動時解析所有 JSON。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+
+# SQLite 索引的結構版本（結構變更或合併後的欄位變更時遞增，舊索引會自動失效）
+INDEX_SCHEMA_VERSION = 2
+
+# 由 *_mapping.json 補充到合併結果的欄位（識別碼快速查詢使用）
+SUPPLEMENT_KEYS = ('original_url', 'document_number', 'announcement_number', 'law_name')
+
+# 預設索引位置（相對於 data/）
+DEFAULT_INDEX_NAME = 'metadata_index.sqlite'
+
+
+@dataclass(frozen=True)
+class MappingSource:
+    """單一映射檔的描述"""
+    key: str            # 合併時使用的識別名稱
+    relpath: str        # 相對於 data/ 的路徑
+    label: str          # 錯誤訊息用的中文名稱
+    warn: bool = False  # 載入失敗時是否需要提示使用者
+
+
+# 參與合併的映射檔（順序即為合併順序）
+MAPPING_SOURCES = (
+    MappingSource('penalty_files', 'penalties/file_mapping.json', '裁罰映射檔', warn=True),
+    MappingSource('penalty_gemini', 'penalties/gemini_id_mapping.json', '裁罰 Gemini 映射檔'),
+    MappingSource('law_gemini', 'law_interpretations/gemini_id_mapping_new.json', '法令函釋 Gemini 映射檔', warn=True),
+    MappingSource('law_files', 'law_interpretations/law_interpretations_mapping.json', '法令函釋映射檔'),
+    MappingSource('ann_gemini', 'announcements/gemini_id_mapping_new.json', '公告 Gemini 映射檔', warn=True),
+    MappingSource('ann_files', 'announcements/announcements_mapping.json', '公告映射檔'),
+)
+
+
+def read_sources(base_path, sources=MAPPING_SOURCES) -> tuple:
+    """讀取各映射檔的原始 JSON 內容
+
+    Returns:
+        (raw, errors)：raw 為 {MappingSource.key: json 內容}，
+        errors 為需要提示使用者的 (label, 錯誤訊息)
+    """
+    raw = {}
+    errors = []
+    for source in sources:
+        path = Path(base_path) / source.relpath
+        if not path.exists():
+            continue
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                raw[source.key] = json.load(f)
+        except Exception as e:
+            if source.warn:
+                errors.append((source.label, str(e)))
+    return raw, errors
+
+def source_fingerprint(base_path, sources=MAPPING_SOURCES) -> list:
+    """各映射檔的 [路徑, 大小, sha1]（不依賴 mtime，git checkout 後仍然一致）"""
+    fingerprint = []
+    for source in sources:
+        path = Path(base_path) / source.relpath
+        if not path.exists():
+            fingerprint.append([source.relpath, None, None])
+            continue
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 16), b''):
+                digest.update(block)
+        fingerprint.append([source.relpath, path.stat().st_size, digest.hexdigest()])
+    return fingerprint
+
+def merge_mappings(raw: dict) -> tuple:
+    """合併各映射檔的原始內容
+
+    Args:
+        raw: {MappingSource.key: json 內容}，缺少或載入失敗的來源可省略
+
+    Returns:
+        (file_mapping, gemini_id_mapping)
+    """
+    file_mapping = {}
+    reverse_mapping = {}
+
+    # 裁罰案件映射
+    for file_id, info in (raw.get('penalty_files') or {}).items():
+        info = dict(info)
+        info['_type'] = 'penalty'
+        file_mapping[file_id] = info
+
+    # 法令函釋 / 重要公告：先載入 gemini_id_mapping_new（包含基本資訊），
+    # 再以 *_mapping.json 補充 original_url、發文字號與法規名稱
+    for gemini_key, files_key, data_type in (
+        ('law_gemini', 'law_files', 'law_interpretation'),
+        ('ann_gemini', 'ann_files', 'announcement'),
+    ):
+        for file_id, info in (raw.get(gemini_key) or {}).items():
+            file_mapping[file_id] = {
+                'display_name': info.get('display_name', file_id),
+                'date': info.get('date', ''),
+                'source': info.get('source', ''),
+                'category': info.get('category', ''),
+                '_type': data_type
+            }
+
+        for file_id, info in (raw.get(files_key) or {}).items():
+            if file_id in file_mapping:
+                file_mapping[file_id]['original_url'] = info.get('original_url', '')
+                for key in SUPPLEMENT_KEYS[1:]:
+                    if info.get(key):
+                        file_mapping[file_id][key] = info[key]
+            else:
+                info = dict(info)
+                info['_type'] = data_type
+                file_mapping[file_id] = info
+
+    # 反向映射：裁罰案件為舊格式（直接是 gemini_id → doc_id）
+    reverse_mapping.update(raw.get('penalty_gemini') or {})
+
+    # 法令函釋、重要公告為新格式（doc_id → {gemini_file_id: ...}）
+    for gemini_key in ('law_gemini', 'ann_gemini'):
+        for doc_id, info in (raw.get(gemini_key) or {}).items():
+            gemini_id = info.get('gemini_file_id', '')
+            if gemini_id:
+                reverse_mapping[gemini_id] = doc_id
+
+    return file_mapping, reverse_mapping
+
+
+@dataclass(frozen=True)
+class MetadataSnapshot:
+    """某一時間點的映射內容（唯讀，請勿修改其中的 dict）"""
+    file_mapping: dict
+    gemini_id_mapping: dict
+    signature: tuple
+    version: str
+    loaded_at: float
+    load_seconds: float
+    errors: tuple = ()
+    backend: str = 'json'
+    _doc_digests: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def counts(self) -> dict:
+        """各資料類型的文件數"""
+        if isinstance(self.file_mapping, IndexedMapping):
+            by_type = self.file_mapping.count_by('type')
+        else:
+            by_type = {}
+            for info in self.file_mapping.values():
+                data_type = info.get('_type', 'unknown')
+                by_type[data_type] = by_type.get(data_type, 0) + 1
+        return {
+            'file_mapping': len(self.file_mapping),
+            'gemini_id_mapping': len(self.gemini_id_mapping),
+            'by_type': by_type
+        }
+
+    def docs_of_type(self, data_type: str):
+        """依序產生指定資料類型的 (doc_id, info)"""
+        if isinstance(self.file_mapping, IndexedMapping):
+            for doc_id in self.file_mapping.where('type = ?', (data_type,)):
+                yield doc_id, self.file_mapping[doc_id]
+        else:
+            for doc_id, info in self.file_mapping.items():
+                if info.get('_type') == data_type:
+                    yield doc_id, info
+
+    def doc_digest(self, doc_id: str) -> str:
+        """單一文件資訊的內容雜湊（用於判斷該文件是否變動）"""
+        digest = self._doc_digests.get(doc_id)
+        if digest is None:
+            info = self.file_mapping.get(doc_id)
+            payload = json.dumps(info, ensure_ascii=False, sort_keys=True)
+            digest = hashlib.sha1(payload.encode('utf-8')).hexdigest()[:16]
+            self._doc_digests[doc_id] = digest
+        return digest
+
+    def close(self):
+        """立即釋放 SQLite 索引的連線（JSON 快照不需要）
+
+        重新載入時不會呼叫：其他執行緒可能仍持有舊快照，連線在最後一個引用釋放時才關閉。
+        """
+        for mapping in (self.file_mapping, self.gemini_id_mapping):
+            if isinstance(mapping, IndexedMapping):
+                mapping.close()
+
+
+class _IndexConnection:
+    """同一索引檔的映射共用的唯讀連線，最後一個引用（映射）釋放時才關閉"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._finalizer = weakref.finalize(self, conn.close)
+
+    def execute(self, *args):
+        return self._conn.execute(*args)
+
+    def close(self):
+        self._finalizer()
+
+
+class IndexedMapping(Mapping):
+    """以 SQLite 索引為後端的唯讀 dict（按需查詢，只快取最近使用的項目）"""
+
+    def __init__(self, conn, lock, table: str, key_column: str, value_column: str,
+                 decode_json: bool = False, cache_size: int = 4096):
+        self._conn = conn
+        self._lock = lock
+        self._table = table
+        self._key_column = key_column
+        self._value_column = value_column
+        self._decode_json = decode_json
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._len = None
+
+    def _fetch(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._value_column} FROM {self._table} WHERE {self._key_column} = ?",
+                (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]) if self._decode_json else row[0]
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                return value
+        value = self._fetch(key)
+        if value is None:
+            raise KeyError(key)
+        with self._lock:
+            self._cache[key] = value
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        with self._lock:
+            keys = [row[0] for row in self._conn.execute(
+                f"SELECT {self._key_column} FROM {self._table}"
+            )]
+        return iter(keys)
+
+    def __len__(self):
+        if self._len is None:
+            with self._lock:
+                self._len = self._conn.execute(f"SELECT COUNT(*) FROM {self._table}").fetchone()[0]
+        return self._len
+
+    def count_by(self, column: str) -> dict:
+        """依欄位統計筆數（例如各資料類型的文件數）"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {column}, COUNT(*) FROM {self._table} GROUP BY {column}"
+            ).fetchall()
+        return {value: count for value, count in rows}
+
+    def close(self):
+        """立即關閉 SQLite 連線（與同一索引的其他映射共用連線；未呼叫時於最後一個引用釋放後關閉）"""
+        with self._lock:
+            self._conn.close()
+            self._cache.clear()
+
+    def where(self, clause: str, params: tuple = ()) -> list:
+        """以 SQL 條件篩選，回傳符合的 key 列表"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._key_column} FROM {self._table} WHERE {clause}", params
+            ).fetchall()
+        return [row[0] for row in rows]
+
+def open_index(index_path, base_path=None, sources=MAPPING_SOURCES):
+    """開啟 SQLite 索引
+
+    Args:
+        index_path: 索引檔路徑
+        base_path: data/ 目錄；提供時會檢查索引是否與映射檔內容一致
+
+    Returns:
+        (file_mapping, gemini_id_mapping, meta)，索引不存在、版本不符或已過期時返回 None
+    """
+    index_path = Path(index_path)
+    if not index_path.exists():
+        return None
+
+    try:
+        conn = sqlite3.connect(
+            f"file:{index_path}?mode=ro&immutable=1", uri=True, check_same_thread=False
+        )
+        meta = dict(conn.execute("SELECT key, value FROM meta").fetchall())
+    except sqlite3.Error:
+        return None
+
+    if meta.get('schema_version') != str(INDEX_SCHEMA_VERSION):
+        conn.close()
+        return None
+
+    if base_path is not None:
+        if json.loads(meta.get('source_fingerprint', 'null')) != source_fingerprint(base_path, sources):
+            conn.close()
+            return None
+
+    lock = threading.Lock()
+    conn = _IndexConnection(conn)
+    file_mapping = IndexedMapping(conn, lock, 'docs', 'doc_id', 'info', decode_json=True)
+    gemini_id_mapping = IndexedMapping(conn, lock, 'gemini_ids', 'gemini_id', 'doc_id')
+    return file_mapping, gemini_id_mapping, meta
+
+class MetadataRegistry:
+    """執行緒安全的映射檔登錄，依檔案 mtime / 大小決定是否重新載入"""
+
+    def __init__(self, base_path, sources=MAPPING_SOURCES, check_interval: float = 1.0,
+                 index_path=None):
+        """
+        Args:
+            base_path: data/ 目錄
+            sources: 參與合併的映射檔
+            check_interval: 兩次檢查檔案狀態之間的最短間隔（秒），0 表示每次都檢查
+            index_path: SQLite 索引路徑（預設為 data/metadata_index.sqlite，不存在時改用 JSON）
+        """
+        self.base_path = Path(base_path)
+        self.sources = tuple(sources)
+        self.check_interval = check_interval
+        self.index_path = Path(index_path) if index_path else self.base_path / DEFAULT_INDEX_NAME
+
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()  # 命中計數用（重新載入期間不必等待 _lock）
+        self._snapshot = None
+        self._last_check = 0.0
+        self._hits = 0
+        self._loads = 0
+
+    def _signature(self) -> tuple:
+        """所有映射檔的 (路徑, mtime, 大小)，檔案不存在時為 None"""
+        signature = []
+        for relpath in [source.relpath for source in self.sources] + [self.index_path]:
+            try:
+                st = os.stat(self.base_path / relpath)
+                signature.append((str(relpath), st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append((str(relpath), None, None))
+        return tuple(signature)
+
+    def _load(self, signature: tuple) -> MetadataSnapshot:
+        start = time.perf_counter()
+
+        # 優先使用與映射檔一致的 SQLite 索引
+        opened = open_index(self.index_path, self.base_path, self.sources)
+        if opened is not None:
+            file_mapping, gemini_id_mapping, meta = opened
+            return MetadataSnapshot(
+                file_mapping=file_mapping,
+                gemini_id_mapping=gemini_id_mapping,
+                signature=signature,
+                version=meta.get('content_hash', '')[:12],
+                loaded_at=time.time(),
+                load_seconds=time.perf_counter() - start,
+                backend='sqlite'
+            )
+
+        raw, errors = read_sources(self.base_path, self.sources)
+        file_mapping, gemini_id_mapping = merge_mappings(raw)
+        version = hashlib.sha1(repr(signature).encode('utf-8')).hexdigest()[:12]
+
+        return MetadataSnapshot(
+            file_mapping=file_mapping,
+            gemini_id_mapping=gemini_id_mapping,
+            signature=signature,
+            version=version,
+            loaded_at=time.time(),
+            load_seconds=time.perf_counter() - start,
+            errors=tuple(errors)
+        )
+
+    def snapshot(self) -> MetadataSnapshot:
+        """取得目前的映射內容（必要時重新載入）"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+
+        if snapshot is not None and now - self._last_check < self.check_interval:
+            with self._stats_lock:
+                self._hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            signature = self._signature()
+            self._last_check = time.monotonic()
+
+            if snapshot is not None and snapshot.signature == signature:
+                with self._stats_lock:
+                    self._hits += 1
+                return snapshot
+
+            # 舊快照不在這裡關閉：其他執行緒可能仍在讀取，其 SQLite 連線於最後一個引用釋放時關閉
+            snapshot = self._load(signature)
+            self._snapshot = snapshot
+            self._loads += 1
+            return snapshot
+
+    def get_file_mapping(self) -> dict:
+        """document_id → 文件資訊"""
+        return self.snapshot().file_mapping
+
+    def get_gemini_id_mapping(self) -> dict:
+        """gemini_file_id → document_id"""
+        return self.snapshot().gemini_id_mapping
+
+    def stats(self) -> dict:
+        """載入時間、筆數與命中統計"""
+        snapshot = self._snapshot
+        stats = {
+            'loads': self._loads,
+            'hits': self._hits,
+            'version': None,
+            'backend': None,
+            'loaded_at': None,
+            'load_seconds': None,
+            'counts': {}
+        }
+        if snapshot is not None:
+            stats.update({
+                'version': snapshot.version,
+                'backend': snapshot.backend,
+                'loaded_at': snapshot.loaded_at,
+                'load_seconds': snapshot.load_seconds,
+                'counts': snapshot.counts()
+            })
+        return stats
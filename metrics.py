@@ -0,0 +1,372 @@
+"""
+查詢流程的分段計時與指標
+
+記錄每個查詢各階段的耗時（system instruction 建立、Gemini 呼叫、grounding 解析、
+映射檔載入、ID 對應、連結插入、來源顯示）、token 用量，以及快取、重試與對沖的結果，
+彙整為程序內的直方圖與計數器：
+  - 直方圖同時保留固定區間的累計次數（匯出 Prometheus）與最近 N 筆樣本（即時百分位數）
+  - 可匯出為 Prometheus 文字格式或 JSON lines，也可啟動 HTTP 端點供 Prometheus 抓取
+  - 每個查詢的分段計時（Trace）可另外逐筆寫入 JSON lines 檔
+
+用於判斷查詢變慢是 Gemini、檢索，還是我們自己的程式碼。
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 延遲區間（秒）
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+# token 數區間
+TOKEN_BUCKETS = (256, 1024, 2048, 4096, 8192, 16384, 32768, 65536, 131072)
+
+# 各階段的中文名稱（除錯資訊與指標頁面使用）
+STAGE_LABELS = {
+    'local_analytics': '本地統計',
+    'identifier_lookup': '識別碼比對',
+    'answer_cache_lookup': '答案快取查詢',
+    'similar_lookup': '相似查詢比對',
+    'system_instruction': '建立 system instruction',
+    'prompt_cache': '指令快取',
+    'scheduler_wait': '排隊等待',
+    'single_flight_wait': '等待相同查詢',
+    'store_fanout': '多資料庫檢索',
+    'source_merge': '來源合併',
+    'gemini_call': 'Gemini 呼叫',
+    'gemini_first_chunk': 'Gemini 首個 chunk',
+    'stream_render': '串流顯示',
+    'grounding_extraction': 'grounding 解析',
+    'mapping_load': '映射檔載入',
+    'id_resolution': '文件 ID 對應',
+    'link_insertion': '連結插入',
+    'answer_rendering': '答案顯示',
+    'source_rendering': '來源顯示',
+}
+
+DESCRIPTIONS = {
+    'stage_seconds': '查詢流程各階段耗時（秒）',
+    'query_seconds': '查詢端到端耗時（秒）',
+    'request_prompt_tokens': '每次 Gemini 請求的輸入 token 數',
+    'queries_total': '查詢次數',
+    'cache_lookups_total': '答案快取查詢結果',
+    'retries_total': '重新查詢次數',
+    'hedge_runs_total': '對沖查詢結果',
+    'single_flight_total': '相同查詢合併（leader 實際呼叫、follower 共用結果）',
+    'store_fanout_total': '多資料庫檢索各 Store 的結果（ok / timeout / error）',
+    'identifier_lookups_total': '識別碼比對（local 直接列出文件、mention 先列出文件再查詢、none 未比對到）',
+    'tokens_total': 'Gemini token 用量',
+    'cost_usd_total': 'Gemini 估計花費（美元）',
+    'errors_total': '錯誤次數',
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((name, str(value)) for name, value in labels.items() if value is not None))
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    items = key + extra
+    if not items:
+        return ''
+    escaped = (
+        f'{name}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in items
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _nearest_rank(samples: list, p: float) -> float:
+    """已排序樣本的第 p 百分位數（最近排名法），沒有樣本時返回 None"""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, int(round(p * (len(samples) - 1)))))]
+
+
+class Histogram:
+    """固定區間直方圖，另保留最近的樣本用於即時百分位數（執行緒安全）"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, window: int = 1024):
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)  # 最後一格為 +Inf
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            self._counts[index] += 1
+            self._recent.append(value)
+            self.count += 1
+            self.sum += value
+
+    def percentile(self, p: float) -> float:
+        """最近樣本的第 p 百分位數（p 介於 0 到 1），沒有樣本時返回 None"""
+        with self._lock:
+            samples = sorted(self._recent)
+        return _nearest_rank(samples, p)
+
+    def cumulative_buckets(self) -> list:
+        """[(上限, 累計次數), ...]，最後一項上限為 +Inf"""
+        with self._lock:
+            counts = list(self._counts)
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            total += count
+            cumulative.append((bound, total))
+        return cumulative
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            samples = sorted(self._recent)
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else None,
+            'p50': _nearest_rank(samples, 0.5),
+            'p95': _nearest_rank(samples, 0.95),
+            'p99': _nearest_rank(samples, 0.99),
+            'max': samples[-1] if samples else None,
+            'window': len(samples)
+        }
+
+
+class Trace:
+    """單一查詢的分段計時（同時寫入共用的 MetricsRegistry）"""
+
+    def __init__(self, registry: 'MetricsRegistry'):
+        self.registry = registry
+        self.stages = {}
+        self.attributes = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()  # 對沖查詢會在多個執行緒中寫入同一個 trace
+
+    @contextmanager
+    def span(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        self.registry.observe('stage_seconds', seconds, stage=stage)
+
+    def set(self, **attributes):
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def finish(self, path: str, outcome: str) -> dict:
+        """結束查詢：記錄端到端耗時與查詢次數，返回本次查詢的紀錄"""
+        total = self.elapsed()
+        self.registry.observe('query_seconds', total, path=path, outcome=outcome)
+        self.registry.inc('queries_total', path=path, outcome=outcome)
+        record = self.to_dict(path=path, outcome=outcome, total_seconds=round(total, 4))
+        self.registry.log(record)
+        return record
+
+    def to_dict(self, **extra) -> dict:
+        with self._lock:
+            stages = {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+            attributes = dict(self.attributes)
+        return {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            **extra,
+            'stages': stages,
+            **attributes
+        }
+
+    def summary(self, min_seconds: float = 0.001) -> str:
+        """各階段耗時的簡短說明（依耗時由大到小，省略短於 min_seconds 的階段）"""
+        with self._lock:
+            stages = sorted(self.stages.items(), key=lambda item: item[1], reverse=True)
+        shown = [
+            f"{STAGE_LABELS.get(stage, stage)} {seconds * 1000:,.0f} ms"
+            for stage, seconds in stages if seconds >= min_seconds
+        ]
+        if len(shown) < len(stages):
+            shown.append(f"其餘 {len(stages) - len(shown)} 個階段各不到 {min_seconds * 1000:g} ms")
+        return '、'.join(shown)
+
+
+class MetricsRegistry:
+    """程序內的直方圖與計數器（所有 session 共用）"""
+
+    def __init__(self, namespace: str = 'fsc', window: int = 1024, log_path=None):
+        """
+        Args:
+            namespace: 匯出時的指標名稱前綴
+            window: 即時百分位數使用的最近樣本數
+            log_path: 每個查詢的分段計時逐筆寫入的 JSON lines 檔（None 表示不寫入）
+        """
+        self.namespace = namespace
+        self.window = window
+        self.log_path = Path(log_path) if log_path else None
+        self._lock = threading.Lock()
+        self._log_lock = threading.Lock()
+        self._histograms = {}  # (名稱, 標籤) → Histogram
+        self._counters = {}    # (名稱, 標籤) → 數值
+
+    def histogram(self, name: str, buckets=LATENCY_BUCKETS, **labels) -> Histogram:
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(buckets, self.window)
+        return histogram
+
+    def observe(self, name: str, value: float, buckets=LATENCY_BUCKETS, **labels):
+        self.histogram(name, buckets, **labels).observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    @contextmanager
+    def span(self, stage: str):
+        """不屬於任何查詢的分段計時"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe('stage_seconds', time.perf_counter() - start, stage=stage)
+
+    def trace(self) -> Trace:
+        return Trace(self)
+
+    def record_usage(self, usage: dict):
+        """記錄一次 Gemini 請求的 token 用量（extract_usage 的結果）"""
+        if not usage:
+            return
+        for kind in ('prompt', 'cached', 'output', 'thoughts', 'tool_prompt'):
+            amount = usage.get(f'{kind}_tokens') or 0
+            if amount:
+                self.inc('tokens_total', amount, kind=kind)
+        if usage.get('prompt_tokens'):
+            self.observe('request_prompt_tokens', usage['prompt_tokens'], TOKEN_BUCKETS)
+
+    def log(self, record: dict):
+        """將一筆查詢紀錄附加到 JSON lines 檔"""
+        if self.log_path is None:
+            return
+        line = json.dumps(record, ensure_ascii=False)
+        with self._log_lock:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+
+    def snapshot(self) -> dict:
+        """{'histograms': [...], 'counters': [...]}，依名稱與標籤排序"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+        return {
+            'histograms': [
+                {'name': name, 'labels': dict(labels), **histogram.snapshot()}
+                for (name, labels), histogram in histograms
+            ],
+            'counters': [
+                {'name': name, 'labels': dict(labels), 'value': value}
+                for (name, labels), value in counters
+            ]
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文字格式（exposition format 0.0.4）"""
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+            counters = sorted(self._counters.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name: str, kind: str):
+            if name not in declared:
+                declared.add(name)
+                base = name.removeprefix(f'{self.namespace}_')
+                lines.append(f"# HELP {name} {DESCRIPTIONS.get(base, base)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), histogram in histograms:
+            full_name = f'{self.namespace}_{name}'
+            declare(full_name, 'histogram')
+            for bound, count in histogram.cumulative_buckets():
+                lines.append(f"{full_name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {count}")
+            lines.append(f"{full_name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+            lines.append(f"{full_name}_count{_format_labels(labels)} {histogram.count}")
+
+        for (name, labels), value in counters:
+            full_name = f'{self.namespace}_{name}'
+            declare(full_name, 'counter')
+            lines.append(f"{full_name}{_format_labels(labels)} {_format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+    def to_json_lines(self) -> str:
+        """每個指標序列一行 JSON（含時間戳記，可直接附加到檔案）"""
+        timestamp = datetime.now().isoformat(timespec='seconds')
+        snapshot = self.snapshot()
+        lines = [
+            json.dumps({'timestamp': timestamp, 'type': 'histogram', **item}, ensure_ascii=False)
+            for item in snapshot['histograms']
+        ]
+        lines += [
+            json.dumps({'timestamp': timestamp, 'type': 'counter', **item}, ensure_ascii=False)
+            for item in snapshot['counters']
+        ]
+        return '\n'.join(lines) + ('\n' if lines else '')
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+class _ExporterHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.partition('?')[0]
+        if path == '/metrics':
+            body, content_type = self.server.registry.to_prometheus(), 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.jsonl':
+            body, content_type = self.server.registry.to_json_lines(), 'application/x-ndjson; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_http_exporter(registry: MetricsRegistry, port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """在背景執行緒提供 /metrics（Prometheus）與 /metrics.jsonl"""
+    server = ThreadingHTTPServer((host, port), _ExporterHandler)
+    server.daemon_threads = True
+    server.registry = registry
+    threading.Thread(target=server.serve_forever, name='metrics-exporter', daemon=True).start()
+    return server
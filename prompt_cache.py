@@ -0,0 +1,220 @@
+"""
+System instruction 的 Gemini 內容快取（context caching）
+
+system instruction（格式規則 + 法條連結表）每次查詢都相同，卻每次都重新傳送、計費。
+這裡將它與 File Search 工具設定上傳為 cached content，查詢時只傳 cached_content 名稱：
+  - 依 (模型, Store, system instruction 雜湊) 管理快取；法條連結表變動時自動建立新快取
+  - 快取接近到期時延長 TTL，延長失敗則重新建立；被取代的舊快取保留一段寬限期再刪除
+    （其他執行緒可能剛取得舊名稱，請求仍在進行中）
+  - 建立失敗（例如 token 數不足、API 不支援）時暫停一段時間，期間改用內嵌指令
+  - 建立與延長快取的網路呼叫不持有鎖，同一 (模型, Store) 同時只有一個執行緒呼叫
+"""
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+
+from startup import lazy_module
+
+types = lazy_module('google.genai.types')  # 第一次建立快取時才匯入
+
+
+class CachedPromptManager:
+    """管理 system instruction 的 cached content（執行緒安全）"""
+
+    def __init__(self, client, ttl_seconds: int = 3600, refresh_margin: int = 300,
+                 retry_after: int = 600, wait_timeout: float = 30.0, retire_grace: float = 120.0):
+        """
+        Args:
+            client: genai.Client（或具有相同 caches 介面的假 client）
+            ttl_seconds: 快取 TTL（秒）
+            refresh_margin: 距離到期少於此秒數時延長 TTL
+            retry_after: 建立失敗後，多久之後才再嘗試（秒）
+            wait_timeout: 等待其他執行緒建立快取的上限（秒），逾時則改用內嵌指令
+            retire_grace: 被取代的快取保留多久才刪除（秒），在此之前到期的舊快取不另外刪除
+        """
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.wait_timeout = wait_timeout
+        self.retire_grace = retire_grace
+
+        self._lock = threading.Lock()
+        self._entries = {}         # (model, store_id) → {'hash', 'name', 'expires_at'}
+        self._disabled_until = {}  # (model, store_id) → 暫停到何時（time.time()）
+        self._in_flight = {}       # (model, store_id) → 建立/延長中的 threading.Event
+        self._retired = []         # [(被取代的快取名稱, 何時刪除)]
+        self._stats = {
+            'hits': 0,
+            'created': 0,
+            'refreshed': 0,
+            'failures': 0,
+            'fallbacks': 0
+        }
+        self.last_error = None
+
+    @staticmethod
+    def _expires_at(cached_content, default: float) -> float:
+        expire_time = getattr(cached_content, 'expire_time', None)
+        if isinstance(expire_time, datetime):
+            if expire_time.tzinfo is None:
+                expire_time = expire_time.replace(tzinfo=timezone.utc)
+            return expire_time.timestamp()
+        return default
+
+    def _create(self, model: str, store_id: str, system_instruction: str, instruction_hash: str) -> dict:
+        cached_content = self.client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                display_name=f"fsc-penalties-{instruction_hash}",
+                system_instruction=system_instruction,
+                tools=[
+                    types.Tool(
+                        file_search=types.FileSearch(
+                            file_search_store_names=[store_id]
+                        )
+                    )
+                ],
+                ttl=f"{self.ttl_seconds}s"
+            )
+        )
+        return {
+            'hash': instruction_hash,
+            'name': cached_content.name,
+            'expires_at': self._expires_at(cached_content, time.time() + self.ttl_seconds)
+        }
+
+    def _refresh(self, name: str):
+        """延長快取 TTL，返回新的到期時間（失敗時返回 None）"""
+        try:
+            cached_content = self.client.caches.update(
+                name=name,
+                config=types.UpdateCachedContentConfig(ttl=f"{self.ttl_seconds}s")
+            )
+        except Exception as e:
+            self.last_error = str(e)
+            return None
+        return self._expires_at(cached_content, time.time() + self.ttl_seconds)
+
+    def _delete(self, name: str):
+        try:
+            self.client.caches.delete(name=name)
+        except Exception:
+            pass  # 舊快取到期後會自動刪除
+
+    def _retire(self, entry: dict, now: float):
+        """記錄被取代的快取，寬限期過後才刪除（呼叫前需持有鎖）"""
+        if entry['expires_at'] > now + self.retire_grace:
+            self._retired.append((entry['name'], now + self.retire_grace))
+
+    def _pop_retired(self, now: float) -> list:
+        """寬限期已過的舊快取名稱（呼叫前需持有鎖）"""
+        due = [name for name, delete_after in self._retired if delete_after <= now]
+        self._retired = [item for item in self._retired if item[1] > now]
+        return due
+
+    def get(self, model: str, store_id: str, system_instruction: str):
+        """取得可用的 cached content 名稱
+
+        建立與延長快取是網路呼叫，不在鎖內執行：同一 (模型, Store) 只由一個執行緒呼叫，
+        其他執行緒在快取尚未到期時直接使用舊快取，否則等待該呼叫完成（逾時則改用內嵌指令）。
+
+        Returns:
+            cached content 名稱，無法使用快取時返回 None（呼叫端應改用內嵌指令）
+        """
+        key = (model, store_id)
+        instruction_hash = hashlib.sha256(system_instruction.encode('utf-8')).hexdigest()[:16]
+        deadline = time.monotonic() + self.wait_timeout
+
+        while True:
+            now = time.time()
+            with self._lock:
+                if self._disabled_until.get(key, 0) > now:
+                    self._stats['fallbacks'] += 1
+                    return None
+
+                entry = self._entries.get(key)
+                usable = entry is not None and entry['hash'] == instruction_hash and entry['expires_at'] > now
+                if usable and entry['expires_at'] - now > self.refresh_margin:
+                    self._stats['hits'] += 1
+                    return entry['name']
+
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    in_flight = self._in_flight[key] = threading.Event()
+                    break
+                if usable:
+                    # 其他執行緒正在延長或重新建立：舊快取尚未到期，直接使用
+                    self._stats['hits'] += 1
+                    return entry['name']
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not in_flight.wait(remaining):
+                with self._lock:
+                    self._stats['fallbacks'] += 1
+                return None
+
+        # 由目前的執行緒執行網路呼叫（鎖外），完成後才在鎖內更新快取
+        expired = []
+        try:
+            if usable:
+                expires_at = self._refresh(entry['name'])
+                if expires_at is not None:
+                    with self._lock:
+                        entry['expires_at'] = expires_at
+                        self._stats['refreshed'] += 1
+                    return entry['name']
+
+            # 沒有快取、法條連結表已變動、快取已到期或延長失敗：建立新快取
+            try:
+                new_entry = self._create(model, store_id, system_instruction, instruction_hash)
+            except Exception as e:
+                self.last_error = str(e)
+                with self._lock:
+                    self._stats['failures'] += 1
+                    self._stats['fallbacks'] += 1
+                    self._disabled_until[key] = time.time() + self.retry_after
+                return None
+
+            with self._lock:
+                replaced = self._entries.get(key)
+                self._entries[key] = new_entry
+                self._stats['created'] += 1
+                # 其他執行緒可能剛取得舊快取的名稱，不立即刪除
+                if replaced is not None:
+                    self._retire(replaced, time.time())
+            return new_entry['name']
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+                expired = self._pop_retired(time.time())
+            in_flight.set()
+            for name in expired:
+                self._delete(name)
+
+    def invalidate(self, model: str, store_id: str, name: str):
+        """使用快取的請求失敗時呼叫：name 仍是目前的快取時捨棄並暫停使用一段時間
+
+        Args:
+            name: 失敗的請求使用的快取名稱；已被其他執行緒換成新快取時不做任何事
+        """
+        key = (model, store_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['name'] != name:
+                return
+            del self._entries[key]
+            self._disabled_until[key] = time.time() + self.retry_after
+        self._delete(name)
+
+    def stats(self) -> dict:
+        """快取使用統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._entries)
+        stats['last_error'] = self.last_error
+        return stats
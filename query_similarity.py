@@ -0,0 +1,222 @@
+"""
+相似查詢索引
+
+以字元 bigram / trigram 的 TF-IDF 餘弦相似度，找出與目前查詢「換句話說」的既有查詢，
+讓快取可以服務措辭不同但意思相同的問題，例如：
+  「違反金控法利害關係人規定會受到什麼處罰？」
+  「金控法利害關係人違規的處罰」
+
+比對前會統一全形/半形、將法律簡稱換成全名（law_index.LAW_ALIASES）、
+統一「裁罰」「罰則」等同義詞、移除標點與常見的疑問贅詞；
+查詢中的數字（年份、金額、條號）必須完全一致才視為相似，避免 2023 年與 2024 年的問題互相取代。
+
+n-gram 相似度無法分辨只差一兩個字的主體（「證券商」與「票券商」、「銀行法」與「金控法」），
+直接使用既有答案前另以 same_subject 確認兩個查詢提到的機構類型、業務局與法律名稱相同。
+"""
+
+import math
+import re
+import threading
+import unicodedata
+from collections import Counter, OrderedDict, namedtuple
+
+from law_index import LAW_ALIASES
+
+# 比對時忽略的疑問贅詞，以及「違反」「規定」等幾乎每個查詢都有的詞
+FILLER_RE = re.compile(r'請問|想知道|有哪些|哪些|什麼|有何|是否|會受到|受到|會有|會被|會怎麼|怎麼|如何|關於|違反|違規|規定|的案例|的|嗎|呢')
+
+# 比對前換成同一寫法的詞：法律簡稱換成全名（「金控法」與「金融控股公司法」視為相同）、處罰的同義詞
+FOLD_TERMS = {**LAW_ALIASES, '裁罰': '處罰', '罰則': '處罰'}
+
+_FOLD_TERMS_RE = re.compile('|'.join(sorted(map(re.escape, FOLD_TERMS), key=len, reverse=True)))
+
+_DIGITS_RE = re.compile(r'\d+')
+
+# n-gram 長度
+NGRAM_SIZES = (2, 3)
+
+SimilarMatch = namedtuple('SimilarMatch', ['score', 'key', 'query'])
+
+
+def fold_text(text: str) -> str:
+    """正規化文字：全形/半形統一、轉小寫、法律簡稱與同義詞換成同一寫法、移除標點符號/空白與疑問贅詞"""
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    text = ''.join(ch for ch in text if unicodedata.category(ch)[0] not in 'PSZC')
+    text = _FOLD_TERMS_RE.sub(lambda match: FOLD_TERMS[match.group()], text)
+    return FILLER_RE.sub('', text)
+
+
+def char_ngrams(folded: str) -> Counter:
+    """字元 n-gram 詞頻"""
+    grams = Counter()
+    for size in NGRAM_SIZES:
+        for i in range(len(folded) - size + 1):
+            grams[folded[i:i + size]] += 1
+    if not grams and folded:
+        grams[folded] += 1
+    return grams
+
+
+# 查詢主體：機構類型（正規化名稱 → 比對樣式）；後面接「法」「條例」等時是法律名稱，不算機構
+INSTITUTION_PATTERNS = {
+    '金控': r'金融控股公司|金控',
+    '銀行': r'銀行',
+    '證券商': r'證券商|證券公司|(?<!票)券商',
+    '票券商': r'票券商|票券公司|票券金融公司',
+    '期貨商': r'期貨商|期貨公司',
+    '投信': r'投信|證券投資信託(?:事業|公司)',
+    '投顧': r'投顧|證券投資顧問(?:事業|公司)',
+    '壽險': r'壽險|人壽',
+    '產險': r'產險|產物保險',
+    '保險業': r'保險公司|保險業',
+    '保經代': r'保險經紀人|保險代理人',
+    '信合社': r'信用合作社|信合社',
+    '電子支付': r'電子支付機構|電支機構',
+    '農漁會': r'農會|漁會',
+}
+
+# 業務局（名稱內含機構類型，例如「銀行局」含「銀行」，比對機構前先移除）
+BUREAU_PATTERNS = {
+    '銀行局': r'銀行局',
+    '證券期貨局': r'證券期貨局|證期局',
+    '保險局': r'保險局',
+    '檢查局': r'檢查局',
+}
+
+_INSTITUTION_RES = [(name, re.compile(f'(?:{pattern})(?!法|條例|管理|施行)'))
+                    for name, pattern in INSTITUTION_PATTERNS.items()]
+_BUREAU_RES = [(name, re.compile(pattern)) for name, pattern in BUREAU_PATTERNS.items()]
+
+
+def subject_terms(query: str, law_index=None) -> frozenset:
+    """查詢提到的機構類型、業務局與法律名稱
+
+    Args:
+        query: 查詢文字
+        law_index: LawIndex（提供時以 mentioned_laws 取得法律名稱，含常用簡稱）
+
+    Returns:
+        正規化名稱的集合，法律名稱以「law:」開頭
+    """
+    text = unicodedata.normalize('NFKC', query or '')
+    terms = set()
+    for name, pattern in _BUREAU_RES:
+        if pattern.search(text):
+            terms.add(name)
+            text = pattern.sub('', text)
+    terms.update(name for name, pattern in _INSTITUTION_RES if pattern.search(text))
+    if law_index is not None:
+        terms.update(f"law:{name}" for name in law_index.mentioned_laws(query or ''))
+    return frozenset(terms)
+
+
+def same_subject(query: str, other: str, law_index=None) -> bool:
+    """兩個查詢提到的機構類型、業務局與法律名稱是否相同"""
+    return subject_terms(query, law_index) == subject_terms(other, law_index)
+
+
+class SimilarQueryIndex:
+    """既有查詢的 n-gram 倒排索引（執行緒安全，超過上限時淘汰最舊的查詢）"""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key → (query, scope, grams, digits)
+        self._postings = {}            # gram → {key, ...}
+        self._df = Counter()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _idf(self, gram: str) -> float:
+        return math.log((len(self._entries) + 1) / (self._df.get(gram, 0) + 1)) + 1.0
+
+    def _remove(self, key: str):
+        """移除查詢（呼叫前需持有鎖）"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for gram in entry[2]:
+            keys = self._postings.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+            self._df[gram] -= 1
+            if self._df[gram] <= 0:
+                del self._df[gram]
+
+    def add(self, key: str, query: str, scope: str = ''):
+        """加入已有答案的查詢
+
+        Args:
+            key: 對應的答案快取鍵
+            query: 原始查詢文字
+            scope: 查詢範圍（Store、模型、篩選條件等），只有相同範圍的查詢才會互相比對
+        """
+        folded = fold_text(query)
+        grams = char_ngrams(folded)
+        digits = tuple(_DIGITS_RE.findall(folded))
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (query, scope, grams, digits)
+            for gram in grams:
+                self._postings.setdefault(gram, set()).add(key)
+                self._df[gram] += 1
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def remove(self, key: str):
+        """移除查詢（例如對應的快取已失效）"""
+        with self._lock:
+            self._remove(key)
+
+    def search(self, query: str, scope: str = '', min_score: float = 0.0, limit: int = 3) -> list:
+        """找出最相似的既有查詢
+
+        Args:
+            query: 查詢文字
+            scope: 查詢範圍
+            min_score: 最低相似度
+            limit: 最多返回筆數
+
+        Returns:
+            SimilarMatch 列表（相似度由高到低）
+        """
+        folded = fold_text(query)
+        grams = char_ngrams(folded)
+        digits = tuple(_DIGITS_RE.findall(folded))
+        if not grams:
+            return []
+
+        with self._lock:
+            weights = {gram: count * self._idf(gram) for gram, count in grams.items()}
+            query_norm = math.sqrt(sum(w * w for w in weights.values()))
+
+            candidates = set()
+            for gram in grams:
+                candidates.update(self._postings.get(gram, ()))
+
+            matches = []
+            for key in candidates:
+                entry_query, entry_scope, entry_grams, entry_digits = self._entries[key]
+                if entry_scope != scope or entry_digits != digits:
+                    continue
+
+                dot = 0.0
+                entry_norm_sq = 0.0
+                for gram, count in entry_grams.items():
+                    weight = count * self._idf(gram)
+                    entry_norm_sq += weight * weight
+                    if gram in weights:
+                        dot += weights[gram] * weight
+
+                if dot <= 0 or entry_norm_sq <= 0:
+                    continue
+                score = dot / (query_norm * math.sqrt(entry_norm_sq))
+                if score >= min_score:
+                    matches.append(SimilarMatch(score, key, entry_query))
+
+        matches.sort(key=lambda match: match.score, reverse=True)
+        return matches[:limit]
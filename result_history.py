@@ -0,0 +1,84 @@
+"""
+查詢結果紀錄（每個 session 一份，存放在 st.session_state）
+
+Streamlit 任何互動（快速查詢按鈕、清除、切換篩選條件）都會重新執行整個腳本，
+查詢結果原本只在「按下查詢」的那一次執行中顯示，之後就消失，使用者只好再查一次（再呼叫一次 Gemini）。
+這裡保存已處理完成的結果（加入連結後的答案、已對應到文件的參考來源、除錯資訊），
+重新執行時直接顯示，不必重新查詢或重新處理。
+
+紀錄有筆數與總字數上限，超過時從最舊的開始淘汰（最新的一筆一定保留）；
+相同查詢（查詢文字與篩選條件相同）再查一次時取代舊的紀錄。
+"""
+
+import itertools
+import json
+from collections import OrderedDict
+
+
+def entry_size(entry: dict) -> int:
+    """紀錄的大約字數（答案與參考來源片段）"""
+    size = len(entry.get('markdown') or '') + len(entry.get('message') or '') + len(entry.get('identifier_docs') or '')
+    for source in entry.get('sources') or ():
+        size += len(source.get('snippet') or '') + len(source.get('display_name') or '')
+    return size
+
+
+class ResultHistory:
+    """有上限的查詢結果紀錄（依加入順序，最新的在最後）"""
+
+    def __init__(self, max_entries: int = 5, max_chars: int = 200_000):
+        """
+        Args:
+            max_entries: 最多保存的筆數
+            max_chars: 所有紀錄的總字數上限
+        """
+        self.max_entries = max(1, max_entries)
+        self.max_chars = max_chars
+        self._entries = OrderedDict()  # id → 紀錄
+        self._sizes = {}
+        self._ids = itertools.count(1)
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _same_query(entry: dict, query: str, filters: dict) -> bool:
+        return entry['query'] == query and json.dumps(entry.get('filters') or {}, sort_keys=True) == \
+            json.dumps(filters or {}, sort_keys=True)
+
+    def add(self, entry: dict) -> str:
+        """加入一筆紀錄（entry 需含 query、filters），返回紀錄 ID"""
+        for entry_id, existing in list(self._entries.items()):
+            if self._same_query(existing, entry['query'], entry.get('filters')):
+                self._remove(entry_id)
+
+        entry_id = f"r{next(self._ids)}"
+        entry['id'] = entry_id
+        self._entries[entry_id] = entry
+        self._sizes[entry_id] = entry_size(entry)
+
+        while len(self._entries) > 1 and (len(self._entries) > self.max_entries
+                                          or sum(self._sizes.values()) > self.max_chars):
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+        return entry_id
+
+    def _remove(self, entry_id: str):
+        del self._entries[entry_id]
+        del self._sizes[entry_id]
+
+    def get(self, entry_id: str):
+        return self._entries.get(entry_id)
+
+    def latest(self):
+        """最新的紀錄，沒有紀錄時返回 None"""
+        return next(reversed(self._entries.values()), None)
+
+    def ids(self) -> list:
+        """紀錄 ID（最新的在前）"""
+        return list(reversed(self._entries))
+
+    def clear(self):
+        self._entries.clear()
+        self._sizes.clear()
@@ -0,0 +1,362 @@
+"""
+Gemini 請求排程器（所有 session 共用）
+
+原本每個 session 各自直接呼叫 Gemini：流量突增時所有請求同時碰到配額上限（429），
+使用者看到原始錯誤訊息後再按一次查詢，讓情況更糟。這裡在程序內統一排程：
+  - 權杖桶（token bucket）依 API 金鑰的每分鐘請求數（RPM）與每分鐘 token 數（TPM）放行請求
+  - 優先順序：互動查詢 > 對沖請求 > 批次查詢 > 預熱；同一優先順序先到先放行
+  - 遇到 429 / 503 時以 AIMD 調整速率：放行速率減半並依連續失敗次數指數退避（含隨機抖動），
+    之後每次成功逐步恢復；被限流的請求保留原本的排隊順序重新排隊
+  - 等待佇列有上限：佇列已滿時淘汰優先順序較低的請求，沒有可淘汰的請求時直接拒絕新請求，
+    避免請求無限堆積（負載過高時快速失敗，而不是全部逾時）
+  - 排隊中的請求可透過 on_wait 取得目前排隊位置與預估等待時間（顯示在介面上）
+"""
+
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# 優先順序（數字越小越優先）
+PRIORITIES = {
+    'interactive': 0,  # 使用者在介面上的查詢
+    'hedge': 1,        # 對沖查詢的第二個請求（推測性質，負載高時先讓給互動查詢）
+    'batch': 2,        # 批次查詢
+    'prewarm': 3,      # 快取預熱
+}
+
+# 各優先順序最多排隊等待的秒數（None 表示不限制）
+DEFAULT_MAX_WAIT = {
+    'interactive': 60.0,
+    'hedge': 10.0,
+    'batch': None,
+    'prewarm': 30.0,
+}
+
+# 視為配額不足或暫時無法服務、可重新排隊的錯誤
+RETRYABLE_CODES = (429, 503)
+RETRYABLE_STATUSES = ('RESOURCE_EXHAUSTED', 'UNAVAILABLE')
+
+
+class SchedulerOverloaded(Exception):
+    """排程器負載過高：佇列已滿被拒絕、被較高優先順序的請求淘汰，或退避期間不接受低優先順序的請求"""
+
+
+class SchedulerTimeout(SchedulerOverloaded):
+    """排隊超過等待上限"""
+
+
+def is_retryable(error: Exception) -> bool:
+    """錯誤是否為配額不足（429）或服務暫時無法使用（503）"""
+    code = getattr(error, 'code', None)
+    status = getattr(error, 'status', None)
+    return code in RETRYABLE_CODES or status in RETRYABLE_STATUSES
+
+
+class TokenBucket:
+    """權杖桶（由 RequestScheduler 加鎖使用，本身不是執行緒安全的）"""
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        """
+        Args:
+            rate: 每秒補充的權杖數
+            capacity: 權杖上限（允許的瞬間突發量）
+            now: 目前時間（time.monotonic）
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self._updated = now
+
+    def _refill(self, now: float):
+        if now > self._updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+            self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """取得 amount 個權杖還需要等待的秒數（超過上限的數量以上限計算）"""
+        self._refill(now)
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate) if missing > 0 else 0.0
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+    def adjust(self, amount: float):
+        """事後修正扣除量（正數為補扣，負數為退還；可扣到負值，之後的請求會等待補足）"""
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def drain(self, now: float):
+        """清空權杖（退避結束後從零開始累積，避免瞬間送出大量請求）"""
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Ticket:
+    """等待中的請求"""
+
+    __slots__ = ('priority', 'seq', 'tokens', 'evicted', 'done')
+
+    def __init__(self, priority: int, seq: int, tokens: float):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.evicted = False  # 被較高優先順序的請求淘汰
+        self.done = False     # 已放行、逾時或被淘汰（留在 heap 中的項目之後略過）
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class RequestScheduler:
+    """以權杖桶與 AIMD 退避排程 Gemini 請求（可跨執行緒共用）"""
+
+    def __init__(self, requests_per_minute: float = 300, tokens_per_minute: float = 1_000_000,
+                 burst_seconds: float = 2.0, max_queue: int = 64, max_wait: dict = None,
+                 max_retries: int = 2, min_rate_ratio: float = 0.25, increase_ratio: float = 0.1,
+                 base_backoff: float = 1.0, max_backoff: float = 30.0, shed_during_backoff: str = 'prewarm',
+                 seed: int = None, clock=time.monotonic):
+        """
+        Args:
+            requests_per_minute: API 金鑰的每分鐘請求數上限（RPM）
+            tokens_per_minute: API 金鑰的每分鐘 token 數上限（TPM）
+            burst_seconds: 權杖桶容量相當於幾秒的額度（允許的瞬間突發量）
+            max_queue: 等待佇列上限
+            max_wait: 各優先順序最多排隊等待的秒數（未列出的沿用 DEFAULT_MAX_WAIT）
+            max_retries: 遇到 429 / 503 時最多重新排隊幾次
+            min_rate_ratio: 放行速率最低降到設定值的比例
+            increase_ratio: 每次成功時放行速率恢復的比例（加法增加）
+            base_backoff: 第一次退避的秒數（之後每次連續失敗加倍）
+            max_backoff: 退避秒數上限
+            shed_during_backoff: 退避期間直接拒絕此優先順序以下（含）的請求（None 表示不拒絕）
+            seed: 退避抖動的亂數種子
+            clock: 時間來源（測量用）
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_queue = max(1, max_queue)
+        self.max_wait = {**DEFAULT_MAX_WAIT, **(max_wait or {})}
+        self.max_retries = max(0, max_retries)
+        self.min_rate_ratio = min_rate_ratio
+        self.increase_ratio = increase_ratio
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.shed_priority = PRIORITIES.get(shed_during_backoff) if shed_during_backoff else None
+        self._clock = clock
+        self._rng = random.Random(seed)
+
+        now = clock()
+        self._requests = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60 * burst_seconds), now)
+        self._tokens = TokenBucket(tokens_per_minute / 60, max(1.0, tokens_per_minute / 60 * burst_seconds), now)
+        self.rate_ratio = 1.0        # 目前放行速率相對於設定值的比例
+        self._backoff_until = 0.0
+        self._consecutive_throttles = 0
+
+        self._cond = threading.Condition()
+        self._queue = []             # heap of _Ticket
+        self._waiting = 0            # 佇列中尚未結束的請求數
+        self._seq = itertools.count()
+        self._stats = {
+            'submitted': 0,
+            'admitted': 0,
+            'rejected': 0,      # 佇列已滿或退避期間被拒絕
+            'shed': 0,          # 被較高優先順序的請求淘汰
+            'timeouts': 0,
+            'throttled': 0,     # 遇到 429 / 503
+            'requeued': 0,
+            'wait_seconds': 0.0
+        }
+
+    def _count(self, name: str, amount=1):
+        self._stats[name] += amount
+
+    def _apply_rate(self):
+        self._requests.rate = self.requests_per_minute / 60 * self.rate_ratio
+        self._tokens.rate = self.tokens_per_minute / 60 * self.rate_ratio
+
+    def _head(self):
+        """佇列中最優先的有效請求（順便移除已結束的項目）"""
+        while self._queue and self._queue[0].done:
+            heapq.heappop(self._queue)
+        return self._queue[0] if self._queue else None
+
+    def _position(self, ticket: _Ticket) -> int:
+        """排在此請求前面的請求數"""
+        return sum(1 for other in self._queue if not other.done and other < ticket)
+
+    def _ready_in(self, ticket: _Ticket, now: float) -> float:
+        """佇列最前面的請求還需要等待的秒數"""
+        return max(self._backoff_until - now,
+                   self._requests.wait_time(1, now),
+                   self._tokens.wait_time(ticket.tokens, now))
+
+    def _eta(self, position: int, head_wait: float) -> float:
+        """排在 position 的請求大約還要等待的秒數"""
+        interval = 60 / max(self.requests_per_minute * self.rate_ratio, 1e-9)
+        return max(0.0, head_wait) + position * interval
+
+    def _finish(self, ticket: _Ticket):
+        ticket.done = True
+        self._waiting -= 1
+        self._cond.notify_all()
+
+    def _enqueue(self, priority: int, tokens: float, seq: int, now: float) -> _Ticket:
+        """加入等待佇列（佇列已滿時淘汰優先順序最低的請求，或拒絕新請求）"""
+        if self.shed_priority is not None and priority >= self.shed_priority and now < self._backoff_until:
+            self._count('rejected')
+            raise SchedulerOverloaded("Gemini 配額暫時不足，已暫停低優先順序的請求")
+
+        ticket = _Ticket(priority, next(self._seq) if seq is None else seq, tokens)
+        if self._waiting >= self.max_queue:
+            victim = max((other for other in self._queue if not other.done), default=None)
+            if victim is None or not ticket < victim:
+                self._count('rejected')
+                raise SchedulerOverloaded(f"等待中的請求已達上限（{self.max_queue} 個）")
+            victim.evicted = True
+            self._count('shed')
+            self._finish(victim)
+
+        heapq.heappush(self._queue, ticket)
+        self._waiting += 1
+        return ticket
+
+    def acquire(self, priority: str = 'interactive', tokens: float = 0, on_wait=None, seq: int = None) -> int:
+        """排隊等待放行
+
+        Args:
+            priority: 優先順序（PRIORITIES 的鍵）
+            tokens: 此請求預估使用的 token 數（用於 TPM 限制）
+            on_wait: 需要排隊時呼叫 on_wait(排在前面的請求數, 預估等待秒數)（位置或預估秒數改變時再次呼叫）
+            seq: 重新排隊時沿用原本的順序（None 表示排在同一優先順序的最後）
+
+        Returns:
+            此請求的順序編號（重新排隊時傳回 seq）
+
+        Raises:
+            SchedulerOverloaded: 佇列已滿、被淘汰或退避期間不接受此優先順序
+            SchedulerTimeout: 排隊超過等待上限
+        """
+        level = PRIORITIES[priority]
+        max_wait = self.max_wait.get(priority)
+        start = self._clock()
+        deadline = start + max_wait if max_wait is not None else None
+        reported = None
+
+        with self._cond:
+            self._count('submitted')
+            ticket = self._enqueue(level, tokens, seq, start)
+
+        try:
+            while True:
+                with self._cond:
+                    now = self._clock()
+                    if ticket.evicted:
+                        raise SchedulerOverloaded("負載過高，請求已讓給優先順序較高的查詢")
+
+                    head = self._head()
+                    head_wait = self._ready_in(head, now)
+                    if head is ticket and head_wait <= 0:
+                        self._requests.take(1, now)
+                        self._tokens.take(ticket.tokens, now)
+                        self._count('admitted')
+                        self._count('wait_seconds', now - start)
+                        self._finish(ticket)
+                        return ticket.seq
+
+                    if deadline is not None and now >= deadline:
+                        self._count('timeouts')
+                        self._finish(ticket)
+                        raise SchedulerTimeout(f"排隊超過 {max_wait:g} 秒")
+
+                    position = self._position(ticket)
+                    eta = self._eta(position, head_wait)
+                    status = (position, round(eta))
+                    if on_wait is None or status == reported:
+                        timeout = head_wait if head is ticket else 1.0
+                        if deadline is not None:
+                            timeout = min(timeout, deadline - now)
+                        self._cond.wait(max(0.01, timeout))
+                        continue
+
+                # 在鎖外呼叫（呼叫端可能需要更新介面）
+                reported = status
+                on_wait(position, eta)
+        except BaseException:
+            # on_wait 或等待時的例外（含 Streamlit 的 RerunException）：離開佇列，避免後面的請求被卡住
+            with self._cond:
+                if not ticket.done:
+                    self._finish(ticket)
+                self._cond.notify_all()
+            raise
+
+    def on_throttled(self):
+        """遇到 429 / 503：放行速率減半並退避（同一退避期間內的其他失敗不再重複減半）"""
+        with self._cond:
+            now = self._clock()
+            self._count('throttled')
+            if now < self._backoff_until:
+                return
+            self._consecutive_throttles += 1
+            self.rate_ratio = max(self.min_rate_ratio, self.rate_ratio / 2)
+            self._apply_rate()
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (self._consecutive_throttles - 1))
+            self._backoff_until = now + delay * self._rng.uniform(0.5, 1.0)  # 抖動：避免同時恢復
+            self._requests.drain(now)
+            self._tokens.drain(now)
+            self._cond.notify_all()
+
+    def on_success(self):
+        """請求成功：逐步恢復放行速率"""
+        with self._cond:
+            self._consecutive_throttles = 0
+            if self.rate_ratio < 1.0:
+                self.rate_ratio = min(1.0, self.rate_ratio + self.increase_ratio)
+                self._apply_rate()
+                self._cond.notify_all()
+
+    def settle(self, estimated_tokens: float, actual_tokens: float):
+        """以實際 token 用量修正放行時預估的扣除量"""
+        if not actual_tokens:
+            return
+        with self._cond:
+            self._tokens.adjust(actual_tokens - estimated_tokens)
+            self._cond.notify_all()
+
+    def call(self, fn, priority: str = 'interactive', tokens: float = 0, on_wait=None):
+        """排隊放行後執行 fn()，遇到 429 / 503 時退避並以原本的順序重新排隊
+
+        Raises:
+            SchedulerOverloaded / SchedulerTimeout，或 fn 的例外（重新排隊次數用完時為最後一次的錯誤）
+        """
+        seq = None
+        for attempt in range(self.max_retries + 1):
+            seq = self.acquire(priority, tokens, on_wait, seq)
+            try:
+                result = fn()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                self.on_throttled()
+                if attempt == self.max_retries:
+                    raise
+                with self._cond:
+                    self._count('requeued')
+                continue
+            self.on_success()
+            return result
+
+    def stats(self) -> dict:
+        with self._cond:
+            stats = dict(self._stats)
+            now = self._clock()
+            stats.update({
+                'queue_length': self._waiting,
+                'rate_ratio': self.rate_ratio,
+                'backoff_seconds': max(0.0, self._backoff_until - now),
+                'requests_per_minute': self.requests_per_minute * self.rate_ratio,
+                'tokens_per_minute': self.tokens_per_minute * self.rate_ratio,
+            })
+        stats['mean_wait_seconds'] = stats['wait_seconds'] / stats['admitted'] if stats['admitted'] else 0.0
+        return stats
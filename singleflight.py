@@ -0,0 +1,122 @@
+"""
+相同查詢的單一請求合併（single-flight）
+
+首頁的快速查詢按鈕很熱門時，許多使用者會在幾秒內送出完全相同的查詢；
+答案快取只有在第一個請求完成後才會命中，在此之前每個 session 都各自呼叫一次 Gemini。
+這裡以快取鍵（正規化查詢、篩選條件、模型、Store、system instruction）合併進行中的請求：
+  - 第一個呼叫者（leader）實際執行查詢（含沒有引用來源時的重試）
+  - 之後的呼叫者等待同一個請求完成並共用結果
+  - leader 執行時拋出例外：等待中的呼叫者收到同一個例外
+  - leader 被取消（Streamlit 重新執行或停止腳本時拋出的 BaseException）：
+    等待中的呼叫者改由其中一人重新執行，不會收到 leader 的取消訊號
+  - leader 卡住（例如請求一直沒有回應）：等待超過 wait_timeout 的呼叫者自行執行，不再等待
+"""
+
+import threading
+
+
+class _Flight:
+    """進行中的請求"""
+
+    __slots__ = ('done', 'result', 'error', 'cancelled')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.cancelled = False
+
+
+class SingleFlight:
+    """依鍵合併進行中的呼叫（可跨執行緒共用）"""
+
+    def __init__(self, wait_timeout: float = None):
+        """
+        Args:
+            wait_timeout: 等待 leader 的上限（秒），逾時後自行執行；None 表示一直等待
+        """
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._stats = {
+            'calls': 0,
+            'executions': 0,   # 實際執行（leader）
+            'coalesced': 0,    # 共用其他呼叫者的結果
+            'takeovers': 0,    # leader 被取消後重新競爭的等待者
+            'timeouts': 0,     # 等待逾時後自行執行的等待者
+            'errors': 0        # 執行時拋出例外（已傳給所有等待者）
+        }
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def do(self, key: str, fn, on_join=None) -> tuple:
+        """執行 fn()，相同鍵已有進行中的呼叫時等待並共用其結果
+
+        Args:
+            key: 合併鍵
+            fn: 不帶參數的函式
+            on_join: 加入進行中的呼叫、開始等待前呼叫 on_join()（例如顯示「相同查詢進行中」）
+
+        Returns:
+            (結果, 是否共用其他呼叫者的結果)；等待逾時後自行執行時不算共用
+
+        Raises:
+            fn 拋出的例外（包含共用時 leader 拋出的例外）
+        """
+        self._count('calls')
+        joined = False
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+
+            if leader:
+                return self._lead(key, flight, fn), False
+
+            if on_join is not None and not joined:
+                joined = True
+                on_join()
+            if not flight.done.wait(self.wait_timeout):
+                # leader 逾時：自行執行（不取代 leader，之後的呼叫者仍等待原本的 leader）
+                self._count('timeouts')
+                return fn(), False
+            if flight.cancelled:
+                # leader 被取消：重新競爭（其中一個等待者成為新的 leader）
+                self._count('takeovers')
+                continue
+            self._count('coalesced')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+    def _lead(self, key: str, flight: _Flight, fn):
+        self._count('executions')
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            self._count('errors')
+            flight.error = e
+            raise
+        except BaseException:
+            flight.cancelled = True
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def in_flight(self) -> int:
+        """目前進行中的呼叫數"""
+        with self._lock:
+            return len(self._flights)
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._flights)
+        return stats
@@ -0,0 +1,207 @@
+"""
+檢索片段正規化（移除社群媒體分享按鈕等網頁雜訊）
+
+原本 remove_social_media_noise 每一行最多執行 20 次 re.search。這裡改為：
+  - 所有雜訊關鍵字預先編譯成單一 alternation 正則，只移除整行都是分享按鈕/導覽文字的短行
+    （原本任何含「分享」「line」的行都會被移除，例如「情資分享機制」「LINE Bank」「online banking」）
+  - 逐行處理以 generator 串接（strip → 去空行 → 去雜訊行）
+  - 以片段內容雜湊記憶清理結果：同一片段在不同查詢、不同 session 中只清理一次
+  - 大量片段（離線整理語料）可用 normalize_bulk 平行處理
+
+使用方式（離線整理語料）：
+    python snippet_normalizer.py raw_dir/ cleaned_dir/
+    python snippet_normalizer.py chunks.jsonl cleaned.jsonl --field text --workers 8
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# 社群媒體/網站導覽相關關鍵字（不分大小寫）
+NOISE_KEYWORDS = (
+    'facebook',
+    'twitter',
+    'line',
+    '分享',
+    '列印',
+    '轉寄',
+    '友善列印',
+    '回上一頁',
+    ':::',
+    '回首頁',
+    '網站導覽',
+    'English',
+    '兒童版',
+    '行動版',
+    'RSS',
+    '字級大小',
+    '小 中 大',
+)
+
+# 雜訊行的長度上限（分享按鈕/導覽列都很短，較長的行視為內文）
+NOISE_MAX_LINE_LENGTH = 40
+
+# 雜訊關鍵字之間的分隔符號
+NOISE_SEPARATORS = r'\s|｜/／、,，·・•>＞:：\-'
+
+
+def _keyword_pattern(keyword: str) -> str:
+    """英文關鍵字前後不可緊接英文字母（「LINE Bank」的 LINE 仍算，「online」不算）"""
+    escaped = re.escape(keyword)
+    if keyword[0].isascii() and keyword[0].isalpha():
+        return rf'(?<![A-Za-z]){escaped}(?![A-Za-z])'
+    return escaped
+
+
+# 整行只由雜訊關鍵字與分隔符號組成（以 fullmatch 比對）
+NOISE_RE = re.compile(
+    rf"(?:(?:{'|'.join(_keyword_pattern(keyword) for keyword in NOISE_KEYWORDS)})[{NOISE_SEPARATORS}]*)+",
+    re.IGNORECASE
+)
+
+
+def is_noise_line(line: str) -> bool:
+    """是否為分享按鈕/網站導覽等雜訊行（已去除前後空白）"""
+    return len(line) <= NOISE_MAX_LINE_LENGTH and NOISE_RE.fullmatch(line) is not None
+
+
+def iter_clean_lines(text: str):
+    """逐行產生清理後的內容（去除前後空白、空行與雜訊行）"""
+    for line in text.split('\n'):
+        line = line.strip()
+        if line and not is_noise_line(line):
+            yield line
+
+
+def clean_text(text: str) -> str:
+    """移除文字中的社群媒體分享按鈕等雜訊（不使用記憶）"""
+    return '\n'.join(iter_clean_lines(text or ''))
+
+
+def content_hash(text: str) -> str:
+    """片段內容雜湊（記憶清理結果的鍵）"""
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()
+
+
+class SnippetNormalizer:
+    """以內容雜湊記憶清理結果的片段正規化器（執行緒安全）"""
+
+    def __init__(self, max_entries: int = 20000):
+        """
+        Args:
+            max_entries: 最多記憶的片段數
+        """
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._memo = OrderedDict()  # 內容雜湊 → 清理後文字
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def normalize(self, text: str) -> str:
+        """清理單一片段"""
+        if not text:
+            return ''
+        key = content_hash(text)
+        with self._lock:
+            cleaned = self._memo.get(key)
+            if cleaned is not None:
+                self._memo.move_to_end(key)
+                self._stats['hits'] += 1
+                return cleaned
+
+        cleaned = clean_text(text)
+
+        with self._lock:
+            self._stats['misses'] += 1
+            self._memo[key] = cleaned
+            while len(self._memo) > self.max_entries:
+                self._memo.popitem(last=False)
+                self._stats['evictions'] += 1
+        return cleaned
+
+    def normalize_many(self, texts) -> list:
+        """依序清理多個片段（同一批中重複的片段只清理一次）"""
+        return [self.normalize(text) for text in texts]
+
+    def stats(self) -> dict:
+        """命中/未命中統計"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._memo)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+
+def normalize_bulk(texts, workers: int = None, chunksize: int = 256) -> list:
+    """平行清理大量片段（離線整理語料用）
+
+    內容相同的片段只清理一次，再依原順序展開。
+
+    Args:
+        texts: 片段列表
+        workers: 行程數（預設為 CPU 數）；1 表示不使用多行程
+        chunksize: 每次分派給行程的片段數
+
+    Returns:
+        清理後的片段列表（順序與輸入相同）
+    """
+    texts = list(texts)
+    unique = list(dict.fromkeys(texts))
+
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(unique) < chunksize:
+        cleaned = [clean_text(text) for text in unique]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            cleaned = list(pool.map(clean_text, unique, chunksize=chunksize))
+
+    lookup = dict(zip(unique, cleaned))
+    return [lookup[text] for text in texts]
+
+
+def _normalize_directory(input_dir: Path, output_dir: Path, workers: int) -> int:
+    paths = sorted(p for p in input_dir.rglob('*') if p.is_file() and p.suffix in ('.txt', '.md'))
+    cleaned = normalize_bulk((p.read_text(encoding='utf-8') for p in paths), workers=workers)
+    for path, text in zip(paths, cleaned):
+        target = output_dir / path.relative_to(input_dir)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(text, encoding='utf-8')
+    return len(paths)
+
+
+def _normalize_jsonl(input_path: Path, output_path: Path, field: str, workers: int) -> int:
+    with open(input_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    cleaned = normalize_bulk((record.get(field) or '' for record in records), workers=workers)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for record, text in zip(records, cleaned):
+            record[field] = text
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return len(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='清理語料片段中的網頁雜訊')
+    parser.add_argument('input', help='輸入目錄（.txt/.md）或 JSONL 檔')
+    parser.add_argument('output', help='輸出目錄或 JSONL 檔')
+    parser.add_argument('--field', default='text', help='JSONL 中要清理的欄位')
+    parser.add_argument('--workers', type=int, help='行程數（預設為 CPU 數）')
+    args = parser.parse_args()
+
+    input_path = Path(args.input)
+    if input_path.is_dir():
+        count = _normalize_directory(input_path, Path(args.output), args.workers)
+    else:
+        count = _normalize_jsonl(input_path, Path(args.output), args.field, args.workers)
+    print(f"✅ 已清理 {count} 筆：{args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+冷啟動：延遲匯入、背景預熱與啟動耗時報告
+
+Streamlit Cloud 閒置後喚醒（scale-from-zero）時，第一個使用者要等模組匯入
+（google.genai 的 types 與 pandas 就佔了大半）、Gemini client 建立、映射檔載入與各種索引建立全部完成。
+這裡：
+  - LazyModule：第一次使用模組的屬性時才匯入（匯入耗時記入啟動報告）
+  - Warmup：頁面顯示的同時，在背景執行緒依序執行預熱工作（建立 client、載入映射檔、建立索引），
+    使用者按下查詢時多半已經完成；預熱失敗只記錄，不影響頁面（查詢時會照常重新建立）
+  - StartupTimer：記錄匯入、預熱與第一次頁面顯示的耗時，完成時寫入 log（fsc.startup）
+
+使用方式（量測冷啟動，不需要瀏覽器）：
+    python startup.py
+"""
+
+import importlib
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 啟動耗時的 log（Streamlit 只設定自己的 logger，這裡另外輸出到 stderr）
+logger = logging.getLogger('fsc.startup')
+if not logger.handlers:
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter('%(asctime)s %(name)s: %(message)s'))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+# 在非 Streamlit 執行緒呼叫快取函式時，Streamlit 會對每次呼叫記錄一次警告
+_MISSING_CONTEXT_LOGGER = 'streamlit.runtime.scriptrunner_utils.script_run_context'
+WARMUP_THREAD_NAME = 'fsc-warmup'
+
+
+class StartupTimer:
+    """程序啟動過程的耗時紀錄（可跨執行緒共用）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._events = []
+        self._reported = set()
+
+    def record(self, phase: str, seconds: float, kind: str = 'startup', error: str = None, once: bool = False):
+        """
+        Args:
+            phase: 項目名稱（例如 import google.genai.types、warmup corpus_analytics）
+            seconds: 耗時
+            kind: import / warmup / startup
+            error: 失敗原因（成功為 None）
+            once: 同一項目已有紀錄時不再記錄（例如每次重新執行都會執行到的腳本開頭）
+        """
+        with self._lock:
+            if once and any(event['phase'] == phase for event in self._events):
+                return
+            self._events.append({'phase': phase, 'kind': kind, 'seconds': seconds, 'error': error})
+
+    @contextmanager
+    def measure(self, phase: str, kind: str = 'startup'):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(phase, time.perf_counter() - start, kind)
+
+    def events(self) -> list:
+        with self._lock:
+            return list(self._events)
+
+    def summary(self, kinds=None) -> str:
+        """耗時摘要（依耗時由大到小）"""
+        events = [event for event in self.events() if kinds is None or event['kind'] in kinds]
+        events.sort(key=lambda event: event['seconds'], reverse=True)
+        return '、'.join(
+            f"{event['phase']} {event['seconds'] * 1000:,.0f} ms" + ('（失敗）' if event['error'] else '')
+            for event in events
+        )
+
+    def reported(self, name: str) -> bool:
+        with self._lock:
+            return name in self._reported
+
+    def report_once(self, name: str, message: str, kinds=None):
+        """寫入一次 log（同一 name 只寫一次，例如每個程序只報告一次首次顯示）"""
+        with self._lock:
+            if name in self._reported:
+                return
+            self._reported.add(name)
+        logger.info("%s：%s", message, self.summary(kinds) or '無')
+
+
+# 程序共用的啟動耗時紀錄（模組匯入階段就需要，因此不放在 st.cache_resource）
+STARTUP = StartupTimer()
+
+
+class LazyModule:
+    """第一次存取屬性時才匯入的模組（可跨執行緒使用；匯入鎖由 importlib 處理）"""
+
+    def __init__(self, name: str, timer: StartupTimer = STARTUP):
+        self._name = name
+        self._timer = timer
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            already_loaded = self._name in sys.modules
+            start = time.perf_counter()
+            module = importlib.import_module(self._name)
+            if not already_loaded:
+                self._timer.record(f"import {self._name}", time.perf_counter() - start, 'import')
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<LazyModule {self._name} ({state})>"
+
+
+def lazy_module(name: str) -> LazyModule:
+    """延遲匯入的模組（用法同 import，例如 types = lazy_module('google.genai.types')）"""
+    return LazyModule(name)
+
+
+class _WarmupContextFilter(logging.Filter):
+    """略過預熱執行緒呼叫快取函式時的「missing ScriptRunContext」警告"""
+
+    def filter(self, record):
+        return not threading.current_thread().name.startswith(WARMUP_THREAD_NAME)
+
+
+class Warmup:
+    """背景預熱（每個程序執行一次）"""
+
+    def __init__(self, tasks: list, timer: StartupTimer = STARTUP):
+        """
+        Args:
+            tasks: [(名稱, 不帶參數的函式), ...]，依序執行
+            timer: 啟動耗時紀錄
+        """
+        self.tasks = tasks
+        self.timer = timer
+        self._thread = None
+        self._done = threading.Event()
+        self._status = {name: 'pending' for name, _ in tasks}
+        self._started_at = None
+        self._elapsed = None
+
+    def start(self) -> 'Warmup':
+        if self._thread is None:
+            logging.getLogger(_MISSING_CONTEXT_LOGGER).addFilter(_WarmupContextFilter())
+            self._started_at = time.perf_counter()
+            self._thread = threading.Thread(target=self._run, name=WARMUP_THREAD_NAME, daemon=True)
+            self._thread.start()
+        return self
+
+    def run(self) -> 'Warmup':
+        """在目前的執行緒執行（量測用）"""
+        self._started_at = time.perf_counter()
+        self._run()
+        return self
+
+    def _run(self):
+        try:
+            for name, fn in self.tasks:
+                self._status[name] = 'running'
+                start = time.perf_counter()
+                error = None
+                try:
+                    fn()
+                except BaseException as e:  # 包含 st.stop() 的 StopException：只記錄，查詢時會照常重新執行
+                    error = f"{type(e).__name__}: {e}"
+                    logger.warning("預熱 %s 失敗：%s", name, error)
+                self.timer.record(f"warmup {name}", time.perf_counter() - start, 'warmup', error)
+                self._status[name] = 'failed' if error else 'done'
+        finally:
+            self._elapsed = time.perf_counter() - self._started_at
+            self._done.set()
+            self.timer.report_once('warmup', f"背景預熱完成（{self._elapsed:.2f} 秒）", kinds=('warmup', 'import'))
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待預熱完成（尚未啟動時立即返回 False）"""
+        if self._thread is None and self._started_at is None:
+            return False
+        return self._done.wait(timeout)
+
+    def status(self) -> dict:
+        return {
+            'started': self._started_at is not None,
+            'done': self.done,
+            'elapsed': self._elapsed,
+            'tasks': dict(self._status)
+        }
+
+
+def main():
+    """量測冷啟動：匯入 app、執行所有預熱工作，輸出耗時明細"""
+    start = time.perf_counter()
+    from streamlit.logger import set_log_level
+
+    # 不在 streamlit run 之下執行時，快取函式會警告沒有執行環境
+    set_log_level('error')
+
+    import app
+    import startup  # 以 python startup.py 執行時本檔案是 __main__，app 記錄在 startup 模組的 STARTUP
+    warmup = startup.Warmup(app.warmup_tasks()).run()
+
+    print(f"{'項目':<40}{'類型':<10}{'耗時 (ms)':>12}")
+    for event in sorted(startup.STARTUP.events(), key=lambda event: event['seconds'], reverse=True):
+        status = f"  ❌ {event['error']}" if event['error'] else ''
+        print(f"{event['phase']:<40}{event['kind']:<10}{event['seconds'] * 1000:>12,.1f}{status}")
+    print(f"合計 {time.perf_counter() - start:.2f} 秒（預熱 {warmup.status()['elapsed']:.2f} 秒）")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""
+多個 File Search Store 的並行檢索（fan-out）與來源合併
+
+裁罰案件、法令函釋、重要公告分別放在不同的 Store 時（各自重建索引，互不影響），
+查詢同時送到各 Store 檢索，每個 Store 有自己的期限：
+  - 期限內完成的 Store 結果納入；逾時或失敗的 Store 略過，仍以其他 Store 的結果回答（部分結果）
+  - 各 Store 的引用來源以 heap 取前 k 筆：依相關度（在該 Store 回答中被引用的比例與排名），
+    相同時較新的文件優先；同一文件出現在多個 Store 時取相關度較高者
+  - 合併後的來源片段交給一次生成呼叫撰寫最終回答，回答以 [來源 N] 標示引用，換算為引用區間
+    （案件標題仍可依段落實際引用的文件加入連結）；換算後移除標記，引用區間改為移除後的位置
+
+Store 設定（GEMINI_STORE_IDS）：
+    penalty=fileSearchStores/aaa,law_interpretation=fileSearchStores/bbb,announcement=fileSearchStores/ccc
+    （也可以只列 Store 名稱，以逗號分隔）
+"""
+
+import heapq
+import re
+from bisect import bisect_right
+from itertools import accumulate
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+
+# 資料類型的中文名稱（顯示逾時的 Store 用）
+FAMILY_LABELS = {
+    'penalty': '裁罰案件',
+    'law_interpretation': '法令函釋',
+    'announcement': '重要公告',
+}
+
+# 最終回答中的引用標記：[來源 3]、[來源3]、[來源 1、2]
+CITATION_RE = re.compile(r'\[來源\s*(\d+(?:\s*[、,，]\s*\d+)*)\]')
+
+# 移除引用標記時一併移除標記前的空白（「違規 [來源 1]。」→「違規。」）
+CITATION_MARK_RE = re.compile(r'[ \t\u3000]*' + CITATION_RE.pattern)
+
+
+@dataclass(frozen=True)
+class StoreTarget:
+    """一個 File Search Store"""
+    name: str           # fileSearchStores/...
+    family: str = None  # penalty / law_interpretation / announcement（未指定時為 None）
+
+    @property
+    def label(self) -> str:
+        return FAMILY_LABELS.get(self.family, self.family or self.name)
+
+
+def parse_store_ids(value: str) -> list:
+    """解析 Store 設定（「類型=名稱」或「名稱」，以逗號分隔）
+
+    Returns:
+        [StoreTarget, ...]（重複的 Store 只保留第一個）
+    """
+    targets = []
+    seen = set()
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        family, _, name = item.rpartition('=')
+        name = name.strip()
+        if name and name not in seen:
+            seen.add(name)
+            targets.append(StoreTarget(name, family.strip() or None))
+    return targets
+
+
+def format_store_ids(targets: list) -> str:
+    """parse_store_ids 的反向（作為快取鍵等使用的 store_id 字串）"""
+    return ','.join(f"{target.family}={target.name}" if target.family else target.name for target in targets)
+
+
+@dataclass
+class StoreResult:
+    """單一 Store 的檢索結果"""
+    target: StoreTarget
+    status: str             # ok / timeout / error
+    seconds: float
+    value: object = None    # 檢索函式的返回值（status 為 ok 時）
+    error: str = None
+
+
+class StoreFanOut:
+    """並行檢索多個 Store（所有 session 共用執行緒池與統計）"""
+
+    def __init__(self, deadline: float = 20.0, deadlines: dict = None, max_workers: int = 16):
+        """
+        Args:
+            deadline: 每個 Store 的預設期限（秒，從送出時起算）
+            deadlines: 個別 Store 的期限 {類型或 Store 名稱: 秒}
+            max_workers: 執行緒池大小
+        """
+        self.deadline = deadline
+        self.deadlines = dict(deadlines or {})
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='store-fanout')
+        self._lock = threading.Lock()
+        self._stats = {'runs': 0, 'partial': 0, 'failed': 0, 'timeouts': 0, 'errors': 0}
+
+    def deadline_for(self, target: StoreTarget) -> float:
+        return self.deadlines.get(target.family, self.deadlines.get(target.name, self.deadline))
+
+    def run(self, targets: list, fn) -> list:
+        """對每個 Store 執行 fn(target)，等到全部完成或各自的期限到期
+
+        逾時的呼叫不會被中斷（執行緒無法取消），結果直接捨棄。
+
+        Returns:
+            [StoreResult, ...]（與 targets 順序相同）
+        """
+        start = time.monotonic()
+        futures = {self._pool.submit(self._timed, fn, target): target for target in targets}
+        expires = {future: start + self.deadline_for(target) for future, target in futures.items()}
+
+        pending = set(futures)
+        while pending:
+            now = time.monotonic()
+            live = [future for future in pending if expires[future] > now]
+            if not live:
+                break
+            done, _ = wait(live, timeout=min(expires[future] for future in live) - now, return_when=FIRST_COMPLETED)
+            pending -= done
+
+        results = []
+        for future, target in futures.items():
+            if future in pending:
+                future.cancel()  # 尚未開始執行時直接取消
+                results.append(StoreResult(target, 'timeout', self.deadline_for(target)))
+                continue
+            value, seconds, error = future.result()
+            if error is not None:
+                results.append(StoreResult(target, 'error', seconds, error=f"{type(error).__name__}: {error}"))
+            else:
+                results.append(StoreResult(target, 'ok', seconds, value))
+
+        statuses = [result.status for result in results]
+        with self._lock:
+            self._stats['runs'] += 1
+            self._stats['timeouts'] += statuses.count('timeout')
+            self._stats['errors'] += statuses.count('error')
+            if 'ok' not in statuses:
+                self._stats['failed'] += 1
+            elif statuses.count('ok') < len(statuses):
+                self._stats['partial'] += 1
+        return results
+
+    @staticmethod
+    def _timed(fn, target):
+        start = time.monotonic()
+        try:
+            return fn(target), time.monotonic() - start, None
+        except Exception as e:
+            return None, time.monotonic() - start, e
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+
+class SharedRetrieval:
+    """同一次查詢的多個嘗試（對沖請求、沒有引用來源時的重試）共用一次各 Store 的檢索
+
+    第一個呼叫者執行檢索，同時到達的呼叫者等待其完成後直接使用；檢索拋出例外或 reuse(結果) 為 False
+    （例如所有 Store 都失敗）時不保留，下一個呼叫者重新檢索。
+    """
+
+    def __init__(self, reuse=lambda value: True):
+        self.reuse = reuse
+        self.hits = 0
+        self._lock = threading.Lock()
+        self._value = None
+
+    def get(self, fn):
+        """取得共用的檢索結果，還沒有時執行 fn()"""
+        with self._lock:
+            if self._value is not None:
+                self.hits += 1
+                return self._value
+            value = fn()
+            if self.reuse(value):
+                self._value = value
+            return value
+
+
+def source_relevance(sources: list) -> list:
+    """單一 Store 回答中各來源的相關度（0–1）
+
+    被引用的區間數佔該回答所有引用的比例為主，另加上排名（第一次被引用的順序）的權重；
+    沒有引用區間時只依排名。
+    """
+    total_spans = sum(len(source.get('spans') or ()) for source in sources)
+    scores = []
+    for rank, source in enumerate(sources):
+        rank_score = 1.0 / (rank + 1)
+        if total_spans:
+            scores.append(0.7 * len(source.get('spans') or ()) / total_spans + 0.3 * rank_score)
+        else:
+            scores.append(rank_score)
+    return scores
+
+
+def merge_sources(groups: list, k: int, date_of=lambda filename: 0) -> list:
+    """合併各 Store 的引用來源，以 heap 取相關度最高的前 k 筆（相關度相同時較新的文件優先）
+
+    Args:
+        groups: [(Store 識別名稱, [{'filename', 'snippet', 'spans'}]), ...]
+        k: 保留的來源數
+        date_of: 檔名 → 日期數值（YYYYMMDD，未知為 0）
+
+    Returns:
+        [{'filename', 'snippet', 'spans': [], 'store', 'relevance'}, ...]，依相關度排序
+    """
+    best = {}  # 檔名 → (相關度, 日期, 來源)
+    for store, sources in groups:
+        for source, score in zip(sources, source_relevance(sources)):
+            filename = source.get('filename', '')
+            if filename in best and best[filename][0] >= score:
+                continue
+            best[filename] = (score, date_of(filename) or 0, {
+                'filename': filename,
+                'snippet': source.get('snippet', ''),
+                'spans': [],
+                'store': store,
+                'relevance': round(score, 3)
+            })
+    top = heapq.nlargest(k, best.values(), key=lambda item: (round(item[0], 2), item[1]))
+    return [source for _, _, source in top]
+
+
+def context_block(sources: list) -> str:
+    """最終回答使用的檢索片段（附在查詢內容後面）"""
+    parts = ["以下是從各資料庫檢索到的文件片段，請只根據這些片段回答，並在引用處標示 [來源 N]："]
+    for number, source in enumerate(sources, 1):
+        parts.append(f"[來源 {number}]（{source['filename']}）\n{source['snippet']}")
+    return '\n\n'.join(parts)
+
+
+def cited_sources(text: str, sources: list) -> list:
+    """依最終回答中的 [來源 N] 標記建立引用區間
+
+    引用區間為標記所在行的開頭到標記結尾。回答中有引用標記時只保留被引用的來源（依第一次被引用的順序），
+    沒有任何標記時保留全部來源（沒有引用區間）。
+
+    Returns:
+        [{'filename', 'snippet', 'spans', 'store', 'relevance'}, ...]
+    """
+    text = text or ''
+    spans = {}  # 來源索引 → [(起, 訖), ...]
+    for match in CITATION_RE.finditer(text):
+        line_start = text.rfind('\n', 0, match.start()) + 1
+        for number in re.findall(r'\d+', match.group(1)):
+            index = int(number) - 1
+            if 0 <= index < len(sources):
+                spans.setdefault(index, []).append([line_start, match.end()])
+    if not spans:
+        return [dict(source, spans=[]) for source in sources]
+    return [dict(sources[index], spans=index_spans) for index, index_spans in spans.items()]
+
+
+def strip_citations(text: str, sources: list) -> tuple:
+    """移除回答中的 [來源 N] 標記（cited_sources 之後呼叫），引用區間換算為移除後的位置
+
+    Returns:
+        (移除標記後的文字, 引用區間已換算的來源)
+    """
+    removed = [match.span() for match in CITATION_MARK_RE.finditer(text or '')]
+    if not removed:
+        return text, sources
+
+    starts = [start for start, _ in removed]
+    shifts = list(accumulate(end - start for start, end in removed))  # 到第 i 個標記為止移除的字數
+
+    def position(pos: int) -> int:
+        i = bisect_right(starts, pos) - 1
+        if i < 0:
+            return pos
+        start, end = removed[i]
+        if pos < end:  # 位於標記內：對應到標記原本的位置
+            return start - (shifts[i - 1] if i else 0)
+        return pos - shifts[i]
+
+    pieces = []
+    last = 0
+    for start, end in removed:
+        pieces.append(text[last:start])
+        last = end
+    pieces.append(text[last:])
+    sources = [
+        dict(source, spans=[[position(start), position(end)] for start, end in source.get('spans') or ()])
+        for source in sources
+    ]
+    return ''.join(pieces), sources
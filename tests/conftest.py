@@ -0,0 +1,11 @@
+"""
+測試共用設定
+
+模組都放在專案根目錄（沒有套件結構），直接以 pytest 執行時把根目錄加入匯入路徑。
+所有測試都不需要 API Key 或網路（Gemini 以 fake_genai 的假 client 代替）。
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
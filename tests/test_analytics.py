@@ -0,0 +1,104 @@
+"""本地結構化統計：查詢路由（統計型問題 / 案件內容問題）與小型映射檔上的統計結果"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from analytics import AnalyticsIntent, CorpusAnalytics, parse_amount, route_query
+
+FILE_MAPPING = {
+    'fsc_pen_20230315_0001': {'_type': 'penalty', 'source': 'bank_bureau', 'display_name': '甲銀行',
+                              'penalty_amount': '600萬', 'original_url': 'https://www.fsc.gov.tw/1'},
+    'fsc_pen_20230620_0002': {'_type': 'penalty', 'source': 'insurance_bureau', 'display_name': '乙保險',
+                              'penalty_amount': '1.2億元'},
+    'fsc_pen_20240110_0001': {'_type': 'penalty', 'source': 'bank_bureau', 'display_name': '丙銀行',
+                              'penalty_amount': '新臺幣 3,000,000 元'},
+    'fsc_pen_20240805_0002': {'_type': 'penalty', 'source': 'bank_bureau', 'display_name': '丁銀行'},
+    'fsc_pen_20241201_0003': {'_type': 'penalty', 'source': 'securities_bureau', 'display_name': '戊證券',
+                              'penalty_amount': 2_400_000},
+    'fsc_law_202405010001': {'_type': 'law_interpretation', 'source': 'bank_bureau', 'display_name': '函釋'},
+}
+
+
+@pytest.fixture(scope='module')
+def analytics():
+    snapshot = SimpleNamespace(file_mapping=FILE_MAPPING, gemini_id_mapping={}, version='test')
+    return CorpusAnalytics.from_snapshot(snapshot)
+
+
+@pytest.mark.parametrize('query, kind', [
+    ('2024年銀行局裁罰多少件？', 'count'),
+    ('裁罰金額最高的前3個案例', 'top_amount'),
+    ('罰鍰超過1000萬的案件', 'amount_over'),
+    ('2023年和2024年裁罰案件比較', 'trend'),
+    ('民國113年函釋有幾件', 'count'),
+])
+def test_aggregate_questions_are_routed(query, kind):
+    assert route_query(query).kind == kind
+
+
+@pytest.mark.parametrize('query', [
+    '某銀行違反洗錢防制法的裁罰內容',
+    '2024年有多少件洗錢防制相關裁罰？',   # 帶有主題條件：需要檢索內容
+    '內線交易的處分依據為何',
+    '',
+])
+def test_case_questions_go_to_gemini(query):
+    assert route_query(query) is None
+
+
+def test_route_extracts_scope():
+    intent = route_query('民國112年證期局和保險局裁罰金額最高的前三名')
+    assert intent == AnalyticsIntent(kind='top_amount', years=(2023,), limit=3,
+                                     sources=('insurance_bureau', 'securities_bureau'))
+    assert route_query('罰鍰超過1.5億元的案件').threshold == 150_000_000
+    assert route_query('民國113年函釋有幾件').data_type == 'law_interpretation'
+
+
+def test_parse_amount():
+    assert parse_amount('600萬') == 6_000_000
+    assert parse_amount('1.2億元') == 120_000_000
+    assert parse_amount('新臺幣 3,000,000 元') == 3_000_000
+    assert parse_amount('未載明') is None and parse_amount(None) is None
+
+
+def test_count_by_year_and_source(analytics):
+    result = analytics.answer(route_query('2024年裁罰多少件？'))
+    assert result['local'] and result['debug_info']['matched_docs'] == 3
+    assert '共有 **3** 件裁罰案件' in result['text']
+    assert '- 銀行局：2 件（66.7%）' in result['text']
+
+    result = analytics.answer(route_query('2024年銀行局裁罰多少件？'))
+    assert result['debug_info']['matched_docs'] == 2
+
+    # 介面篩選條件一併套用
+    result = analytics.answer(route_query('裁罰共幾件'), filters={'start_date': '2024-06-01', 'end_date': '2024-12-31'})
+    assert result['debug_info']['matched_docs'] == 2
+
+
+def test_top_amount_and_threshold(analytics):
+    result = analytics.answer(route_query('裁罰金額最高的前2個案例'))
+    lines = result['text'].splitlines()
+    assert lines[2] == '1. 2023-06-20｜乙保險｜12,000 萬元'
+    assert lines[3] == '2. 2023-03-15｜[甲銀行](https://www.fsc.gov.tw/1)｜600 萬元'
+    assert len(lines) == 4
+
+    result = analytics.answer(route_query('罰鍰超過250萬的案件'))
+    assert '共 3 件' in result['text'] and '丙銀行' in result['text'] and '戊證券' not in result['text']
+
+
+def test_trend_table(analytics):
+    result = analytics.answer(route_query('2023年和2024年裁罰案件比較'))
+    assert '| 年度 | 銀行局 | 保險局 | 證券期貨局 | 合計 |' in result['text']
+    assert '| 2023 | 1 | 1 | 0 | 2 |' in result['text']
+    assert '| 2024 | 2 | 0 | 1 | 3 |' in result['text']
+    assert '2024 年相較 2023 年：2 → 3 件（+50%）' in result['text']
+
+
+def test_unknown_sources_or_amounts_fall_back(analytics):
+    no_source = CorpusAnalytics.from_snapshot(SimpleNamespace(
+        file_mapping={}, gemini_id_mapping={'files/1': 'fsc_pen_20240101_0001'}, version='test'
+    ))
+    assert no_source.answer(route_query('2024年裁罰多少件？'))['debug_info']['matched_docs'] == 1
+    assert no_source.answer(route_query('2024年銀行局裁罰多少件？')) is None   # 來源單位未標示：無法精確回答
+    assert no_source.answer(route_query('裁罰金額最高的前3個案例')) is None    # 沒有金額資料
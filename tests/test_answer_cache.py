@@ -0,0 +1,133 @@
+"""查詢結果快取（AnswerCache）：有效時間、LRU 淘汰、磁碟快取與依賴文件失效"""
+
+import threading
+
+import pytest
+
+import answer_cache
+from answer_cache import AnswerCache, make_cache_key
+
+
+class FakeTime:
+    """手動推進的 time.time"""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(answer_cache.time, 'time', fake)
+    return fake
+
+
+def result(text: str) -> dict:
+    return {'success': True, 'text': text, 'sources': [{'filename': 'files/a', 'snippet': '片段'}]}
+
+
+def test_key_ignores_width_and_whitespace():
+    assert make_cache_key('ＡＢＣ銀行  罰鍰', 's', 'm', 'h') == make_cache_key('ABC銀行 罰鍰', 's', 'm', 'h')
+    assert make_cache_key('罰鍰', 's', 'm', 'h') != make_cache_key('罰鍰', 's', 'm', 'h', {'bureau': '銀行局'})
+
+
+def test_ttl_expiry(clock):
+    cache = AnswerCache(ttl=60)
+    cache.put('k', result('答案'))
+    clock.now += 59
+    assert cache.get('k') == result('答案')
+
+    clock.now += 2
+    assert cache.get('k') is None
+    stats = cache.stats()
+    assert stats['expired'] == 1 and stats['memory_entries'] == 0
+
+
+def test_lru_evicts_least_recently_used(clock):
+    cache = AnswerCache(max_entries=2)
+    cache.put('a', result('A'))
+    cache.put('b', result('B'))
+    assert cache.get('a') is not None  # a 變成最近使用
+    cache.put('c', result('C'))
+
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_sqlite_round_trip(tmp_path, clock):
+    path = tmp_path / 'cache' / 'answers.sqlite'
+    cache = AnswerCache(path)
+    cache.put('k', result('答案'), deps={'doc1': 'abc'}, query='某銀行罰鍰', scope='scope')
+
+    reopened = AnswerCache(path)
+    assert reopened.entries() == [('k', '某銀行罰鍰', 'scope')]
+    seen = []
+    assert reopened.get('k', validator=lambda deps: seen.append(deps) or True) == result('答案')
+    assert seen == [{'doc1': 'abc'}]
+
+    stats = reopened.stats()
+    assert stats['disk_hits'] == 1 and stats['memory_entries'] == 1
+    assert reopened.get('k') is not None and reopened.stats()['memory_hits'] == 1
+
+
+def test_disk_cache_keeps_newest_entries(tmp_path, clock):
+    cache = AnswerCache(tmp_path / 'answers.sqlite', disk_max_entries=2)
+    for key in 'abc':
+        clock.now += 1
+        cache.put(key, result(key))
+    assert [key for key, _, _ in cache.entries()] == ['b', 'c']
+
+
+def test_changed_deps_invalidate(tmp_path, clock):
+    digests = {'doc1': 'v1', 'doc2': 'v1'}
+
+    def is_current(deps):
+        return all(digests.get(doc_id) == digest for doc_id, digest in deps.items())
+
+    cache = AnswerCache(tmp_path / 'answers.sqlite')
+    cache.put('uses-doc1', result('一'), deps={'doc1': 'v1'})
+    cache.put('uses-doc2', result('二'), deps={'doc2': 'v1'})
+
+    digests['doc1'] = 'v2'
+    assert cache.get('uses-doc1', validator=is_current) is None
+    assert cache.get('uses-doc2', validator=is_current) is not None
+    assert cache.stats()['invalidated'] == 1
+    assert [key for key, _, _ in cache.entries()] == ['uses-doc2']  # 磁碟上的失效項目一併移除
+
+
+def test_validator_runs_outside_lock(clock):
+    cache = AnswerCache()
+    cache.put('slow', result('慢'))
+    cache.put('fast', result('快'))
+    entered, release = threading.Event(), threading.Event()
+
+    def slow_validator(deps):
+        entered.set()
+        assert release.wait(5)
+        return True
+
+    worker = threading.Thread(target=lambda: cache.get('slow', validator=slow_validator))
+    worker.start()
+    try:
+        assert entered.wait(5)
+        assert cache.get('fast') is not None  # 其他查詢不必等待依賴檢查
+    finally:
+        release.set()
+        worker.join(5)
+    assert cache.stats()['memory_hits'] == 2
+
+
+def test_entry_replaced_during_validation_is_kept(clock):
+    cache = AnswerCache()
+    cache.put('k', result('舊'), deps={'doc1': 'v1'})
+
+    def stale_then_replaced(deps):
+        cache.put('k', result('新'), deps={'doc1': 'v2'})  # 檢查期間寫入新答案
+        return False
+
+    assert cache.get('k', validator=stale_then_replaced) is None
+    assert cache.get('k') == result('新')
@@ -0,0 +1,85 @@
+"""串流回答的案件標題連結：與原本整段文字替換（insert_case_links_by_order 舊版）的結果一致"""
+
+import random
+import re
+
+import pytest
+
+from answer_stream import CASE_HEADING_RE, IncrementalAnswer
+from grounding import heading_citations
+
+
+def baseline_insert_case_links(text: str, case_urls: list) -> str:
+    """原本的實作（整段文字以規則式由後往前替換）"""
+    if not case_urls:
+        return text
+    matches = list(re.finditer(r'(###\s*\d+\.\s+)([^\n]+)', text))
+    result = text
+    for i, match in enumerate(reversed(matches)):
+        idx = len(matches) - 1 - i
+        if idx >= len(case_urls):
+            continue
+        prefix = match.group(1)
+        title = match.group(2).strip()
+        if title.startswith('[') and '](' in title:
+            continue
+        result = result[:match.start()] + f"{prefix}[{title}]({case_urls[idx]})" + result[match.end():]
+    return result
+
+
+def streamed(text: str, case_urls: list, chunk_sizes=(1, 3, 7, 50)) -> list:
+    """以不同的分段方式送入，返回各自的結果"""
+    results = []
+    for size in chunk_sizes:
+        answer = IncrementalAnswer()
+        for i in range(0, len(text), size):
+            answer.feed(text[i:i + size])
+        assert answer.render() == text
+        results.append(answer.finalize(case_urls))
+    return results
+
+
+ANSWERS = [
+    "根據資料庫：\n\n### 1. 甲銀行\n- 日期：2024-01-01\n\n### 2. 乙證券\n內容\n",
+    # 標題文字在下一行（\s+ 跨行）
+    "### 1.\n甲銀行\n說明\n### 2. 乙證券\n",
+    "###\n1. 甲銀行\n### 2.\n\n  乙證券  \n### 3. 丙保險",
+    # 已經是連結的標題不再替換
+    "### 1. [甲銀行](https://example.com/a)\n### 2. 乙證券\n",
+    # 沒有結尾換行、標題數多於連結數
+    "### 1. 甲\n### 2. 乙\n### 3. 丙",
+    "沒有任何標題的回答",
+    "#### 1. 四個井號也會比對到\n",
+]
+
+
+@pytest.mark.parametrize('text', ANSWERS)
+def test_finalize_matches_baseline(text):
+    urls = ['https://example.com/1', 'https://example.com/2']
+    expected = baseline_insert_case_links(text, urls)
+    assert all(result == expected for result in streamed(text, urls))
+
+
+def test_heading_on_next_line_keeps_links_aligned():
+    text = "### 1.\n甲銀行\n### 2. 乙證券\n"
+    result = streamed(text, ['https://example.com/1', 'https://example.com/2'])[0]
+    assert "### 1.\n[甲銀行](https://example.com/1)" in result
+    assert "### 2. [乙證券](https://example.com/2)" in result
+    # 與 grounding.heading_citations 看到的標題數相同
+    assert len(heading_citations(text, [])) == len(list(CASE_HEADING_RE.finditer(text)))
+
+
+def test_missing_url_skips_heading_only():
+    text = "### 1. 甲\n### 2. 乙\n"
+    result = streamed(text, [None, 'https://example.com/2'])[0]
+    assert result == "### 1. 甲\n### 2. [乙](https://example.com/2)\n"
+
+
+def test_randomized_parity():
+    rng = random.Random(5)
+    parts = ['### ', '###', '1.', '2. ', '\n', ' ', '甲銀行', '[乙](u)', '內容', '\n\n', '3.\n']
+    for _ in range(300):
+        text = ''.join(rng.choice(parts) for _ in range(rng.randint(1, 30)))
+        urls = [f'https://example.com/{i}' for i in range(rng.randint(0, 4))]
+        expected = baseline_insert_case_links(text, urls)
+        assert all(result == expected for result in streamed(text, urls, (1, 4, 1000)))
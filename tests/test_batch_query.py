@@ -0,0 +1,81 @@
+"""批次查詢：中斷後從輸出檔繼續，以及重查時加總所有嘗試的 token 用量（以 fake_genai 的假 client 執行）"""
+
+import json
+
+import pytest
+
+import app
+import batch_query
+from fake_genai import FakeClient, build_corpus
+
+STORE = 'fileSearchStores/fake-batch'
+QUERIES = ['某銀行違反洗錢防制法的裁罰內容', '證券商內部控制缺失的處分', '保險公司招攬不當的案例']
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """成本帳本寫到暫存目錄，不影響專案的 .cache"""
+    monkeypatch.setenv('FSC_CACHE_DIR', str(tmp_path / 'cache'))
+    app.get_cost_ledger.clear()
+    yield
+    app.get_cost_ledger.clear()
+
+
+@pytest.fixture
+def client():
+    return FakeClient(corpus=build_corpus(app.get_metadata_registry().snapshot()))
+
+
+@pytest.fixture
+def queries(tmp_path):
+    path = tmp_path / 'queries.txt'
+    path.write_text('# 批次查詢\n\n' + '\n'.join(QUERIES) + '\n', encoding='utf-8')
+    return batch_query.load_queries(path)
+
+
+def read_records(path) -> list:
+    return [json.loads(line) for line in path.read_text(encoding='utf-8').splitlines() if line.strip()]
+
+
+def test_resume_skips_completed_and_reruns_failed(tmp_path, client, queries):
+    output = tmp_path / 'results.jsonl'
+    done, failed, _ = queries
+    # 上次執行：第一筆成功、第二筆失敗，最後一行只寫了一半就中斷
+    output.write_text(
+        json.dumps({'id': done['id'], 'query': done['query'], 'success': True}, ensure_ascii=False) + '\n'
+        + json.dumps({'id': failed['id'], 'query': failed['query'], 'success': False}, ensure_ascii=False) + '\n'
+        + '{"id": "partial', encoding='utf-8'
+    )
+    assert batch_query.completed_ids(output) == {done['id']}
+
+    summary = batch_query.run_batch(queries, output, client, STORE, concurrency=2)
+    assert (summary['total'], summary['skipped'], summary['succeeded'], summary['failed']) == (3, 1, 2, 0)
+
+    lines = output.read_text(encoding='utf-8').splitlines()
+    assert lines[2] == '{"id": "partial'  # 寫到一半的行保留，新紀錄從下一行開始
+    new_records = [json.loads(line) for line in lines[3:]]
+    assert sorted(record['id'] for record in new_records) == sorted(item['id'] for item in queries[1:])
+    assert all(record['success'] and record['doc_ids'] and record['usage'] for record in new_records)
+    assert batch_query.completed_ids(output) == {item['id'] for item in queries}
+
+    # 全部完成：再次執行不送出任何請求
+    calls = client.models.calls
+    summary = batch_query.run_batch(queries, output, client, STORE)
+    assert summary['skipped'] == 3 and client.models.calls == calls
+
+
+def test_ungrounded_retry_sums_usage_across_attempts(tmp_path):
+    ungrounded = FakeClient(corpus=())  # 回答沒有引用來源：每筆查詢都會再查一次
+    queries = [{'id': 'q1', 'query': QUERIES[0], 'filters': None}]
+
+    single = batch_query.run_batch(queries, tmp_path / 'single.jsonl', ungrounded, STORE, retry_ungrounded=False)
+    retried = batch_query.run_batch(queries, tmp_path / 'retried.jsonl', ungrounded, STORE)
+    (once,) = read_records(tmp_path / 'single.jsonl')
+    (twice,) = read_records(tmp_path / 'retried.jsonl')
+
+    assert (once['attempts'], twice['attempts']) == (1, 2)
+    assert once['usage']['total_tokens'] > 0
+    assert twice['usage'] == {key: value * 2 for key, value in once['usage'].items()}
+    assert twice['cost_usd'] == pytest.approx(once['cost_usd'] * 2, abs=2e-6)  # 各筆成本四捨五入到 6 位
+    assert retried['total_tokens'] == 2 * single['total_tokens']
+    assert retried['cost_usd'] == pytest.approx(2 * single['cost_usd'], abs=2e-6)
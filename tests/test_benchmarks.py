@@ -0,0 +1,20 @@
+"""效能測試的冒煙測試：以最小規模跑一輪，索引格式等變更不會讓效能測試悄悄壞掉"""
+
+import functools
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+import run_benchmarks  # noqa: E402
+
+
+def test_tiny_benchmark_run(monkeypatch):
+    # 每個項目只跑一次，不等 autorange 累積到最短測量時間
+    monkeypatch.setattr(run_benchmarks.timeit.Timer, 'autorange', lambda self: (1, self.timeit(number=1)))
+    monkeypatch.setattr(run_benchmarks, 'measure', functools.partial(run_benchmarks.measure, min_time=0))
+
+    report = run_benchmarks.run([200], [50], [3], repeat=1, progress=lambda line: None)
+    assert report['results']
+    assert any(result['name'].startswith('mapping.') for result in report['results'])
+    assert all(result['ops_per_sec'] > 0 for result in report['results'])
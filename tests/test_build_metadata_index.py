@@ -0,0 +1,78 @@
+"""映射檔離線編譯：一致性報告的各類問題計數，以及編譯後的索引可直接開啟"""
+
+import json
+
+import pytest
+
+from build_metadata_index import compile_index
+from metadata_registry import MAPPING_SOURCES, open_index
+
+RAW = {
+    'penalty_files': {
+        'fsc_pen_20240101_0001': {'display_name': '甲銀行', 'date': '2024-01-01', 'source': 'bank_bureau'},
+        'fsc_pen_20240201_0002': {'display_name': '乙證券', 'date': '2024-02-01', 'source': 'securities_bureau'},
+    },
+    'penalty_gemini': {
+        'files/pen1': 'fsc_pen_20240101_0001',
+        'files/pen2': 'fsc_pen_20240201_0002',
+        'files/pen2-reupload': 'fsc_pen_20240201_0002',  # 同一文件有兩個 Gemini ID
+        'files/shared': 'fsc_pen_20240101_0001',         # 與函釋共用同一個 Gemini ID
+        'files/orphan': 'fsc_pen_20231231_0009',         # 指向不存在的文件
+    },
+    'law_gemini': {
+        'fsc_law_202403010001': {'display_name': '函釋', 'date': '2024-03-01', 'source': 'bank_bureau',
+                                 'gemini_file_id': 'files/shared'},
+    },
+    'law_files': {
+        'fsc_law_202403010001': {'date': '2024-03-02', 'original_url': 'https://www.fsc.gov.tw/law1'},  # 日期衝突
+        'fsc_law_202404010002': {'display_name': '只在函釋映射檔', 'date': '2024-04-01'},
+    },
+}
+
+
+@pytest.fixture
+def report(tmp_path):
+    for source in MAPPING_SOURCES:
+        if source.key in RAW:
+            path = tmp_path / source.relpath
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(json.dumps(RAW[source.key], ensure_ascii=False), encoding='utf-8')
+    return compile_index(tmp_path)
+
+
+def test_report_counts(report):
+    assert report['counts'] == {
+        'missing_sources': 2,            # 公告的兩個映射檔
+        'unresolved_gemini_ids': 1,
+        'docs_without_gemini_id': 1,
+        'duplicate_gemini_ids': 1,
+        'duplicate_doc_gemini_ids': 1,
+        'conflicting_fields': 1,
+        'unpaired_docs': 1,
+    }
+    assert (report['doc_count'], report['gemini_id_count']) == (4, 5)
+
+
+def test_report_samples(report):
+    samples = report['samples']
+    assert samples['unresolved_gemini_ids'] == [{'gemini_id': 'files/orphan', 'doc_id': 'fsc_pen_20231231_0009'}]
+    assert samples['docs_without_gemini_id'] == ['fsc_law_202404010002']
+    assert samples['duplicate_gemini_ids'] == [
+        {'gemini_id': 'files/shared', 'doc_ids': ['fsc_law_202403010001', 'fsc_pen_20240101_0001']}
+    ]
+    assert samples['duplicate_doc_gemini_ids'] == [
+        {'doc_id': 'fsc_pen_20240201_0002', 'gemini_ids': ['files/pen2', 'files/pen2-reupload']}
+    ]
+    assert samples['conflicting_fields'] == [{'doc_id': 'fsc_law_202403010001', 'field': 'date',
+                                              'law_gemini': '2024-03-01', 'law_files': '2024-03-02'}]
+    assert samples['unpaired_docs'] == [{'doc_id': 'fsc_law_202404010002', 'only_in': 'law_files'}]
+
+
+def test_written_index_matches_sources(tmp_path, report):
+    indexed = open_index(report['index_path'], base_path=tmp_path)
+    assert indexed is not None
+    file_mapping, gemini_id_mapping = indexed[0], indexed[1]
+    assert len(file_mapping) == 4 and len(gemini_id_mapping) == 5
+    assert gemini_id_mapping['files/shared'] == 'fsc_law_202403010001'   # 後載入的函釋映射覆蓋裁罰映射
+    assert file_mapping['fsc_law_202403010001']['original_url'] == 'https://www.fsc.gov.tw/law1'
+    assert json.loads((tmp_path / 'metadata_index_report.json').read_text(encoding='utf-8'))['counts'] == report['counts']
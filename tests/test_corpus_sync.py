@@ -0,0 +1,213 @@
+"""語料增量同步：比對計畫與上傳/刪除流程（以 fake_genai 的假 Store 執行）"""
+
+import json
+from pathlib import Path
+
+import pytest
+
+from benchmarks import synthetic
+import corpus_sync
+from corpus_sync import (CONTENT_HASH_KEY, LocalDoc, StoreDoc, list_store_docs, plan_sync, sync_corpus,
+                         upload_document)
+from fake_genai import FakeClient
+from metadata_registry import MAPPING_SOURCES
+
+STORE = 'fileSearchStores/fake-sync'
+
+
+def local_doc(doc_id: str, content_hash: str) -> LocalDoc:
+    return LocalDoc(doc_id, Path(f"{doc_id}.txt"), content_hash, 'penalty', {'display_name': doc_id},
+                    'plaintext', 'text/plain')
+
+
+def store_doc(name: str, doc_id: str, content_hash, create_time: str = '2025-01-01T00:00:00') -> StoreDoc:
+    return StoreDoc(f"{STORE}/documents/{name}", doc_id, content_hash, doc_id or name, create_time)
+
+
+def test_plan_sync():
+    local = {
+        'fsc_pen_20250101_0001': local_doc('fsc_pen_20250101_0001', 'aaa'),   # 未變動（另有一份舊版本）
+        'fsc_pen_20250101_0002': local_doc('fsc_pen_20250101_0002', 'bbb'),   # 內容變動
+        'fsc_pen_20250101_0003': local_doc('fsc_pen_20250101_0003', 'ccc'),   # 新文件
+        'fsc_pen_20250101_0004': local_doc('fsc_pen_20250101_0004', 'ddd'),   # 沒有內容雜湊的舊上傳
+    }
+    store = [
+        store_doc('a-new', 'fsc_pen_20250101_0001', 'aaa', '2025-02-01T00:00:00'),
+        store_doc('a-old', 'fsc_pen_20250101_0001', 'old'),
+        store_doc('b', 'fsc_pen_20250101_0002', 'old'),
+        store_doc('d', 'fsc_pen_20250101_0004', None),
+        store_doc('known', 'fsc_pen_20240101_0009', 'xxx'),    # 只在映射檔中：不是孤兒
+        store_doc('orphan', 'fsc_pen_20200101_0001', 'yyy'),
+        store_doc('unnamed', None, None),
+    ]
+
+    plan = plan_sync(local, store, known_doc_ids=['fsc_pen_20240101_0009'])
+    assert [(doc.doc_id, reason) for doc, reason in plan.uploads] == [
+        ('fsc_pen_20250101_0002', 'changed'), ('fsc_pen_20250101_0003', 'new')
+    ]
+    assert plan.stale == {
+        'fsc_pen_20250101_0001': [f"{STORE}/documents/a-old"],
+        'fsc_pen_20250101_0002': [f"{STORE}/documents/b"],
+    }
+    assert sorted(doc.name.rsplit('/', 1)[-1] for doc in plan.orphans) == ['orphan', 'unnamed']
+    assert plan.counts() == {'new': 1, 'changed': 1, 'unchanged': 1, 'legacy': 1, 'stale': 2, 'orphans': 2}
+
+    plan = plan_sync(local, store, replace_legacy=True)
+    assert ('fsc_pen_20250101_0004', 'legacy') in [(doc.doc_id, reason) for doc, reason in plan.uploads]
+    assert plan.stale['fsc_pen_20250101_0004'] == [f"{STORE}/documents/d"]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    """映射檔（data/）、本地文件目錄（每份文件一個 .txt）與假 Store"""
+    raw = synthetic.make_raw_mappings(20)
+    data_dir = tmp_path / 'data'
+    synthetic.write_raw_mappings(raw, data_dir)
+    doc_ids = sorted(raw['penalty_files']) + sorted(raw['law_files'])[:3] + sorted(raw['ann_files'])[:3]
+
+    docs_dir = tmp_path / 'docs'
+    docs_dir.mkdir()
+    for doc_id in doc_ids:
+        (docs_dir / f"{doc_id}.txt").write_text(f"{doc_id} 的內容", encoding='utf-8')
+
+    client = FakeClient(store_path=tmp_path / 'store.json')
+    return {'data': data_dir, 'docs': docs_dir, 'doc_ids': doc_ids, 'client': client, 'state': tmp_path / 'state'}
+
+
+def run_sync(corpus, **kwargs):
+    return sync_corpus(corpus['client'], STORE, corpus['docs'], corpus['data'], concurrency=2,
+                       state_dir=corpus['state'], poll_interval=0, **kwargs)
+
+
+def store_doc_ids(client) -> list:
+    return sorted(doc.doc_id for doc in list_store_docs(client, STORE))
+
+
+def read_mapping(data_dir: Path, key: str) -> dict:
+    source = next(source for source in MAPPING_SOURCES if source.key == key)
+    return json.loads((data_dir / source.relpath).read_text(encoding='utf-8'))
+
+
+def test_sync_uploads_then_noop(corpus):
+    dry = run_sync(corpus, dry_run=True)
+    assert dry['new'] == len(corpus['doc_ids']) and dry['uploaded'] == 0
+    assert store_doc_ids(corpus['client']) == []
+
+    summary = run_sync(corpus)
+    assert summary['uploaded'] == len(corpus['doc_ids']) and not summary['failed']
+    assert store_doc_ids(corpus['client']) == sorted(corpus['doc_ids'])
+
+    # 映射檔記錄新的 gemini_file_id 與內容雜湊，Store 文件帶有篩選用的 metadata
+    law_id = corpus['doc_ids'][-4]
+    law_entry = read_mapping(corpus['data'], 'law_files')[law_id]
+    assert law_entry['gemini_file_id'].startswith('files/fake') and law_entry[CONTENT_HASH_KEY]
+    assert read_mapping(corpus['data'], 'law_gemini')[law_id]['gemini_file_id'] == law_entry['gemini_file_id']
+    document = corpus['client'].file_search_stores.documents_of(STORE)[0]
+    assert {item.key for item in document.custom_metadata} >= {'doc_id', CONTENT_HASH_KEY}
+
+    # 沒有變動：不上傳、不寫入映射檔（本地雜湊取自快取）
+    summary = run_sync(corpus)
+    assert summary['uploaded'] == 0 and summary['unchanged'] == len(corpus['doc_ids'])
+    assert summary['mappings_written'] == [] and summary['hash_cache_hits'] == len(corpus['doc_ids'])
+
+
+def test_changed_doc_replaces_old_version(corpus):
+    run_sync(corpus)
+    changed_id = corpus['doc_ids'][0]
+    old_names = {doc.name for doc in list_store_docs(corpus['client'], STORE) if doc.doc_id == changed_id}
+    (corpus['docs'] / f"{changed_id}.txt").write_text('修正後的內容', encoding='utf-8')
+
+    summary = run_sync(corpus)
+    assert (summary['changed'], summary['uploaded'], summary['deleted']) == (1, 1, 1)
+    versions = [doc for doc in list_store_docs(corpus['client'], STORE) if doc.doc_id == changed_id]
+    assert len(versions) == 1 and versions[0].name not in old_names
+
+    # 裁罰案件的 gemini ID 映射為舊格式（gemini_id → doc_id）：舊 ID 移除，只留新版本
+    penalty_gemini = read_mapping(corpus['data'], 'penalty_gemini')
+    assert [gemini_id for gemini_id, doc_id in penalty_gemini.items() if doc_id == changed_id] == \
+        [read_mapping(corpus['data'], 'penalty_files')[changed_id]['gemini_file_id']]
+
+
+def test_failed_upload_keeps_old_version_and_retries(corpus):
+    run_sync(corpus)
+    client = corpus['client']
+    failing_id, ok_id = corpus['doc_ids'][:2]
+    for doc_id in (failing_id, ok_id):
+        (corpus['docs'] / f"{doc_id}.txt").write_text(f"{doc_id} 新版", encoding='utf-8')
+
+    upload = client.files.upload
+
+    def flaky_upload(file, config=None):
+        if failing_id in str(file):
+            raise ValueError('invalid file')  # 不可重試的錯誤
+        return upload(file=file, config=config)
+
+    client.files.upload = flaky_upload
+    summary = run_sync(corpus)
+    assert (summary['uploaded'], summary['failed'], summary['deleted']) == (1, 1, 1)
+    assert store_doc_ids(client).count(failing_id) == 1  # 上傳失敗：保留舊版本
+
+    client.files.upload = upload
+    summary = run_sync(corpus)
+    assert (summary['changed'], summary['uploaded'], summary['deleted']) == (1, 1, 1)
+    assert store_doc_ids(client) == sorted(corpus['doc_ids'])
+
+
+def test_prune_removes_orphans(corpus):
+    run_sync(corpus)
+    client = corpus['client']
+    orphan = corpus['docs'].parent / 'fsc_pen_19990101_0001.txt'
+    orphan.write_text('已撤下的文件', encoding='utf-8')
+    uploaded = client.files.upload(file=orphan)
+    client.file_search_stores.import_file(file_search_store_name=STORE, file_name=uploaded.name)
+
+    summary = run_sync(corpus)
+    assert summary['orphans'] == 1 and summary['deleted'] == 0
+    summary = run_sync(corpus, prune=True)
+    assert summary['deleted'] == 1
+    assert store_doc_ids(client) == sorted(corpus['doc_ids'])
+
+
+class Throttled(Exception):
+    code = 429
+
+
+def test_import_retry_reuses_the_uploaded_file(corpus, monkeypatch):
+    monkeypatch.setattr(corpus_sync.time, 'sleep', lambda seconds: None)
+    client = corpus['client']
+    doc_id = corpus['doc_ids'][0]
+    doc = local_doc(doc_id, 'aaa')
+    doc.path = corpus['docs'] / f"{doc_id}.txt"
+
+    uploads = []
+    upload, import_file = client.files.upload, client.file_search_stores.import_file
+
+    def counting_upload(file, config=None):
+        uploaded = upload(file=file, config=config)
+        uploads.append(uploaded.name)
+        return uploaded
+
+    def flaky_import(file_search_store_name, file_name, config=None):
+        if len(attempts) < 2:
+            attempts.append(file_name)
+            raise Throttled('RESOURCE_EXHAUSTED')
+        return import_file(file_search_store_name=file_search_store_name, file_name=file_name, config=config)
+
+    attempts = []
+    client.files.upload = counting_upload
+    client.file_search_stores.import_file = flaky_import
+    record = upload_document(client, STORE, doc, poll_interval=0)
+    assert uploads == [record['gemini_file_id']] and attempts == uploads * 2
+    assert store_doc_ids(client) == [doc_id]
+
+    # 匯入一直失敗：刪除這次上傳的檔案
+    def failing_import(file_search_store_name, file_name, config=None):
+        raise Throttled('RESOURCE_EXHAUSTED')
+
+    client.file_search_stores.import_file = failing_import
+    with pytest.raises(Throttled):
+        upload_document(client, STORE, doc, poll_interval=0, max_retries=2)
+    assert len(uploads) == 2
+    with pytest.raises(ValueError):
+        client.files.get(uploads[-1])
+    assert client.files.get(uploads[0])  # 已匯入的檔案不受影響
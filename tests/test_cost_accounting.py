@@ -0,0 +1,67 @@
+"""Token 用量與成本：請求成本、價格覆寫與每日預算狀態"""
+
+from datetime import date, timedelta
+
+import pytest
+
+from cost_accounting import CostBudget, CostLedger, DEFAULT_PRICING, load_pricing, request_cost
+
+FLASH = DEFAULT_PRICING['gemini-2.5-flash']
+
+
+def test_cached_tokens_billed_at_cached_price():
+    usage = {'prompt_tokens': 1_000_000, 'cached_tokens': 400_000, 'tool_prompt_tokens': 200_000,
+             'output_tokens': 100_000, 'thoughts_tokens': 50_000}
+    cost = request_cost(usage, 'gemini-2.5-flash')
+
+    assert cost['input_usd'] == pytest.approx(0.6 * FLASH['input'])
+    assert cost['cached_usd'] == pytest.approx(0.4 * FLASH['cached'])
+    assert cost['tool_usd'] == pytest.approx(0.2 * FLASH['input'])
+    assert cost['output_usd'] == pytest.approx(0.15 * FLASH['output'])  # 思考 token 以輸出價格計算
+    assert cost['total_usd'] == pytest.approx(
+        cost['input_usd'] + cost['cached_usd'] + cost['tool_usd'] + cost['output_usd']
+    )
+
+
+def test_cached_tokens_never_exceed_prompt():
+    cost = request_cost({'prompt_tokens': 100, 'cached_tokens': 500}, 'gemini-2.5-flash')
+    assert cost['input_usd'] == 0
+    assert cost['cached_usd'] == pytest.approx(100 * FLASH['cached'] / 1e6)
+
+
+def test_load_pricing_override_for_unknown_model():
+    pricing = load_pricing('{"gemini-3-flash": {"output": 4.0}, "gemini-2.5-pro": {"input": 2.0}}')
+    assert pricing['gemini-3-flash'] == dict(FLASH, output=4.0)   # 未列出的價格沿用預設模型
+    assert pricing['gemini-2.5-pro']['input'] == 2.0
+    assert DEFAULT_PRICING['gemini-2.5-pro']['input'] == 1.25      # 不修改預設價格表
+
+    usage = {'prompt_tokens': 1_000_000, 'output_tokens': 1_000_000}
+    assert request_cost(usage, 'gemini-3-flash', pricing)['total_usd'] == pytest.approx(FLASH['input'] + 4.0)
+    # 價格表沒有的模型以預設模型計價
+    assert request_cost(usage, 'unlisted-model')['total_usd'] == pytest.approx(FLASH['input'] + FLASH['output'])
+
+
+def test_budget_states_across_warn_ratio_and_cap():
+    ledger = CostLedger(pricing={'m': {'input': 1.0, 'cached': 0.0, 'output': 0.0}})
+    budget = CostBudget(daily_usd=1.0, warn_ratio=0.8)
+
+    def spend(usd: float, day: date = None):
+        ledger.record('m', {'prompt_tokens': round(usd * 1e6)}, day=day)
+
+    assert ledger.budget_status(budget)['state'] == 'ok'
+    spend(0.79)
+    assert ledger.budget_status(budget)['state'] == 'ok'
+    spend(0.01)
+    status = ledger.budget_status(budget)
+    assert status['state'] == 'warn' and status['ratio'] == pytest.approx(0.8)
+    spend(0.19)
+    assert ledger.budget_status(budget)['state'] == 'warn'
+    spend(0.01)
+    status = ledger.budget_status(budget)
+    assert status['state'] == 'exceeded' and status['spent_usd'] == pytest.approx(1.0)
+
+    # 其他日期的花費不計入今日；沒有上限時一律 ok
+    spend(5.0, day=date.today() - timedelta(days=1))
+    assert ledger.spent() == pytest.approx(1.0)
+    assert ledger.budget_status(CostBudget()) == {'spent_usd': pytest.approx(1.0), 'cap_usd': None,
+                                                  'ratio': None, 'state': 'ok'}
@@ -0,0 +1,132 @@
+"""Gemini 傳輸層：錄製後重播保留 grounding、錯誤注入，以及經由本地替身伺服器查詢"""
+
+import threading
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from google import genai
+from google.genai import errors, types
+
+from gemini_transport import (RecordingClient, Recorder, ReplayClient, ReplayModels, ReplayOptions,
+                              dump_response, load_recordings, load_response, make_server, parse_faults)
+
+MODEL = 'gemini-2.5-flash'
+QUERY = '某銀行違反洗錢防制法的裁罰內容'
+ANSWER = '某銀行因未落實 KYC 遭罰鍰 600 萬元。'
+
+
+def grounded_response() -> types.GenerateContentResponse:
+    chunk = types.GroundingChunk(retrieved_context=types.GroundingChunkRetrievedContext(
+        title='fsc_pen_20250301_0001', text='未落實客戶審查程序'
+    ))
+    support = types.GroundingSupport(
+        segment=types.Segment(start_index=0, end_index=len(ANSWER.encode('utf-8')), text=ANSWER),
+        grounding_chunk_indices=[0]
+    )
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role='model', parts=[types.Part(text=ANSWER)]),
+            grounding_metadata=types.GroundingMetadata(grounding_chunks=[chunk], grounding_supports=[support]),
+            finish_reason='STOP'
+        )],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(prompt_token_count=120, candidates_token_count=30)
+    )
+
+
+def grounding_of(response):
+    metadata = response.candidates[0].grounding_metadata
+    return metadata and (metadata.grounding_chunks, metadata.grounding_supports)
+
+
+@pytest.fixture
+def recordings(tmp_path):
+    """錄製一次查詢（以回傳固定回應的 client 代替 Gemini）"""
+    live = SimpleNamespace(models=SimpleNamespace(
+        generate_content=lambda model, contents, config=None: grounded_response()
+    ))
+    client = RecordingClient(live, Recorder(tmp_path))
+    client.models.generate_content(model=MODEL, contents=QUERY)
+    return tmp_path
+
+
+def replay_models(recordings, **options) -> ReplayModels:
+    return ReplayModels(load_recordings(recordings), ReplayOptions(latency='0', seed=1, **options))
+
+
+def test_dump_and_load_preserve_grounding():
+    response = grounded_response()
+    loaded = load_response(dump_response(response))
+    assert loaded.text == ANSWER
+    assert grounding_of(loaded) == grounding_of(response)
+    assert loaded.usage_metadata.prompt_token_count == 120
+
+
+def test_record_then_replay(recordings):
+    (takes,) = load_recordings(recordings).values()
+    assert len(takes) == 1 and takes[0]['contents'] == QUERY
+
+    client = ReplayClient(recordings, ReplayOptions(latency='0', strict=True))
+    replayed = client.models.generate_content(model=f'models/{MODEL}', contents=QUERY)
+    assert replayed.text == ANSWER
+    assert grounding_of(replayed) == grounding_of(grounded_response())
+
+    # 串流重播：grounding 只在最後一個 chunk
+    chunks = list(client.models.generate_content_stream(model=MODEL, contents=QUERY))
+    assert ''.join(chunk.text for chunk in chunks) == ANSWER
+    assert grounding_of(chunks[-1]) == grounding_of(grounded_response())
+    assert client.models.stats()['hits'] == 2
+
+
+def test_parse_faults():
+    assert parse_faults('429=0.05, timeout=0.02,empty=0.1') == {'429': 0.05, 'timeout': 0.02, 'empty': 0.1}
+    assert parse_faults('') == {}
+    with pytest.raises(ValueError):
+        parse_faults('500=0.1')
+    with pytest.raises(ValueError):
+        parse_faults('429=0.6,empty=0.6')
+
+
+def test_injected_429(recordings):
+    models = replay_models(recordings, faults={'429': 1.0})
+    with pytest.raises(errors.ClientError) as excinfo:
+        models.generate_content(model=MODEL, contents=QUERY)
+    assert excinfo.value.code == 429
+    assert models.stats()['fault_429'] == 1
+
+
+def test_injected_timeout(recordings):
+    models = replay_models(recordings, faults={'timeout': 1.0}, timeout_seconds=0)
+    with pytest.raises(httpx.ReadTimeout):
+        models.generate_content(model=MODEL, contents=QUERY)
+
+
+def test_injected_empty_strips_grounding(recordings):
+    models = replay_models(recordings, faults={'empty': 1.0})
+    response = models.generate_content(model=MODEL, contents=QUERY)
+    assert response.text == ANSWER and grounding_of(response) is None
+    assert models.stats()['fault_empty'] == 1
+
+
+def test_pick_fault_follows_rates(recordings):
+    models = replay_models(recordings, faults={'429': 0.2, 'empty': 0.3})
+    picks = [models._pick_fault() for _ in range(2000)]
+    assert picks.count('429') == pytest.approx(400, abs=80)
+    assert picks.count('empty') == pytest.approx(600, abs=90)
+    assert 'timeout' not in picks
+
+
+def test_stand_in_server(recordings):
+    server = make_server(recordings, port=0, options=ReplayOptions(latency='0'))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address
+        client = genai.Client(api_key='stand-in', http_options=types.HttpOptions(base_url=f'http://{host}:{port}'))
+        response = client.models.generate_content(model=MODEL, contents=QUERY)
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert response.text == ANSWER
+    assert grounding_of(response) == grounding_of(grounded_response())
+    assert server.models.stats()['hits'] == 1
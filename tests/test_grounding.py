@@ -0,0 +1,114 @@
+"""grounding_metadata 解析：位元組→字元位置換算、引用區間與案件標題的對應"""
+
+from types import SimpleNamespace
+
+from grounding import _OffsetMap, extract_grounding, heading_citations
+
+ANSWER = """以下為查詢結果（共 2 件）：
+
+### 1. 某銀行違反洗錢防制法
+- **日期**：2025-03-01，罰鍰 NT$ 600 萬元
+- **違規事項**：未落實 KYC 客戶審查
+
+### 2. 某證券商違反證券交易法
+- **日期**：2024-11-20
+- **違規事項**：內部人員利用未公開資訊交易
+"""
+
+
+def byte_range(text: str, fragment: str) -> tuple:
+    """fragment 在 text 中的 UTF-8 位元組起訖位置"""
+    start = text.index(fragment)
+    return len(text[:start].encode('utf-8')), len(text[:start + len(fragment)].encode('utf-8'))
+
+
+def support(fragment: str, chunks: list, text: str = ANSWER, segment_text: str = None, byte_span: tuple = None):
+    start, end = byte_span or byte_range(text, fragment)
+    segment = SimpleNamespace(start_index=start, end_index=end,
+                              text=fragment if segment_text is None else segment_text)
+    return SimpleNamespace(segment=segment, grounding_chunk_indices=chunks)
+
+
+def chunk(title: str, text: str = "片段"):
+    return SimpleNamespace(retrieved_context=SimpleNamespace(title=title, uri=None, text=text))
+
+
+def response(supports: list, chunks: list, text: str = ANSWER):
+    metadata = SimpleNamespace(grounding_chunks=chunks, grounding_supports=supports)
+    return SimpleNamespace(text=text, candidates=[SimpleNamespace(grounding_metadata=metadata)])
+
+
+def spans_of(sources: list) -> dict:
+    return {source.filename: source.spans for source in sources}
+
+
+def test_offset_map_on_cjk_and_mixed_width_text():
+    text = "罰鍰 NT$ 600 萬元（ABC）é😀完"
+    offsets = _OffsetMap(text)
+    for index in range(len(text) + 1):
+        assert offsets.char_offset(len(text[:index].encode('utf-8'))) == index
+
+    # 往回查詢時從頭重新解碼
+    assert offsets.char_offset(len("罰鍰".encode('utf-8'))) == 2
+    # 落在多位元組字元中間：該字元不計入
+    assert offsets.char_offset(len("罰".encode('utf-8')) + 1) == 1
+    assert offsets.char_offset(10 ** 6) == len(text)
+
+
+def test_spans_map_to_character_offsets():
+    fragment = "罰鍰 NT$ 600 萬元"
+    sources, debug_info = extract_grounding(response([support(fragment, [0])], [chunk('files/a')]))
+
+    assert debug_info['grounding_supports_count'] == 1
+    (start, end), = sources[0].spans
+    assert ANSWER[start:end] == fragment
+
+
+def test_out_of_order_supports_give_same_spans():
+    fragments = ["未落實 KYC 客戶審查", "2024-11-20", "某銀行違反洗錢防制法", "內部人員利用未公開資訊交易"]
+    supports = [support(fragment, [i % 2]) for i, fragment in enumerate(fragments)]
+    chunks = [chunk('files/a'), chunk('files/b')]
+
+    in_order = spans_of(extract_grounding(response(supports, chunks))[0])
+    shuffled = spans_of(extract_grounding(response(supports[::-1], chunks))[0])
+    assert in_order == shuffled
+    assert [ANSWER[start:end] for start, end in in_order['files/a']] == [fragments[2], fragments[0]]
+    assert [ANSWER[start:end] for start, end in in_order['files/b']] == [fragments[1], fragments[3]]
+
+
+def test_mismatched_segment_falls_back_to_text_search():
+    fragment = "內部人員利用未公開資訊交易"
+    # 位元組位置指向別處（例如回答經過重組），以 segment.text 搜尋
+    stale = support(fragment, [0], byte_span=byte_range(ANSWER, "某銀行違反洗錢防制法"))
+    sources, _ = extract_grounding(response([stale], [chunk('files/a')]))
+    (start, end), = sources[0].spans
+    assert ANSWER[start:end] == fragment
+
+    # segment.text 也找不到時不記錄區間，但仍保留來源
+    missing = support(fragment, [0], segment_text="不存在的句子", byte_span=byte_range(ANSWER, fragment))
+    sources, _ = extract_grounding(response([missing], [chunk('files/a')]))
+    assert [source.filename for source in sources] == ['files/a'] and sources[0].spans == []
+
+
+def test_heading_citations_follow_spans():
+    supports = [
+        support("內部人員利用未公開資訊交易", [1]),
+        support("未落實 KYC 客戶審查", [0]),
+    ]
+    sources, _ = extract_grounding(response(supports, [chunk('files/a'), chunk('files/b')]))
+    cited = heading_citations(ANSWER, [source.to_dict() for source in sources])
+
+    filenames = [sources[idx].filename if idx is not None else None for idx in cited]
+    assert filenames == ['files/a', 'files/b']
+
+
+def test_support_spanning_two_headings_cites_only_the_first():
+    fragment = ANSWER[ANSWER.index("未落實"):ANSWER.index("2024-11-20")]
+    assert "### 2." in fragment
+    sources, _ = extract_grounding(response([support(fragment, [0])], [chunk('files/a')]))
+    cited = heading_citations(ANSWER, [source.to_dict() for source in sources])
+    assert cited == [0, None]  # 區間起點所在的段落才算引用
+
+
+def test_heading_without_spans_is_none():
+    assert heading_citations(ANSWER, [{'filename': 'files/a', 'spans': []}]) == [None, None]
@@ -0,0 +1,106 @@
+"""串流查詢的對沖（HedgedExecutor.run_stream）"""
+
+import threading
+import time
+
+from hedged_query import HedgedExecutor
+
+GROUNDED = {'success': True, 'text': '有來源的回答', 'sources': ['doc']}
+UNGROUNDED = {'success': True, 'text': '沒有來源的回答', 'sources': []}
+
+
+def is_grounded(result):
+    return bool(result and result.get('success') and result.get('sources'))
+
+
+def make_stream(chunks, result, first_delay=0.0, release: threading.Event = None):
+    """模擬串流請求：等待 first_delay 秒（或 release）後逐段送出文字，返回 result"""
+    def stream(emit):
+        if release is not None:
+            release.wait(5)
+        time.sleep(first_delay)
+        for chunk in chunks:
+            emit({'type': 'text', 'text': chunk})
+        return result
+    return stream
+
+
+def run(executor, stream, backup):
+    shown = []
+    retries = []
+    result, info = executor.run_stream(stream, backup, is_grounded, shown.append, on_retry=lambda: retries.append(1))
+    return result, info, [event['text'] for event in shown if event['type'] == 'text'], retries
+
+
+def test_grounded_stream_wins_without_backup():
+    executor = HedgedExecutor(default_delay=5.0)
+    backup_calls = []
+    result, info, shown, retries = run(executor, make_stream(['甲', '乙'], GROUNDED), lambda: backup_calls.append(1))
+    assert result is GROUNDED
+    assert info == {'attempts': 1, 'hedged': False, 'winner': 1, 'streamed': True}
+    assert shown == ['甲', '乙'] and not retries and not backup_calls
+
+
+def test_ungrounded_stream_launches_backup_immediately():
+    executor = HedgedExecutor(default_delay=5.0)
+    start = time.monotonic()
+    result, info, shown, retries = run(executor, make_stream(['甲'], UNGROUNDED), lambda: GROUNDED)
+    assert time.monotonic() - start < 1.0  # 不等待對沖等待時間
+    assert result is GROUNDED
+    assert info == {'attempts': 2, 'hedged': False, 'winner': 2, 'streamed': False}
+    assert retries == [1]
+    assert executor.stats()['retries_launched'] == 1
+
+
+def test_slow_first_text_is_hedged_and_backup_replaces_stream():
+    executor = HedgedExecutor(default_delay=0.05)
+    release = threading.Event()
+    try:
+        result, info, shown, _ = run(executor, make_stream(['慢'], GROUNDED, release=release), lambda: GROUNDED)
+    finally:
+        release.set()
+    assert result is GROUNDED
+    assert info['hedged'] and info['winner'] == 2 and not info['streamed']
+    assert shown == []  # 備援勝出後串流的文字不再顯示
+    assert executor.stats()['hedges_launched'] == 1
+
+
+def test_backup_does_not_replace_text_already_shown():
+    executor = HedgedExecutor(default_delay=0.05)
+    text_shown = threading.Event()
+    backup_done = threading.Event()
+
+    def backup():
+        text_shown.wait(5)
+        backup_done.set()
+        return GROUNDED
+
+    def stream(emit):
+        time.sleep(0.1)  # 超過對沖等待時間，備援請求已送出
+        emit({'type': 'text', 'text': '串流'})
+        text_shown.set()
+        backup_done.wait(5)
+        time.sleep(0.05)
+        return dict(GROUNDED)
+
+    result, info, shown, _ = run(executor, stream, backup)
+    assert info['hedged'] and info['winner'] == 1 and info['streamed']
+    assert shown == ['串流'] and result is not GROUNDED
+
+
+def test_both_ungrounded_prefers_stream_result():
+    executor = HedgedExecutor(default_delay=5.0)
+    result, info, shown, _ = run(executor, make_stream(['甲'], UNGROUNDED), lambda: dict(UNGROUNDED))
+    assert result is UNGROUNDED
+    assert info['winner'] is None and info['streamed'] and info['attempts'] == 2
+
+
+def test_failed_stream_falls_back_to_backup():
+    executor = HedgedExecutor(default_delay=5.0)
+
+    def stream(emit):
+        raise RuntimeError('連線中斷')
+
+    fallback = dict(UNGROUNDED)
+    result, info, _, _ = run(executor, stream, lambda: fallback)
+    assert result is fallback and not info['streamed']
@@ -0,0 +1,66 @@
+"""識別碼快速查詢（IdentifierIndex.lookup）"""
+
+from identifier_index import IdentifierIndex
+
+DOCS = {
+    'fsc_law_202511140001': {
+        '_type': 'law_interpretation',
+        'law_name': '保險法施行細則',
+        'document_number': '金管保壽字第11404942301號',
+        'date': '2025-11-14',
+    },
+    'fsc_law_202510010002': {
+        '_type': 'law_interpretation',
+        'law_name': '保險法',
+        'document_number': '金管保財字第11404811111號',
+        'date': '2025-10-01',
+    },
+    'fsc_pen_20250925_0001': {
+        '_type': 'penalty',
+        'display_name': '某銀行違反洗錢防制法',
+        'document_number': '金管銀法字第11401234567號',
+        'date': '2025-09-25',
+    },
+    'fsc_ann_202509010003': {
+        '_type': 'announcement',
+        'announcement_number': '金管證發字第1140000001號',
+        'display_name': '公告證券商內部控制制度標準規範',
+        'date': '2025-09-01',
+    },
+}
+
+INDEX = IdentifierIndex(DOCS)
+
+# 查詢幾乎只有識別碼時不呼叫 Gemini 的門檻（FSC_IDENTIFIER_COVERAGE 的預設值）
+COVERAGE_THRESHOLD = 0.8
+
+
+def test_exact_document_number():
+    lookup = INDEX.lookup('「金管保壽字第11404942301號」')
+    assert [(match.field, match.partial) for match in lookup.matches] == [('document_number', False)]
+    assert lookup.doc_ids() == ['fsc_law_202511140001']
+    assert lookup.coverage == 1.0
+
+
+def test_digits_only_is_partial_match():
+    lookup = INDEX.lookup('11401234567')
+    assert [match.partial for match in lookup.matches] == [True]
+    assert lookup.doc_ids() == ['fsc_pen_20250925_0001']
+
+
+def test_longest_law_name_wins():
+    lookup = INDEX.lookup('保險法施行細則')
+    assert [match.label for match in lookup.matches] == ['保險法施行細則']
+    assert lookup.doc_ids() == ['fsc_law_202511140001']
+    assert INDEX.lookup('保險法').doc_ids() == ['fsc_law_202510010002']
+
+
+def test_identifier_inside_longer_question():
+    lookup = INDEX.lookup('請問金管銀法字第11401234567號的裁罰原因與罰鍰金額是多少，後續有無改善？')
+    assert lookup.doc_ids() == ['fsc_pen_20250925_0001'] and not lookup.matches[0].partial
+    assert 0 < lookup.coverage < COVERAGE_THRESHOLD
+
+
+def test_no_match():
+    assert not INDEX.lookup('最近的內線交易案例')
+    assert INDEX.lookup('').coverage == 0.0
@@ -0,0 +1,71 @@
+"""法條連結索引（LawIndex）：依查詢挑選相關法條，沒有提到法律時改用常被引用的法條"""
+
+from law_index import LawIndex
+
+URL = 'https://law.moj.gov.tw/'
+
+DOC_LAW_LINKS = {
+    'fsc_pen_20240101_0001': {
+        '洗錢防制法第7條': URL + 'aml7',
+        '洗錢防制法第9條': URL + 'aml9',
+        '第7條': URL + 'aml7',                 # 簡寫：只用於本地插入連結
+    },
+    'fsc_pen_20240201_0002': {
+        '洗錢防制法第7條': URL + 'aml7-dup',   # 同一法條以最先出現的連結為準
+        '銀行法第45條之1': URL + 'bank45-1',
+        '與第3條': URL + 'bad',                # 斷句錯誤：不使用
+    },
+    'fsc_pen_20240301_0003': {
+        '證券交易法第178條': URL + 'sec178',
+        '金融控股公司法第45條': URL + 'fhc45',
+        '洗錢防制法第7條': URL + 'aml7',
+    },
+}
+
+
+def make_index() -> LawIndex:
+    return LawIndex(DOC_LAW_LINKS)
+
+
+def test_index_keeps_full_citations_only():
+    index = make_index()
+    assert len(index) == 5
+    assert index.links['洗錢防制法第7條'] == URL + 'aml7'
+    assert index.citations['洗錢防制法第7條'] == 3
+    assert set(index.articles) == {'洗錢防制法', '銀行法', '證券交易法', '金融控股公司法'}  # 不含「與第3條」
+
+
+def test_conjunctions_do_not_match_invalid_citations():
+    assert make_index().mentioned_laws('洗錢防制法與銀行法') == ['洗錢防制法', '銀行法']
+
+
+def test_query_selects_mentioned_law_names():
+    index = make_index()
+    assert set(index.select_for_query('違反洗錢防制法的裁罰')) == {'洗錢防制法第7條', '洗錢防制法第9條'}
+    # 簡稱與去掉「法」的名稱也能對應；查詢提到的條號排在前面
+    assert list(index.select_for_query('證交法第178條的案例')) == ['證券交易法第178條']
+    assert list(index.select_for_query('洗錢防制第9條')) == ['洗錢防制法第9條', '洗錢防制法第7條']
+    assert set(index.select_for_query('金控法與銀行法')) == {'金融控股公司法第45條', '銀行法第45條之1'}
+
+
+def test_limit_takes_articles_from_each_law_in_turn():
+    selected = make_index().select_for_query('洗錢防制法與銀行法', limit=2)
+    assert set(selected) == {'洗錢防制法第7條', '銀行法第45條之1'}
+
+
+def test_unmatched_query_falls_back_to_full_table_when_small():
+    index = make_index()
+    assert index.select_for_query('最近有哪些裁罰案件？') == index.links
+    assert index.select_for_query('') == index.links
+
+
+def test_unmatched_query_caps_fallback_at_most_cited():
+    index = make_index()
+    assert index.select_for_query('最近有哪些裁罰案件？', fallback=1) == {'洗錢防制法第7條': URL + 'aml7'}
+
+
+def test_select_for_docs_includes_short_forms_and_skips_invalid():
+    selected = make_index().select_for_docs(['fsc_pen_20240101_0001', 'fsc_pen_20240201_0002', 'missing'])
+    assert selected['第7條'] == URL + 'aml7'
+    assert selected['洗錢防制法第7條'] == URL + 'aml7-dup'   # 後面的文件覆蓋相同法條
+    assert '與第3條' not in selected
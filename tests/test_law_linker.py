@@ -0,0 +1,166 @@
+"""法條連結：LawLinker.link 與原本兩階段正則（add_law_links_to_text 舊版）的結果一致"""
+
+import random
+import re
+
+import pytest
+
+from benchmarks import synthetic
+from law_linker import LawLinker
+
+LAW_LINKS = {
+    '金融控股公司法第45條': 'https://law.moj.gov.tw/fhc/45',
+    '金融控股公司法第46條': 'https://law.moj.gov.tw/fhc/46',
+    '銀行法第33條': 'https://law.moj.gov.tw/bank/33',
+    '銀行法第45條之1': 'https://law.moj.gov.tw/bank/45-1',
+    '保險法第171條': 'https://law.moj.gov.tw/ins/171',
+    '保險法第171條之1': 'https://law.moj.gov.tw/ins/171-1',
+    '保險法施行細則第3條': 'https://law.moj.gov.tw/ins-rule/3',
+    '證券交易法第178條': 'https://law.moj.gov.tw/sec/178',
+    '第46條': 'https://law.moj.gov.tw/short/46',
+    '第60條': 'https://law.moj.gov.tw/short/60',
+    '第3條': 'https://law.moj.gov.tw/short/3',
+}
+
+
+def baseline_add_law_links(text: str, law_links_dict: dict, shift_positions: bool = False) -> str:
+    """原本的實作（依法條名稱長度逐條以正則替換，之後再處理「第N條」簡寫）
+
+    原本記錄的已替換區間不會隨之後的替換位移：前面的文字加入連結變長後，舊區間可能蓋到後面尚未處理的法條，
+    使該法條漏掉連結（LawLinker 在原始文字上比對，不會漏）。shift_positions=True 時修正這一點，其餘規則不變。
+    """
+    if not law_links_dict:
+        return text
+
+    sorted_laws = sorted(law_links_dict.keys(), key=len, reverse=True)
+    result = text
+    replaced_positions = []
+
+    def replace(start, end, replacement):
+        nonlocal result
+        result = result[:start] + replacement + result[end:]
+        if shift_positions:
+            delta = len(replacement) - (end - start)
+            replaced_positions[:] = [(pos + delta, pos_end + delta) if pos >= end else (pos, pos_end)
+                                     for pos, pos_end in replaced_positions]
+        replaced_positions.append((start, start + len(replacement)))
+
+    for law in sorted_laws:
+        if law.startswith('第'):
+            continue
+        link = law_links_dict[law]
+        law_match = re.match(r'^(.+?)(第\d+條(?:之\d+)?)', law)
+        if not law_match:
+            continue
+        pattern = (
+            r'(?<!\[)(?<!\()'
+            r'(?:[、，及與和以]\s*)?'
+            r'(?:《)?' + re.escape(law_match.group(1)) + r'(?:》)?'
+            r'\s*' + re.escape(law_match.group(2)) +
+            r'(?:第\d+項)?(?:第\d+款)?(?:第\d+目)?'
+            r'(?!\])(?!\))'
+        )
+        matches = []
+        for match in re.finditer(pattern, result):
+            start, end = match.span()
+            if not any(start < pos_end and end > pos for pos, pos_end in replaced_positions):
+                matches.append((start, end, match.group(0)))
+        for start, end, matched_text in reversed(matches):
+            connector_match = re.match(r'^([、，及與和以]\s*)?(.+)$', matched_text)
+            if connector_match:
+                replacement = f'{connector_match.group(1) or ""}[{connector_match.group(2)}]({link})'
+            else:
+                replacement = f'[{matched_text}]({link})'
+            replace(start, end, replacement)
+
+    for law in sorted_laws:
+        if not law.startswith('第'):
+            continue
+        link = law_links_dict[law]
+        pattern = (
+            r'(?<!\[)(?<!\()'
+            r'(?:[、，及與和])\s*' + re.escape(law) +
+            r'(?:第\d+項)?(?:第\d+款)?(?:第\d+目)?'
+            r'(?!\])(?!\))'
+        )
+        matches = []
+        for match in re.finditer(pattern, result):
+            start, end = match.span()
+            if not any(start < pos_end and end > pos for pos, pos_end in replaced_positions):
+                matches.append((start, end, match.group(0)))
+        for start, end, matched_text in reversed(matches):
+            connector_match = re.match(r'([、，及與和]\s*)(.+)', matched_text)
+            if connector_match:
+                replace(start, end, f'{connector_match.group(1)}[{connector_match.group(2)}]({link})')
+
+    return result
+
+
+ANSWERS = [
+    # 項/款/目與簡寫條號
+    "違反金融控股公司法第45條第1項第2款、第46條及第60條規定，核處罰鍰。",
+    # 重疊的法律名稱：「保險法施行細則」「保險法」、「第171條之1」「第171條」、「商業銀行法」內含「銀行法」
+    "依保險法施行細則第3條及保險法第171條之1第2項，另違反保險法第171條。",
+    "依商業銀行法第33條辦理，並違反銀行法第45條之1與第3條。",
+    # 書名號、空白與連接詞「以」
+    "爰依《銀行法》第33條規定，以證券交易法 第178條處分。",
+    # 已經是連結的法條（連結內外都不應重複加連結）
+    "[金融控股公司法第45條](https://example.com/a)及第46條，另見[銀行法第33條](https://example.com/b)。",
+    # 全形/半形：全形數字的條號、半形逗號、全形與半形括號
+    "違反保險法第１７１條及第４６條，與銀行法第33條,第60條。",
+    "（銀行法第33條）與(金融控股公司法第45條)，以及【保險法第171條】。",
+    # 連接詞與簡寫條號之間的空白、行首簡寫（沒有連接詞）
+    "第46條不加連結，但、 第46條與，第60條第3項會加。",
+    "",
+    "沒有任何法條的回答。",
+]
+
+
+@pytest.mark.parametrize('text', ANSWERS)
+def test_link_matches_baseline(text):
+    assert LawLinker(LAW_LINKS).link(text) == baseline_add_law_links(text, LAW_LINKS)
+
+
+def test_existing_links_are_kept():
+    text = ANSWERS[4]
+    linked = LawLinker(LAW_LINKS).link(text)
+    assert linked.count('](https://example.com/a)') == 1 and linked.count('](https://example.com/b)') == 1
+    assert '及[第46條](https://law.moj.gov.tw/short/46)' in linked
+
+
+def test_no_nested_link_inside_link_text():
+    # 原本的正則只檢查前一字是否為「[」，連結文字中間的法條會產生巢狀連結；這裡略過已存在的連結
+    text = "參見[違反銀行法第33條規定](https://example.com/c)。"
+    assert LawLinker(LAW_LINKS).link(text) == text
+    assert baseline_add_law_links(text, LAW_LINKS) != text
+
+
+def test_full_width_variants():
+    linked = LawLinker(LAW_LINKS).link(ANSWERS[5])
+    assert '保險法第１７１條' in linked and '[保險法第１７１條]' not in linked  # 全形數字不視為條號
+    assert '[第４６條]' not in linked
+    assert ',第60條' in linked  # 半形逗號不是連接詞
+    linked = LawLinker(LAW_LINKS).link(ANSWERS[6])
+    assert '（[銀行法第33條](https://law.moj.gov.tw/bank/33)）' in linked  # 全形括號照常加連結
+    assert '(金融控股公司法第45條)' in linked  # 半形括號內視為連結語法，不加連結
+
+
+def test_no_link_dropped_after_earlier_replacement():
+    # 原本的實作：結尾的「金融控股公司法第45條」先加連結並記錄區間，開頭的「保險法第171條」加連結後文字右移，
+    # 舊區間沒有位移，蓋到中間的「銀行法第33條」而漏掉連結
+    links = {'金融控股公司法第45條': 'https://law.moj.gov.tw/fhc/45', '保險法第171條': 'https://law.moj.gov.tw/ins/171',
+             '銀行法第33條': 'https://law.moj.gov.tw/bank/33'}
+    text = "違反保險法第171條、銀行法第33條、金融控股公司法第45條規定"
+    expected = ("違反[保險法第171條](https://law.moj.gov.tw/ins/171)、[銀行法第33條](https://law.moj.gov.tw/bank/33)、"
+                "[金融控股公司法第45條](https://law.moj.gov.tw/fhc/45)規定")
+    assert LawLinker(links).link(text) == expected
+    assert baseline_add_law_links(text, links, shift_positions=True) == expected
+    assert '、銀行法第33條、' in baseline_add_law_links(text, links)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_randomized_parity(seed):
+    rng = random.Random(seed)
+    law_table = synthetic.make_law_table(rng.randint(20, 300), n_short=rng.randint(0, 80), seed=seed)
+    answer = synthetic.make_answer(rng.randint(1, 30), law_table, seed=seed)
+    assert LawLinker(law_table).link(answer) == baseline_add_law_links(answer, law_table, shift_positions=True)
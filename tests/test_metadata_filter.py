@@ -0,0 +1,70 @@
+"""篩選條件下推（MetadataFilter）：表達式、本地比對與可下推欄位"""
+
+from datetime import date
+from types import SimpleNamespace
+
+from metadata_filter import (MetadataFilter, doc_metadata, has_matching_docs, parse_filters,
+                             pushable_keys)
+
+PENALTY = doc_metadata('fsc_pen_20250301_0001')  # 裁罰案件：只有 Gemini ID 映射，沒有來源單位
+LAW = doc_metadata('fsc_law_202411140001', {'_type': 'law_interpretation', 'source': 'bank_bureau',
+                                             'category': '函釋'})
+
+
+def snapshot(file_mapping: dict, gemini_ids: dict = None):
+    return SimpleNamespace(file_mapping=file_mapping, gemini_id_mapping=gemini_ids or {})
+
+
+def test_parse_filters_builds_expression():
+    metadata_filter = parse_filters({
+        'start_date': date(2024, 1, 1), 'end_date': '2024-12-31',
+        'source_units': ['證券期貨局', '銀行局'], 'min_penalty': 1_000_000
+    })
+    assert metadata_filter == MetadataFilter(20240101, 20241231, ('bank_bureau', 'securities_bureau'))
+    assert metadata_filter.expression() == (
+        'date >= 20240101 AND date <= 20241231 AND (source = "bank_bureau" OR source = "securities_bureau")'
+    )
+    assert not parse_filters({'min_penalty': 1_000_000})  # 裁罰金額無法下推
+
+
+def test_date_range_is_inclusive():
+    metadata_filter = MetadataFilter(start_date=20250301, end_date=20250331)
+    assert PENALTY['date'] == 20250301
+    assert metadata_filter.may_match(PENALTY)
+    assert metadata_filter.may_match({'date': 20250331})
+    assert not metadata_filter.may_match({'date': 20250401})
+    assert not MetadataFilter(end_date=20250228).may_match(PENALTY)
+
+
+def test_source_list():
+    metadata_filter = MetadataFilter(sources=('bank_bureau', 'insurance_bureau'))
+    assert metadata_filter.may_match(LAW)
+    assert not MetadataFilter(sources=('insurance_bureau',)).may_match(LAW)
+
+
+def test_missing_metadata_may_match():
+    assert 'source' not in PENALTY and 'category' not in PENALTY
+    assert MetadataFilter(sources=('insurance_bureau',), categories=('函釋',)).may_match(PENALTY)
+    assert MetadataFilter(start_date=20250101).may_match(doc_metadata('unknown_doc'))
+
+
+def test_has_matching_docs_uses_local_mapping():
+    docs = snapshot({'fsc_law_202411140001': {'source': 'bank_bureau'}}, {'files/1': 'fsc_pen_20250301_0001'})
+    assert has_matching_docs(docs, MetadataFilter(start_date=20250101))
+    assert not has_matching_docs(docs, MetadataFilter(start_date=20260101))
+    assert has_matching_docs(docs, MetadataFilter())
+
+
+def test_keys_missing_from_a_family_are_not_pushed_down():
+    with_penalties = snapshot(
+        {'fsc_law_202411140001': {'source': 'bank_bureau', 'category': '函釋'}},
+        {'files/1': 'fsc_pen_20250301_0001'}
+    )
+    assert pushable_keys(with_penalties) == {'date'}
+    assert pushable_keys(snapshot({'fsc_law_202411140001': {'source': 'bank_bureau'}})) == {'date', 'source'}
+
+    metadata_filter = MetadataFilter(start_date=20240101, sources=('bank_bureau',))
+    pushed = metadata_filter.restrict(pushable_keys(with_penalties))
+    assert pushed.expression() == 'date >= 20240101'
+    assert pushed.keys() == {'date'} and metadata_filter.keys() == {'date', 'source'}
+    assert not MetadataFilter(sources=('bank_bureau',)).restrict({'date'})
@@ -0,0 +1,52 @@
+"""映射檔登錄（MetadataRegistry）：重新載入後，舊快照仍可讀取"""
+
+import gc
+import os
+import sqlite3
+
+import pytest
+
+from benchmarks import synthetic
+from build_metadata_index import compile_index
+from metadata_registry import MAPPING_SOURCES, MetadataRegistry
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    raw = synthetic.make_raw_mappings(50)
+    synthetic.write_raw_mappings(raw, tmp_path)
+    compile_index(tmp_path)
+    return tmp_path
+
+
+def test_old_snapshot_readable_after_reload(data_dir):
+    registry = MetadataRegistry(data_dir, check_interval=0)
+    old = registry.snapshot()
+    assert old.backend == 'sqlite'
+    doc_id = next(iter(old.file_mapping))
+
+    # 映射檔變動（例如同步後寫回）：下一次取得快照時重新載入
+    mapping_file = data_dir / MAPPING_SOURCES[0].relpath
+    stat = mapping_file.stat()
+    os.utime(mapping_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    new = registry.snapshot()
+    assert new is not old and registry.stats()['loads'] == 2
+
+    # 仍持有舊快照的執行緒照常讀取（未快取的項目需要查詢 SQLite）
+    assert old.file_mapping[doc_id] == new.file_mapping[doc_id]
+    assert len(old.file_mapping) == len(new.file_mapping)
+    assert old.counts()['by_type'] == new.counts()['by_type']
+
+
+def test_connection_closed_with_last_reference(data_dir):
+    registry = MetadataRegistry(data_dir, check_interval=0)
+    mapping = registry.get_file_mapping()
+    conn = mapping._conn._conn
+    registry._snapshot = None
+    gc.collect()
+    conn.execute('SELECT 1')  # 映射仍被引用：連線未關閉
+
+    del mapping
+    gc.collect()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
@@ -0,0 +1,82 @@
+"""查詢指標：直方圖累計區間與百分位數、Prometheus 匯出格式、跨執行緒累加的分段計時"""
+
+import threading
+
+import pytest
+
+from metrics import Histogram, MetricsRegistry, _nearest_rank
+
+
+def test_histogram_cumulative_buckets():
+    histogram = Histogram(buckets=(1, 5, 10))
+    for value in (0.5, 1, 3, 7, 20, 100):
+        histogram.observe(value)
+
+    # 邊界值算在該區間內（le）；超過最大區間的落在 +Inf
+    assert histogram.cumulative_buckets() == [(1, 2), (5, 3), (10, 4), (float('inf'), 6)]
+    assert histogram.count == 6 and histogram.sum == pytest.approx(131.5)
+
+
+def test_nearest_rank_percentiles():
+    samples = list(range(1, 101))
+    assert _nearest_rank(samples, 0) == 1
+    assert _nearest_rank(samples, 0.5) == 51   # round(0.5 × 99) = 50 → 第 51 筆
+    assert _nearest_rank(samples, 0.95) == 95
+    assert _nearest_rank(samples, 1) == 100
+    assert _nearest_rank([], 0.5) is None
+
+
+def test_percentiles_use_recent_window():
+    histogram = Histogram(window=4)
+    for value in (100, 1, 2, 3, 4):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['window'] == 4 and snapshot['max'] == 4   # 最舊的 100 已移出視窗
+    assert snapshot['count'] == 5 and histogram.percentile(0.5) == 3
+
+
+def test_prometheus_declares_each_metric_once():
+    registry = MetricsRegistry(namespace='t')
+    registry.observe('stage_seconds', 0.2, buckets=(0.1, 1), stage='gemini_call')
+    registry.observe('stage_seconds', 5, buckets=(0.1, 1), stage='grounding_extraction')
+    registry.inc('errors_total', stage='gemini_call', error='ClientError')
+    registry.inc('errors_total', stage='gemini_call', error='ReadTimeout')
+    lines = registry.to_prometheus().splitlines()
+
+    assert lines.count('# TYPE t_stage_seconds histogram') == 1
+    assert lines.count('# HELP t_stage_seconds 查詢流程各階段耗時（秒）') == 1
+    assert lines.count('# TYPE t_errors_total counter') == 1
+    assert sum(line.startswith('# HELP') for line in lines) == 2
+
+    assert 't_stage_seconds_bucket{stage="gemini_call",le="0.1"} 0' in lines
+    assert 't_stage_seconds_bucket{stage="gemini_call",le="1"} 1' in lines
+    assert 't_stage_seconds_bucket{stage="gemini_call",le="+Inf"} 1' in lines
+    assert 't_stage_seconds_bucket{stage="grounding_extraction",le="+Inf"} 1' in lines
+    assert 't_stage_seconds_count{stage="grounding_extraction"} 1' in lines
+    assert 't_errors_total{error="ReadTimeout",stage="gemini_call"} 1' in lines
+
+
+def test_prometheus_escapes_label_values():
+    registry = MetricsRegistry(namespace='t')
+    registry.inc('errors_total', error='say "hi"\\\nbye')
+    assert 't_errors_total{error="say \\"hi\\"\\\\\\nbye"} 1' in registry.to_prometheus().splitlines()
+
+
+def test_trace_add_accumulates_across_threads():
+    registry = MetricsRegistry()
+    trace = registry.trace()
+    start = threading.Barrier(8)
+
+    def hedge():
+        start.wait()
+        for _ in range(500):
+            trace.add('gemini_call', 0.001)
+
+    threads = [threading.Thread(target=hedge) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert trace.stages['gemini_call'] == pytest.approx(4.0)
+    assert registry.histogram('stage_seconds', stage='gemini_call').count == 4000
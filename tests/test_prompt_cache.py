@@ -0,0 +1,178 @@
+"""System instruction 快取（CachedPromptManager）：以 fake_genai.FakeClient 執行"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from fake_genai import FakeClient
+from prompt_cache import CachedPromptManager
+
+MODEL = 'gemini-2.5-flash'
+STORE = 'fileSearchStores/test'
+INSTRUCTION = '系統指令' * 100
+
+
+class SlowCaches:
+    """包裝 FakeCaches：建立/延長前等待 gate，fail 中列出的呼叫拋出例外，並記錄呼叫次數"""
+
+    def __init__(self, caches, gate: threading.Event = None, fail: tuple = ()):
+        self._caches = caches
+        self.gate = gate
+        self.fail = fail
+        self.calls = {'create': 0, 'update': 0, 'delete': 0}
+        self.started = threading.Event()
+
+    def _enter(self, name):
+        self.calls[name] += 1
+        self.started.set()
+        if self.gate is not None:
+            self.gate.wait(5)
+        if name in self.fail:
+            raise RuntimeError('cached content is too small')
+
+    def create(self, model, config=None):
+        self._enter('create')
+        return self._caches.create(model=model, config=config)
+
+    def update(self, name, config=None):
+        self._enter('update')
+        return self._caches.update(name=name, config=config)
+
+    def delete(self, name, config=None):
+        self.calls['delete'] += 1
+        return self._caches.delete(name=name, config=config)
+
+
+def make_manager(gate=None, fail=(), **kwargs):
+    client = FakeClient()
+    caches = client.caches = SlowCaches(client.caches, gate, fail)
+    return CachedPromptManager(client, **kwargs), caches
+
+
+def test_create_then_hit():
+    manager, caches = make_manager()
+    name = manager.get(MODEL, STORE, INSTRUCTION)
+    assert name and manager.get(MODEL, STORE, INSTRUCTION) == name
+    assert caches.calls['create'] == 1
+    stats = manager.stats()
+    assert stats['created'] == 1 and stats['hits'] == 1 and stats['active'] == 1
+
+
+def test_concurrent_misses_create_once():
+    gate = threading.Event()
+    manager, caches = make_manager(gate)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(manager.get, MODEL, STORE, INSTRUCTION) for _ in range(8)]
+        assert caches.started.wait(5)
+        time.sleep(0.05)
+        gate.set()
+        names = {future.result() for future in futures}
+    assert len(names) == 1 and None not in names
+    assert caches.calls['create'] == 1
+
+
+def test_network_call_does_not_hold_lock():
+    gate = threading.Event()
+    manager, caches = make_manager()
+    other_store = 'fileSearchStores/other'
+    name = manager.get(MODEL, other_store, INSTRUCTION)
+
+    caches.gate = gate
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(manager.get, MODEL, STORE, INSTRUCTION)
+        assert caches.started.wait(5)
+        # 另一個 Store 建立快取時，已有快取的 Store 與統計不需要等待
+        start = time.monotonic()
+        assert manager.get(MODEL, other_store, INSTRUCTION) == name
+        manager.stats()
+        assert time.monotonic() - start < 1.0
+        gate.set()
+        assert pending.result()
+
+
+def test_refresh_near_expiry_and_stale_entry_served_meanwhile():
+    manager, caches = make_manager(refresh_margin=300)
+    name = manager.get(MODEL, STORE, INSTRUCTION)
+    manager._entries[(MODEL, STORE)]['expires_at'] = time.time() + 60  # 接近到期
+
+    gate = caches.gate = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        refreshing = pool.submit(manager.get, MODEL, STORE, INSTRUCTION)
+        assert caches.started.wait(5)
+        assert manager.get(MODEL, STORE, INSTRUCTION) == name  # 延長中：舊快取尚未到期，直接使用
+        gate.set()
+        assert refreshing.result() == name
+    assert caches.calls == {'create': 1, 'update': 1, 'delete': 0}
+    assert manager._entries[(MODEL, STORE)]['expires_at'] > time.time() + 300
+
+
+def test_changed_instruction_replaces_cache():
+    manager, caches = make_manager(retire_grace=0.05)
+    first = manager.get(MODEL, STORE, INSTRUCTION)
+    second = manager.get(MODEL, STORE, INSTRUCTION + '（法條連結表已更新）')
+    assert second and second != first
+    # 其他請求可能仍在使用舊快取：寬限期內不刪除
+    assert caches.calls['delete'] == 0
+    caches._caches.get(first)
+
+    time.sleep(0.1)
+    third = manager.get(MODEL, STORE, INSTRUCTION + '（再次更新）')
+    assert third not in (first, second)
+    assert caches.calls['delete'] == 1  # 寬限期已過的第一個快取在下一次建立時刪除
+    with pytest.raises(ValueError):
+        caches._caches.get(first)
+    caches._caches.get(second)
+
+
+def test_create_failure_falls_back_and_pauses():
+    manager, caches = make_manager(fail=('create',), retry_after=600)
+    assert manager.get(MODEL, STORE, INSTRUCTION) is None
+    assert manager.get(MODEL, STORE, INSTRUCTION) is None
+    assert caches.calls['create'] == 1
+    stats = manager.stats()
+    assert stats['failures'] == 1 and stats['fallbacks'] == 2
+    assert 'too small' in stats['last_error']
+
+
+def test_waiter_falls_back_after_timeout():
+    gate = threading.Event()
+    manager, caches = make_manager(gate, wait_timeout=0.05)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        creating = pool.submit(manager.get, MODEL, STORE, INSTRUCTION)
+        assert caches.started.wait(5)
+        assert manager.get(MODEL, STORE, INSTRUCTION) is None
+        gate.set()
+        assert creating.result()
+    assert manager.stats()['fallbacks'] == 1
+
+
+def test_failed_refresh_does_not_break_requests_using_old_cache():
+    manager, caches = make_manager(refresh_margin=300, retire_grace=60)
+    old = manager.get(MODEL, STORE, INSTRUCTION)
+    manager._entries[(MODEL, STORE)]['expires_at'] = time.time() + 200  # 接近到期，需要延長
+
+    gate = caches.gate = threading.Event()
+    caches.fail = ('update',)
+    caches.started.clear()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        refreshing = pool.submit(manager.get, MODEL, STORE, INSTRUCTION)
+        assert caches.started.wait(5)
+        in_use = manager.get(MODEL, STORE, INSTRUCTION)  # 延長中：這個請求取得舊快取
+        gate.set()
+        new = refreshing.result()  # 延長失敗，改為建立新快取
+
+    assert in_use == old and new and new != old
+    assert caches.calls['delete'] == 0
+    caches._caches.get(old)  # 使用舊快取的請求仍可進行
+
+    # 使用舊快取的請求失敗（不可重試）：新快取已經換上，不受影響
+    manager.invalidate(MODEL, STORE, old)
+    assert manager.get(MODEL, STORE, INSTRUCTION) == new
+    assert manager.stats()['fallbacks'] == 0
+
+    # 目前的快取失敗：捨棄並暫停使用
+    manager.invalidate(MODEL, STORE, new)
+    assert manager.get(MODEL, STORE, INSTRUCTION) is None
+    assert caches.calls['delete'] == 1
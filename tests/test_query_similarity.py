@@ -0,0 +1,89 @@
+"""相似查詢：n-gram 相似度之外，直接使用既有答案前需提到相同的機構類型與法律"""
+
+import pytest
+
+from law_index import LawIndex
+from query_similarity import SimilarQueryIndex, fold_text, same_subject, subject_terms
+
+LAW_INDEX = LawIndex({
+    'fsc_pen_20250101_0001': {'金融控股公司法第45條': 'https://law.moj.gov.tw/fhc/45',
+                              '洗錢防制法第7條': 'https://law.moj.gov.tw/aml/7'},
+    'fsc_pen_20250101_0002': {'銀行法第33條': 'https://law.moj.gov.tw/bank/33',
+                              '票券金融管理法第50條': 'https://law.moj.gov.tw/bills/50'},
+})
+
+SERVE_THRESHOLD = 0.85  # app.py FSC_SIMILAR_SERVE_THRESHOLD 的預設值
+
+# (新查詢, 快取中的查詢, 是否為同一主體)
+PAIRS = [
+    # 只差一字的機構類型：n-gram 相似度超過門檻，但不是同一個問題
+    ('證券商違反洗錢防制法的裁罰案例', '票券商違反洗錢防制法的裁罰案例有哪些', False),
+    # 換句話說（簡稱與全名）：主體相同
+    ('金控法利害關係人違規的處罰', '違反金控法利害關係人規定會受到什麼處罰？', True),
+    ('違反金融控股公司法利害關係人規定的處罰', '違反金控法利害關係人規定會受到什麼處罰？', True),
+    # 不同的法律
+    ('違反銀行法利害關係人規定會受到什麼處罰？', '違反金控法利害關係人規定會受到什麼處罰？', False),
+]
+
+
+def best_match(query: str, cached: str):
+    index = SimilarQueryIndex()
+    index.add('cached', cached)
+    index.add('other', '保險業招攬不當的裁罰')
+    matches = index.search(query, min_score=0.45)
+    assert matches and matches[0].key == 'cached'
+    return matches[0]
+
+
+@pytest.mark.parametrize('query, cached, same', PAIRS)
+def test_subject_gate(query, cached, same):
+    match = best_match(query, cached)
+    assert same_subject(query, match.query, LAW_INDEX) is same
+
+
+# 同一個問題的不同說法：直接使用既有答案
+PARAPHRASES = [
+    ('金控法利害關係人違規的處罰', '違反金控法利害關係人規定會受到什麼處罰？'),
+    ('違反金控法利害關係人規定會有什麼處罰？', '違反金控法利害關係人規定會受到什麼處罰？'),
+    ('金控法利害關係人違規會怎麼處罰', '違反金控法利害關係人規定會受到什麼處罰？'),
+    ('違反金融控股公司法利害關係人規定的罰則', '違反金控法利害關係人規定會受到什麼處罰？'),
+]
+
+# 主體相同但問的是另一件事：不超過門檻
+DIFFERENT_QUESTIONS = [
+    ('金控法利害關係人交易的規定', '違反金控法利害關係人規定會受到什麼處罰？'),
+    ('金控法利害關係人授信的案例', '違反金控法利害關係人規定會受到什麼處罰？'),
+    ('銀行違反洗錢防制法的裁罰金額', '銀行違反洗錢防制法的裁罰案例'),
+    ('銀行違反洗錢防制法的裁罰', '銀行違反洗錢防制法的處分依據'),
+]
+
+
+@pytest.mark.parametrize('query, cached', PARAPHRASES)
+def test_paraphrase_is_served(query, cached):
+    match = best_match(query, cached)
+    assert match.score >= SERVE_THRESHOLD and same_subject(query, match.query, LAW_INDEX)
+
+
+@pytest.mark.parametrize('query, cached', DIFFERENT_QUESTIONS)
+def test_different_question_stays_below_threshold(query, cached):
+    assert best_match(query, cached).score < SERVE_THRESHOLD
+
+
+def test_fold_text_expands_law_aliases():
+    assert fold_text('金控法利害關係人違規的處罰') == fold_text('違反金融控股公司法利害關係人規定會受到什麼處罰？')
+    assert fold_text('證交法第155條') == '證券交易法第155條'
+
+
+def test_near_identical_wrong_subject_scores_above_threshold():
+    # 只靠相似度會直接使用「票券商」的答案回答「證券商」的問題
+    query, cached, _ = PAIRS[0]
+    assert best_match(query, cached).score >= SERVE_THRESHOLD
+
+
+def test_subject_terms():
+    assert subject_terms('證券商違反洗錢防制法', LAW_INDEX) == {'證券商', 'law:洗錢防制法'}
+    assert subject_terms('票券商違反票券法') == {'票券商'}  # 沒有法條索引時只比對機構
+    # 法律名稱中的機構字樣不算機構；業務局名稱中的「銀行」也不算
+    assert subject_terms('違反銀行法第33條', LAW_INDEX) == {'law:銀行法'}
+    assert subject_terms('銀行局對商業銀行的處分') == {'銀行局', '銀行'}
+    assert subject_terms('證期局對投信的裁罰') == {'證券期貨局', '投信'}
@@ -0,0 +1,54 @@
+"""查詢結果紀錄（ResultHistory）：相同查詢取代舊紀錄、依筆數與總字數淘汰，最新的一筆一定保留"""
+
+from result_history import ResultHistory, entry_size
+
+
+def entry(query: str, filters: dict = None, markdown: str = '答案') -> dict:
+    return {'query': query, 'filters': filters, 'markdown': markdown, 'sources': []}
+
+
+def queries(history: ResultHistory) -> list:
+    return [history.get(entry_id)['query'] for entry_id in history.ids()]
+
+
+def test_same_query_and_filters_replaces_entry():
+    history = ResultHistory()
+    first = history.add(entry('洗錢防制裁罰', {'end_date': '2025-01-01', 'start_date': '2024-01-01'}))
+    history.add(entry('內線交易'))
+    replaced = history.add(entry('洗錢防制裁罰', {'start_date': '2024-01-01', 'end_date': '2025-01-01'}))
+
+    assert replaced != first and history.get(first) is None
+    assert queries(history) == ['洗錢防制裁罰', '內線交易']   # 最新的在前
+    assert history.evictions == 0
+
+
+def test_different_filters_are_kept_separately():
+    history = ResultHistory()
+    history.add(entry('洗錢防制裁罰'))
+    history.add(entry('洗錢防制裁罰', {'bureau': '銀行局'}))
+    assert len(history) == 2
+
+
+def test_evicts_oldest_by_entry_count():
+    history = ResultHistory(max_entries=2)
+    for query in ('一', '二', '三'):
+        history.add(entry(query))
+    assert queries(history) == ['三', '二']
+    assert history.evictions == 1
+
+
+def test_evicts_oldest_by_total_chars():
+    history = ResultHistory(max_chars=25)
+    history.add(entry('一', markdown='甲' * 10))
+    history.add(entry('二', markdown='乙' * 10))
+    history.add(entry('三', markdown='丙' * 10))
+    assert queries(history) == ['三', '二']
+    assert sum(entry_size(history.get(entry_id)) for entry_id in history.ids()) <= 25
+
+
+def test_newest_entry_is_always_kept():
+    history = ResultHistory(max_entries=3, max_chars=10)
+    history.add(entry('一', markdown='短'))
+    newest = history.add(entry('二', markdown='很長的答案' * 10))   # 單筆就超過總字數上限
+    assert history.ids() == [newest] and history.latest()['query'] == '二'
+    assert history.evictions == 1
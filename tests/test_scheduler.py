@@ -0,0 +1,153 @@
+"""Gemini 請求排程器（RequestScheduler）：以假時鐘控制權杖補充與退避"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from scheduler import RequestScheduler, SchedulerTimeout
+
+
+class FakeClock:
+    """手動推進的時鐘（取代 time.monotonic）"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Throttled(Exception):
+    code = 429
+
+
+def make_scheduler(requests_per_minute=60, **kwargs):
+    """每秒放行 1 個請求、不允許突發的排程器"""
+    clock = FakeClock()
+    scheduler = RequestScheduler(requests_per_minute=requests_per_minute, burst_seconds=1.0, seed=0,
+                                 clock=clock, **kwargs)
+    return scheduler, clock
+
+
+def advance(scheduler, clock, seconds):
+    """推進時鐘並喚醒等待中的請求（排程器以實際時間等待，推進假時鐘後需要通知）"""
+    with scheduler._cond:
+        clock.now += seconds
+        scheduler._cond.notify_all()
+
+
+def wait_until(predicate):
+    deadline = time.monotonic() + 5
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_interactive_jumps_ahead_of_batch():
+    scheduler, clock = make_scheduler()
+    scheduler.acquire('batch')  # 用掉唯一的權杖
+    admitted = []
+
+    def request(priority):
+        scheduler.acquire(priority)
+        admitted.append(priority)
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        batch = pool.submit(request, 'batch')
+        wait_until(lambda: scheduler.stats()['queue_length'] == 1)
+        interactive = pool.submit(request, 'interactive')
+        wait_until(lambda: scheduler.stats()['queue_length'] == 2)
+
+        advance(scheduler, clock, 1.0)
+        interactive.result(timeout=5)
+        assert admitted == ['interactive']  # 權杖只夠一個請求：後到的互動查詢先放行
+        advance(scheduler, clock, 1.0)
+        batch.result(timeout=5)
+    assert admitted == ['interactive', 'batch']
+
+
+def test_throttled_request_halves_rate_and_keeps_its_place():
+    scheduler, clock = make_scheduler(base_backoff=1.0)
+    seqs = []
+    acquire = scheduler.acquire
+
+    def recording_acquire(*args):
+        seq = acquire(*args)
+        seqs.append(seq)
+        return seq
+
+    scheduler.acquire = recording_acquire
+    calls = []
+
+    def flaky():
+        calls.append('flaky')
+        if len(calls) == 1:
+            raise Throttled('RESOURCE_EXHAUSTED')
+        return 'answer'
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        throttled = pool.submit(scheduler.call, flaky)
+        wait_until(lambda: scheduler.stats()['requeued'] == 1)
+        stats = scheduler.stats()
+        assert stats['throttled'] == 1 and stats['rate_ratio'] == 0.5
+        assert stats['requests_per_minute'] == 30
+        assert stats['backoff_seconds'] > 0
+
+        # 退避期間才到的互動查詢排在重新排隊的請求之後
+        wait_until(lambda: scheduler.stats()['queue_length'] == 1)
+        later = pool.submit(scheduler.call, lambda: calls.append('later'))
+        wait_until(lambda: scheduler.stats()['queue_length'] == 2)
+
+        advance(scheduler, clock, 10.0)
+        assert throttled.result(timeout=5) == 'answer'
+        assert calls == ['flaky', 'flaky']
+        advance(scheduler, clock, 10.0)
+        later.result(timeout=5)
+
+    assert calls == ['flaky', 'flaky', 'later']
+    assert seqs[0] == seqs[1] and seqs[2] > seqs[1]
+    assert scheduler.stats()['rate_ratio'] == pytest.approx(0.7)  # 每次成功恢復 0.1
+
+
+def test_max_wait_expiry_raises():
+    scheduler, clock = make_scheduler(requests_per_minute=1, max_wait={'batch': 5.0})
+    scheduler.acquire('batch')  # 下一個權杖要 60 秒後才補充
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        waiting = pool.submit(scheduler.acquire, 'batch')
+        wait_until(lambda: scheduler.stats()['queue_length'] == 1)
+        advance(scheduler, clock, 4.0)
+        time.sleep(0.05)
+        assert not waiting.done()
+        advance(scheduler, clock, 2.0)
+        with pytest.raises(SchedulerTimeout):
+            waiting.result(timeout=5)
+
+    stats = scheduler.stats()
+    assert stats['timeouts'] == 1 and stats['queue_length'] == 0 and stats['admitted'] == 1
+
+
+class Rerun(BaseException):
+    """模擬 Streamlit 的 RerunException（BaseException 子類別）"""
+
+
+def test_raising_on_wait_leaves_the_queue():
+    scheduler, clock = make_scheduler()
+    scheduler.acquire('interactive')  # 用掉唯一的權杖
+
+    def on_wait(position, eta):
+        raise Rerun()
+
+    with pytest.raises(Rerun):
+        scheduler.acquire('interactive', on_wait=on_wait)
+    assert scheduler.stats()['queue_length'] == 0
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        waiting = pool.submit(scheduler.acquire, 'interactive')
+        wait_until(lambda: scheduler.stats()['queue_length'] == 1)
+        advance(scheduler, clock, 1.0)
+        waiting.result(timeout=5)
+
+    stats = scheduler.stats()
+    assert stats['admitted'] == 2 and stats['queue_length'] == 0
@@ -0,0 +1,128 @@
+"""相同查詢的單一請求合併（SingleFlight）"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+class Cancelled(BaseException):
+    """模擬 Streamlit 重新執行腳本時拋出的例外（不是 Exception 的子類別）"""
+
+
+def start_leader(flight: SingleFlight, key: str, fn):
+    """在背景執行緒以 leader 身分執行 fn，等到 leader 已開始執行才返回"""
+    started = threading.Event()
+
+    def run():
+        started.set()
+        return fn()
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    future = pool.submit(flight.do, key, run)
+    assert started.wait(5)
+    pool.shutdown(wait=False)
+    return future
+
+
+def wait_for_waiters(flight: SingleFlight, key: str, count: int):
+    """等待 count 個呼叫者加入進行中的呼叫"""
+    deadline = time.monotonic() + 5
+    while flight.stats()['calls'] < count + 1:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_followers_share_leader_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        release.wait(5)
+        return 'answer'
+
+    leader = start_leader(flight, 'q', fn)
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        followers = [pool.submit(flight.do, 'q', fn) for _ in range(4)]
+        wait_for_waiters(flight, 'q', 4)
+        release.set()
+        assert [future.result() for future in followers] == [('answer', True)] * 4
+    assert leader.result() == ('answer', False)
+    assert len(calls) == 1
+    assert flight.stats()['coalesced'] == 4 and flight.in_flight() == 0
+
+
+def test_leader_error_is_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def fn():
+        release.wait(5)
+        raise ValueError('查詢失敗')
+
+    leader = start_leader(flight, 'q', fn)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        follower = pool.submit(flight.do, 'q', fn)
+        wait_for_waiters(flight, 'q', 1)
+        release.set()
+        with pytest.raises(ValueError):
+            follower.result()
+    with pytest.raises(ValueError):
+        leader.result()
+    assert flight.stats()['errors'] == 1
+
+
+def test_leader_cancellation_hands_over_to_one_waiter():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def cancelled_leader():
+        release.wait(5)
+        raise Cancelled()
+
+    def fn():
+        calls.append(threading.current_thread().name)
+        time.sleep(0.05)
+        return 'answer'
+
+    leader = start_leader(flight, 'q', cancelled_leader)
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        waiters = [pool.submit(flight.do, 'q', fn) for _ in range(3)]
+        wait_for_waiters(flight, 'q', 3)
+        release.set()
+        results = [future.result() for future in waiters]
+
+    with pytest.raises(Cancelled):
+        leader.result()
+    # 取消訊號不會傳給等待者：其中一人重新執行，其餘共用其結果
+    assert len(calls) == 1
+    assert sorted(results) == [('answer', False), ('answer', True), ('answer', True)]
+    stats = flight.stats()
+    assert stats['takeovers'] == 3 and stats['executions'] == 2 and stats['in_flight'] == 0
+
+
+def test_waiter_runs_itself_after_timeout():
+    flight = SingleFlight(wait_timeout=0.05)
+    release = threading.Event()
+
+    def stuck():
+        release.wait(5)
+        return 'late'
+
+    leader = start_leader(flight, 'q', stuck)
+    try:
+        start = time.monotonic()
+        assert flight.do('q', lambda: 'own') == ('own', False)
+        assert time.monotonic() - start < 1.0
+        assert flight.stats()['timeouts'] == 1
+        assert flight.in_flight() == 1  # 原本的 leader 仍在執行
+    finally:
+        release.set()
+    assert leader.result() == ('late', False)
+    assert flight.in_flight() == 0
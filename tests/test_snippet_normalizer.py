@@ -0,0 +1,39 @@
+"""檢索片段正規化：只移除整行都是分享按鈕/網站導覽的短行"""
+
+import pytest
+
+from snippet_normalizer import NOISE_MAX_LINE_LENGTH, SnippetNormalizer, clean_text
+
+
+def test_content_mentioning_keywords_is_kept():
+    text = ('金管會核處連線商業銀行(LINE Bank)新臺幣600萬元罰鍰\n'
+            '該行未落實與同業間洗錢防制情資分享機制\n'
+            '違反銀行法第45條之1\n'
+            '依online banking作業規範辦理')
+    assert clean_text(text) == text
+
+
+@pytest.mark.parametrize('line', [
+    'Facebook Twitter LINE',
+    '分享',
+    '友善列印 | 轉寄 | 回上一頁',
+    ':::',
+    '字級大小 小 中 大',
+    'English',
+    'rss',
+    '回首頁 > 網站導覽',
+])
+def test_navigation_lines_removed(line):
+    assert clean_text(f"  {line}  \n裁罰內容\n\n{line}") == '裁罰內容'
+
+
+def test_long_line_of_keywords_is_kept():
+    line = '分享 ' * (NOISE_MAX_LINE_LENGTH // 3 + 1)
+    assert clean_text(line) == line.strip()
+
+
+def test_normalizer_memoizes():
+    normalizer = SnippetNormalizer()
+    text = '分享\n違反銀行法第45條之1'
+    assert normalizer.normalize(text) == normalizer.normalize(text) == '違反銀行法第45條之1'
+    assert normalizer.stats()['hits'] == 1
@@ -0,0 +1,59 @@
+"""冷啟動：延遲匯入只在第一次匯入時記錄耗時；預熱工作失敗（含 st.stop）不影響其他工作"""
+
+import sys
+
+import pytest
+from streamlit.runtime.scriptrunner_utils.exceptions import StopException
+
+from startup import LazyModule, StartupTimer, Warmup
+
+
+@pytest.fixture
+def fresh_module(tmp_path, monkeypatch):
+    """尚未匯入過的模組名稱"""
+    (tmp_path / 'lazy_target.py').write_text('VALUE = 42\n', encoding='utf-8')
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'lazy_target', raising=False)
+    return 'lazy_target'
+
+
+def test_lazy_module_records_first_import_only(fresh_module):
+    timer = StartupTimer()
+    module = LazyModule(fresh_module, timer)
+    assert timer.events() == [] and 'not loaded' in repr(module)
+
+    assert module.VALUE == 42 and module.VALUE == 42
+    (event,) = timer.events()
+    assert (event['phase'], event['kind'], event['error']) == ('import lazy_target', 'import', None)
+
+    # 其他地方已經匯入過的模組不再記錄
+    assert LazyModule(fresh_module, timer).VALUE == 42
+    assert len(timer.events()) == 1
+
+
+def test_failed_tasks_do_not_stop_remaining_tasks():
+    timer = StartupTimer()
+    ran = []
+
+    def stop():
+        raise StopException()  # st.stop() 拋出的例外不是 Exception 的子類別
+
+    def fail():
+        raise RuntimeError('映射檔不存在')
+
+    warmup = Warmup([('client', stop), ('mapping', fail), ('index', lambda: ran.append('index'))], timer)
+    assert warmup.start().wait(5)
+
+    assert ran == ['index']
+    assert warmup.status()['tasks'] == {'client': 'failed', 'mapping': 'failed', 'index': 'done'}
+    errors = {event['phase']: event['error'] for event in timer.events()}
+    assert errors['warmup client'].startswith('StopException')
+    assert errors['warmup mapping'] == 'RuntimeError: 映射檔不存在'
+    assert errors['warmup index'] is None
+
+
+def test_wait_before_start_returns_false():
+    warmup = Warmup([('noop', lambda: None)], StartupTimer())
+    assert warmup.wait(0.01) is False
+    assert warmup.status() == {'started': False, 'done': False, 'elapsed': None, 'tasks': {'noop': 'pending'}}
+    assert warmup.run().wait() is True and warmup.done
@@ -0,0 +1,99 @@
+"""多個 Store 的最終回答：[來源 N] 標記換算引用區間後移除"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from grounding import heading_citations
+from store_fanout import CITATION_RE, SharedRetrieval, cited_sources, strip_citations
+
+SOURCES = [
+    {'filename': f"files/doc{i}", 'snippet': f"片段 {i}", 'store': 'penalty', 'relevance': 1.0}
+    for i in range(1, 5)
+]
+
+ANSWER = """根據資料庫所查詢到的案件，主要涉及內部控制缺失 [來源 2]。
+
+### 1. 某銀行違反洗錢防制規定
+- **日期**：2025-03-01 [來源 3]
+- **違規事項**：未落實客戶審查[來源 3]
+
+### 2. 某證券商內線交易
+- **日期**：2024-11-20　[來源 1、4]
+- **法律依據**：證券交易法第178條 [來源 1,2]
+"""
+
+
+def test_markers_removed_and_spans_follow_text():
+    sources = cited_sources(ANSWER, SOURCES)
+    text, stripped = strip_citations(ANSWER, sources)
+
+    assert not CITATION_RE.search(text) and '來源' not in text
+    assert '主要涉及內部控制缺失。' in text and '- **日期**：2025-03-01\n' in text
+    assert '- **日期**：2024-11-20\n' in text  # 標記前的全形空白一併移除
+    assert [source['filename'] for source in stripped] == [source['filename'] for source in sources]
+
+    # 每個引用區間仍涵蓋原本標記所在的那一行（移除標記後的內容）
+    for before, after in zip(sources, stripped):
+        assert len(before['spans']) == len(after['spans'])
+        for (start, end), (new_start, new_end) in zip(before['spans'], after['spans']):
+            line = CITATION_RE.sub('', ANSWER[start:end]).rstrip(' 　')
+            assert text[new_start:new_end] == line
+
+
+def test_heading_citations_unchanged_after_strip():
+    sources = cited_sources(ANSWER, SOURCES)
+    text, stripped = strip_citations(ANSWER, sources)
+    assert heading_citations(text, stripped) == heading_citations(ANSWER, sources)
+
+
+@pytest.mark.parametrize('text', ['沒有任何引用標記的回答', ''])
+def test_without_markers(text):
+    sources = cited_sources(text, SOURCES)
+    assert strip_citations(text, sources) == (text, sources)
+
+
+def test_shared_retrieval_runs_once_and_skips_failures():
+    calls = []
+
+    def retrieve():
+        calls.append(len(calls))
+        return {'failed': len(calls) == 1, 'sources': SOURCES}
+
+    shared = SharedRetrieval(reuse=lambda fanout: not fanout['failed'])
+    assert shared.get(retrieve)['failed']        # 失敗的結果不保留
+    first = shared.get(retrieve)
+    assert not first['failed'] and shared.get(retrieve) is first
+    assert calls == [0, 1] and shared.hits == 1
+
+
+def test_shared_retrieval_waiters_reuse_the_leader_result():
+    shared = SharedRetrieval()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_retrieve():
+        calls.append('retrieve')
+        started.set()
+        assert release.wait(5)
+        return {'sources': SOURCES}
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        primary = pool.submit(shared.get, slow_retrieve)
+        assert started.wait(5)
+        backup = pool.submit(shared.get, slow_retrieve)  # 對沖請求：等待第一次檢索完成
+        release.set()
+        assert backup.result(timeout=5) is primary.result(timeout=5)
+    assert calls == ['retrieve']
+
+
+def test_shared_retrieval_retries_after_error():
+    shared = SharedRetrieval()
+
+    def broken():
+        raise RuntimeError('store unavailable')
+
+    with pytest.raises(RuntimeError):
+        shared.get(broken)
+    assert shared.get(lambda: {'sources': []}) == {'sources': []}